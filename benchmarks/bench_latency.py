@@ -0,0 +1,148 @@
+# -*- coding: utf-8 -*-
+
+"""
+bench_latency
+-------------
+
+End to end latency benchmark of a poll of the available data, run
+against the local stand-in of the Derytelecom Extranet. Each phase of
+a poll (connect, get_internettraffic, get_available and disconnect) is
+timed and its p50, p95 and p99 are reported, along with the number of
+requests made per poll.
+
+Usage:
+    python benchmarks/bench_latency.py [--polls N] [--latency SECONDS]
+
+Copyright(c) 2016 Rémi Tétreault <tetreault.remi@gmail.com>
+MIT Licensed, see LICENSE for more details.
+"""
+
+
+import os
+import sys
+import time
+import argparse
+
+from stubserver import StubServer, Account
+
+
+
+PHASES = ("connect", "get_internettraffic", "get_available", "disconnect",
+          "poll")
+
+
+
+########################################################################
+# Helper functions
+########################################################################
+def percentile(sorted_values, p):
+    """Return the p percentile of the sorted values, using the
+    nearest-rank method.
+    """
+
+    if not sorted_values:
+        return float("nan")
+
+    rank = int(round(p / 100.0 * len(sorted_values) + 0.5)) - 1
+    return sorted_values[min(max(rank, 0), len(sorted_values) - 1)]
+
+
+def import_module(base_url):
+    # The derytelecomextranetquery module read the URL of the Extranet
+    # when it is imported
+    os.environ["DERYTELECOM_EXTRANET_URL"] = base_url
+    sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                    os.pardir, "derytelecomextranetquery"))
+    import derytelecomextranetquery
+    return derytelecomextranetquery
+
+
+def poll(deq_module, timings):
+    # Make one poll of the available data and add the duration of its
+    # phases to timings
+
+    DerytelecomExtranetQuery = deq_module.DerytelecomExtranetQuery
+
+    start = time.time()
+    deq = DerytelecomExtranetQuery.connect("user", "password")
+    t_connect = time.time()
+    try:
+        inet_traffic = deq.get_internettraffic()
+        t_traffic = time.time()
+        inet_traffic.get_available()
+        t_available = time.time()
+    finally:
+        deq.disconnect()
+    end = time.time()
+
+    timings["connect"].append(t_connect - start)
+    timings["get_internettraffic"].append(t_traffic - t_connect)
+    timings["get_available"].append(t_available - t_traffic)
+    timings["disconnect"].append(end - t_available)
+    timings["poll"].append(end - start)
+
+
+
+########################################################################
+# Main
+########################################################################
+def main(argv):
+    parser = argparse.ArgumentParser(
+        description='Benchmark a poll against the local stand-in.')
+    parser.add_argument('--polls', type=int, default=200,
+        help='the number of polls (default: 200)')
+    parser.add_argument('--latency', type=float, default=0,
+        help='the mean latency of the stand-in in seconds')
+    parser.add_argument('--jitter', type=float, default=0,
+        help='the standard deviation of the latency in seconds')
+    parser.add_argument('--error-rate', type=float, default=0,
+        help='the probability of a 500 response')
+    parser.add_argument('--logout-rate', type=float, default=0,
+        help='the probability of an unexpected log out')
+    parser.add_argument('--used', type=float, default=39.7,
+        help='the used data in Gb, above 85 the page use the layout '
+             'without the Available string (default: 39.7)')
+    args = parser.parse_args(argv)
+
+    server = StubServer(accounts={"user" : Account("password", args.used)},
+                        latency=args.latency, jitter=args.jitter,
+                        error_rate=args.error_rate,
+                        logout_rate=args.logout_rate)
+    deq_module = import_module(server.start())
+
+    timings = dict((phase, []) for phase in PHASES)
+    failures = {}
+
+    for _ in range(args.polls):
+        try:
+            poll(deq_module, timings)
+        except deq_module.DerytelecomExtranetQueryException as e:
+            name = type(e).__name__
+            failures[name] = failures.get(name, 0) + 1
+
+    requests_count = server.total_requests()
+
+    # Close the keep-alive connections before stopping the stand-in
+    import transport
+    transport.default_transport().close_pools()
+    server.stop()
+
+    successes = len(timings["poll"])
+
+    print("{:<20} {:>10} {:>10} {:>10}".format("phase (ms)", "p50",
+                                               "p95", "p99"))
+    for phase in PHASES:
+        values = sorted(timings[phase])
+        print("{:<20} {:>10.2f} {:>10.2f} {:>10.2f}".format(
+            phase, *[percentile(values, p) * 1000 for p in (50, 95, 99)]))
+
+    print("")
+    print("polls: {}, successful: {}".format(args.polls, successes))
+    print("requests per poll: {:.2f}".format(
+        requests_count / float(args.polls)))
+    for name, count in sorted(failures.items()):
+        print("failures {}: {}".format(name, count))
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
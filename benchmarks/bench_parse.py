@@ -0,0 +1,268 @@
+# -*- coding: utf-8 -*-
+
+"""
+bench_parse
+-----------
+
+Parsing benchmark of a corpus of web pages, recorded with the --record
+option of the get command. Each page is parsed along every path of its
+Content class, with each parser, and the pages per second, the objects
+allocated and the peak memory per page are reported.
+
+Without a corpus, one is recorded from the local stand-in of the
+Derytelecom Extranet, with both layouts of the Internet > Traffic page
+and tables of many sizes. The corpus is first replayed through
+DerytelecomExtranetQuery, and the benchmark fail when the parsers do
+not agree on a page, which is how a new layout shows up.
+
+The objects allocated are those that are alive as long as the
+Content is, like the parse tree of BeautifulSoup, and the kept memory
+is their size, the parsed values included. The peak memory, which
+include the temporary objects, is only measured when tracemalloc is
+available.
+
+Usage:
+    python benchmarks/bench_parse.py [--corpus DIR] [--repeat N]
+
+Copyright(c) 2016 Rémi Tétreault <tetreault.remi@gmail.com>
+MIT Licensed, see LICENSE for more details.
+"""
+
+
+import gc
+import os
+import sys
+import time
+import shutil
+import argparse
+import tempfile
+
+try:
+    import tracemalloc
+except ImportError:
+    tracemalloc = None
+
+from stubserver import StubServer, Account
+
+
+
+# The accounts of the corpus recorded from the stand-in, the last one
+# has less than 15 Gb available
+STUB_ACCOUNTS = {
+    "small" : Account("password", used=12.5, calls=5, invoices=3),
+    "medium" : Account("password", used=39.7, calls=50, invoices=12),
+    "large" : Account("password", used=95.5, calls=500, invoices=60)
+}
+
+
+
+########################################################################
+# Helper functions
+########################################################################
+def import_modules(base_url=None):
+    # The derytelecomextranetquery module read the URL of the Extranet
+    # when it is imported
+    if base_url is not None:
+        os.environ["DERYTELECOM_EXTRANET_URL"] = base_url
+    sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                    os.pardir, "derytelecomextranetquery"))
+    import derytelecomextranetquery
+    import content
+    import corpus
+    return derytelecomextranetquery, content, corpus
+
+
+def parser_paths(content):
+    # Return the Content class and the parser paths of each page, a
+    # path is a function that parse a Content and return a value that
+    # can be compared
+    def usage(c):
+        values = c.get_usage().as_dict()
+        del values["fetched_at"]
+        return values
+
+    return {
+        "internet.traffic" : (content.InternetTraffic, [
+            ("usage", usage),
+            ("daily_traffic", lambda c: c.get_daily_traffic().as_dict())
+        ]),
+        "telephonie.interurbain" : (content.LongDistanceCalls, [
+            ("calls", lambda c: list(c.iter_calls()))
+        ]),
+        "facturation" : (content.Invoices, [
+            ("invoices", lambda c: list(c.iter_invoices()))
+        ])
+    }
+
+
+def record_stub_corpus(directory):
+    # Record the pages of the accounts of the stand-in in directory
+    server = StubServer(accounts=STUB_ACCOUNTS)
+    deq_module, _, corpus = import_modules(server.start())
+
+    page_corpus = corpus.PageCorpus(directory)
+    try:
+        for username, account in sorted(STUB_ACCOUNTS.items()):
+            with deq_module.DerytelecomExtranetQuery.connect(
+                    username, account.password, corpus=page_corpus) as deq:
+                deq.get_internettraffic()
+                deq.get_longdistancecalls()
+                deq.get_invoices()
+    finally:
+        server.stop()
+
+
+def replay(deq_module, corpus, page_corpus, paths):
+    # Retrieve each page of the corpus through the replay adapter and
+    # return the names of those whose values differ from the parse of
+    # the file
+    session = corpus.replay_session(page_corpus)
+    different = set()
+
+    with deq_module.DerytelecomExtranetQuery.connect(
+            corpus.SCRUBBED_USERNAME, corpus.SCRUBBED_PASSWORD,
+            session=session) as deq:
+        for name, _, page in page_corpus.pages():
+            if name not in paths:
+                continue
+            content_class, parser_paths = paths[name]
+            name_params = dict(zip(("content", "sub"), name.split(".")))
+            replayed = deq.get_content(name_params, content_class)
+            for _, parse in parser_paths:
+                if parse(replayed) != parse(content_class(page)):
+                    different.add(name)
+
+    return different
+
+
+def measure(content_class, parser, parse, page):
+    # Parse the page once and return the number of objects allocated
+    # that are alive as long as the Content is, their size in bytes
+    # and the peak memory in bytes, or None without tracemalloc
+    gc.collect()
+    gc.disable()
+    try:
+        before = set(id(o) for o in gc.get_objects())
+        if tracemalloc is not None:
+            tracemalloc.start()
+
+        c = content_class(page, parser=parser)
+        value = parse(c)
+
+        peak = None
+        if tracemalloc is not None:
+            peak = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+
+        kept = [o for o in gc.get_objects()
+                if id(o) not in before and o is not before]
+
+        # The size of the objects and of the strings and numbers that
+        # they reference, except the page itself
+        seen = set([id(page)])
+        size = 0
+        for o in kept + [r for o in kept for r in gc.get_referents(o)
+                         if not gc.is_tracked(r)]:
+            if id(o) not in seen:
+                seen.add(id(o))
+                size += sys.getsizeof(o)
+
+        del c, value
+    finally:
+        gc.enable()
+
+    return len(kept), size, peak
+
+
+
+########################################################################
+# Main
+########################################################################
+def main(argv):
+    parser = argparse.ArgumentParser(
+        description='Benchmark the parsers against a corpus of pages.')
+    parser.add_argument('--corpus', default=None,
+        help='the directory of the corpus, recorded with get --record '
+             '(default: record one from the stand-in)')
+    parser.add_argument('--repeat', type=int, default=10,
+        help='the number of times each page is parsed (default: 10)')
+    args = parser.parse_args(argv)
+
+    tmp = None
+    try:
+        if args.corpus is None:
+            tmp = tempfile.mkdtemp()
+            record_stub_corpus(tmp)
+            directory = tmp
+        else:
+            directory = args.corpus
+
+        deq_module, content, corpus = import_modules()
+        page_corpus = corpus.PageCorpus(directory)
+        paths = parser_paths(content)
+
+        pages = {}
+        for name, _, page in page_corpus.pages():
+            pages.setdefault(name, []).append(page)
+        skipped = sorted(name for name in pages if name not in paths)
+
+        different = replay(deq_module, corpus, page_corpus, paths)
+
+    finally:
+        if tmp is not None:
+            shutil.rmtree(tmp)
+
+    print("{:<24} {:<14} {:<6} {:>6} {:>9} {:>8} {:>8} {:>8}".format(
+        "page", "path", "parser", "pages", "pages/s", "objects",
+        "kept KB", "peak KB"))
+
+    for name in sorted(pages):
+        if name not in paths:
+            continue
+        content_class, parser_paths_of_page = paths[name]
+
+        for path, parse in parser_paths_of_page:
+            values = set()
+
+            for parser_name in content.PARSERS:
+                # The first parse also warm up the parser
+                values.add(repr([parse(content_class(page, parser=parser_name))
+                                 for page in pages[name]]))
+
+                start = time.time()
+                for _ in range(args.repeat):
+                    for page in pages[name]:
+                        parse(content_class(page, parser=parser_name))
+                elapsed = time.time() - start
+
+                # The means per page
+                measures = [measure(content_class, parser_name, parse,
+                                    page) for page in pages[name]]
+                objects, kept, peak = [
+                    sum(m) / float(len(m)) if None not in m else None
+                    for m in zip(*measures)]
+
+                print("{:<24} {:<14} {:<6} {:>6} {:>9.0f} {:>8.0f} {:>8.1f} "
+                      "{:>8}".format(
+                          name, path, parser_name, len(pages[name]),
+                          args.repeat * len(pages[name]) / elapsed,
+                          objects, kept / 1024,
+                          "{:.1f}".format(peak / 1024)
+                          if peak is not None else "-"))
+
+            if len(values) > 1:
+                different.add(name)
+
+    if skipped:
+        print("")
+        print("pages without a parser: {}".format(", ".join(skipped)))
+
+    if different:
+        print("")
+        print("parsers that do not agree: {}".format(
+            ", ".join(sorted(different))))
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
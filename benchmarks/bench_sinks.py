@@ -0,0 +1,205 @@
+# -*- coding: utf-8 -*-
+
+"""
+bench_sinks
+-----------
+
+Delivery benchmark of the sinks, run against the local stand-in
+receivers. For each sink, threads put the samples of many accounts as
+a fleet poll would, then the sink is closed. The time the threads
+spent in put, the time until everything was delivered and the number
+of writes are reported, for batches and for one write per sample. The
+benchmark fail when a sample is missing at the receiver.
+
+Usage:
+    python benchmarks/bench_sinks.py [--samples N] [--latency SECONDS]
+
+Copyright(c) 2016 Rémi Tétreault <tetreault.remi@gmail.com>
+MIT Licensed, see LICENSE for more details.
+"""
+
+
+import os
+import sys
+import time
+import shutil
+import argparse
+import tempfile
+import threading
+
+from receivers import HTTPReceiver, UDPReceiver
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                os.pardir, "derytelecomextranetquery"))
+import sinks
+from usage import UsageRecord
+
+
+
+THREADS = 8
+
+
+
+########################################################################
+# Helper functions
+########################################################################
+def samples(count):
+    """Return count samples of distinct accounts."""
+
+    return [("user{}".format(i),
+             UsageRecord(available=i * 1000, used=10 ** 9, total=None,
+                         fetched_at=1462000000 + i))
+            for i in range(count)]
+
+
+def put_all(sink, all_samples):
+    """Put the samples from THREADS threads and return the time spent
+    in put by the slowest thread.
+    """
+
+    durations = []
+
+    def put_some(some):
+        start = time.time()
+        for username, record in some:
+            sink.put(username, record)
+        durations.append(time.time() - start)
+
+    threads = [threading.Thread(target=put_some,
+                                args=(all_samples[i::THREADS],))
+               for i in range(THREADS)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    return max(durations)
+
+
+def accounts_of_lines(lines, prefix, separator):
+    return set(line[len(prefix):].split(separator)[0] for line in lines
+               if line.startswith(prefix))
+
+
+def run_jsonl(tmp, all_samples, **kwargs):
+    import json
+    path = os.path.join(tmp, "samples.jsonl")
+    sink = sinks.JsonLinesSink(path, **kwargs)
+    yield sink
+    with open(path) as f:
+        yield set(json.loads(line)["username"] for line in f), None
+
+
+def run_textfile(tmp, all_samples, **kwargs):
+    path = os.path.join(tmp, "usage.prom")
+    sink = sinks.PrometheusTextfileSink(path, **kwargs)
+    yield sink
+    # A file per account
+    lines = []
+    for name in os.listdir(tmp):
+        with open(os.path.join(tmp, name)) as f:
+            lines.extend(f.read().splitlines())
+    yield accounts_of_lines(lines, 'derytelecom_usage_used_bytes{account="',
+                            '"'), None
+
+
+def run_pushgateway(tmp, all_samples, latency=0, **kwargs):
+    receiver = HTTPReceiver(latency=latency)
+    sink = sinks.PushgatewaySink(receiver.start(), **kwargs)
+    yield sink
+    bodies = receiver.bodies()
+    receiver.stop()
+    # A group per account
+    lines = [l for body in bodies for l in body.splitlines()]
+    yield accounts_of_lines(lines, 'derytelecom_usage_used_bytes{account="',
+                            '"'), len(bodies)
+
+
+def run_influxdb(tmp, all_samples, latency=0, **kwargs):
+    receiver = HTTPReceiver(latency=latency)
+    sink = sinks.InfluxDBSink(receiver.start() + "/write?db=usage", **kwargs)
+    yield sink
+    bodies = receiver.bodies()
+    receiver.stop()
+    lines = [l for body in bodies for l in body.splitlines()]
+    yield accounts_of_lines(lines, "derytelecom_usage,account=", " "), \
+        len(bodies)
+
+
+def run_statsd(tmp, all_samples, **kwargs):
+    receiver = UDPReceiver()
+    host, port = receiver.start()
+    sink = sinks.StatsDSink(host, port, **kwargs)
+    yield sink
+    # Let the receiver read the last datagrams
+    time.sleep(0.2)
+    lines = receiver.lines()
+    receiver.stop()
+    yield accounts_of_lines([l for l in lines if l.endswith("|g")],
+                            "derytelecom.", "."), len(receiver.received)
+
+
+SCENARIOS = (("jsonl", run_jsonl), ("textfile", run_textfile),
+             ("pushgateway", run_pushgateway), ("influxdb", run_influxdb),
+             ("statsd", run_statsd))
+
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(
+        description='Benchmark the delivery of the samples by the sinks.')
+    parser.add_argument('--samples', type=int, default=500,
+        help='the number of samples, one per account (default: 500)')
+    parser.add_argument('--latency', type=float, default=0.002,
+        help='the latency of the HTTP receiver in seconds '
+             '(default: 0.002)')
+    args = parser.parse_args(argv)
+
+    all_samples = samples(args.samples)
+    expected = set(username for username, _ in all_samples)
+    tmp = tempfile.mkdtemp()
+    failed = []
+
+    print("{:<12} {:>6} {:>10} {:>10} {:>8}  {}".format(
+        "sink", "batch", "put ms", "total ms", "writes", "delivered"))
+
+    try:
+        for name, scenario in SCENARIOS:
+            for batch_size in (sinks.BATCH_SIZE, 1):
+                kwargs = {"batch_size" : batch_size}
+                if name in ("pushgateway", "influxdb"):
+                    kwargs["latency"] = args.latency
+
+                steps = scenario(tmp, all_samples, **kwargs)
+                sink = next(steps)
+
+                start = time.time()
+                put_time = put_all(sink, all_samples)
+                sink.close()
+                total_time = time.time() - start
+
+                accounts, writes = next(steps)
+                delivered = len(accounts & expected)
+
+                print("{:<12} {:>6} {:>10.1f} {:>10.1f} {:>8}  {}/{}".format(
+                    name, batch_size, put_time * 1000, total_time * 1000,
+                    writes if writes is not None else "-", delivered,
+                    len(expected)))
+
+                if delivered != len(expected) or sink.failed:
+                    failed.append(name)
+
+                for f in os.listdir(tmp):
+                    os.remove(os.path.join(tmp, f))
+
+    finally:
+        shutil.rmtree(tmp)
+
+    if failed:
+        print("")
+        print("samples not delivered: {}".format(", ".join(failed)))
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
@@ -0,0 +1,171 @@
+# -*- coding: utf-8 -*-
+
+"""
+bench_startup
+-------------
+
+Startup time benchmark of the command line application. Each scenario
+is run many times in a new interpreter, its p50 and p95 wall time are
+reported along with the slow to import modules that it loaded. The get
+scenario retrieve the available data from the stand-in Extranet.
+
+The budget of a scenario is the time that its p50 may take over the
+one of the interpreter alone, so that it does not depend on how fast
+the machine start an interpreter. The benchmark exit with the status 1
+when a scenario is over its budget or load a slow module that it does
+not need, so that a new eager import does not go unnoticed.
+
+Usage:
+    python benchmarks/bench_startup.py [--runs N] [--scale FACTOR]
+
+Copyright(c) 2016 Rémi Tétreault <tetreault.remi@gmail.com>
+MIT Licensed, see LICENSE for more details.
+"""
+
+
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import tempfile
+import subprocess
+
+from bench_latency import percentile
+from stubserver import StubServer, Account
+
+
+
+APP_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                       os.pardir, "derytelecomextranetquery")
+
+# The modules that are slow to import, none of them should be loaded
+# by the scenarios that do not need them
+SLOW_MODULES = ("requests", "BeautifulSoup", "numpy", "webbrowser",
+                "pykeyboard", "urllib", "urlparse")
+
+# The scenarios, their command line arguments, the modules that they
+# need and their budget in milliseconds over the interpreter. With
+# requests, the get scenario take about three times as long as the
+# others.
+SCENARIOS = (
+    ("--help", ["--help"], (), 85),
+    ("get --help", ["get", "--help"], (), 85),
+    ("history", ["history", "--db", "{tmp}/history.sqlite"], (), 85),
+    ("get", ["get", "user", "password"],
+     ("requests", "urllib", "urlparse"), 250),
+)
+
+# The account of the stand-in Extranet queried by the get scenario
+STUB_ACCOUNTS = {"user" : Account("password")}
+
+# The code run in the new interpreter to find the modules loaded by a
+# scenario
+LOADED_MODULES_CODE = """
+import sys, json, runpy
+sys.argv = [{app_dir!r}] + {args!r}
+try:
+    runpy.run_path({app_dir!r}, run_name="__main__")
+except SystemExit:
+    pass
+sys.stderr.write(json.dumps([m for m in {modules!r} if m in sys.modules]))
+"""
+
+
+
+########################################################################
+# Helper functions
+########################################################################
+def run(args, env):
+    # Run the application and return its wall time, a scenario that
+    # fail would not measure what it should
+    with open(os.devnull, "wb") as devnull:
+        start = time.time()
+        status = subprocess.call([sys.executable, APP_DIR] + args,
+                                 stdout=devnull, stderr=devnull, env=env)
+        elapsed = time.time() - start
+
+    if status != 0:
+        raise RuntimeError("{} exited with the status {}"
+                           .format(" ".join(args), status))
+    return elapsed
+
+
+def loaded_modules(args, env):
+    # Return the slow modules loaded when running the application
+    code = LOADED_MODULES_CODE.format(app_dir=APP_DIR, args=args,
+                                      modules=SLOW_MODULES)
+    p = subprocess.Popen([sys.executable, "-c", code],
+                         stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+                         env=env)
+    _, err = p.communicate()
+    return json.loads(err.decode("utf-8").splitlines()[-1])
+
+
+
+########################################################################
+# Main
+########################################################################
+def main(argv):
+    parser = argparse.ArgumentParser(
+        description='Benchmark the startup time of the application.')
+    parser.add_argument('--runs', type=int, default=20,
+        help='the number of runs of each scenario (default: 20)')
+    parser.add_argument('--scale', type=float, default=1.0,
+        help='the factor by which the budgets of the scenarios are '
+             'multiplied, for a slower machine (default: 1)')
+    args = parser.parse_args(argv)
+
+    server = StubServer(accounts=STUB_ACCOUNTS)
+    tmp = tempfile.mkdtemp()
+    env = dict(os.environ, XDG_CACHE_HOME=tmp, XDG_DATA_HOME=tmp,
+               PYTHONWARNINGS="ignore",
+               DERYTELECOM_EXTRANET_URL=server.start())
+    over_budget = []
+
+    try:
+        # The baseline is the startup time of the interpreter
+        baseline = []
+        for _ in range(args.runs):
+            start = time.time()
+            subprocess.call([sys.executable, "-c", "pass"], env=env)
+            baseline.append(time.time() - start)
+        baseline.sort()
+        baseline_p50 = percentile(baseline, 50) * 1000
+
+        print("{:<14} {:>8} {:>8} {:>8} {:>8}  {}".format(
+            "scenario (ms)", "p50", "p95", "over", "budget",
+            "slow modules loaded"))
+        print("{:<14} {:>8.1f} {:>8.1f}".format(
+            "interpreter", baseline_p50, percentile(baseline, 95) * 1000))
+
+        for name, scenario_args, needed, budget in SCENARIOS:
+            scenario_args = [a.format(tmp=tmp) for a in scenario_args]
+            timings = sorted(run(scenario_args, env)
+                             for _ in range(args.runs))
+            p50 = percentile(timings, 50) * 1000
+            budget *= args.scale
+            modules = [m for m in loaded_modules(scenario_args, env)
+                       if m not in needed]
+
+            print("{:<14} {:>8.1f} {:>8.1f} {:>8.1f} {:>8.0f}  {}".format(
+                name, p50, percentile(timings, 95) * 1000,
+                p50 - baseline_p50, budget, " ".join(modules) or "-"))
+
+            if p50 - baseline_p50 > budget or modules:
+                over_budget.append(name)
+
+    finally:
+        server.stop()
+        shutil.rmtree(tmp)
+
+    if over_budget:
+        print("")
+        print("over budget or loading slow modules: {}"
+              .format(", ".join(over_budget)))
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
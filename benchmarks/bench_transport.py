@@ -0,0 +1,145 @@
+# -*- coding: utf-8 -*-
+
+"""
+bench_transport
+---------------
+
+Transport benchmark of the polls of many accounts, run against the
+local stand-in of the Derytelecom Extranet. The accounts are polled
+with a Transport per account, like when each session had its own
+connections, then with one Transport shared by all the sessions, with
+and without compression. The handshakes (new connections), the
+requests, the bytes on the wire and the time per poll are reported.
+
+The stand-in take --handshake seconds to accept each new connection,
+to account for the handshake of TLS.
+
+Usage:
+    python benchmarks/bench_transport.py [--accounts N] [--workers N]
+                                         [--handshake SECONDS]
+
+Copyright(c) 2016 Rémi Tétreault <tetreault.remi@gmail.com>
+MIT Licensed, see LICENSE for more details.
+"""
+
+
+import os
+import sys
+import time
+import argparse
+
+from stubserver import StubServer, Account
+
+
+
+########################################################################
+# Helper functions
+########################################################################
+def import_modules(base_url):
+    # The derytelecomextranetquery module read the URL of the Extranet
+    # when it is imported
+    os.environ["DERYTELECOM_EXTRANET_URL"] = base_url
+    sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                    os.pardir, "derytelecomextranetquery"))
+    import derytelecomextranetquery
+    import threadpool
+    import transport
+    return derytelecomextranetquery, threadpool, transport
+
+
+def poll_accounts(deq_module, threadpool, accounts, workers, transports):
+    # Poll the accounts with the transports returned by the function
+    # transports and return the number of failures
+    DerytelecomExtranetQuery = deq_module.DerytelecomExtranetQuery
+
+    def poll(account):
+        username, password = account
+        with DerytelecomExtranetQuery.connect(
+                username, password, transport=transports()) as deq:
+            return deq.get_internettraffic().get_available()
+
+    return sum(1 for _, _, exception
+               in threadpool.imap_unordered(poll, accounts, workers)
+               if exception is not None)
+
+
+
+########################################################################
+# Main
+########################################################################
+def main(argv):
+    parser = argparse.ArgumentParser(
+        description='Benchmark the transport of the polls of many '
+                    'accounts against the local stand-in.')
+    parser.add_argument('--accounts', type=int, default=100,
+        help='the number of accounts (default: 100)')
+    parser.add_argument('--workers', type=int, default=8,
+        help='the number of accounts polled at the same time '
+             '(default: 8)')
+    parser.add_argument('--handshake', type=float, default=0.01,
+        help='the time taken by the handshake of a connection in '
+             'seconds (default: 0.01)')
+    parser.add_argument('--latency', type=float, default=0,
+        help='the mean latency of the stand-in in seconds')
+    args = parser.parse_args(argv)
+
+    accounts = [("user{}".format(i), "password")
+                for i in range(args.accounts)]
+    server = StubServer(accounts=dict((u, Account(p)) for u, p in accounts),
+                        latency=args.latency, compress=True,
+                        handshake=args.handshake)
+    deq_module, threadpool, transport = import_modules(server.start())
+
+    print("{:<24} {:>12} {:>10} {:>10} {:>12} {:>10}".format(
+        "transport (per poll)", "handshakes", "requests", "sent", "received",
+        "ms"))
+
+    failed = False
+    for name, shared, compress in (("per account", False, True),
+                                   ("shared", True, False),
+                                   ("shared, compressed", True, True)):
+        used = []
+        shared_transport = transport.Transport(compress=compress)
+
+        def transports():
+            t = (shared_transport if shared
+                 else transport.Transport(compress=compress))
+            if t not in used:
+                used.append(t)
+            return t
+
+        server.reset_stats()
+        start = time.time()
+        failures = poll_accounts(deq_module, threadpool, accounts,
+                                 args.workers, transports)
+        elapsed = time.time() - start
+
+        totals = dict((k, sum(t.stats()[k] for t in used))
+                      for k in ("connections", "requests", "bytes_sent",
+                                "bytes_received"))
+        for t in used:
+            t.close_pools()
+
+        polls = float(len(accounts))
+        print("{:<24} {:>12.2f} {:>10.2f} {:>10.0f} {:>12.0f} {:>10.2f}"
+              .format(name, totals["connections"] / polls,
+                      totals["requests"] / polls,
+                      totals["bytes_sent"] / polls,
+                      totals["bytes_received"] / polls,
+                      elapsed * 1000 / polls))
+
+        # The connections counted by the transports must be those
+        # accepted by the stand-in
+        if failures or totals["connections"] != server.connections:
+            print("failures: {}, connections accepted: {}".format(
+                failures, server.connections))
+            failed = True
+
+    server.stop()
+
+    if failed:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
@@ -0,0 +1,153 @@
+# -*- coding: utf-8 -*-
+
+"""
+receivers
+---------
+
+Local stand-ins for the monitoring systems that the sinks of the
+derytelecomextranetquery module deliver the samples to, used to test
+and measure the sinks without a real server:
+
+    HTTPReceiver    record the requests of the Prometheus pushgateway
+                    and InfluxDB sinks, it answers 204 or the status
+                    it is told to
+    UDPReceiver     record the datagrams of the StatsD sink
+
+Copyright(c) 2016 Rémi Tétreault <tetreault.remi@gmail.com>
+MIT Licensed, see LICENSE for more details.
+"""
+
+
+import time
+import socket
+import threading
+import BaseHTTPServer
+import SocketServer
+
+
+
+########################################################################
+# Classes
+########################################################################
+class ReceiverRequestHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+    """Record the requests made to the HTTPReceiver."""
+
+    protocol_version = "HTTP/1.1"
+
+    # Send the headers of a response in one write, like the stand-in
+    # Extranet
+    wbufsize = -1
+
+
+    def log_message(self, *args):
+        pass
+
+
+    def _receive(self):
+        length = int(self.headers.get("Content-Length", 0))
+        body = self.rfile.read(length) if length else ""
+
+        server = self.server
+        if server.latency:
+            time.sleep(server.latency)
+
+        with server.lock:
+            server.received.append((self.command, self.path, body))
+
+        self.send_response(server.status)
+        self.send_header("Content-Length", "0")
+        self.end_headers()
+
+    do_PUT = do_POST = _receive
+
+
+
+class HTTPReceiver(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    """The stand-in HTTP server.
+
+    Attributes:
+        received -- the requests received, tuples (method, path, body)
+        status   -- the status of the responses
+        latency  -- the time in seconds to wait before each response
+    """
+
+    daemon_threads = True
+
+
+    def __init__(self, address=("127.0.0.1", 0), status=204, latency=0):
+        BaseHTTPServer.HTTPServer.__init__(self, address,
+                                           ReceiverRequestHandler)
+        self.status = status
+        self.latency = latency
+        self.received = []
+        self.lock = threading.Lock()
+
+
+    @property
+    def url(self):
+        return "http://{}:{}".format(*self.server_address)
+
+
+    def start(self):
+        """Serve in a background thread and return the URL."""
+
+        thread = threading.Thread(target=self.serve_forever)
+        thread.daemon = True
+        thread.start()
+        return self.url
+
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+
+    def bodies(self):
+        with self.lock:
+            return [body for _, _, body in self.received]
+
+
+
+class UDPReceiver(object):
+    """The stand-in UDP server.
+
+    Attributes:
+        received -- the datagrams received
+    """
+
+    def __init__(self, address=("127.0.0.1", 0)):
+        self.socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.socket.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 1 << 22)
+        self.socket.bind(address)
+        self.address = self.socket.getsockname()
+        self.received = []
+        self.lock = threading.Lock()
+
+
+    def start(self):
+        """Receive in a background thread and return the address."""
+
+        thread = threading.Thread(target=self._receive_forever)
+        thread.daemon = True
+        thread.start()
+        return self.address
+
+
+    def _receive_forever(self):
+        while True:
+            try:
+                data = self.socket.recv(65536)
+            except socket.error:
+                return
+            with self.lock:
+                self.received.append(data)
+
+
+    def stop(self):
+        self.socket.close()
+
+
+    def lines(self):
+        with self.lock:
+            return [line for data in self.received
+                    for line in data.split("\n")]
@@ -0,0 +1,562 @@
+# -*- coding: utf-8 -*-
+
+"""
+stubserver
+----------
+
+A local stand-in for the Derytelecom Extranet, used to measure and test
+the network path without reaching extranet.derytelecom.ca. It serves:
+
+    /               the login page, it set the PHPSESSID cookie and
+                    name the inputs of the form after it
+    /auth_sess.php  the authentication, a bad username or password
+                    redirect to /index.php?logout=1
+    /index.php      the pages of the Extranet, including both layouts
+                    of the Internet > Traffic page. With
+                    url_session_ids, the session id can also be passed
+                    in the PHPSESSID URL parameter, which is an
+                    assumption about the real Extranet that was never
+                    verified (PHP only accept it when its
+                    session.use_only_cookies setting is off).
+
+A latency and errors can be injected in the responses, and they can be
+compressed with gzip.
+
+To point the derytelecomextranetquery module to a running stand-in, set
+the DERYTELECOM_EXTRANET_URL environment variable to its URL.
+
+Usage:
+    python benchmarks/stubserver.py [--port PORT] [--latency SECONDS]
+
+Copyright(c) 2016 Rémi Tétreault <tetreault.remi@gmail.com>
+MIT Licensed, see LICENSE for more details.
+"""
+
+
+import sys
+import zlib
+import time
+import datetime
+import uuid
+import random
+import socket
+import urlparse
+import argparse
+import threading
+import Cookie
+import BaseHTTPServer
+import SocketServer
+
+
+
+########################################################################
+# Constants
+########################################################################
+COOKIE_NAME = "PHPSESSID"
+
+# The available data below which the Extranet no longer display the
+# Available string
+AVAILABLE_STRING_THRESHOLD = 15
+
+# The maximum time in seconds to wait for the thread of a connection
+# when the stand-in is stopped
+STOP_TIMEOUT = 5
+
+
+PAGE_TEMPLATE = """<!DOCTYPE html>
+<html>
+<head>
+<title>Derytelecom Extranet</title>
+<meta charset="utf-8">
+<link rel="stylesheet" href="style.css">
+</head>
+<body>
+<div id="header"><a href="index.php"><img src="logo.png"></a></div>
+<div id="menu">
+<ul>
+<li><a href="index.php?content=profil">Profile</a></li>
+<li><a href="index.php?content=internet">Internet</a></li>
+<li><a href="index.php?content=telephonie">Phone</a></li>
+<li><a href="index.php?content=television">Television</a></li>
+<li><a href="index.php?content=facturation">Invoicing</a></li>
+</ul>
+</div>
+<div id="content">
+{content}
+</div>
+<div id="footer">Derytelecom</div>
+</body>
+</html>
+"""
+
+LOGIN_CONTENT = """<form name="loginform" action="auth_sess.php" method="post">
+<input type="text" name="{cookie}_login">
+<input type="password" name="{cookie}_password">
+<input type="submit" value="Login">
+</form>"""
+
+# The layout of the Internet > Traffic page when the Available string
+# is displayed
+TRAFFIC_AVAILABLE_CONTENT = """<div class="traffic">
+<p>Used: <b>{used}</b><b>Gb</b></p>
+<p>Available: <b>{available}</b><b>Gb</b></p>
+<p>Total: <b>{total}</b><b>Gb</b></p>
+<p>Period: <b>{period_start}</b><b>to</b><b>{period_end}</b></p>
+</div>"""
+
+# The layout of the Internet > Traffic page when there are less than
+# AVAILABLE_STRING_THRESHOLD Gb available
+TRAFFIC_USED_CONTENT = """<div class="traffic">
+<div class="label"><span>Used</span></div>
+<div class="value"><span>
+<b>{available}</b><b>Gb</b></span></div>
+<p>Period: <b>{period_start}</b><b>to</b><b>{period_end}</b></p>
+</div>"""
+
+# The daily traffic table that follow both layouts, its Total header is
+# not a label and must not be taken for the one of the total
+DAILY_TRAFFIC_CONTENT = """<table class="daily">
+<tr><th>Date</th><th>Download</th><th>Upload</th><th>Total</th></tr>
+{rows}
+</table>"""
+
+DAILY_TRAFFIC_ROW = """<tr><td>{date}</td><td>{download:.2f} Gb</td>\
+<td>{upload:.2f} Gb</td><td>{total:.2f} Gb</td></tr>"""
+
+GENERIC_CONTENT = """<div class="page"><h1>{title}</h1></div>"""
+
+# The Phone > Long distance page, a table of the calls
+CALLS_CONTENT = """<div class="page"><h1>Long distance</h1>
+<table class="calls">
+<tr><th>Date</th><th>Time</th><th>Number</th><th>Destination</th>
+<th>Duration</th><th>Amount</th></tr>
+{rows}
+</table></div>"""
+
+CALL_ROW = """<tr><td>2016-05-{day:02d}</td><td>{hour:02d}:{minute:02d}</td>\
+<td>819-555-{number:04d}</td><td>Montr&eacute;al</td>\
+<td>{duration_minutes}:{duration_seconds:02d}</td>\
+<td>${amount:.2f}</td></tr>"""
+
+# The Invoicing page, a table of the invoices
+INVOICES_CONTENT = """<div class="page"><h1>Invoicing</h1>
+<table class="invoices">
+<tr><th>Invoice date</th><th>Invoice number</th><th>Amount</th>
+<th>Due date</th><th>Status</th></tr>
+{rows}
+</table></div>"""
+
+INVOICE_ROW = """<tr><td>{year}-{month:02d}-01</td><td>{number}</td>\
+<td>${amount:.2f}</td><td>{year}-{month:02d}-21</td><td>{status}</td></tr>"""
+
+
+
+########################################################################
+# Classes
+########################################################################
+class Account(object):
+    """An account of the stand-in Extranet."""
+
+    def __init__(self, password, used=39.7, total=100.0,
+                 period_start="2016-05-01", period_end="2016-05-31",
+                 calls=50, invoices=12):
+        self.password = password
+        self.used = used
+        self.total = total
+        self.period_start = period_start
+        self.period_end = period_end
+        self.calls = calls
+        self.invoices = invoices
+
+    @property
+    def available(self):
+        return round(self.total - self.used, 1)
+
+
+
+class StubRequestHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+    """Handle the requests made to the stand-in Extranet."""
+
+    protocol_version = "HTTP/1.1"
+
+    # Send the headers and the body of a response in one write, the
+    # response is flushed once it is complete
+    wbufsize = -1
+
+
+    def log_message(self, *args):
+        pass
+
+
+    def setup(self):
+        # A new connection, count it and wait for its handshake
+        BaseHTTPServer.BaseHTTPRequestHandler.setup(self)
+        self.server.count_connection(self.connection)
+
+
+    def finish(self):
+        try:
+            BaseHTTPServer.BaseHTTPRequestHandler.finish(self)
+        finally:
+            self.server.forget_connection(self.connection)
+
+
+    def _session_id(self):
+        cookie = Cookie.SimpleCookie(self.headers.get("Cookie", ""))
+        if COOKIE_NAME in cookie:
+            return cookie[COOKIE_NAME].value
+        return None
+
+
+    def _send(self, body, status=200, headers=()):
+        body = body.encode("utf-8")
+        compressed = (self.server.compress and body
+                      and "gzip" in self.headers.get("Accept-Encoding", ""))
+        if compressed:
+            # The gzip format is deflate with a header, selected by the
+            # 16 added to the window bits
+            gzip = zlib.compressobj(6, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+            body = gzip.compress(body) + gzip.flush()
+
+        self.send_response(status)
+        self.send_header("Content-Type", "text/html; charset=utf-8")
+        if compressed:
+            self.send_header("Content-Encoding", "gzip")
+        self.send_header("Content-Length", str(len(body)))
+        for name, value in headers:
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+
+    def _redirect(self, location):
+        self._send("", 302, [("Location", location)])
+
+
+    def _inject(self):
+        # Wait for the latency and return True if an error was
+        # injected instead of the response
+        server = self.server
+        server.count(self.path)
+
+        if server.latency:
+            time.sleep(max(0, random.gauss(server.latency, server.jitter)))
+
+        if random.random() < server.error_rate:
+            self._send("Internal Server Error", 500)
+            return True
+
+        return False
+
+
+    def do_GET(self):
+        if self._inject():
+            return
+
+        url = urlparse.urlparse(self.path)
+        params = dict(urlparse.parse_qsl(url.query))
+        session_id = self._session_id()
+        server = self.server
+
+        if url.path == "/":
+            headers = []
+            if session_id is None:
+                session_id = uuid.uuid4().hex
+                headers.append(("Set-Cookie",
+                                "{}={}; path=/".format(COOKIE_NAME,
+                                                       session_id)))
+            content = LOGIN_CONTENT.format(cookie=session_id)
+            self._send(PAGE_TEMPLATE.format(content=content), 200, headers)
+
+        elif url.path == "/index.php":
+            headers = []
+            if (server.url_session_ids and session_id is None
+                    and COOKIE_NAME in params):
+                # Like PHP when session.use_only_cookies is off, the
+                # session id can be passed in the URL, it is then set
+                # in the cookie
+                session_id = params[COOKIE_NAME]
+                headers.append(("Set-Cookie",
+                                "{}={}; path=/".format(COOKIE_NAME,
+                                                       session_id)))
+
+            if params.get("logout") == "1":
+                server.logout(session_id)
+                content = LOGIN_CONTENT.format(cookie=session_id)
+                self._send(PAGE_TEMPLATE.format(content=content))
+                return
+
+            account = server.account_of(session_id)
+            if (account is None
+                    or random.random() < server.logout_rate):
+                server.logout(session_id)
+                self._redirect("/index.php?logout=1")
+                return
+
+            self._send(PAGE_TEMPLATE.format(
+                content=server.content(account, params)), 200, headers)
+
+        else:
+            self._send("Not Found", 404)
+
+
+    def do_POST(self):
+        length = int(self.headers.get("Content-Length", 0))
+        data = dict(urlparse.parse_qsl(self.rfile.read(length)))
+
+        if self._inject():
+            return
+
+        session_id = self._session_id()
+
+        if self.path == "/auth_sess.php" and session_id is not None:
+            username = data.get(session_id + "_login")
+            password = data.get(session_id + "_password")
+            if self.server.login(session_id, username, password):
+                self._redirect("/index.php")
+            else:
+                self._redirect("/index.php?logout=1")
+
+        else:
+            self._send("Not Found", 404)
+
+
+
+class StubServer(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    """The stand-in Extranet.
+
+    Attributes:
+        accounts    -- the accounts, a dict of Account by username
+        latency     -- the mean latency of each response in seconds
+        jitter      -- the standard deviation of the latency
+        error_rate  -- the probability of a 500 response
+        logout_rate -- the probability of an unexpected log out
+        compress    -- True if the responses are compressed with gzip
+                       when the client accept it
+        handshake   -- the time in seconds taken by the handshake of
+                       each new connection, like the one of TLS
+        url_session_ids -- True if the session id is accepted in the
+                           PHPSESSID URL parameter
+        connections -- the number of connections accepted
+        requests    -- the number of requests received, by path
+    """
+
+    daemon_threads = True
+
+
+    def __init__(self, address=("127.0.0.1", 0), accounts=None,
+                 latency=0, jitter=0, error_rate=0, logout_rate=0,
+                 compress=False, handshake=0, url_session_ids=False):
+        BaseHTTPServer.HTTPServer.__init__(self, address, StubRequestHandler)
+
+        if accounts is None:
+            accounts = {"user" : Account("password")}
+
+        self.accounts = accounts
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.logout_rate = logout_rate
+        self.compress = compress
+        self.handshake = handshake
+        self.url_session_ids = url_session_ids
+        self.connections = 0
+        self.requests = {}
+
+        self._sessions = {}
+        self._lock = threading.Lock()
+
+        # The open connections and the threads that handle them, a
+        # keep-alive connection is kept open by its client after its
+        # requests were answered
+        self._connections = {}
+
+
+    @property
+    def url(self):
+        """The base URL of the stand-in, to use as the Extranet URL."""
+        return "http://{}:{}/".format(*self.server_address)
+
+
+    def start(self):
+        """Serve in a background thread and return the URL."""
+
+        thread = threading.Thread(target=self.serve_forever)
+        thread.daemon = True
+        thread.start()
+        return self.url
+
+
+    def stop(self):
+        """Stop serving and close the open connections, once their
+        threads are done the stand-in is no longer running.
+        """
+
+        self.shutdown()
+        self.server_close()
+
+        with self._lock:
+            connections = list(self._connections.items())
+        for connection, thread in connections:
+            try:
+                connection.shutdown(socket.SHUT_RDWR)
+            except socket.error:
+                # The client closed it
+                pass
+        for _, thread in connections:
+            thread.join(STOP_TIMEOUT)
+
+
+    def count_connection(self, connection):
+        with self._lock:
+            self.connections += 1
+            self._connections[connection] = threading.current_thread()
+        if self.handshake:
+            time.sleep(self.handshake)
+
+
+    def forget_connection(self, connection):
+        with self._lock:
+            self._connections.pop(connection, None)
+
+
+    def count(self, path):
+        path = urlparse.urlparse(path).path
+        with self._lock:
+            self.requests[path] = self.requests.get(path, 0) + 1
+
+
+    def total_requests(self):
+        with self._lock:
+            return sum(self.requests.values())
+
+
+    def reset_stats(self):
+        with self._lock:
+            self.requests.clear()
+            self.connections = 0
+
+
+    def login(self, session_id, username, password):
+        account = self.accounts.get(username)
+        if account is None or account.password != password:
+            return False
+
+        with self._lock:
+            self._sessions[session_id] = account
+        return True
+
+
+    def logout(self, session_id):
+        with self._lock:
+            self._sessions.pop(session_id, None)
+
+
+    def account_of(self, session_id):
+        with self._lock:
+            return self._sessions.get(session_id)
+
+
+    def daily_traffic(self, account):
+        """Return the daily traffic table of the account, the used data
+        spread over the days of its billing period.
+        """
+
+        # strptime is not thread-safe the first time it is called
+        start, end = [datetime.date(*map(int, d.split("-")))
+                      for d in (account.period_start, account.period_end)]
+        days = (end - start).days + 1
+        rows = []
+
+        for i in range(days):
+            download = account.used * (0.5 + (i % 7) / 10.0) / days
+            upload = account.used * (0.5 - (i % 7) / 10.0) / days
+            rows.append(DAILY_TRAFFIC_ROW.format(
+                date=start + datetime.timedelta(days=i), download=download,
+                upload=upload, total=download + upload))
+
+        return DAILY_TRAFFIC_CONTENT.format(rows="\n".join(rows))
+
+
+    def content(self, account, params):
+        """Return the content of the page of the params."""
+
+        if (params.get("content") == "internet"
+                and params.get("sub") == "traffic"):
+            if account.available < AVAILABLE_STRING_THRESHOLD:
+                template = TRAFFIC_USED_CONTENT
+            else:
+                template = TRAFFIC_AVAILABLE_CONTENT
+            return template.format(used=account.used,
+                                   available=account.available,
+                                   total=account.total,
+                                   period_start=account.period_start,
+                                   period_end=account.period_end) + \
+                self.daily_traffic(account)
+
+        if (params.get("content") == "telephonie"
+                and params.get("sub") == "interurbain"):
+            return CALLS_CONTENT.format(rows="\n".join(
+                CALL_ROW.format(day=i % 28 + 1, hour=i % 24,
+                                minute=i * 7 % 60, number=i % 10000,
+                                duration_minutes=i % 45,
+                                duration_seconds=i * 13 % 60,
+                                amount=(i % 45) * 0.05)
+                for i in range(account.calls)))
+
+        if params.get("content") == "facturation" and not params.get("sub"):
+            return INVOICES_CONTENT.format(rows="\n".join(
+                INVOICE_ROW.format(year=2016 - (i + 7) // 12,
+                                   month=(4 - i) % 12 + 1,
+                                   number=100000 + i,
+                                   amount=59.95 + i % 3,
+                                   status="Unpaid" if i == 0 else "Paid")
+                for i in range(account.invoices)))
+
+        title = " > ".join(params.get(k, "") for k in ("content", "sub"))
+        return GENERIC_CONTENT.format(title=title or "Home")
+
+
+
+########################################################################
+# Main
+########################################################################
+def main(argv):
+    parser = argparse.ArgumentParser(
+        description='Run a local stand-in for the Derytelecom Extranet.')
+    parser.add_argument('--port', type=int, default=8080,
+        help='the port to listen on (default: 8080)')
+    parser.add_argument('--latency', type=float, default=0,
+        help='the mean latency of the responses in seconds')
+    parser.add_argument('--jitter', type=float, default=0,
+        help='the standard deviation of the latency in seconds')
+    parser.add_argument('--error-rate', type=float, default=0,
+        help='the probability of a 500 response')
+    parser.add_argument('--logout-rate', type=float, default=0,
+        help='the probability of an unexpected log out')
+    parser.add_argument('--used', type=float, default=39.7,
+        help='the used data of the account user/password in Gb '
+             '(default: 39.7)')
+    parser.add_argument('--compress', action='store_true',
+        help='compress the responses with gzip')
+    parser.add_argument('--url-session-ids', action='store_true',
+        help='accept the session id in the PHPSESSID URL parameter')
+    args = parser.parse_args(argv)
+
+    server = StubServer(("127.0.0.1", args.port),
+                        {"user" : Account("password", args.used)},
+                        args.latency, args.jitter,
+                        args.error_rate, args.logout_rate, args.compress,
+                        url_session_ids=args.url_session_ids)
+    print("Serving on {}".format(server.url))
+
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
@@ -11,9 +11,34 @@ MIT Licensed, see LICENSE for more details.
 """
 
 
+import os
+import re
 import sys
+import csv
+import json
+import time
+import errno
+import signal
+import datetime
 import argparse
-from derytelecomextranetquery import *
+import socket
+import threading
+
+# Only the modules that are fast to import are imported here, the
+# others (like requests, BeautifulSoup, numpy, sqlite3 and the modules
+# of the server, of the polls and of the sinks) are imported by the
+# sub-commands that need them, so their defaults are written out in the
+# help of the options
+from derytelecomextranetquery import (DerytelecomExtranetQuery, PARAM,
+                                      MAX_WORKERS, FORM_HANDOFF,
+                                      KEYBOARD_HANDOFF,
+                                      DerytelecomExtranetQueryException,
+                                      InternetConnectionError,
+                                      HTTPNotOKError,
+                                      BadUsernamePasswordError,
+                                      UnexpectedLogOutError,
+                                      CircuitOpenError)
+from usage import UsageRecord, format_amount
 
 
 
@@ -48,15 +73,63 @@ LANG = {
 }
 
 
+# The output formats, text output the available data as displayed by
+# the Extranet and the others output the usage as numbers of bytes
+FORMATS = ("text", "json", "csv")
+
+
+# The data that are tables, by name, and the methods that retrieve
+# them. Their rows are output as they are read, in CSV or JSON lines.
+TABLES = {
+    "longdistance" : DerytelecomExtranetQuery.get_longdistancecalls,
+    "invoices" : DerytelecomExtranetQuery.get_invoices,
+    "dailytraffic" : lambda deq: deq.get_internettraffic().get_daily_traffic()
+}
+
+
+# The formats of the metrics file, those of metrics.Recorder
+METRICS_FORMATS = ("prometheus", "json")
+
+
+# The default paths of the history store and of the socket of the
+# server, as written in the help of their options
+HISTORY_PATH_HELP = ("derytelecomextranetquery/history.sqlite in "
+                     "$XDG_DATA_HOME or ~/.local/share")
+SOCKET_PATH_HELP = ("derytelecomextranetquery.sock in $XDG_RUNTIME_DIR, "
+                    "or /tmp/UID-derytelecomextranetquery.sock")
+
+
 EXITCODE_FOR_EXCEPTIONS = {
     DerytelecomExtranetQueryException : 3,
     InternetConnectionError : 4,
     HTTPNotOKError : 5,
     BadUsernamePasswordError : 6,
-    UnexpectedLogOutError : 7
+    UnexpectedLogOutError : 7,
+    CircuitOpenError : 8
 }
 
 
+# The file where the state of the circuit breaker is kept, so that the
+# processes that fail one after the other while the Extranet is down
+# end up failing fast
+CIRCUIT_FILE_NAME = "circuit.json"
+
+
+# The delay in seconds between two writes of the metrics file of the
+# serve sub-command
+METRICS_INTERVAL = 15
+
+
+# The maximum time in seconds to wait for the sinks to deliver the
+# samples before exiting
+SINK_CLOSE_TIMEOUT = 30
+
+
+# The exit code when the reader of the output is gone, the one of a
+# process killed by SIGPIPE, like the other commands of a pipeline
+EXITCODE_BROKEN_PIPE = 128 + signal.SIGPIPE
+
+
 
 def derytelecom_open(args):
     parser = args.parser
@@ -71,38 +144,736 @@ def derytelecom_open(args):
     params.update(SUBPAGES.get(subpage, {}))
     params.update(LANG.get(lang, {}))
 
-    DerytelecomExtranetQuery.open_in_webbrowser(params, username, password)
+    if args.form_handoff:
+        sys.stderr.write("warning: the session id is passed in the URL "
+                         "of the page, it is kept in the history of the "
+                         "web browser, and this only works if the Extranet "
+                         "accepts session ids in URLs\n")
+
+    handoff = FORM_HANDOFF if args.form_handoff else KEYBOARD_HANDOFF
+    try:
+        opened = DerytelecomExtranetQuery.open_in_webbrowser(
+            params, username, password, handoff)
+    except Exception as e:
+        exit_for_exception(parser, e)
+
+    if not opened:
+        parser.exit(EXITCODE_FOR_EXCEPTIONS[DerytelecomExtranetQueryException],
+                    "error: the web browser did not open the page in time\n")
+
+
+def exitcode_for_exception(e):
+    """Return the exit code associated with the exception e and the
+    exception whose message must be reported.
+    """
+
+    if type(e) not in EXITCODE_FOR_EXCEPTIONS:
+        # For unknow exceptions, act as if they were
+        # DerytelecomExtranetQueryException exceptions,
+        # with the same exit code and error message.
+        e = DerytelecomExtranetQueryException()
+
+    return EXITCODE_FOR_EXCEPTIONS[type(e)], e
+
+
+def exit_for_exception(parser, e):
+    """Exit with the exit code and the error message associated with
+    the exception e.
+    """
+
+    exitcode, e = exitcode_for_exception(e)
+    parser.exit(exitcode, "error: {}\n".format(e))
+
+
+def exit_for_broken_pipe():
+    """Exit quietly once the reader of the output is gone, like head
+    once it read its lines. The output is redirected to /dev/null
+    first, so that the interpreter does not fail again when it flushes
+    it at exit.
+    """
+
+    devnull = os.open(os.devnull, os.O_WRONLY)
+    os.dup2(devnull, sys.stdout.fileno())
+    sys.exit(EXITCODE_BROKEN_PIPE)
+
+
+def read_accounts(accounts_file):
+    """Read the accounts from a file that contain one account per
+    line: the username followed by the password, separated by
+    whitespaces. Empty lines and lines starting with # are ignored.
+
+    Return:
+    A list of (username, password) tuples
+    """
+
+    accounts = []
+
+    for line in accounts_file:
+        line = line.strip()
+        if line and not line.startswith("#"):
+            fields = line.split(None, 1)
+            if len(fields) != 2:
+                raise ValueError("'{}' is not a valid account"
+                                 .format(fields[0]))
+            accounts.append(tuple(fields))
+
+    return accounts
+
+
+def parse_time(string):
+    """Convert a date (YYYY-MM-DD), a date and time
+    (YYYY-MM-DD HH:MM[:SS]) or a relative time in the past (like 7d
+    or 12h) to a timestamp.
+    """
+
+    m = re.match(r"^(\d+)([smhdw])$", string)
+    if m:
+        from history import MINUTE, HOUR, DAY
+
+        time_units = {
+            "s" : 1,
+            "m" : MINUTE,
+            "h" : HOUR,
+            "d" : DAY,
+            "w" : 7 * DAY
+        }
+        return time.time() - int(m.group(1)) * time_units[m.group(2)]
+
+    for time_format in ("%Y-%m-%d", "%Y-%m-%d %H:%M", "%Y-%m-%d %H:%M:%S"):
+        try:
+            t = datetime.datetime.strptime(string, time_format)
+            return time.mktime(t.timetuple())
+        except ValueError:
+            pass
+
+    raise argparse.ArgumentTypeError("'{}' is not a valid time"
+                                     .format(string))
+
+
+def parse_resolution(string):
+    """Convert a resolution name or a number of seconds to seconds."""
+
+    from history import RAW, MINUTE, HOUR, DAY
+
+    resolutions = {
+        "raw" : RAW,
+        "minute" : MINUTE,
+        "hour" : HOUR,
+        "day" : DAY
+    }
+    if string in resolutions:
+        return resolutions[string]
+
+    try:
+        return int(string)
+    except ValueError:
+        raise argparse.ArgumentTypeError("'{}' is not a valid resolution"
+                                         .format(string))
+
+
+def parse_workers(string):
+    """Convert a number of workers, which must be at least 1."""
+
+    try:
+        workers = int(string)
+    except ValueError:
+        workers = 0
+
+    if workers < 1:
+        raise argparse.ArgumentTypeError("'{}' is not a valid number of "
+                                         "workers, it must be at least 1"
+                                         .format(string))
+    return workers
+
+
+def make_result_writer(output_format, with_username=False):
+    """Return a function that write a result to stdout in the output
+    format. The function take the result and the username of the
+    account as arguments. The result is a dict with the available data
+    (availabledata) and the usage, a dict made by UsageRecord.as_dict
+    (usage).
+    """
+
+    if output_format == "text":
+        def write(result, username=None):
+            line = result["availabledata"]
+            if with_username:
+                line = "{}: {}".format(username, line)
+            sys.stdout.write(u"{}\n".format(line))
+
+    elif output_format == "json":
+        def write(result, username=None):
+            usage = result["usage"]
+            if with_username:
+                usage = dict(usage, username=username)
+            sys.stdout.write(json.dumps(usage, sort_keys=True) + "\n")
+
+    else:
+        fields = list(UsageRecord.FIELDS)
+        if with_username:
+            fields.insert(0, "username")
+
+        writer = csv.DictWriter(sys.stdout, fields)
+        writer.writerow(dict(zip(fields, fields)))
+
+        def write(result, username=None):
+            usage = result["usage"]
+            if with_username:
+                usage = dict(usage, username=username)
+            writer.writerow(usage)
+
+    def write_and_flush(result, username=None):
+        write(result, username)
+        sys.stdout.flush()
+
+    return write_and_flush
+
+
+def make_policy(args):
+    """Return the RetryPolicy of the requests specified by the
+    arguments of the get sub-command.
+    """
+
+    import retry
+    from sessionstore import default_cache_dir
+
+    timeout = retry.TIMEOUT if args.timeout is None else args.timeout
+    budget = retry.BUDGET if args.budget is None else args.budget
+    retries = retry.RETRIES if args.retries is None else args.retries
+
+    breaker = retry.CircuitBreaker(
+        state_path=os.path.join(default_cache_dir(), CIRCUIT_FILE_NAME))
+    return retry.RetryPolicy(timeout=timeout or None, budget=budget or None,
+                             retries=retries, breaker=breaker)
+
+
+def make_transport(args):
+    """Return the Transport of the sessions of the get sub-command,
+    with a connection for each worker. It is created the first time it
+    is needed.
+    """
+
+    if args.transport is None:
+        from transport import Transport, POOL_SIZE
+        args.transport = Transport(max(POOL_SIZE, args.workers))
+    return args.transport
+
+
+def write_metrics(args):
+    """Write the metrics recorded by args.recorder in the metrics file,
+    if one was specified.
+    """
+
+    if args.metrics_file:
+        try:
+            args.recorder.write_file(args.metrics_file, args.metrics_format)
+        except (IOError, OSError) as e:
+            sys.stderr.write("error: {}\n".format(e))
+
+
+def store_history(args, results):
+    """Add the usage of the results to the history store, if it was
+    requested.
+
+    Arguments:
+    results -- a list of (username, result) tuples
+    """
+
+    if args.history and results:
+        from history import HistoryStore
+
+        with HistoryStore(args.db) as store:
+            store.add_many((username, UsageRecord.from_dict(result["usage"]))
+                           for username, result in results)
+
+
+def send_to_sinks(args, results):
+    """Queue the usage of the results for their delivery by the sinks
+    of args.sinks.
+
+    Arguments:
+    results -- a list of (username, result) tuples
+    """
+
+    for sink in args.sinks:
+        for username, result in results:
+            sink.put(username, UsageRecord.from_dict(result["usage"]))
+
+
+def close_sinks(args):
+    """Deliver the samples queued in the sinks of args.sinks and report
+    those that could not be delivered.
+    """
+
+    for spec, sink in zip(args.sink, args.sinks):
+        if not sink.close(SINK_CLOSE_TIMEOUT):
+            sys.stderr.write("error: {}: the samples were not all delivered "
+                             "in time\n".format(spec))
+        if sink.failed or sink.dropped:
+            sys.stderr.write("error: {}: {} samples failed, {} dropped, last "
+                             "error: {}\n".format(spec, sink.failed,
+                                                  sink.dropped, sink.error))
+
+
+def derytelecom_get_from_server(args):
+    # Retrieve the data by using the server listening on args.socket.
+    # Return False if the server can not be reached.
+    from queryserver import query_server
+
+    parser = args.parser
+
+    try:
+        answer = query_server(args.socket, "traffic",
+                              args.username, args.password)
+    except socket.error:
+        return False
+
+    if "error" in answer:
+        exitcode = EXITCODE_FOR_EXCEPTIONS[DerytelecomExtranetQueryException]
+        for exception_class, code in EXITCODE_FOR_EXCEPTIONS.iteritems():
+            if exception_class.__name__ == answer["error"]:
+                exitcode = code
+        parser.exit(exitcode, "error: {}\n".format(answer["msg"]))
+
+    make_result_writer(args.format)(answer["result"])
+    store_history(args, [(args.username, answer["result"])])
+    send_to_sinks(args, [(args.username, answer["result"])])
+    return True
+
+
+def load_accounts(args):
+    """Return the accounts of the file of the --accounts option."""
+
+    try:
+        with args.accounts as accounts_file:
+            accounts = read_accounts(accounts_file)
+    except ValueError as e:
+        args.parser.error(str(e))
+
+    if not accounts:
+        args.parser.error("the accounts file contains no account")
+
+    return accounts
+
+
+def make_interval(args):
+    """Return a new AdaptiveInterval as specified by the arguments of
+    the get sub-command.
+    """
+
+    from watch import AdaptiveInterval
+
+    # The options that were not specified keep the defaults of
+    # AdaptiveInterval
+    kwargs = dict((name, getattr(args, name))
+                  for name in ("min_interval", "max_interval", "jitter")
+                  if getattr(args, name) is not None)
+    if args.threshold is not None:
+        kwargs["threshold"] = args.threshold * 1000 ** 3
+
+    return AdaptiveInterval(**kwargs)
+
+
+def derytelecom_get_accounts(args):
+    # Retrieve the data of all the accounts of args.accounts, the
+    # results are printed as they arrive
+    from queryserver import DATA
+    from sessionstore import SessionStore
+
+    parser = args.parser
+    accounts = load_accounts(args)
+
+    session_store = SessionStore() if args.session_cache else None
+    write = make_result_writer(args.format, with_username=True)
+    exitcodes = set()
+    successes = []
+
+    results = DerytelecomExtranetQuery.query_accounts(
+        accounts, DATA["traffic"], args.workers, session_store,
+        make_policy(args), args.recorder, args.corpus, make_transport(args))
+
+    for username, result, exception in results:
+        if exception is None:
+            write(result, username)
+            successes.append((username, result))
+            send_to_sinks(args, [(username, result)])
+        else:
+            exitcode, e = exitcode_for_exception(exception)
+            exitcodes.add(exitcode)
+            sys.stderr.write("{}: error: {}\n".format(username, e))
+
+    store_history(args, successes)
+
+    # When the accounts did not all fail for the same reason, exit
+    # as if it was an unknown error
+    if len(exitcodes) == 1:
+        parser.exit(exitcodes.pop())
+    elif exitcodes:
+        parser.exit(EXITCODE_FOR_EXCEPTIONS[DerytelecomExtranetQueryException])
+
+
+def derytelecom_get_accounts_watch(args):
+    # Poll the data of all the accounts of args.accounts until
+    # interrupted, at the rate of args.rate, the results are printed as
+    # they arrive
+    from queryserver import DATA
+    from sessionstore import SessionStore
+    import scheduler
+
+    parser = args.parser
+    accounts = load_accounts(args)
+
+    session_store = SessionStore() if args.session_cache else None
+    write = make_result_writer(args.format, with_username=True)
+
+    polls = scheduler.Scheduler(
+        accounts, DATA["traffic"],
+        lambda r: UsageRecord.from_dict(r["usage"]),
+        lambda: make_interval(args), args.rate or scheduler.DEFAULT_RATE,
+        max_in_flight=args.workers,
+        session_store=session_store, policy=make_policy(args),
+        recorder=args.recorder, corpus=args.corpus,
+        transport=make_transport(args))
+    results = polls.run()
+
+    try:
+        for username, result, exception in results:
+            if exception is None:
+                write(result, username)
+                store_history(args, [(username, result)])
+                send_to_sinks(args, [(username, result)])
+            else:
+                exitcode, e = exitcode_for_exception(exception)
+                sys.stderr.write("{}: error: {}\n".format(username, e))
+            write_metrics(args)
+
+    except KeyboardInterrupt:
+        results.close()
+
+    if args.profile:
+        sys.stderr.write("accounts: {accounts}, polls: {polls}, failures: "
+                         "{failures}, queue depth: {queue_depth}, max lag: "
+                         "{max_lag_seconds:.2f} s\n".format(**polls.stats()))
+
+    # The polls only stop by themselves once the username or the
+    # password of all the accounts were rejected
+    if not polls.accounts:
+        parser.exit(EXITCODE_FOR_EXCEPTIONS[BadUsernamePasswordError])
+
+
+def derytelecom_get_watch(args):
+    # Poll the data of the account until interrupted, the results are
+    # printed as they arrive
+    from queryserver import DATA
+    from sessionstore import SessionStore
+    from watch import watch
+
+    parser = args.parser
+
+    session_store = SessionStore() if args.session_cache else None
+    interval = make_interval(args)
+    write = make_result_writer(args.format)
+
+    results = watch(args.username, args.password, DATA["traffic"],
+                    lambda r: UsageRecord.from_dict(r["usage"]),
+                    interval, session_store, make_policy(args),
+                    args.recorder, args.corpus, make_transport(args))
+
+    try:
+        for result, exception in results:
+            if exception is None:
+                write(result)
+                store_history(args, [(args.username, result)])
+                send_to_sinks(args, [(args.username, result)])
+            else:
+                exitcode, e = exitcode_for_exception(exception)
+                sys.stderr.write("error: {}\n".format(e))
+            write_metrics(args)
+
+    except KeyboardInterrupt:
+        results.close()
+
+    except IOError as e:
+        # The broken pipe is a failure to write the output, not to poll
+        if e.errno == errno.EPIPE:
+            raise
+        exit_for_exception(parser, e)
+
+    except Exception as e:
+        exit_for_exception(parser, e)
+
+
+def derytelecom_get_account(args):
+    # Retrieve the data of the account with a direct query, shared with
+    # the other processes that query the account at the same time if
+    # args.shared_cache is set
+    from queryserver import DATA
+    from sessionstore import SessionStore
+
+    parser = args.parser
+    session_store = SessionStore() if args.session_cache else None
+
+    def fetch():
+        with DerytelecomExtranetQuery.connect(
+                args.username, args.password, session_store,
+                policy=make_policy(args), recorder=args.recorder,
+                corpus=args.corpus, transport=make_transport(args)) as deq:
+            return DATA["traffic"](deq)
+
+    try:
+        if args.shared_cache:
+            from sharedcache import SharedCache
+            result, _ = SharedCache(args.shared_cache).get(
+                args.username, args.password, "traffic", fetch)
+        else:
+            result = fetch()
+
+    except Exception as e:
+        exit_for_exception(parser, e)
+
+    make_result_writer(args.format)(result)
+    store_history(args, [(args.username, result)])
+    send_to_sinks(args, [(args.username, result)])
+
+
+def derytelecom_get_table(args):
+    # Retrieve a table of the account and output its rows as they are
+    # read
+    from sessionstore import SessionStore
+
+    parser = args.parser
+    session_store = SessionStore() if args.session_cache else None
+
+    try:
+        with DerytelecomExtranetQuery.connect(
+                args.username, args.password, session_store,
+                policy=make_policy(args), recorder=args.recorder,
+                corpus=args.corpus, transport=make_transport(args)) as deq:
+            table = TABLES[args.data](deq)
+
+    except Exception as e:
+        exit_for_exception(parser, e)
+
+    if args.format == "json":
+        for row in table.iter_rows():
+            sys.stdout.write(json.dumps(row, sort_keys=True) + "\n")
+
+    else:
+        fields = table.get_fields()
+        writer = csv.DictWriter(sys.stdout, fields, extrasaction="ignore")
+        writer.writerow(dict(zip(fields, fields)))
+        for row in table.iter_rows():
+            writer.writerow(dict((k, v.encode("utf-8")
+                                  if isinstance(v, unicode) else v)
+                                 for k, v in row.items()))
+
+    sys.stdout.flush()
 
 
 def derytelecom_get(args):
     parser = args.parser
+
+    # When only two positional arguments are passed, they are the
+    # username and the password
+    if args.password is None and args.username is not None:
+        args.data, args.username, args.password = ('availabledata',
+                                                   args.data,
+                                                   args.username)
+
     data = args.data
     username = args.username
     password = args.password
 
-    if data == 'availabledata':
+    if data != 'availabledata' and data not in TABLES:
+        parser.error("'{}' is not a valid data to retrieve".format(data))
+
+    if data in TABLES:
+        if args.format == "text":
+            parser.error("the {} table can only be output in json or csv"
+                         .format(data))
+        for option in ("accounts", "watch", "socket", "history",
+                       "shared_cache", "sink"):
+            if getattr(args, option):
+                parser.error("--{} can not be used with the {} table"
+                             .format(option.replace("_", "-"), data))
+
+    # Watch output a stream of samples, one JSON line per sample by
+    # default, and the tables one CSV line per row
+    if args.format is None:
+        if data in TABLES:
+            args.format = "csv"
+        else:
+            args.format = "json" if args.watch else "text"
+
+    if args.shared_cache and (args.accounts or args.watch):
+        parser.error("--shared-cache can not be used with --accounts or "
+                     "--watch")
+
+    if not args.accounts and (username is None or password is None):
+        parser.error("the username and the password are required")
+
+    if args.rate is not None:
+        if not (args.accounts and args.watch):
+            parser.error("--rate can only be used with --accounts and "
+                         "--watch")
+        if args.rate <= 0:
+            parser.error("--rate must be greater than 0")
+
+    if args.metrics_file and not args.watch:
+        parser.error("--metrics-file can only be used with --watch")
+
+    if args.profile or args.metrics_file:
+        from metrics import Recorder
+        args.recorder = Recorder()
+    else:
+        args.recorder = None
+
+    args.transport = None
+
+    if args.record:
+        from corpus import PageCorpus
+        args.corpus = PageCorpus(args.record)
+    else:
+        args.corpus = None
+
+    args.sink = args.sink or []
+    args.sinks = []
+    if args.sink:
+        from sinks import make_sink
         try:
-            with DerytelecomExtranetQuery.connect(username, password) as deq:
-                inet_traffic = deq.get_internettraffic()
-                available = inet_traffic.get_available()
-                print(available)
-
-        except DerytelecomExtranetQueryException as e:
-            exitcode = EXITCODE_FOR_EXCEPTIONS[type(e)]
-            parser.exit(exitcode, "error: {}\n".format(e))
-
-        except:
-            # For unknow exceptions, act as if they were
-            # DerytelecomExtranetQueryException exceptions,
-            # with the same exit code and error message.
-            exitcode = EXITCODE_FOR_EXCEPTIONS[
-                DerytelecomExtranetQueryException]
-            e = DerytelecomExtranetQueryException()
-            parser.exit(exitcode, "error: {}\n".format(e))
+            args.sinks = [make_sink(spec) for spec in args.sink]
+        except (ValueError, socket.error) as e:
+            parser.error(str(e))
+
+    try:
+        if data in TABLES:
+            derytelecom_get_table(args)
+
+        elif args.accounts and args.watch:
+            derytelecom_get_accounts_watch(args)
+
+        elif args.accounts:
+            derytelecom_get_accounts(args)
+
+        elif args.watch:
+            derytelecom_get_watch(args)
+
+        # When a server is specified, use it and only fall back on a
+        # direct query if it is not running
+        elif not (args.socket and derytelecom_get_from_server(args)):
+            derytelecom_get_account(args)
+
+    finally:
+        close_sinks(args)
+        if args.profile:
+            sys.stderr.write(args.recorder.format_profile())
+            if args.transport is not None:
+                sys.stderr.write("connections: {connections}, requests: "
+                                 "{requests}, bytes sent: {bytes_sent}, "
+                                 "bytes received: {bytes_received}\n"
+                                 .format(**args.transport.stats()))
+
+
+def derytelecom_history(args):
+    from history import HistoryStore, RAW
+
+    resolution = RAW if args.resolution is None else args.resolution
+
+    with HistoryStore(args.db) as store:
+        if args.compact:
+            store.compact()
+
+        write = make_result_writer(args.format, with_username=True)
+        records = store.query(args.account, args.since, args.until,
+                              resolution)
+
+        for username, record in records:
+            fetched_at = datetime.datetime.fromtimestamp(record.fetched_at)
+            write({"availabledata" : "{:%Y-%m-%d %H:%M:%S} {}".format(
+                       fetched_at, format_amount(record.available)),
+                   "usage" : record.as_dict()},
+                  username)
+
+
+def format_forecast(f):
+    # Format a forecast as a line of text
+    from history import DAY
+
+    line = "{}: {} available".format(f.username, format_amount(f.available))
+
+    if f.rate is None:
+        return line + ", not enough samples to forecast"
+
+    line += ", {}/day".format(format_amount(f.rate * DAY))
+    if f.exhausted_at is None:
+        return line
+
+    exhausted_at = datetime.datetime.fromtimestamp(f.exhausted_at)
+    line += ", runs out on {:%Y-%m-%d %H:%M}".format(exhausted_at)
+    if f.runs_out:
+        line += " before the end of the period"
+    return line
+
+
+def derytelecom_forecast(args):
+    import forecast
+    from history import HistoryStore
+
+    parser = args.parser
+
+    if forecast.numpy is None:
+        parser.error("NumPy is required to forecast the usage")
+
+    since = time.time() - forecast.MAX_PERIOD
+    window = args.window or forecast.DEFAULT_WINDOW
+    with HistoryStore(args.db) as store:
+        forecasts = forecast.forecast_history(store, args.account, since,
+                                              window)
+
+    if args.format == "text":
+        for f in forecasts:
+            sys.stdout.write("{}\n".format(format_forecast(f)))
+
+    elif args.format == "json":
+        for f in forecasts:
+            sys.stdout.write(json.dumps(f.as_dict(), sort_keys=True) + "\n")
 
     else:
-        parser.error("'{}' is not a valid data to retrieve".format(data))
+        fields = forecast.Forecast.FIELDS
+        writer = csv.DictWriter(sys.stdout, fields)
+        writer.writerow(dict(zip(fields, fields)))
+        for f in forecasts:
+            writer.writerow(f.as_dict())
+
 
+def derytelecom_serve(args):
+    from queryserver import QueryServer, default_socket_path, IDLE_TIMEOUT
+    from responsecache import ResponseCache
+
+    idle_timeout = (IDLE_TIMEOUT if args.idle_timeout is None
+                    else args.idle_timeout)
+
+    cache = ResponseCache() if args.cache else None
+    server = QueryServer(args.socket or default_socket_path(), cache,
+                         idle_timeout=idle_timeout)
+    args.recorder = server.recorder
+
+    if args.metrics_file:
+        def write_metrics_forever():
+            while True:
+                write_metrics(args)
+                time.sleep(METRICS_INTERVAL)
+
+        thread = threading.Thread(target=write_metrics_forever)
+        thread.daemon = True
+        thread.start()
+
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
 
 
 
@@ -121,6 +892,13 @@ parser_open.add_argument('-s', '--subpage', dest='subpage', default='',
     choices=SUBPAGES, help='the subpage to open')
 parser_open.add_argument('-l', '--lang', dest='lang', default='',
     choices=LANG, help='the langue to use')
+parser_open.add_argument('--form-handoff', dest='form_handoff',
+    action='store_true',
+    help='log in first and open the page logged in through a local form, '
+         'instead of typing the username and the password in the login '
+         'form after a delay; the session id is passed in the URL, so it '
+         'is kept in the history of the web browser, and the Extranet '
+         'must accept session ids in URLs')
 parser_open.add_argument('username', nargs='?', default='',
     help='the username to use to auto log in')
 parser_open.add_argument('password', nargs='?', default='',
@@ -131,11 +909,179 @@ parser_open.set_defaults(func=derytelecom_open, parser=parser_open)
 parser_get = subparsers.add_parser('get',
     help='Retrieve data from the Derytelecom Extranet')
 parser_get.add_argument('data', nargs='?', default='availabledata',
-    help='the data to retrieve (default: availabledata)')
-parser_get.add_argument('username', help='the username to use to log in')
-parser_get.add_argument('password', help='the password to use to log in')
+    help='the data to retrieve, availabledata or one of the tables {} '
+         '(default: availabledata)'.format(', '.join(sorted(TABLES))))
+parser_get.add_argument('username', nargs='?', default=None,
+    help='the username to use to log in')
+parser_get.add_argument('password', nargs='?', default=None,
+    help='the password to use to log in')
+parser_get.add_argument('--accounts', dest='accounts', default=None,
+    type=argparse.FileType('r'),
+    help='retrieve the data of all the accounts of this file, which '
+         'contain one username and password per line, instead of the '
+         'specified username and password, with --watch poll them '
+         'until interrupted, spread over their intervals')
+parser_get.add_argument('--workers', dest='workers', type=parse_workers,
+    default=MAX_WORKERS,
+    help='the maximum number of accounts queried at the same time '
+         '(default: {})'.format(MAX_WORKERS))
+parser_get.add_argument('--rate', dest='rate', type=float, default=None,
+    help='with --accounts and --watch, the maximum number of requests per '
+         'second made to the Extranet (default: 2.0)')
+parser_get.add_argument('--socket', dest='socket', default=None,
+    help='query the server listening on this socket (see the serve '
+         'sub-command) instead of the Extranet, if it is running')
+parser_get.add_argument('-f', '--format', dest='format', default=None,
+    choices=FORMATS,
+    help='the output format, json and csv output the usage as numbers '
+         'of bytes (default: text, json with --watch)')
+parser_get.add_argument('--history', dest='history', action='store_true',
+    help='add the usage to the history store')
+parser_get.add_argument('--sink', dest='sink', action='append',
+    metavar='TYPE:TARGET',
+    help='also deliver the usage to this sink, it can be repeated. The '
+         'types are jsonl:PATH, textfile:PATH (Prometheus textfile '
+         'collector, a file per account named after PATH), '
+         'pushgateway:URL, influxdb:URL (of the write '
+         'endpoint, with its db parameter) and statsd:HOST:PORT')
+parser_get.add_argument('--record', dest='record', default=None,
+    metavar='DIR',
+    help='record the web pages retrieved from the Extranet in this '
+         'directory, without the username, the password and the session '
+         'id, to replay them or to benchmark the parsers against them')
+parser_get.add_argument('--db', dest='db', default=None,
+    help='the path of the history store (default: {})'
+         .format(HISTORY_PATH_HELP))
+parser_get.add_argument('--session-cache', dest='session_cache',
+    action='store_true',
+    help='keep the session on the disk and reuse it instead of logging in '
+         'each time')
+parser_get.add_argument('--shared-cache', dest='shared_cache', type=float,
+    default=0, metavar='SECONDS',
+    help='share the query with the other processes that retrieve the data '
+         'of the account at the same time, only one of them log in, and '
+         'reuse the data retrieved less than SECONDS ago (default: 0, '
+         'disabled)')
+parser_get.add_argument('--timeout', dest='timeout', type=float,
+    default=None,
+    help='the maximum time in seconds to wait for a response, 0 to wait '
+         'forever (default: 10)')
+parser_get.add_argument('--budget', dest='budget', type=float,
+    default=None,
+    help='the maximum time in seconds spent on logging in, retrieving a '
+         'page or logging out, retries included, 0 for no limit '
+         '(default: 30)')
+parser_get.add_argument('--retries', dest='retries', type=int,
+    default=None,
+    help='the number of times a request that failed because of the '
+         'connection or a 5xx status code is made again (default: 2)')
+parser_get.add_argument('--watch', dest='watch', action='store_true',
+    help='keep the session open and poll the data until interrupted, '
+         'less often when the usage is flat and more often when the '
+         'available data approaches the threshold')
+parser_get.add_argument('--min-interval', dest='min_interval', type=float,
+    default=None,
+    help='with --watch, the minimum delay between two polls in seconds '
+         '(default: 60)')
+parser_get.add_argument('--max-interval', dest='max_interval', type=float,
+    default=None,
+    help='with --watch, the maximum delay between two polls in seconds '
+         '(default: 1800)')
+parser_get.add_argument('--threshold', dest='threshold', type=float,
+    default=None,
+    help='with --watch, the available data in Gb under which the polls '
+         'are made at the minimum interval (default: 10)')
+parser_get.add_argument('--jitter', dest='jitter', type=float,
+    default=None,
+    help='with --watch, the fraction by which the delays are randomly '
+         'shortened or lengthened (default: 0.1)')
+parser_get.add_argument('--profile', dest='profile', action='store_true',
+    help='print the duration, the bytes transferred and the outcome of '
+         'each phase of the queries on stderr')
+parser_get.add_argument('--metrics-file', dest='metrics_file', default=None,
+    help='with --watch, write the metrics of the phases of the queries '
+         'in this file after each poll')
+parser_get.add_argument('--metrics-format', dest='metrics_format',
+    default='prometheus', choices=METRICS_FORMATS,
+    help='the format of the metrics file (default: prometheus)')
 parser_get.set_defaults(func=derytelecom_get, parser=parser_get)
 
 
+parser_history = subparsers.add_parser('history',
+    help='Show the usage stored in the history store')
+parser_history.add_argument('-a', '--account', dest='account', default=None,
+    help='only show the usage of this username')
+parser_history.add_argument('--since', dest='since', default=None,
+    type=parse_time,
+    help='only show the usage since this time, a date (YYYY-MM-DD), a '
+         'date and time (YYYY-MM-DD HH:MM) or a relative time like 7d')
+parser_history.add_argument('--until', dest='until', default=None,
+    type=parse_time, help='only show the usage before this time')
+parser_history.add_argument('-r', '--resolution', dest='resolution',
+    default=None, type=parse_resolution,
+    help='average the usage over intervals of this duration, raw, '
+         'minute, hour, day or a number of seconds (default: raw)')
+parser_history.add_argument('-f', '--format', dest='format',
+    default='text', choices=FORMATS,
+    help='the output format (default: text)')
+parser_history.add_argument('--compact', dest='compact',
+    action='store_true',
+    help='apply the retention rules to the store before showing it')
+parser_history.add_argument('--db', dest='db',
+    default=None,
+    help='the path of the history store (default: {})'
+         .format(HISTORY_PATH_HELP))
+parser_history.set_defaults(func=derytelecom_history, parser=parser_history)
+
+
+parser_forecast = subparsers.add_parser('forecast',
+    help='Forecast when the accounts of the history store will run out of '
+         'data before the end of their billing period (require NumPy)')
+parser_forecast.add_argument('-a', '--account', dest='account',
+    default=None, help='only forecast the usage of this username')
+parser_forecast.add_argument('-w', '--window', dest='window',
+    default=None, type=parse_resolution,
+    help='the duration over which the consumption rate is computed, '
+         'hour, day or a number of seconds (default: day)')
+parser_forecast.add_argument('-f', '--format', dest='format',
+    default='text', choices=FORMATS,
+    help='the output format (default: text)')
+parser_forecast.add_argument('--db', dest='db',
+    default=None,
+    help='the path of the history store (default: {})'
+         .format(HISTORY_PATH_HELP))
+parser_forecast.set_defaults(func=derytelecom_forecast,
+                             parser=parser_forecast)
+
+
+parser_serve = subparsers.add_parser('serve',
+    help='Keep the sessions with the Derytelecom Extranet open and answer '
+         'the queries received on a Unix socket')
+parser_serve.add_argument('--socket', dest='socket', default=None,
+    help='the path of the socket to listen on (default: {})'
+         .format(SOCKET_PATH_HELP))
+parser_serve.add_argument('--cache', dest='cache', action='store_true',
+    help='serve the pages retrieved recently from a cache instead of '
+         'retrieving them again')
+parser_serve.add_argument('--idle-timeout', dest='idle_timeout', type=float,
+    default=None,
+    help='close the sessions that were not used for this number of '
+         'seconds (default: 1800)')
+parser_serve.add_argument('--metrics-file', dest='metrics_file', default=None,
+    help='write the metrics of the phases of the queries in this file '
+         'every {} seconds, they can also be queried on the socket'
+         .format(METRICS_INTERVAL))
+parser_serve.add_argument('--metrics-format', dest='metrics_format',
+    default='prometheus', choices=METRICS_FORMATS,
+    help='the format of the metrics file (default: prometheus)')
+parser_serve.set_defaults(func=derytelecom_serve, parser=parser_serve)
+
+
 args = parser.parse_args()
-args.func(args)
+
+try:
+    args.func(args)
+except IOError as e:
+    if e.errno != errno.EPIPE:
+        raise
+    exit_for_broken_pipe()
@@ -0,0 +1,200 @@
+# -*- coding: utf-8 -*-
+
+"""
+asyncquery
+----------
+
+This module provides the AsyncDerytelecomExtranetQuery class, a
+non-blocking version of DerytelecomExtranetQuery. Its methods return
+futures instead of waiting for the Extranet, so that one thread can
+poll hundreds of accounts at the same time.
+
+The requests of all the instances are made by a bounded pool of
+threads, on keep-alive connections shared by all the sessions, so the
+cost of an account is its session and not a thread and a connection.
+The concurrent.futures module is required, it is part of Python 3 and
+is available for Python 2 as the futures package.
+
+Example:
+    pending = [AsyncDerytelecomExtranetQuery.connect(u, p)
+               for u, p in accounts]
+    for future in futures.as_completed(pending):
+        with future.result() as deq:
+            print(deq.get_internettraffic().result().get_available())
+
+Copyright(c) 2016 Rémi Tétreault <tetreault.remi@gmail.com>
+MIT Licensed, see LICENSE for more details.
+"""
+
+
+import threading
+
+try:
+    from concurrent import futures
+except ImportError:
+    futures = None
+
+from derytelecomextranetquery import DerytelecomExtranetQuery
+from transport import Transport
+
+
+
+########################################################################
+# Constants
+########################################################################
+# The maximum number of requests in flight at the same time, which is
+# also the maximum number of connections kept alive with the Extranet
+POOL_SIZE = 32
+
+
+
+########################################################################
+# Classes
+########################################################################
+class QueryPool(object):
+    """This class hold the threads that make the requests and the
+    connections that they use. It is shared by many instances of
+    AsyncDerytelecomExtranetQuery.
+    """
+
+    def __init__(self, size=POOL_SIZE):
+        """Arguments:
+        size -- the maximum number of requests in flight at the same
+                time (default: POOL_SIZE)
+        """
+
+        if futures is None:
+            raise RuntimeError("The concurrent.futures module is required "
+                               "by AsyncDerytelecomExtranetQuery")
+
+        self.executor = futures.ThreadPoolExecutor(size)
+        self.transport = Transport(size)
+
+
+    def session(self):
+        """Return a new requests.Session that use the shared
+        connections.
+        """
+
+        return self.transport.session()
+
+
+    def submit(self, function, *args, **kwargs):
+        """Call the function on a thread of the pool and return the
+        future of its result.
+        """
+
+        return self.executor.submit(function, *args, **kwargs)
+
+
+    def shutdown(self, wait=True):
+        """Stop the threads and close the connections."""
+
+        self.executor.shutdown(wait)
+        self.transport.close_pools()
+
+
+
+class AsyncDerytelecomExtranetQuery(object):
+    """This class represent a session with the Derytelecom Extranet,
+    like DerytelecomExtranetQuery, but its methods return futures.
+    To use it, you must first connect to the Extranet using the class
+    method connect.
+    """
+
+    _default_pool = None
+    _default_pool_lock = threading.Lock()
+
+
+    def __init__(self, deq, pool):
+        """This constructor should not be used"""
+        self._deq = deq
+        self._pool = pool
+
+
+    @classmethod
+    def default_pool(cls):
+        """Return the QueryPool used when none is specified, it is
+        created the first time it is needed.
+        """
+
+        with cls._default_pool_lock:
+            if cls._default_pool is None:
+                cls._default_pool = QueryPool()
+            return cls._default_pool
+
+
+    @classmethod
+    def connect(cls, username, password, session_store=None, cache=None,
+                pool=None, session=None, policy=None, recorder=None,
+                corpus=None, transport=None):
+        """Establish a connection with the Derytelecom Extranet, see
+        DerytelecomExtranetQuery.connect for the other arguments.
+
+        Arguments:
+        pool      -- the QueryPool to use (default: default_pool())
+        transport -- the transport.Transport of the session
+                     (default: the Transport of the pool)
+
+        Return:
+        A future of an instance of this class
+        """
+
+        if pool is None:
+            pool = cls.default_pool()
+        if transport is None:
+            transport = pool.transport
+
+        def connect():
+            deq = DerytelecomExtranetQuery.connect(
+                username, password, session_store, cache, session,
+                policy=policy, recorder=recorder, corpus=corpus,
+                transport=transport)
+            return cls(deq, pool)
+
+        return pool.submit(connect)
+
+
+    @property
+    def connected(self):
+        """Return True if the instance is connected on the
+        Derytelecom Extranet, False otherwise
+        """
+
+        return self._deq.connected
+
+
+    def get_content(self, content_param, content_class=None):
+        """Retrieve a web page, see DerytelecomExtranetQuery.get_content.
+
+        Return:
+        A future of the web page encapsulated in the Content class
+        """
+
+        if content_class is None:
+            return self._pool.submit(self._deq.get_content, content_param)
+        return self._pool.submit(self._deq.get_content, content_param,
+                                 content_class)
+
+
+    def get_internettraffic(self):
+        """Return a future of the internet traffic web page
+        encapsulated in a InternetTrafic class.
+        """
+
+        return self._pool.submit(self._deq.get_internettraffic)
+
+
+    def disconnect(self):
+        """Return a future that is done once disconnected from the
+        Derytelecom Extranet.
+        """
+
+        return self._pool.submit(self._deq.disconnect)
+
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.disconnect().result()
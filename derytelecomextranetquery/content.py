@@ -13,7 +13,12 @@ MIT Licensed, see LICENSE for more details.
 
 
 import re
-from BeautifulSoup import BeautifulSoup
+import time
+
+import fastparse
+from extraction import ExtractionSpec, Field, Locator
+from usage import UsageRecord, parse_amount, parse_period, format_date
+from dailytraffic import DailyTraffic
 
 
 ########################################################################
@@ -23,6 +28,130 @@ from BeautifulSoup import BeautifulSoup
 # Internet > Traffic page
 AVAILABLE_STRING = "Available"
 USED_STRING = "Used"
+TOTAL_STRING = "Total"
+PERIOD_STRING = "Period"
+
+
+# The pattern of a label: a text that only contain the string followed
+# by a colon, like "Total: ", so that the same word elsewhere on the
+# page, like the Total header of the daily traffic table, is not taken
+# for it. The label is also matched within the markup of the page,
+# between two tags, so that the page can be searched for it at once.
+LABEL_PATTERN = r"(?:^|>)\s*{}\s*:\s*(?:$|<)"
+
+# The Used string is also displayed alone, without a colon
+BARE_LABEL_PATTERN = r"(?:^|>)\s*{}\s*:?\s*(?:$|<)"
+
+
+# The compiled patterns of the labels of the strings above, compiled
+# once
+AVAILABLE_RE = re.compile(LABEL_PATTERN.format(AVAILABLE_STRING), re.U)
+USED_RE = re.compile(BARE_LABEL_PATTERN.format(USED_STRING), re.U)
+TOTAL_RE = re.compile(LABEL_PATTERN.format(TOTAL_STRING), re.U)
+PERIOD_RE = re.compile(LABEL_PATTERN.format(PERIOD_STRING), re.U)
+
+# The patterns that find the strings anywhere in a text, like the first
+# versions of this module did. They are the fallbacks of the labels, so
+# that a label like "Available data:" or "Available:&nbsp;" is found.
+AVAILABLE_FALLBACK_RE = re.compile(AVAILABLE_STRING)
+USED_FALLBACK_RE = re.compile(USED_STRING)
+
+
+# The parsers that can be used by the Content classes
+# FAST_PARSER use the fast path of the fastparse module and fall back on
+# BeautifulSoup when the page is not regular enough for it
+# SOUP_PARSER always use BeautifulSoup
+FAST_PARSER = "fast"
+SOUP_PARSER = "soup"
+PARSERS = (FAST_PARSER, SOUP_PARSER)
+
+
+MONEY_RE = re.compile(r"(-)?\s*\$?\s*(\d[\d\s]*(?:[.,]\d+)?)")
+
+DURATION_RE = re.compile(r"^(?:(\d+):)?(\d+):(\d{2})$")
+
+MINUTES_RE = re.compile(r"(\d+(?:[.,]\d+)?)\s*min")
+
+
+
+########################################################################
+# Helper functions
+########################################################################
+_specs = {}
+
+def string_after_spec(string):
+    """Return the ExtractionSpec of the strings that follow the string
+    in its parent, in its field named after the string. Each spec is
+    only compiled once.
+    """
+
+    spec = _specs.get(string)
+    if spec is None:
+        spec = _specs[string] = ExtractionSpec(
+            [Field(string, [Locator(re.compile(string))])])
+    return spec
+
+
+def fields_of_header(header, columns):
+    """Return the fields of the cells of the header row of a table.
+    A cell is associated with the first field of the columns (see
+    TableContent.COLUMNS) whose pattern match it, the cells that match
+    none are kept as they are, in lowercase.
+    """
+
+    fields = []
+
+    for name in header:
+        for field, pattern, _ in columns:
+            if field not in fields and pattern.search(name):
+                fields.append(field)
+                break
+        else:
+            fields.append(name.lower())
+
+    return fields
+
+
+def parse_text(string):
+    return string or None
+
+
+def parse_date(string):
+    """Convert a date like 2016-05-01 to a string in the YYYY-MM-DD
+    format, or None if the string does not contain a date.
+    """
+
+    return format_date(parse_period(string)[0])
+
+
+def parse_money(string):
+    """Convert an amount of money like "$12.34" or "12,34 $" to a
+    float, or None if the string is not an amount.
+    """
+
+    m = MONEY_RE.search(string)
+    if m is None:
+        return None
+
+    amount = float(re.sub(r"\s", "", m.group(2)).replace(",", "."))
+    return -amount if m.group(1) else amount
+
+
+def parse_duration(string):
+    """Convert a duration like "1:02:03", "12:34" or "5 min" to a
+    number of seconds, or None if the string is not a duration.
+    """
+
+    m = DURATION_RE.match(string.strip())
+    if m is not None:
+        hours, minutes, seconds = m.groups()
+        return int(hours or 0) * 3600 + int(minutes) * 60 + int(seconds)
+
+    m = MINUTES_RE.search(string)
+    if m is not None:
+        return int(round(float(m.group(1).replace(",", ".")) * 60))
+
+    return None
 
 
 
@@ -33,16 +162,207 @@ class Content:
     """Basic class used to act as an interface for the web pages
     retrived from the Derytelecom extranet. It should be subclassed
     instead of being used directly.
+
+    The web page is only parsed when a field is first read and the
+    value of each field is kept, so reading it again is free. The
+    subclasses list their fields in FIELDS, once all of them have
+    been read the web page can be released.
     """
 
-    def __init__(self, html_page):
-        self._soup = BeautifulSoup(html_page)
+    FIELDS = ()
+
+    # The ExtractionSpec of the fields that are read with
+    # _get_spec_field, they are all extracted at once
+    SPEC = None
+
+
+    def __init__(self, html_page, parser=FAST_PARSER,
+                 release_when_done=False, fetched_at=None, elapsed=0,
+                 recorder=None):
+        """Arguments:
+        html_page         -- the web page
+        parser            -- the parser to use, one of PARSERS
+                             (default: FAST_PARSER)
+        release_when_done -- release the web page and its parse tree
+                             once all the FIELDS have been read, for
+                             long-running processes (default: False)
+        fetched_at        -- when the web page was retrieved
+                             (default: now)
+        elapsed           -- the time spent retrieving the web page in
+                             seconds, 0 when it came from a cache
+                             (default: 0)
+        recorder          -- the metrics.Recorder of the parsing
+                             phases (optional)
+        """
+
+        if parser not in PARSERS:
+            raise ValueError("'{}' is not a valid parser".format(parser))
+
+        if fetched_at is None:
+            fetched_at = time.time()
+
+        self.fetched_at = fetched_at
+        self.elapsed = elapsed
+        self._html_page = html_page
+        self._parser = parser
+        self._soup_tree = None
+        self._fields = {}
+        self._release_when_done = release_when_done
+        self._recorder = recorder
+
+
+    @property
+    def _soup(self):
+        # The BeautifulSoup tree is only built when it is needed, and
+        # BeautifulSoup is only imported then
+        if self._soup_tree is None:
+            from BeautifulSoup import BeautifulSoup
+
+            if self._recorder is None:
+                self._soup_tree = BeautifulSoup(self._html_page)
+            else:
+                with self._recorder.phase("parse.soup"):
+                    self._soup_tree = BeautifulSoup(self._html_page)
+        return self._soup_tree
+
+
+    def _get_field(self, key, extract):
+        # Return the value of the field associated with the key. The
+        # value is extracted from the web page by calling extract,
+        # only the first time.
+
+        try:
+            return self._fields[key]
+        except KeyError:
+            pass
+
+        if self._html_page is None:
+            raise ValueError("The web page was released")
+
+        if self._recorder is None:
+            value = self._fields[key] = extract()
+        else:
+            name = key[0] if isinstance(key, tuple) else key
+            with self._recorder.phase("parse." + name):
+                value = self._fields[key] = extract()
+
+        # A page with no FIELDS is not done when a field is read
+        if (self._release_when_done and self.FIELDS
+                and all(f in self._fields for f in self.FIELDS)):
+            self.release()
+
+        return value
+
+
+    def _get_spec_field(self, name):
+        # Return the value of the field of the SPEC. The first time a
+        # field is read, all of them are extracted and kept.
+        return self._get_field(name, lambda: self._extract_spec(self.SPEC)
+                               [name])
+
+
+    def _extract_spec(self, spec):
+        values = spec.extract(self._html_page, lambda: self._soup,
+                              fast=self._parser == FAST_PARSER)
+        for name, value in values.items():
+            self._fields.setdefault(name, value)
+        return values
+
+
+    def _iter_table_cells(self, pattern):
+        # Yield the header row, the first row with a cell that match
+        # the pattern, and then the other rows of its table, as lists
+        # of cell texts
+        yielded = 0
+
+        if self._parser == FAST_PARSER:
+            try:
+                for row in fastparse.iter_table_rows(self._html_page,
+                                                     pattern):
+                    yield row
+                    yielded += 1
+                return
+            except fastparse.NoFastPath:
+                # Continue with BeautifulSoup from the row where the
+                # fast path stopped
+                pass
+
+        for i, row in enumerate(self._iter_soup_table_cells(pattern)):
+            if i >= yielded:
+                yield row
+
+
+    def _iter_soup_table_cells(self, pattern):
+        from BeautifulSoup import Comment
+
+        def cell_text(cell):
+            return fastparse.clean_cell(
+                [t for t in cell.findAll(text=True)
+                 if not isinstance(t, Comment)])
+
+        header = None
+        for cell in self._soup.findAll(["th", "td"]):
+            if pattern.search(cell_text(cell)):
+                header = cell.findParent("tr")
+                break
+
+        if header is None:
+            return
+
+        yield [cell_text(c) for c in header.findAll(["th", "td"])]
+        for tr in header.findNextSiblings("tr"):
+            yield [cell_text(c) for c in tr.findAll(["th", "td"])]
+
+
+    def release(self):
+        """Release the web page and its parse tree to free the memory.
+        After that, only the fields that were already read can be read
+        again.
+        """
+
+        self._html_page = None
+        self._soup_tree = None
+
 
 
 class InternetTraffic(Content):
     """This class act as an interface for the Internet > Traffic page.
     """
 
+    FIELDS = ("available", "usage")
+
+    # The pattern of a header of the daily traffic table and how to
+    # read its columns, like TableContent.HEADER_PATTERN and COLUMNS
+    DAILY_TRAFFIC_HEADER_PATTERN = re.compile(r"download|upload", re.I)
+
+    DAILY_TRAFFIC_COLUMNS = (
+        ("date", re.compile(r"date|day", re.I),
+         lambda string: parse_period(string)[0]),
+        ("download", re.compile(r"download|received", re.I), parse_amount),
+        ("upload", re.compile(r"upload|sent", re.I), parse_amount),
+        ("total", re.compile(r"total", re.I), parse_amount)
+    )
+
+
+    # The Available string is not displayed when there are less than
+    # 15 Gb of available data. The available data is then displayed in
+    # the span of the div that follow the grandparent of the Used
+    # string. Each label is looked for as a label first, then anywhere
+    # in a text.
+    SPEC = ExtractionSpec([
+        Field("available", [
+            Locator(AVAILABLE_RE),
+            Locator(AVAILABLE_FALLBACK_RE),
+            Locator(USED_RE, up=2, next_sibling="div", find="span"),
+            Locator(USED_FALLBACK_RE, up=2, next_sibling="div",
+                    find="span")
+        ]),
+        Field("used", [Locator(USED_RE)], parse_amount),
+        Field("total", [Locator(TOTAL_RE)], parse_amount),
+        Field("period", [Locator(PERIOD_RE)], parse_period)
+    ])
+
+
     def get_string_after_colon(self, string_before_colon):
         """The Internet > Trafic page contain a lot of strings that
         are separated by colon. Pass the string before the colon and
@@ -61,18 +381,12 @@ class InternetTraffic(Content):
         The string after the colon or ""
         """
 
-        string_after_colon = ""
-
-        sbc = self._soup.find(text=re.compile(string_before_colon))
-        if sbc:
-            # Get the strings that are after the specified string
-            sac_list = sbc.parent.contents[1:]
-
-            # Remove irrevelant spaces and joins the strings
-            string_after_colon = " ".join(s.string.strip()
-                for s in sac_list)
-
-        return string_after_colon
+        spec = string_after_spec(string_before_colon)
+        return self._get_field(
+            ("string_after_colon", string_before_colon),
+            lambda: spec.extract(self._html_page, lambda: self._soup,
+                                 fast=self._parser == FAST_PARSER)
+            [string_before_colon])
 
 
     def get_available(self):
@@ -81,31 +395,164 @@ class InternetTraffic(Content):
 
         Exemple of return value: 60.3 Gb
         """
-        available = self.get_string_after_colon(AVAILABLE_STRING)
-
-        # If available is an empty string, that probably mean that the
-        # Available string is no longer displayed
-        # Don't really know why, but it seem that when there are less
-        # than 15 Gb of available data the Available string is no
-        # longer displayed
-        # When that happen, we find the Used string that we then use to
-        # reach the span element that contain the strings that display
-        # the remaining data
-        if available == "":
-            # Find Used string
-            used_elem = self._soup.find(text = re.compile(USED_STRING))
-
-            if used_elem:
-                # Reach the span that contain the remaining data strings
-                av_elem = (used_elem.parent.parent
-                           .findNextSibling("div").find("span"))
-
-                # Get the remaining data strings (start from 1 to skip
-                # the newline)
-                available_strings = av_elem.contents[1:]
-
-                # Remove irrevelant spaces and joins the strings
-                available = " ".join(s.string.strip()
-                                     for s in available_strings)
-
-        return available
+
+        return self._get_spec_field("available")
+
+
+    def get_usage(self):
+        """Return the usage displayed on the page as a UsageRecord,
+        with the amounts of data in bytes.
+        """
+
+        return self._get_field("usage", self._extract_usage)
+
+
+    def _extract_usage(self):
+        available = parse_amount(self.get_available())
+        used = self._get_spec_field("used")
+        total = self._get_spec_field("total")
+        period_start, period_end = self._get_spec_field("period")
+
+        return UsageRecord(available, used, total, period_start,
+                           period_end, self.fetched_at)
+
+
+    def get_daily_traffic(self):
+        """Return the usage by day displayed on the page as a
+        DailyTraffic, with the amounts of data in bytes. It is empty
+        if the page has no daily traffic table.
+        """
+
+        return self._get_field("daily_traffic", self._extract_daily_traffic)
+
+
+    def _extract_daily_traffic(self):
+        cells = self._iter_table_cells(self.DAILY_TRAFFIC_HEADER_PATTERN)
+
+        for header in cells:
+            fields = fields_of_header(header, self.DAILY_TRAFFIC_COLUMNS)
+            columns = [(fields.index(field), convert)
+                       if field in fields else (None, None)
+                       for field, _, convert in self.DAILY_TRAFFIC_COLUMNS]
+
+            def convert_row(row):
+                return tuple(convert(row[i]) if i is not None and i < len(row)
+                             else None for i, convert in columns)
+
+            # The rows without a date, like a row of totals, are skipped
+            return DailyTraffic.from_rows(
+                values for values in (convert_row(row) for row in cells)
+                if values[0] is not None)
+
+        return DailyTraffic()
+
+
+
+class TableContent(Content):
+    """Base class of the pages whose data is a table, like the list of
+    the long distance calls. The rows are read as they are needed, so
+    a long table is never held in memory as a whole.
+
+    The subclasses specify the pattern of a header of their table in
+    HEADER_PATTERN and how to read its columns in COLUMNS, a list of
+    (field, pattern of the header, conversion function) tuples. A
+    header is associated with the first field whose pattern match it,
+    the headers that match none are kept as they are, in lowercase.
+
+    With release_when_done, the web page is released once the rows
+    were read to the end.
+    """
+
+    HEADER_PATTERN = None
+    COLUMNS = ()
+
+
+    def get_fields(self):
+        """Return the fields of the rows, in the order of the columns
+        of the table, or an empty list if there is no table.
+        """
+
+        return self._get_field("fields", self._extract_fields)
+
+
+    def _extract_fields(self):
+        for header in self._iter_table_cells(self.HEADER_PATTERN):
+            return fields_of_header(header, self.COLUMNS)
+        return []
+
+
+    def iter_rows(self):
+        """Return a generator of the rows of the table, as dicts whose
+        keys are the fields. The rows are not kept, each call read the
+        table again.
+        """
+
+        if self._html_page is None:
+            raise ValueError("The web page was released")
+
+        converters = dict((field, convert)
+                          for field, _, convert in self.COLUMNS)
+
+        cells = self._iter_table_cells(self.HEADER_PATTERN)
+        for header in cells:
+            fields = fields_of_header(header, self.COLUMNS)
+            for row in cells:
+                yield dict((field, converters.get(field, parse_text)(cell))
+                           for field, cell in zip(fields, row))
+
+        if self._release_when_done:
+            self.release()
+
+
+
+class LongDistanceCalls(TableContent):
+    """This class act as an interface for the
+    Telephony > Long Distance page.
+    """
+
+    HEADER_PATTERN = re.compile(r"duration", re.I)
+
+    COLUMNS = (
+        ("date", re.compile(r"date", re.I), parse_date),
+        ("time", re.compile(r"time|hour", re.I), parse_text),
+        ("number", re.compile(r"number|called|phone", re.I), parse_text),
+        ("destination", re.compile(r"destination|city|place|location",
+                                   re.I), parse_text),
+        ("duration", re.compile(r"duration|length", re.I), parse_duration),
+        ("amount", re.compile(r"amount|cost|charge|price|total", re.I),
+         parse_money)
+    )
+
+
+    def iter_calls(self):
+        """Return a generator of the long distance calls, as dicts
+        with the date (YYYY-MM-DD), time, number, destination,
+        duration (seconds) and amount (dollars) of each call.
+        """
+
+        return self.iter_rows()
+
+
+
+class Invoices(TableContent):
+    """This class act as an interface for the Invoicing page."""
+
+    HEADER_PATTERN = re.compile(r"invoice|due", re.I)
+
+    COLUMNS = (
+        ("due_date", re.compile(r"due", re.I), parse_date),
+        ("date", re.compile(r"date", re.I), parse_date),
+        ("number", re.compile(r"number|no\b|#", re.I), parse_text),
+        ("amount", re.compile(r"amount|total", re.I), parse_money),
+        ("balance", re.compile(r"balance", re.I), parse_money),
+        ("status", re.compile(r"status|paid", re.I), parse_text)
+    )
+
+
+    def iter_invoices(self):
+        """Return a generator of the invoices, as dicts with the date
+        and the due date (YYYY-MM-DD), number, amount and balance
+        (dollars) and status of each invoice.
+        """
+
+        return self.iter_rows()
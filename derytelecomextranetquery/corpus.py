@@ -0,0 +1,348 @@
+# -*- coding: utf-8 -*-
+
+"""
+corpus
+------
+
+This module provides the PageCorpus class, a directory of web pages
+recorded from the Derytelecom Extranet, and the ReplayAdapter class,
+a transport adapter of requests that serve them back to a
+DerytelecomExtranetQuery in place of the Extranet. A corpus let the
+parsers be tested and measured against real pages, including the
+layouts that are only seen on some accounts.
+
+The pages are scrubbed before they are written: the username, the
+password and the session id are replaced by placeholders.
+
+Example:
+    corpus = PageCorpus("pages")
+    deq = DerytelecomExtranetQuery.connect(username, password,
+                                           corpus=corpus)
+
+    # Later, without reaching the Extranet
+    deq = DerytelecomExtranetQuery.connect(SCRUBBED_USERNAME,
+                                           SCRUBBED_PASSWORD,
+                                           session=replay_session(corpus))
+
+Copyright(c) 2016 Rémi Tétreault <tetreault.remi@gmail.com>
+MIT Licensed, see LICENSE for more details.
+"""
+
+
+import os
+import re
+import hashlib
+import threading
+
+import requests
+from requests.adapters import BaseAdapter
+from requests.models import Response
+from requests.structures import CaseInsensitiveDict
+
+from sessionstore import write_private_file
+from derytelecomextranetquery import (BASE_URL, INDEX_PAGE_NAME,
+                                      AUTH_PAGE_NAME, COOKIE_NAME,
+                                      INPUT_LOGIN_NAME_SUFFIX,
+                                      INPUT_PASSWORD_NAME_SUFFIX,
+                                      SCRUBBED_SESSION_ID,
+                                      scrub_url_session_ids)
+
+
+
+########################################################################
+# Constants
+########################################################################
+PAGE_EXTENSION = ".html"
+
+# The placeholders of the secrets in the recorded pages, the one of the
+# session id is SCRUBBED_SESSION_ID of derytelecomextranetquery
+SCRUBBED_USERNAME = "SCRUBBED_USERNAME"
+SCRUBBED_PASSWORD = "SCRUBBED_PASSWORD"
+
+# The session id given by the ReplayAdapter
+REPLAY_SESSION_ID = "replay"
+
+REPLAY_LOGIN_PAGE = (
+    u'<html><body><form name="loginform" action="{action}" method="post">'
+    u'<input type="text" name="{login}">'
+    u'<input type="password" name="{password}">'
+    u'</form></body></html>').format(
+        action=AUTH_PAGE_NAME,
+        login=REPLAY_SESSION_ID + INPUT_LOGIN_NAME_SUFFIX,
+        password=REPLAY_SESSION_ID + INPUT_PASSWORD_NAME_SUFFIX)
+
+REPLAY_LOGOUT_PAGE = u"<html><body></body></html>"
+
+# The pattern of a letter or a digit, the characters of the tokens
+ALPHANUMERIC_RE = re.compile(r"[^\W_]", re.U)
+
+
+
+########################################################################
+# Helper functions
+########################################################################
+def page_name(params):
+    """Return the name of the web page of the URL parameters, its
+    content and sub URL parameters joined by a dot, like
+    internet.traffic, or index for the home page.
+    """
+
+    return ".".join(params[k] for k in ("content", "sub")
+                    if params.get(k)) or "index"
+
+
+def _variants(secret):
+    # Return the forms in which the secret can appear in a web page
+    import cgi
+    import urllib
+
+    if isinstance(secret, bytes):
+        secret = secret.decode("utf-8", "replace")
+    quoted = urllib.quote_plus(secret.encode("utf-8")).decode("ascii")
+
+    return set([secret, cgi.escape(secret, True), quoted])
+
+
+def _token_pattern(variant):
+    # Return the pattern of the variant as a whole token: when it start
+    # or end with a letter or a digit, it must not be preceded or
+    # followed by one, so that the username user is not replaced in
+    # the word username. The underscore is not part of a token, like
+    # in the names of the inputs of the login form that begin with the
+    # session id.
+    pattern = re.escape(variant)
+    if ALPHANUMERIC_RE.match(variant[0]):
+        pattern = r"(?<![^\W_])" + pattern
+    if ALPHANUMERIC_RE.match(variant[-1]):
+        pattern += r"(?![^\W_])"
+    return pattern
+
+
+def scrub(page, secrets):
+    """Return the web page with the secrets replaced by their
+    placeholders. A secret is only replaced where it appear as a whole
+    token, in the text or in the attributes of the page.
+
+    Arguments:
+    page    -- the web page
+    secrets -- a dict of the placeholders, by secret. The empty
+               secrets are ignored.
+
+    Return:
+    The scrubbed web page
+    """
+
+    replacements = {}
+    for secret, placeholder in secrets.items():
+        if secret:
+            for variant in _variants(secret):
+                replacements[variant] = placeholder
+
+    if not replacements:
+        return page
+
+    # The longest first, so that a secret that contain another one is
+    # replaced as a whole
+    pattern = re.compile("|".join(
+        _token_pattern(variant)
+        for variant in sorted(replacements, key=len, reverse=True)), re.U)
+
+    return pattern.sub(lambda match: replacements[match.group(0)], page)
+
+
+def replay_session(corpus):
+    """Return a requests.Session whose requests to the Derytelecom
+    Extranet are answered by a ReplayAdapter of the corpus.
+    """
+
+    session = requests.Session()
+    session.mount(BASE_URL, ReplayAdapter(corpus))
+    return session
+
+
+def _name_of_path(path):
+    # Return the name of the web page of the file at path
+    return os.path.basename(path)[:-len(PAGE_EXTENSION)].rsplit(".", 1)[0]
+
+
+
+########################################################################
+# Classes
+########################################################################
+class PageCorpus(object):
+    """This class keep the web pages recorded from the Derytelecom
+    Extranet in a directory, one file per distinct page. The file of
+    a page is named after the page and a digest of its content, like
+    internet.traffic.0123456789abcdef.html, so a page that did not
+    change is only written once.
+    """
+
+    def __init__(self, directory):
+        """Arguments:
+        directory -- the directory of the web pages, it is created
+                     when the first page is recorded
+        """
+
+        self.directory = directory
+
+
+    def record(self, params, page, secrets=None):
+        """Scrub the web page and write it in the corpus, unless it is
+        already there. The values of the session id URL parameters are
+        always scrubbed, whatever the secrets.
+
+        Arguments:
+        params  -- the URL parameters of the web page
+        page    -- the web page
+        secrets -- a dict of the placeholders, by secret, like
+                   {password : SCRUBBED_PASSWORD} (optional)
+
+        Return:
+        The path of the file of the web page
+        """
+
+        data = scrub(scrub_url_session_ids(page),
+                     secrets or {}).encode("utf-8")
+        path = os.path.join(self.directory, "{}.{}{}".format(
+            page_name(params), hashlib.sha1(data).hexdigest()[:16],
+            PAGE_EXTENSION))
+
+        if not os.path.exists(path):
+            if not os.path.isdir(self.directory):
+                try:
+                    os.makedirs(self.directory, 0o700)
+                except OSError:
+                    # Another thread may have created it
+                    if not os.path.isdir(self.directory):
+                        raise
+            try:
+                write_private_file(path, data)
+            except OSError:
+                # Another thread may have written the same page
+                if not os.path.exists(path):
+                    raise
+
+        return path
+
+
+    def paths(self, name=None):
+        """Return the sorted paths of the files of the web pages, only
+        those of the pages named name if it is specified.
+        """
+
+        try:
+            filenames = os.listdir(self.directory)
+        except OSError:
+            return []
+
+        return [os.path.join(self.directory, filename)
+                for filename in sorted(filenames)
+                if filename.endswith(PAGE_EXTENSION)
+                and (name is None or _name_of_path(filename) == name)]
+
+
+    def names(self):
+        """Return the sorted names of the web pages of the corpus."""
+
+        return sorted(set(_name_of_path(path) for path in self.paths()))
+
+
+    def pages(self, name=None):
+        """Return a generator of the web pages of the corpus, as
+        tuples (name, path, page), only those named name if it is
+        specified.
+        """
+
+        for path in self.paths(name):
+            with open(path, "rb") as f:
+                page = f.read().decode("utf-8")
+            yield _name_of_path(path), path, page
+
+
+
+class ReplayAdapter(BaseAdapter):
+    """A transport adapter of requests that answer the requests of a
+    DerytelecomExtranetQuery with the web pages of a PageCorpus. Any
+    username and password are accepted. When a page was recorded more
+    than once, its versions are served in turn. The pages that are not
+    in the corpus are answered with a 404.
+
+    Attributes:
+        served -- the number of web pages served from the corpus
+    """
+
+    def __init__(self, corpus):
+        """Arguments:
+        corpus -- the PageCorpus of the web pages to serve
+        """
+
+        BaseAdapter.__init__(self)
+        self.corpus = corpus
+        self.served = 0
+        self._lock = threading.Lock()
+        # The index of the next version to serve, by name of page
+        self._turns = {}
+
+
+    def _response(self, request, status_code, body, url=None,
+                  session_id=None):
+        response = Response()
+        response.status_code = status_code
+        response.reason = "OK" if status_code == 200 else "Not Found"
+        response.headers = CaseInsensitiveDict(
+            {"Content-Type" : "text/html; charset=utf-8"})
+        response.encoding = "utf-8"
+        response._content = body.encode("utf-8")
+        response.url = url or request.url
+        response.request = request
+        response.connection = self
+        if session_id is not None:
+            response.cookies.set(COOKIE_NAME, session_id)
+        return response
+
+
+    def _next_page(self, name):
+        # Return the next version of the page named name, or None if
+        # it is not in the corpus
+        paths = self.corpus.paths(name)
+        if not paths:
+            return None
+
+        with self._lock:
+            turn = self._turns.get(name, 0)
+            self._turns[name] = turn + 1
+            self.served += 1
+
+        with open(paths[turn % len(paths)], "rb") as f:
+            return f.read().decode("utf-8")
+
+
+    def send(self, request, **kwargs):
+        import urlparse
+
+        url = urlparse.urlparse(request.url)
+        params = dict((k, v[-1])
+                      for k, v in urlparse.parse_qs(url.query).items())
+        page = url.path.rsplit("/", 1)[-1]
+
+        if page == AUTH_PAGE_NAME and request.method == "POST":
+            return self._response(request, 200, REPLAY_LOGOUT_PAGE,
+                                  url=BASE_URL + INDEX_PAGE_NAME)
+
+        if page == "":
+            return self._response(request, 200, REPLAY_LOGIN_PAGE,
+                                  session_id=REPLAY_SESSION_ID)
+
+        if page == INDEX_PAGE_NAME:
+            if params.get("logout") == "1":
+                return self._response(request, 200, REPLAY_LOGOUT_PAGE)
+
+            body = self._next_page(page_name(params))
+            if body is not None:
+                return self._response(request, 200, body)
+
+        return self._response(request, 404, u"")
+
+
+    def close(self):
+        pass
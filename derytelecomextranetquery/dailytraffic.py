@@ -0,0 +1,206 @@
+# -*- coding: utf-8 -*-
+
+"""
+dailytraffic
+------------
+
+This module provides the DailyTraffic class, the daily breakdown of the
+internet usage of the Internet > Traffic page, kept by column in typed
+arrays instead of one object per day. The tables of many accounts and
+months can be concatenated and converted to NumPy arrays at once, so
+that they are aggregated without a loop over the days in Python.
+
+NumPy is only required by DailyTraffic.to_numpy, it is imported there
+so that the pages can be parsed without it.
+
+Copyright(c) 2016 Rémi Tétreault <tetreault.remi@gmail.com>
+MIT Licensed, see LICENSE for more details.
+"""
+
+
+import csv
+import datetime
+from array import array
+
+from usage import format_date
+
+
+
+########################################################################
+# Constants
+########################################################################
+# The typecodes of the columns, the dates are kept as the proleptic
+# Gregorian ordinal of the day and the amounts of data in bytes
+DATE_TYPECODE = "l"
+AMOUNT_TYPECODE = "d"
+
+AMOUNT_COLUMNS = ("download", "upload", "total")
+
+EPOCH_ORDINAL = datetime.date(1970, 1, 1).toordinal()
+
+
+
+########################################################################
+# Helper functions
+########################################################################
+def _array(typecode, values):
+    return array(typecode, values if values is not None else ())
+
+
+def _frombuffer(numpy, column, dtype):
+    # Copy the array in a NumPy array, frombuffer refuse an empty buffer
+    if not column:
+        return numpy.empty(0, dtype)
+    return numpy.frombuffer(column, dtype).copy()
+
+
+
+########################################################################
+# Classes
+########################################################################
+class DailyTraffic(object):
+    """The usage of an account by day, by column.
+
+    Attributes:
+        dates    -- the days, an array of date ordinals
+        download -- the downloaded data in bytes, an array of floats
+        upload   -- the uploaded data in bytes, an array of floats
+        total    -- the total data in bytes, an array of floats
+
+    The amounts that are unknown are NaN.
+    """
+
+    FIELDS = ("date",) + AMOUNT_COLUMNS
+
+
+    def __init__(self, dates=None, download=None, upload=None, total=None):
+        """Arguments:
+        dates    -- an iterable of date ordinals (optional)
+        download -- an iterable of amounts in bytes (optional)
+        upload   -- an iterable of amounts in bytes (optional)
+        total    -- an iterable of amounts in bytes (optional)
+
+        All the columns must have the same length.
+        """
+
+        self.dates = _array(DATE_TYPECODE, dates)
+        self.download = _array(AMOUNT_TYPECODE, download)
+        self.upload = _array(AMOUNT_TYPECODE, upload)
+        self.total = _array(AMOUNT_TYPECODE, total)
+
+        if not (len(self.dates) == len(self.download) == len(self.upload)
+                == len(self.total)):
+            raise ValueError("The columns must have the same length")
+
+
+    @classmethod
+    def from_rows(cls, rows):
+        """Build a table from an iterable of (date, download, upload,
+        total) tuples, where date is a datetime.date and the amounts
+        are in bytes or None.
+        """
+
+        table = cls()
+        nan = float("nan")
+
+        for date, download, upload, total in rows:
+            # Deduce the missing amount when the two others are known
+            if total is None and download is not None and upload is not None:
+                total = download + upload
+
+            table.dates.append(date.toordinal())
+            table.download.append(nan if download is None else download)
+            table.upload.append(nan if upload is None else upload)
+            table.total.append(nan if total is None else total)
+
+        return table
+
+
+    @classmethod
+    def concatenate(cls, tables):
+        """Return a table with the rows of all the tables, in order.
+        The number of rows that come from each table is its len.
+        """
+
+        table = cls()
+        for t in tables:
+            table.dates.extend(t.dates)
+            table.download.extend(t.download)
+            table.upload.extend(t.upload)
+            table.total.extend(t.total)
+        return table
+
+
+    def __len__(self):
+        return len(self.dates)
+
+
+    def get_fields(self):
+        """Return the fields of the rows returned by iter_rows."""
+
+        return list(self.FIELDS)
+
+
+    def iter_rows(self):
+        """Return a generator of the rows as dicts, the dates are
+        formatted as YYYY-MM-DD and the unknown amounts are None.
+        """
+
+        for i in range(len(self.dates)):
+            row = {"date" : format_date(
+                datetime.date.fromordinal(self.dates[i]))}
+            for name in AMOUNT_COLUMNS:
+                value = getattr(self, name)[i]
+                row[name] = int(value) if value == value else None
+            yield row
+
+
+    def sums(self):
+        """Return the sums of the amount columns in a dict, the
+        unknown amounts are ignored.
+        """
+
+        return dict((name, sum(v for v in getattr(self, name) if v == v))
+                    for name in AMOUNT_COLUMNS)
+
+
+    def to_numpy(self):
+        """Return the columns as a dict of NumPy arrays: the dates as
+        datetime64[D] and the amounts as float64. Each column is copied
+        from the memory of its array at once.
+        """
+
+        try:
+            import numpy
+        except ImportError:
+            raise RuntimeError("NumPy is required to convert the daily "
+                               "traffic to arrays")
+
+        dates = _frombuffer(numpy, self.dates, numpy.int_)
+        columns = {"date" : (dates - EPOCH_ORDINAL).astype("datetime64[D]")}
+        for name in AMOUNT_COLUMNS:
+            columns[name] = _frombuffer(numpy, getattr(self, name),
+                                        numpy.float64)
+        return columns
+
+
+    def as_dict(self):
+        """Return the columns as a dict of lists that can be
+        serialized, like iter_rows does for each row.
+        """
+
+        columns = dict((name, []) for name in self.FIELDS)
+        for row in self.iter_rows():
+            for name in self.FIELDS:
+                columns[name].append(row[name])
+        return columns
+
+
+    def write_csv(self, f):
+        """Write the table to the file object f in CSV, with a header
+        row.
+        """
+
+        writer = csv.DictWriter(f, self.FIELDS)
+        writer.writerow(dict(zip(self.FIELDS, self.FIELDS)))
+        writer.writerows(self.iter_rows())
@@ -12,28 +12,31 @@ MIT Licensed, see LICENSE for more details.
 
 
 
-import requests
-import urlparse
-import urllib
-import webbrowser
+import os
+import re
 import time
-from BeautifulSoup import BeautifulSoup
+import threading
 
-try:
-    from pykeyboard import PyKeyboard
-except ImportError:
-    PyKeyboard = None
+# The modules that are slow to import (requests, webbrowser, urllib,
+# urlparse, pykeyboard and retry) are only imported by the methods that
+# use them, so that the command line application start faster
 
 
-from content import Content, InternetTraffic
+from content import Content, InternetTraffic, LongDistanceCalls, Invoices
 from wrap_attributes_in_dict import wrap_attributes_in_dict
+from threadpool import imap_unordered
+from responsecache import STALE
+import metrics
 
 
 
 ########################################################################
 # Constants
 ########################################################################
-BASE_URL = "https://extranet.derytelecom.ca/"
+# The URL of the Extranet can be replaced, for example by the one of
+# the stand-in server of the benchmarks
+BASE_URL = os.environ.get("DERYTELECOM_EXTRANET_URL",
+                          "https://extranet.derytelecom.ca/")
 INDEX_PAGE_NAME = "index.php"
 AUTH_PAGE_NAME = "auth_sess.php"
 
@@ -42,10 +45,32 @@ AUTH_URL = BASE_URL + AUTH_PAGE_NAME
 
 COOKIE_NAME = "PHPSESSID"
 
+# The session id can also be passed in the URL parameter named after
+# its cookie, like the form handoff does, so it is replaced by this
+# placeholder in the URLs that are reported or recorded
+URL_SESSION_ID_RE = re.compile(r"(\b{}=)[^&#;\s\"'<>]+".format(COOKIE_NAME))
+SCRUBBED_SESSION_ID = "SCRUBBED_SESSION_ID"
+
 INPUT_LOGIN_NAME_SUFFIX = "_login"
 INPUT_PASSWORD_NAME_SUFFIX = "_password"
 
 
+# Maximum number of accounts queried at the same time by
+# DerytelecomExtranetQuery.query_accounts
+MAX_WORKERS = 8
+
+
+
+
+# The ways the session is handed over to the web browser by
+# open_in_webbrowser: by typing a JavaScript URL that log in, or by
+# opening a local form that continue a session established by this
+# module
+KEYBOARD_HANDOFF = "keyboard"
+FORM_HANDOFF = "form"
+HANDOFFS = (KEYBOARD_HANDOFF, FORM_HANDOFF)
+
+
 # Delay before the AutoLogin code is executed
 SLEEP_DELAY = 2
 
@@ -113,6 +138,18 @@ class PARAM:
 ########################################################################
 # Helper functions
 ########################################################################
+def default_policy():
+    """Return the policy of the requests when none is specified: the
+    requests have a timeout and are retried, and the instance has its
+    own circuit breaker, so the failures of one account do not stop
+    the queries of the others.
+    """
+
+    from retry import RetryPolicy, CircuitBreaker
+
+    return RetryPolicy(breaker=CircuitBreaker())
+
+
 def dict_contain(dict_a, dict_b):
     """Test if all the key:value pairs of dict_b are in dict_a.
 
@@ -135,6 +172,35 @@ def dict_contain(dict_a, dict_b):
     return True
 
 
+def session_ids(cookies):
+    """Return the values of all the session id cookies of a cookiejar.
+    The jar can hold more than one, set for different domains or
+    paths, where cookies.get(COOKIE_NAME) raise a CookieConflictError.
+
+    Arguments:
+    cookies -- the cookiejar
+
+    Return:
+    The list of the session ids
+    """
+
+    return [c.value for c in cookies if c.name == COOKIE_NAME]
+
+
+def scrub_url_session_ids(text):
+    """Return the text with the value of the session id parameters of
+    its URLs replaced by SCRUBBED_SESSION_ID.
+
+    Arguments:
+    text -- the text, like a URL or a web page
+
+    Return:
+    The scrubbed text
+    """
+
+    return URL_SESSION_ID_RE.sub(r"\g<1>" + SCRUBBED_SESSION_ID, text)
+
+
 
 ########################################################################
 # Class
@@ -147,48 +213,95 @@ class DerytelecomExtranetQuery:
     """
 
 
-    def __init__(self, session):
+    def __init__(self, session, username=None, password=None,
+                 session_store=None, cache=None, policy=None,
+                 recorder=None, corpus=None):
         """This constructor should not be used"""
         self._connected = True
         self._session = session
+        self._username = username
+        self._password = password
+        self._session_store = session_store
+        self._cache = cache
+        self._policy = policy if policy is not None else default_policy()
+        self._recorder = recorder
+        self._corpus = corpus
+
+        # The session is shared with the threads of get_contents and
+        # those that retrieve the stale pages of the cache again
+        self._lock = threading.RLock()
+        self._revalidating = set()
+
+        # The number of times the instance logged in, so that the
+        # threads that were logged out at the same time only log in
+        # again once
+        self._logins = 0
 
 
     @classmethod
-    def connect(cls, username, password):
+    def connect(cls, username, password, session_store=None, cache=None,
+                session=None, policy=None, recorder=None, corpus=None,
+                transport=None):
         """The constructor of this class, it establish a connection
         with the Derytelecom Extranet and then return an instance of
         this class.
 
+        If a session store is specified, the session stored for the
+        username is used instead of logging in. It is only when the
+        Extranet reject it that a new session is established. The
+        session is then stored again when disconnecting, without
+        logging out, so that it can be reused.
+
+        If a cache is specified, get_content serve the pages from it
+        for as long as they are fresh.
+
         Arguments:
-        username -- the username to use to log in
-        password -- the password to use to log in
+        username      -- the username to use to log in
+        password      -- the password to use to log in
+        session_store -- the SessionStore to use (optional)
+        cache         -- the ResponseCache to use, it can be shared by
+                         many instances (optional)
+        session       -- the requests.Session to use
+                         (default: a new session of the transport)
+        policy        -- the RetryPolicy of the requests, the instances
+                         that share it share its circuit breaker
+                         (default: default_policy())
+        recorder      -- the metrics.Recorder of the phases of the
+                         queries, it can be shared by many instances
+                         (optional)
+        corpus        -- the corpus.PageCorpus in which the retrieved
+                         web pages are recorded, it can be shared by
+                         many instances (optional)
+        transport     -- the transport.Transport of the session, whose
+                         connections are shared by the instances that
+                         use it (default: the default Transport)
 
         Return:
         An instance of the DerytelecomExtranetQuery class.
         """
 
-        session = requests.Session()
+        import requests
+
+        if session is None:
+            if transport is None:
+                from transport import default_transport
+                transport = default_transport()
+            session = transport.session()
+        if policy is None:
+            policy = default_policy()
+
+        if session_store is not None:
+            cookies = session_store.load(username)
+            if cookies:
+                for c in cookies:
+                    session.cookies.set(c["name"], c["value"],
+                                        domain=c["domain"], path=c["path"])
+                return cls(session, username, password, session_store,
+                           cache, policy, recorder, corpus)
 
         try:
-            # First contact, retrieve the login page
-            r = session.get(BASE_URL)
-            cls._check_response(r)
-
-            cookie_value = r.cookies[COOKIE_NAME]
-
-            input_login_name = cookie_value + INPUT_LOGIN_NAME_SUFFIX
-            input_password_name = cookie_value + INPUT_PASSWORD_NAME_SUFFIX
-
-            # This is the part where a connection is established with
-            # the Extranet
-            payload = {input_login_name    : username,
-                       input_password_name : password}
-            r = session.post(AUTH_URL, data=payload)
-            cls._check_response(r)
-            if cls._is_logout(r):
-                raise BadUsernamePasswordError()
-
-            return cls(session)
+            cls._login(session, username, password, policy,
+                       policy.deadline(), recorder)
 
         except Exception as e:
             session.close()
@@ -197,22 +310,142 @@ class DerytelecomExtranetQuery:
             else:
                 raise
 
+        if session_store is not None:
+            session_store.save(username, session.cookies)
 
-    @staticmethod
-    def open_in_webbrowser(params = {}, username = "", password = ""):
+        deq = cls(session, username, password, session_store, cache,
+                  policy, recorder, corpus)
+        deq._logins = 1
+        return deq
+
+
+    @classmethod
+    def query_accounts(cls, accounts, query, max_workers=MAX_WORKERS,
+                       session_store=None, policy=None, recorder=None,
+                       corpus=None, transport=None):
+        """Query many accounts at the same time. For each account, a
+        connection is established, the query function is called with
+        the connected instance and then the connection is closed.
+
+        A failure with one account does not stop the others from
+        being queried, its exception is returned in place of the
+        result.
+
+        Arguments:
+        accounts      -- an iterable of (username, password) tuples
+        query         -- a function that take a connected instance
+                         of this class and return the result of the
+                         query
+        max_workers   -- the maximum number of accounts queried at
+                         the same time (default: MAX_WORKERS)
+        session_store -- the SessionStore to use (optional)
+        policy        -- the RetryPolicy of the requests, shared by
+                         all the accounts (default: a default_policy()
+                         per account)
+        recorder      -- the metrics.Recorder of the phases of the
+                         queries (optional)
+        corpus        -- the corpus.PageCorpus in which the retrieved
+                         web pages are recorded (optional)
+        transport     -- the transport.Transport of the sessions, the
+                         accounts reuse its connections
+                         (default: the default Transport)
+
+        Return:
+        A generator of tuples (username, result, exception), in the
+        order in which the queries finish. Either result or exception
+        is None.
+        """
+
+        def query_account(account):
+            username, password = account
+            with cls.connect(username, password, session_store,
+                             policy=policy, recorder=recorder,
+                             corpus=corpus, transport=transport) as deq:
+                return query(deq)
+
+        for account, result, exception in imap_unordered(query_account,
+                                                         accounts,
+                                                         max_workers):
+            yield account[0], result, exception
+
+
+    @classmethod
+    def _login(cls, session, username, password, policy, deadline,
+               recorder=None):
+        # This class method log on the Derytelecom Extranet using
+        # the specified session
+
+        # First contact, retrieve the login page
+        r = cls._request(session, policy, deadline, "GET", BASE_URL,
+                         recorder, "login_page")
+        cls._check_response(r)
+
+        cookie_value = r.cookies[COOKIE_NAME]
+
+        input_login_name = cookie_value + INPUT_LOGIN_NAME_SUFFIX
+        input_password_name = cookie_value + INPUT_PASSWORD_NAME_SUFFIX
+
+        # This is the part where a connection is established with
+        # the Extranet
+        payload = {input_login_name    : username,
+                   input_password_name : password}
+        r = cls._request(session, policy, deadline, "POST", AUTH_URL,
+                         recorder, "auth", data=payload)
+        cls._check_response(r)
+        if cls._is_logout(r):
+            raise BadUsernamePasswordError()
+
+
+    @classmethod
+    def open_in_webbrowser(cls, params = {}, username = "", password = "",
+                           handoff = KEYBOARD_HANDOFF, policy = None):
         """Open the index URL in the webbrowser using the value of
         params to make the query string. If the module PyUserInput
         is available and the username and password parameters were
         passed, the login form will be automatically filled and
         submited by using keyboard events.
 
+        With the form handoff, the session is instead established by
+        this method and handed over to the webbrowser through a local
+        form that submit itself (see the handoff module), so the page
+        is opened logged in without any delay or keyboard event. It
+        must be opted in: the session id is then passed in the URL,
+        which end up in the history of the webbrowser, and it only
+        work if the Extranet accept the session ids in the URLs, which
+        was never verified. If the webbrowser does not load the form,
+        the session is logged out.
+
         Arguments:
         params   -- a dict that contain the parameters to use in the
                     query string of the URL (optional)
         username -- the username to use to log in (optional)
         password -- the password to use to log in (optional)
+        handoff  -- how the session is handed over to the webbrowser,
+                    one of HANDOFFS (default: KEYBOARD_HANDOFF)
+        policy   -- the RetryPolicy of the requests of the form
+                    handoff (default: default_policy())
+
+        Return:
+        False if the webbrowser did not load the form of the form
+        handoff in time, True otherwise
         """
 
+        import urllib
+        import webbrowser
+
+        if handoff not in HANDOFFS:
+            raise ValueError("'{}' is not a valid handoff".format(handoff))
+
+        if handoff == FORM_HANDOFF and username and password:
+            return cls._open_with_form(params, username, password,
+                                       policy or default_policy(),
+                                       webbrowser.open_new)
+
+        try:
+            from pykeyboard import PyKeyboard
+        except ImportError:
+            PyKeyboard = None
+
         url = INDEX_URL + "?" + urllib.urlencode(params)
         webbrowser.open_new(url)
 
@@ -241,6 +474,77 @@ class DerytelecomExtranetQuery:
                           .format(username,password))
             k.tap_key(k.enter_key)
 
+        return True
+
+
+    @classmethod
+    def _open_with_form(cls, params, username, password, policy,
+                        open_url):
+        # Log in, then open the page of params in the webbrowser with
+        # the session id, through a local form. The session is only
+        # logged out if the webbrowser did not take it over.
+
+        import requests
+        import handoff
+
+        session = requests.Session()
+        logged_in = served = False
+        try:
+            try:
+                cls._login(session, username, password, policy,
+                           policy.deadline())
+            except requests.RequestException:
+                raise InternetConnectionError()
+            logged_in = True
+
+            form_params = dict(params)
+            form_params[COOKIE_NAME] = session.cookies[COOKIE_NAME]
+            served = handoff.serve_once(handoff.handoff_page(INDEX_URL,
+                                                             form_params),
+                                        open_url)
+            return served
+
+        finally:
+            if logged_in and not served:
+                try:
+                    cls._request(session, policy, policy.deadline(), "GET",
+                                 INDEX_URL, params = PARAM.LOGOUT)
+                except Exception:
+                    pass
+            session.close()
+
+
+    @staticmethod
+    def _request(session, policy, deadline, method, url, recorder=None,
+                 phase=None, **kwargs):
+        # This static method make a request according to the policy,
+        # unless its circuit breaker is open. If a recorder is
+        # specified, the request is recorded as a run of the phase.
+
+        start = time.time()
+
+        try:
+            breaker = policy.breaker
+            if breaker is not None and not breaker.allow():
+                raise CircuitOpenError(breaker.retry_after())
+
+            r = policy.request(session, method, url, deadline, **kwargs)
+
+        except Exception as e:
+            if recorder is not None:
+                recorder.record(phase, time.time() - start,
+                                outcome=metrics.outcome_of_exception(e))
+            raise
+
+        if recorder is not None:
+            outcome = (metrics.OK if r.status_code == 200
+                       else str(r.status_code))
+            recorder.record(phase, time.time() - start,
+                            len(r.content) + len(r.request.body or ""),
+                            outcome)
+
+        return r
+
 
     @staticmethod
     def _check_response(response):
@@ -261,6 +565,8 @@ class DerytelecomExtranetQuery:
         # Derytelecom Extranet
         # If we got logged out, return True, else return False
 
+        import urlparse
+
         url = response.url
         params = urlparse.parse_qs(urlparse.urlparse(url).query)
 
@@ -269,6 +575,16 @@ class DerytelecomExtranetQuery:
 
 
 
+    @property
+    def logins(self):
+        """The number of times this instance logged in, 0 if its
+        session was reused from the session store and never had to be
+        established again.
+        """
+
+        return self._logins
+
+
     @property
     def connected(self):
         """Return True if the instance is connected on the
@@ -295,24 +611,170 @@ class DerytelecomExtranetQuery:
         """
 
         if self._connected:
-            try:
-                payload = content_param.copy()
-                # Access the english page
-                payload.update(PARAM.LANG.ENG)
-                r = self._session.get(INDEX_URL, params = payload)
-                self._check_response(r)
-                if self._is_logout(r):
-                    raise UnexpectedLogOutError()
+            payload = content_param.copy()
+            # Access the english page
+            payload.update(PARAM.LANG.ENG)
 
-                return content_class(r.text)
+            if self._cache is None:
+                start = time.time()
+                page = self._get_page(payload)
+                return content_class(page, elapsed=time.time() - start,
+                                     recorder=self._recorder)
 
-            except requests.RequestException:
-                raise InternetConnectionError()
+            key = self._cache.key(self._username, payload)
+            cached = self._cache.get(key)
+
+            if cached is None:
+                start = time.time()
+                page = self._get_page(payload)
+                self._cache.put(key, page)
+                return content_class(page, elapsed=time.time() - start,
+                                     recorder=self._recorder)
+
+            page, state, stored_at = cached
+            if state == STALE:
+                self._revalidate(key, payload)
+
+            return content_class(page, fetched_at=stored_at,
+                                 recorder=self._recorder)
 
         else:
             return None
 
 
+    def get_contents(self, pages):
+        """Retrieve many web pages at the same time, over the session
+        of this instance. The time spent retrieving each web page is
+        in the elapsed attribute of its Content.
+
+        Arguments:
+        pages -- a dict whose values are either content URL params or
+                 (content URL params, Content class) tuples
+
+        Return:
+        A dict with the same keys as pages whose values are the
+        retrieved web pages encapsulated in their Content class, or
+        None if the instance is not connected. If a web page can not
+        be retrieved, its exception is raised once all the others are
+        done.
+        """
+
+        if not self._connected:
+            return None
+        if not pages:
+            return {}
+
+        def get_content(item):
+            key, page = item
+            if isinstance(page, tuple):
+                return self.get_content(*page)
+            return self.get_content(page)
+
+        contents = {}
+        error = None
+
+        for (key, _), content, exception in imap_unordered(get_content,
+                                                           pages.items(),
+                                                           len(pages)):
+            if exception is not None:
+                error = error or exception
+            contents[key] = content
+
+        if error is not None:
+            raise error
+
+        return contents
+
+
+    def _get_page(self, payload):
+        # Retrieve the web page of the index associated with the URL
+        # parameters of the payload. Many web pages can be retrieved
+        # at the same time, only logging in again is done one thread
+        # at a time.
+
+        import requests
+
+        policy = self._policy
+        deadline = policy.deadline()
+        recorder = self._recorder
+        phase = ".".join(["page"] + [payload[k] for k in ("content", "sub")
+                                     if k in payload])
+
+        try:
+            logins = self._logins
+            r = self._request(self._session, policy, deadline, "GET",
+                              INDEX_URL, recorder, phase, params = payload)
+            self._check_response(r)
+
+            if self._is_logout(r) and self._session_store is not None:
+                # The stored session is no longer valid, log in again,
+                # unless another thread already did, and retry
+                with self._lock:
+                    if self._logins == logins:
+                        self._session.cookies.clear()
+                        self._login(self._session, self._username,
+                                    self._password, policy, deadline,
+                                    recorder)
+                        self._session_store.save(self._username,
+                                                 self._session.cookies)
+                        self._logins += 1
+
+                r = self._request(self._session, policy, deadline, "GET",
+                                  INDEX_URL, recorder, phase,
+                                  params = payload)
+                self._check_response(r)
+
+            if self._is_logout(r):
+                raise UnexpectedLogOutError()
+
+            if self._corpus is not None:
+                self._record(payload, r.text)
+
+            return r.text
+
+        except requests.RequestException:
+            raise InternetConnectionError()
+
+
+    def _record(self, payload, page):
+        # Record the web page in the corpus, without the secrets of
+        # the session
+        from corpus import (SCRUBBED_USERNAME, SCRUBBED_PASSWORD,
+                            SCRUBBED_SESSION_ID)
+
+        secrets = {self._username : SCRUBBED_USERNAME,
+                   self._password : SCRUBBED_PASSWORD}
+        for session_id in session_ids(self._session.cookies):
+            secrets[session_id] = SCRUBBED_SESSION_ID
+
+        self._corpus.record(payload, page, secrets)
+
+
+    def _revalidate(self, key, payload):
+        # Retrieve a stale page of the cache again in the background,
+        # the stale page is served in the meantime
+
+        with self._lock:
+            if key in self._revalidating:
+                return
+            self._revalidating.add(key)
+
+        def revalidate():
+            try:
+                self._cache.put(key, self._get_page(payload))
+            except Exception:
+                # The page will be retrieved again once it is too old
+                # to be served
+                pass
+            finally:
+                with self._lock:
+                    self._revalidating.discard(key)
+
+        thread = threading.Thread(target=revalidate)
+        thread.daemon = True
+        thread.start()
+
+
     def get_internettraffic(self):
         """Convenience method to retrive the internet traffic web page
         encapsulated in a InternetTrafic class.
@@ -323,14 +785,51 @@ class DerytelecomExtranetQuery:
         return self.get_content(params, InternetTraffic)
 
 
+    def get_longdistancecalls(self):
+        """Convenience method to retrive the long distance calls web
+        page encapsulated in a LongDistanceCalls class.
+        """
+        params = {}
+        params.update(PARAM.CONTENT.TELEPHONIE)
+        params.update(PARAM.CONTENT.SUB.TELEPHONIE.INTERURBAIN)
+        return self.get_content(params, LongDistanceCalls)
+
+
+    def get_invoices(self):
+        """Convenience method to retrive the invoicing web page
+        encapsulated in a Invoices class.
+        """
+        return self.get_content(PARAM.CONTENT.FACTURATION, Invoices)
+
+
 
     def disconnect(self):
-        """Disconnect from the Derytelecom extranet."""
+        """Disconnect from the Derytelecom extranet. When a session
+        store is used, the session is stored instead of being logged
+        out.
+        """
 
-        if self._connected:
-            self._session.get(INDEX_URL, params = PARAM.LOGOUT)
-            self._session.close()
-            self._connected =  False
+        import requests
+
+        with self._lock:
+            if self._connected:
+                try:
+                    if self._session_store is not None:
+                        # Keep the session alive so that it can be reused
+                        self._session_store.save(self._username,
+                                                 self._session.cookies)
+                    else:
+                        self._request(self._session, self._policy,
+                                      self._policy.deadline(), "GET",
+                                      INDEX_URL, self._recorder, "logout",
+                                      params = PARAM.LOGOUT)
+
+                except requests.RequestException:
+                    raise InternetConnectionError()
+
+                finally:
+                    self._session.close()
+                    self._connected =  False
 
 
     def __enter__(self):
@@ -385,13 +884,14 @@ class HTTPNotOKError(DerytelecomExtranetQueryException):
     status code that is different of HTTP OK.
 
     Attributes:
-        url         -- url of the request
+        url         -- url of the request, without its session id
         status_code -- the status code of the response
         reason      -- textual reason of the status code
         msg         -- explanation of the error
     """
 
     def __init__(self, url, status_code, reason):
+        url = scrub_url_session_ids(url)
         self.url = url
         self.status_code = status_code
         self.reason = reason
@@ -434,3 +934,23 @@ class UnexpectedLogOutError(DerytelecomExtranetQueryException):
 
     def __str__(self):
         return self.msg
+
+
+
+class CircuitOpenError(DerytelecomExtranetQueryException):
+    """This exception is raised instead of making a request when the
+    Derytelecom Extranet failed too many times in a row.
+
+    Attributes:
+        retry_after -- the number of seconds before the requests are
+                       allowed again
+        msg         -- explanation of the error
+    """
+
+    def __init__(self, retry_after):
+        self.retry_after = retry_after
+        self.msg = ("The Derytelecom Extranet seem to be down, retry in "
+                    "{:.0f} seconds").format(retry_after)
+
+    def __str__(self):
+        return self.msg
@@ -0,0 +1,215 @@
+# -*- coding: utf-8 -*-
+
+"""
+extraction
+----------
+
+This module provides the ExtractionSpec class, a declarative
+description of the fields of a web page of the Derytelecom Extranet:
+for each field, the label that anchor it, the path from the label to
+the element that display its value and the function that convert it.
+
+A spec find the labels of all its fields in a single pass over the
+page, with the fast path of the fastparse module or, when the page is
+not regular enough for it, a single traversal of the BeautifulSoup
+tree. The paths are then followed from each label, which only visit
+the few elements around it. The alternative layouts of a page are
+expressed as the alternative locators of a field.
+
+Example:
+    SPEC = ExtractionSpec([
+        Field("used", [Locator(re.compile("Used"))], parse_amount)
+    ])
+    SPEC.extract(html_page)["used"]
+
+Copyright(c) 2016 Rémi Tétreault <tetreault.remi@gmail.com>
+MIT Licensed, see LICENSE for more details.
+"""
+
+
+import fastparse
+
+
+
+########################################################################
+# Classes
+########################################################################
+class Locator(object):
+    """The location of the value of a field, relative to its label.
+
+    From the first text of the page that match the anchor pattern, go
+    up to the up-th parent, then to its next sibling named
+    next_sibling if specified, then to its first descendant named find
+    if specified. The value is the strings of the children of this
+    element, starting at the start-th one, stripped and joined by
+    spaces.
+
+    The default locate the strings that follow the label in its
+    parent, like "60.3 Gb" in <p>Available: <b>60.3</b> <b>Gb</b></p>.
+    """
+
+    __slots__ = ("anchor", "up", "next_sibling", "find", "start")
+
+
+    def __init__(self, anchor, up=1, next_sibling=None, find=None, start=1):
+        """Arguments:
+        anchor       -- the compiled pattern of the label
+        up           -- the number of parents to go up (default: 1)
+        next_sibling -- the name of the next sibling to go to
+                        (optional)
+        find         -- the name of the descendant to go to (optional)
+        start        -- the index of the first child whose string is
+                        part of the value (default: 1, the label)
+        """
+
+        self.anchor = anchor
+        self.up = up
+        self.next_sibling = next_sibling
+        self.find = find
+        self.start = start
+
+
+    def follow(self, text):
+        """Return the value located from the text, a NavigableString
+        of a BeautifulSoup tree, or "" if the path lead nowhere.
+        """
+
+        element = text
+        for _ in range(self.up):
+            element = element.parent
+            if element is None:
+                return ""
+
+        if self.next_sibling is not None:
+            element = element.findNextSibling(self.next_sibling)
+            if element is None:
+                return ""
+
+        if self.find is not None:
+            element = element.find(self.find)
+            if element is None:
+                return ""
+
+        # Remove irrevelant spaces and joins the strings
+        return " ".join(s.string.strip()
+                        for s in element.contents[self.start:])
+
+
+
+class Field(object):
+    """A field of a web page.
+
+    Attributes:
+        name     -- the name of the field
+        locators -- the Locators of the value, tried in order until one
+                    of them locate a value that is not ""
+        convert  -- the function that convert the value, or None to
+                    keep the string
+    """
+
+    __slots__ = ("name", "locators", "convert")
+
+
+    def __init__(self, name, locators, convert=None):
+        self.name = name
+        self.locators = tuple(locators)
+        self.convert = convert
+
+
+
+class ExtractionSpec(object):
+    """This class extract the fields of a web page in a single pass,
+    as described by a list of Fields.
+    """
+
+    def __init__(self, fields):
+        """Arguments:
+        fields -- the Fields of the page
+        """
+
+        self.fields = tuple(fields)
+        self._fields_by_name = dict((f.name, f) for f in self.fields)
+
+
+    @property
+    def names(self):
+        """The names of the fields, in order."""
+
+        return [f.name for f in self.fields]
+
+
+    def extract(self, html_page, soup=None, names=None, fast=True):
+        """Extract the fields of the web page.
+
+        Arguments:
+        html_page -- the web page
+        soup      -- a function that return the BeautifulSoup tree of
+                     the web page, only called if it is needed
+                     (default: build it)
+        names     -- the names of the fields to extract (default: all)
+        fast      -- use the fast path of the fastparse module when
+                     the page is regular enough (default: True)
+
+        Return:
+        A dict of the converted values, by name. The value of a field
+        that is not found is "" before its conversion.
+        """
+
+        if names is None:
+            fields = self.fields
+        else:
+            fields = [self._fields_by_name[name] for name in names]
+
+        values = {}
+        if fast:
+            values = fastparse.extract_fields(html_page, fields)
+
+        missing = [f for f in fields if values.get(f.name) is None]
+        if missing:
+            if soup is None:
+                from BeautifulSoup import BeautifulSoup
+                tree = BeautifulSoup(html_page)
+            else:
+                tree = soup()
+            values.update(self._extract_soup(tree, missing))
+
+        return dict((f.name, f.convert(values[f.name])
+                     if f.convert is not None else values[f.name])
+                    for f in fields)
+
+
+    @staticmethod
+    def _extract_soup(tree, fields):
+        # Find the first text that match each anchor in one traversal
+        # of the tree, like tree.find(text=anchor) would for each of
+        # them, then follow the locators from these texts
+        from BeautifulSoup import NavigableString
+
+        pending = []
+        for f in fields:
+            for locator in f.locators:
+                if locator.anchor not in pending:
+                    pending.append(locator.anchor)
+
+        texts = {}
+        for node in tree.recursiveChildGenerator():
+            if not isinstance(node, NavigableString):
+                continue
+            for anchor in [a for a in pending if a.search(node)]:
+                texts[anchor] = node
+                pending.remove(anchor)
+            if not pending:
+                break
+
+        values = {}
+        for f in fields:
+            value = ""
+            for locator in f.locators:
+                text = texts.get(locator.anchor)
+                if text is not None:
+                    value = locator.follow(text)
+                if value != "":
+                    break
+            values[f.name] = value
+
+        return values
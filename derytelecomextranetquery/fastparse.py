@@ -0,0 +1,514 @@
+# -*- coding: utf-8 -*-
+
+"""
+fastparse
+---------
+
+This module provides a fast path to extract strings from the pages of
+the Derytelecom Extranet without building a BeautifulSoup tree. It
+scan the tokens of the page only up to the strings it look for and
+keep track of the open elements the same way BeautifulSoup would.
+
+The functions of this module return None whenever the page is not
+regular enough for them to be sure to give the same result as
+BeautifulSoup, in which case BeautifulSoup must be used instead. The
+fields of an extraction.ExtractionSpec are all extracted by
+extract_fields, in a single pass over the page.
+
+It also provides iter_table_rows, that stream the rows of a table.
+
+Copyright(c) 2016 Rémi Tétreault <tetreault.remi@gmail.com>
+MIT Licensed, see LICENSE for more details.
+"""
+
+
+import re
+
+
+
+########################################################################
+# Constants
+########################################################################
+TEXT = 0
+START = 1
+END = 2
+DECLARATION = 3
+
+
+TOKEN_RE = re.compile(r"""
+      (?P<text>[^<]+)
+    | <(?P<end>/)?(?P<name>[a-zA-Z][-.a-zA-Z0-9:_]*)
+      (?:\s+[^\s=>/]+(?:\s*=\s*(?:'[^']*'|"[^"]*"|[^\s'">]+))?)*
+      \s*(?P<selfclosing>/)?>
+    | (?P<declaration><!--.*?-->|<![^>]*>|<\?[^>]*>)
+    """, re.S | re.X)
+
+
+# An entity reference without its semicolon, BeautifulSoup add it
+INCOMPLETE_ENTITY_RE = re.compile(r"&#?\w+(?![\w;])")
+
+
+# The rules used by BeautifulSoup to build its tree
+SELF_CLOSING_TAGS = frozenset(("br", "hr", "input", "img", "meta",
+                               "spacer", "link", "frame", "base", "col"))
+
+QUOTE_TAGS = frozenset(("script", "textarea"))
+
+NESTABLE_INLINE_TAGS = ("span", "font", "q", "object", "bdo", "sub", "sup",
+                        "center")
+
+NESTABLE_BLOCK_TAGS = ("blockquote", "div", "fieldset", "ins", "del")
+
+NESTABLE_LIST_TAGS = {"ol" : (), "ul" : (), "li" : ("ul", "ol"),
+                      "dl" : (), "dd" : ("dl",), "dt" : ("dl",)}
+
+NESTABLE_TABLE_TAGS = {"table" : (),
+                       "tr" : ("table", "tbody", "tfoot", "thead"),
+                       "td" : ("tr",), "th" : ("tr",),
+                       "thead" : ("table",), "tbody" : ("table",),
+                       "tfoot" : ("table",)}
+
+NON_NESTABLE_BLOCK_TAGS = ("address", "form", "p", "pre")
+
+NESTABLE_TAGS = dict([(t, ()) for t in NESTABLE_INLINE_TAGS]
+                     + [(t, ()) for t in NESTABLE_BLOCK_TAGS]
+                     + NESTABLE_LIST_TAGS.items()
+                     + NESTABLE_TABLE_TAGS.items())
+
+RESET_NESTING_TAGS = frozenset(NESTABLE_BLOCK_TAGS
+                               + ("noscript",)
+                               + NON_NESTABLE_BLOCK_TAGS
+                               + tuple(NESTABLE_LIST_TAGS)
+                               + tuple(NESTABLE_TABLE_TAGS))
+
+
+# The elements that delimit the cells of a table
+TABLE_TAGS = frozenset(("table", "tr", "td", "th"))
+
+
+
+########################################################################
+# Tokenizer
+########################################################################
+class NoFastPath(Exception):
+    """Raised when the page is not regular enough for the fast path."""
+    pass
+
+
+def tokenize(html):
+    """Yield the tokens of the html page as tuples (kind, name, text)
+    where kind is TEXT, START, END or DECLARATION. The name is the
+    lowercase name of the element for START and END tokens.
+    """
+
+    pos = 0
+    length = len(html)
+    match = TOKEN_RE.match
+    lowercase_html = None
+
+    while pos < length:
+        m = match(html, pos)
+        if m is None:
+            # A lone "<" or a tag that this tokenizer can't read
+            raise NoFastPath()
+
+        pos = m.end()
+
+        text = m.group("text")
+        if text is not None:
+            yield TEXT, None, text
+            continue
+
+        name = m.group("name")
+        if name is None:
+            yield DECLARATION, None, m.group("declaration")
+            continue
+
+        name = name.lower()
+        if m.group("end"):
+            yield END, name, m.group()
+            continue
+
+        if m.group("selfclosing") and name not in SELF_CLOSING_TAGS:
+            raise NoFastPath()
+
+        yield START, name, m.group()
+
+        if name in QUOTE_TAGS:
+            # The content of these elements is not parsed
+            if lowercase_html is None:
+                lowercase_html = html.lower()
+            end = lowercase_html.find("</" + name, pos)
+            if end == -1:
+                raise NoFastPath()
+            if end > pos:
+                yield TEXT, None, html[pos:end]
+            pos = end
+
+
+
+########################################################################
+# Tree rules
+########################################################################
+def push(stack, name):
+    """Push the element on the stack of the open elements. Raise
+    NoFastPath if BeautifulSoup would implicitly close some of the
+    open elements.
+    """
+
+    if name in SELF_CLOSING_TAGS:
+        return
+
+    reset_triggers = NESTABLE_TAGS.get(name)
+    is_nestable = reset_triggers is not None
+    is_reset_nesting = name in RESET_NESTING_TAGS
+
+    for i in range(len(stack) - 1, -1, -1):
+        open_name = stack[i]
+
+        if open_name == name and not is_nestable:
+            raise NoFastPath()
+
+        if ((reset_triggers and open_name in reset_triggers)
+                or (not is_nestable and is_reset_nesting
+                    and open_name in RESET_NESTING_TAGS)):
+            if i != len(stack) - 1:
+                raise NoFastPath()
+            break
+
+    stack.append(name)
+
+
+def pop(stack, name):
+    """Pop the element from the stack of the open elements. Raise
+    NoFastPath if it is not the last open element.
+    """
+
+    if name in SELF_CLOSING_TAGS:
+        return
+
+    if not stack or stack[-1] != name:
+        raise NoFastPath()
+
+    stack.pop()
+
+
+def clean_string(string):
+    """Return the string as BeautifulSoup would, stripped of its
+    irrelevant spaces.
+    """
+
+    if INCOMPLETE_ENTITY_RE.search(string):
+        raise NoFastPath()
+
+    return string.strip()
+
+
+
+########################################################################
+# Navigation
+########################################################################
+def find_anchors(tokens, stack, anchors):
+    """Advance in the tokens up to the first text that match each of
+    the anchor patterns, or up to the end if some are not found.
+
+    Return:
+    A dict of tuples (index, stack, is_first_child) by anchor, where
+    index is the index of the text in the tokens and stack a copy of
+    the open elements at this point
+    """
+
+    pending = list(anchors)
+    found = {}
+    previous_kind, previous_name = None, None
+
+    for index, (kind, name, text) in enumerate(tokens):
+        if kind == TEXT:
+            matches = [a for a in pending if a.search(text)]
+            if matches:
+                if stack and stack[-1] in QUOTE_TAGS:
+                    raise NoFastPath()
+                is_first_child = (previous_kind == START
+                                  and previous_name not in SELF_CLOSING_TAGS)
+                for anchor in matches:
+                    found[anchor] = (index, list(stack), is_first_child)
+                    pending.remove(anchor)
+                if not pending:
+                    break
+        elif kind == START:
+            push(stack, name)
+        elif kind == END:
+            pop(stack, name)
+        elif any(a.search(text) for a in pending):
+            # BeautifulSoup would match the comment or declaration
+            raise NoFastPath()
+
+        previous_kind, previous_name = kind, name
+
+    return found
+
+
+def children_strings(tokens, stack):
+    """Return the strings of the remaining children of the last open
+    element, like the .string attribute of BeautifulSoup would. Every
+    child must be either a text or an element that only contain a
+    text. The tokens are consumed up to the end of the element.
+    """
+
+    strings = []
+
+    for kind, name, text in tokens:
+        if kind == TEXT:
+            strings.append(clean_string(text))
+
+        elif kind == END:
+            pop(stack, name)
+            return strings
+
+        elif kind == START and name not in SELF_CLOSING_TAGS:
+            push(stack, name)
+            kind, _, text = next(tokens)
+            if kind != TEXT:
+                raise NoFastPath()
+            kind, end_name, _ = next(tokens)
+            if kind != END:
+                raise NoFastPath()
+            pop(stack, end_name)
+            strings.append(clean_string(text))
+
+        else:
+            raise NoFastPath()
+
+    raise NoFastPath()
+
+
+def skip_to_depth(tokens, stack, depth):
+    """Advance in the tokens until the stack of the open elements is
+    back to the specified depth.
+    """
+
+    while len(stack) > depth:
+        kind, name, _ = next(tokens)
+        if kind == START:
+            push(stack, name)
+        elif kind == END:
+            pop(stack, name)
+
+
+def find_start_tag(tokens, stack, name, depth, max_depth=None):
+    """Advance in the tokens up to the start of an element with the
+    specified name. The search stop if the stack go below depth. If
+    max_depth is specified, only the elements that are opened at this
+    depth are considered.
+
+    Return True if the element was found, False otherwise.
+    """
+
+    for kind, tag_name, _ in tokens:
+        if kind == START:
+            is_candidate = max_depth is None or len(stack) == max_depth
+            push(stack, tag_name)
+            if tag_name == name and is_candidate:
+                return True
+        elif kind == END:
+            if len(stack) <= depth:
+                return False
+            pop(stack, tag_name)
+
+    return False
+
+
+
+########################################################################
+# Fast paths
+########################################################################
+class TokenBuffer(object):
+    """The tokens of a page, read as they are needed and kept, so that
+    they can be iterated again from any index.
+    """
+
+    def __init__(self, tokens):
+        self._tokens = tokens
+        self._buffer = []
+
+
+    def __iter__(self):
+        return self.iter_from(0)
+
+
+    def iter_from(self, index):
+        while True:
+            if index < len(self._buffer):
+                yield self._buffer[index]
+            else:
+                token = next(self._tokens, None)
+                if token is None:
+                    return
+                self._buffer.append(token)
+                yield token
+            index += 1
+
+
+def follow(tokens, stack, is_first_child, locator):
+    """Follow the path of the locator (see extraction.Locator) from
+    its anchor and return the value it locate. The tokens start after
+    the anchor and the stack is the one of the anchor, both are
+    consumed. Raise NoFastPath if BeautifulSoup could give another
+    value.
+    """
+
+    if locator.next_sibling is None:
+        # Only the strings that follow the anchor in its parent
+        if (locator.find is not None or locator.up != 1
+                or locator.start != 1 or not is_first_child or not stack):
+            raise NoFastPath()
+        return " ".join(children_strings(tokens, stack))
+
+    if len(stack) < locator.up:
+        raise NoFastPath()
+
+    # Get out of the ancestors
+    depth = len(stack) - locator.up
+    skip_to_depth(tokens, stack, depth)
+
+    # Reach the next sibling and its descendant
+    if not find_start_tag(tokens, stack, locator.next_sibling, depth, depth):
+        raise NoFastPath()
+    if (locator.find is not None
+            and not find_start_tag(tokens, stack, locator.find, depth + 1)):
+        raise NoFastPath()
+
+    return " ".join(children_strings(tokens, stack)[locator.start:])
+
+
+def extract_fields(html, fields):
+    """Fast path of extraction.ExtractionSpec. Find the anchors of the
+    locators of the fields in a single pass over the page, then follow
+    the locators of each field in order until one of them locate a
+    value that is not "".
+
+    Return:
+    A dict of the values by field name. The value is "" if no locator
+    locate a value or None if the fast path can't be used for the
+    field.
+    """
+
+    anchors = []
+    for f in fields:
+        for locator in f.locators:
+            if locator.anchor not in anchors and locator.anchor.search(html):
+                anchors.append(locator.anchor)
+
+    tokens = TokenBuffer(tokenize(html))
+    try:
+        found = find_anchors(iter(tokens), [], anchors)
+    except NoFastPath:
+        return dict((f.name, None) for f in fields)
+
+    values = {}
+    for f in fields:
+        value = ""
+        for locator in f.locators:
+            anchor = found.get(locator.anchor)
+            if anchor is None:
+                continue
+
+            index, stack, is_first_child = anchor
+            try:
+                value = follow(tokens.iter_from(index + 1), list(stack),
+                               is_first_child, locator)
+            except (NoFastPath, StopIteration):
+                value = None
+            if value != "":
+                break
+        values[f.name] = value
+
+    return values
+
+
+
+########################################################################
+# Tables
+########################################################################
+def iter_table_rows(html, pattern):
+    """Find the first table that contain a row with a cell whose text
+    match the pattern, the header row, and yield its rows as they are
+    read, starting from the header row. The page is never parsed
+    beyond the end of that table.
+
+    Unlike the fast paths above, there is no BeautifulSoup equivalent
+    to stay identical to: the cells are read leniently, their texts
+    are joined and their irrelevant spaces removed.
+
+    Return:
+    A generator of lists of cell texts. Raise NoFastPath while reading
+    the page if the page can't be read by the tokenizer or if the
+    table contain another table.
+    """
+
+    tokens = tokenize(html)
+    depth = 0
+    target = None
+    row = None
+    cell = None
+
+    for kind, name, text in tokens:
+        if kind == TEXT:
+            if cell is not None:
+                cell.append(text)
+            continue
+
+        if kind not in (START, END) or name not in TABLE_TAGS:
+            continue
+
+        # The start or the end of a cell, a row or a table end the
+        # current cell
+        if cell is not None:
+            row.append(clean_cell(cell))
+            cell = None
+
+        if name in ("td", "th"):
+            if kind == START:
+                if row is None:
+                    row = []
+                cell = []
+            continue
+
+        # The start or the end of a row or a table end the current row
+        if row:
+            if target is None and _is_header(row, pattern):
+                target = depth
+            if target is not None:
+                yield row
+        row = [] if kind == START and name == "tr" else None
+
+        if name == "table":
+            if target is not None:
+                if kind == START:
+                    raise NoFastPath()
+                return
+            depth += 1 if kind == START else -1
+
+
+def _is_header(row, pattern):
+    return any(pattern.search(c) for c in row)
+
+
+def clean_cell(texts):
+    """Join the texts of a cell, replace the entity references by
+    their characters and remove the irrelevant spaces.
+    """
+
+    return " ".join(unescape(" ".join(texts)).split())
+
+
+def unescape(string):
+    """Replace the entity references of the string by their
+    characters.
+    """
+
+    if "&" not in string:
+        return string
+
+    import HTMLParser
+    return HTMLParser.HTMLParser().unescape(string)
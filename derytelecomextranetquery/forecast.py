@@ -0,0 +1,318 @@
+# -*- coding: utf-8 -*-
+
+"""
+forecast
+--------
+
+This module projects when the accounts will run out of data before the
+end of their billing period, from the usage records of the history
+store. The consumption rates of all the accounts are computed at once
+with NumPy, which is required by this module.
+
+Copyright(c) 2016 Rémi Tétreault <tetreault.remi@gmail.com>
+MIT Licensed, see LICENSE for more details.
+"""
+
+
+import time
+import datetime
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+
+
+########################################################################
+# Constants
+########################################################################
+# The duration in seconds over which the consumption rate is computed
+DEFAULT_WINDOW = 24 * 60 * 60
+
+# A billing period is at most this long, older records are not needed
+# to forecast the current one
+MAX_PERIOD = 35 * 24 * 60 * 60
+
+
+
+########################################################################
+# Helper functions
+########################################################################
+def end_of_day(date):
+    """Return the timestamp of the end of the day (local time), or
+    None if the date is None.
+    """
+
+    if date is None:
+        return None
+
+    next_day = date + datetime.timedelta(days=1)
+    return time.mktime(next_day.timetuple())
+
+
+def rolling_rates(groups, times, available, window=DEFAULT_WINDOW):
+    """Compute the consumption rate at each sample, over the samples of
+    the same group fetched in the preceding window.
+
+    Arguments:
+    groups    -- an array of the group of each sample, the samples
+                 must be sorted by group then by time
+    times     -- an array of the timestamps of the samples
+    available -- an array of the available data of the samples
+    window    -- the duration of the window in seconds
+                 (default: DEFAULT_WINDOW)
+
+    Return:
+    An array of the rates in bytes per second, NaN where there is no
+    previous sample in the window
+    """
+
+    if len(times) == 0:
+        return numpy.empty(0)
+
+    # Offset the time of each group so that a single sorted key cover
+    # all the groups and a window never reach the previous group
+    t0 = times.min()
+    span = times.max() - t0 + window + 1
+    keys = groups * span + (times - t0)
+
+    starts = numpy.searchsorted(keys, keys - window, side="left")
+    elapsed = times - times[starts]
+    consumed = available[starts] - available
+
+    with numpy.errstate(divide="ignore", invalid="ignore"):
+        return numpy.where(elapsed > 0, consumed / elapsed, numpy.nan)
+
+
+def project(groups, times, available, window=DEFAULT_WINDOW):
+    """Project when each group of samples will run out of data, from
+    the consumption rate at its last sample. When there is no previous
+    sample in the window, the rate over all the samples of the group is
+    used instead.
+
+    Arguments:
+    groups    -- an array of the group of each sample, the samples
+                 must be sorted by group then by time
+    times     -- an array of the timestamps of the samples
+    available -- an array of the available data of the samples
+    window    -- the duration of the window in seconds
+                 (default: DEFAULT_WINDOW)
+
+    Return:
+    A tuple of arrays (last, rates, exhausted_at) by group, where last
+    is the index of the last sample of the group, rates the consumption
+    rate in bytes per second and exhausted_at the projected timestamp
+    when no data will be available, inf if the rate is not positive
+    """
+
+    rates = rolling_rates(groups, times, available, window)
+
+    last = numpy.flatnonzero(numpy.r_[groups[1:] != groups[:-1], True])
+    first = numpy.r_[0, last[:-1] + 1]
+
+    elapsed = times[last] - times[first]
+    with numpy.errstate(divide="ignore", invalid="ignore"):
+        overall = numpy.where(elapsed > 0,
+                              (available[first] - available[last]) / elapsed,
+                              numpy.nan)
+
+    rates = rates[last]
+    rates = numpy.where(numpy.isnan(rates), overall, rates)
+
+    with numpy.errstate(divide="ignore", invalid="ignore"):
+        exhausted_at = numpy.where(
+            rates > 0,
+            times[last] + numpy.maximum(available[last], 0) / rates,
+            numpy.inf)
+
+    return last, rates, exhausted_at
+
+
+def forecast(records, window=DEFAULT_WINDOW):
+    """Forecast the usage of the accounts during their current billing
+    period.
+
+    Arguments:
+    records -- an iterable of (username, UsageRecord) tuples, like
+               those returned by HistoryStore.query
+    window  -- the duration in seconds over which the consumption rate
+               is computed (default: DEFAULT_WINDOW)
+
+    Return:
+    A list of Forecast, one by account, sorted by username
+    """
+
+    account_ids = {}
+    rows = []
+
+    for username, record in records:
+        if record.available is None or record.fetched_at is None:
+            continue
+
+        account_id = account_ids.setdefault(username, len(account_ids))
+        rows.append((account_id, _ordinal(record.period_start),
+                     _ordinal(record.period_end), record.fetched_at,
+                     record.available))
+
+    usernames = dict((i, username) for username, i in account_ids.items())
+    return forecast_samples(usernames, rows, window)
+
+
+def forecast_history(store, account=None, since=None,
+                     window=DEFAULT_WINDOW):
+    """Forecast the usage of the accounts of the history store during
+    their current billing period. The samples are read from the store
+    as numbers, which is faster than forecast(store.query()).
+
+    Arguments:
+    store   -- the HistoryStore
+    account -- only forecast the usage of this username (optional)
+    since   -- only use the samples fetched at or after this timestamp
+               (optional)
+    window  -- the duration in seconds over which the consumption rate
+               is computed (default: DEFAULT_WINDOW)
+
+    Return:
+    A list of Forecast, one by account, sorted by username
+    """
+
+    usernames, rows = store.query_samples(account, since)
+    return forecast_samples(usernames, rows, window)
+
+
+def forecast_samples(usernames, rows, window=DEFAULT_WINDOW):
+    """Forecast the usage of the accounts during their current billing
+    period, from rows of numbers.
+
+    Arguments:
+    usernames -- a dict of the usernames by account id
+    rows      -- a sequence of (account_id, period_start, period_end,
+                 fetched_at, available) tuples, like those returned by
+                 HistoryStore.query_samples, in any order
+    window    -- the duration in seconds over which the consumption
+                 rate is computed (default: DEFAULT_WINDOW)
+
+    Return:
+    A list of Forecast, one by account, sorted by username
+    """
+
+    if numpy is None:
+        raise RuntimeError("NumPy is required to forecast the usage")
+
+    if len(rows) == 0:
+        return []
+
+    samples = numpy.array(rows, dtype=float)
+    accounts, period_starts, period_ends, times, available = samples.T
+
+    order = numpy.lexsort((times, period_starts, accounts))
+    accounts, period_starts, period_ends, times, available = samples[order].T
+
+    # A new billing period reset the usage, so the samples are grouped
+    # by account and billing period
+    groups = numpy.cumsum(numpy.r_[
+        True, ((accounts[1:] != accounts[:-1])
+               | (period_starts[1:] != period_starts[:-1]))]) - 1
+
+    last, rates, exhausted_at = project(groups, times, available, window)
+
+    # Keep the current billing period of each account, the one of its
+    # last sample
+    by_time = numpy.lexsort((times[last], accounts[last]))
+    last_accounts = accounts[last][by_time]
+    current = by_time[numpy.r_[last_accounts[1:] != last_accounts[:-1],
+                               True]]
+
+    forecasts = []
+    for i in current:
+        j = last[i]
+        period_end = (datetime.date.fromordinal(int(period_ends[j]))
+                      if period_ends[j] else None)
+        rate = rates[i] if not numpy.isnan(rates[i]) else None
+        exhausted = (exhausted_at[i] if numpy.isfinite(exhausted_at[i])
+                     else None)
+
+        forecasts.append(Forecast(usernames[int(accounts[j])], times[j],
+                                  int(available[j]), rate, exhausted,
+                                  period_end))
+
+    forecasts.sort(key=lambda f: f.username)
+    return forecasts
+
+
+def _ordinal(date):
+    # Return the proleptic Gregorian ordinal of the date, 0 if it is
+    # None
+    return date.toordinal() if date is not None else 0
+
+
+
+########################################################################
+# Classes
+########################################################################
+class Forecast(object):
+    """The forecast of the usage of an account.
+
+    Attributes:
+        username     -- the username of the account
+        fetched_at   -- when the last sample was retrieved (timestamp)
+        available    -- the available data at the last sample
+        rate         -- the consumption rate in bytes per second, or
+                        None if it is unknown
+        exhausted_at -- the projected time when no data will be
+                        available (timestamp), or None if the data is
+                        not being consumed
+        period_end   -- the last day of the billing period (date)
+    """
+
+    __slots__ = ("username", "fetched_at", "available", "rate",
+                 "exhausted_at", "period_end")
+
+    FIELDS = __slots__ + ("runs_out",)
+
+
+    def __init__(self, username, fetched_at, available, rate, exhausted_at,
+                 period_end):
+        self.username = username
+        self.fetched_at = fetched_at
+        self.available = available
+        self.rate = rate
+        self.exhausted_at = exhausted_at
+        self.period_end = period_end
+
+
+    @property
+    def runs_out(self):
+        """True if the account is projected to run out of data before
+        the end of its billing period, None if it is unknown, like when
+        the consumption rate is unknown.
+        """
+
+        if self.rate is None:
+            return None
+        if self.exhausted_at is None:
+            # The data is not being consumed
+            return False
+
+        period_end = end_of_day(self.period_end)
+        if period_end is None:
+            return None
+
+        return self.exhausted_at < period_end
+
+
+    def as_dict(self):
+        """Return the forecast as a dict of values that can be
+        serialized, the date is formatted as YYYY-MM-DD.
+        """
+
+        values = dict((k, getattr(self, k)) for k in self.FIELDS)
+        if self.period_end is not None:
+            values["period_end"] = self.period_end.strftime("%Y-%m-%d")
+        return values
+
+
+    def __repr__(self):
+        return "Forecast({})".format(", ".join(
+            "{}={!r}".format(k, getattr(self, k)) for k in self.__slots__))
@@ -0,0 +1,137 @@
+# -*- coding: utf-8 -*-
+
+"""
+handoff
+-------
+
+This module hand a session of the Derytelecom Extranet over to the web
+browser. The session is established by this application, then the web
+browser is opened on a page served once by a short-lived local HTTP
+server. The page is a form that submit itself as soon as it is loaded,
+to the requested page of the Extranet with the session id, so the web
+browser continue the session in a single navigation.
+
+The session id is passed in the URL, which PHP accept when its
+session.use_only_cookies setting is off, and the Extranet then set
+its cookie in the web browser. The username and the password are never
+given to the web browser.
+
+Copyright(c) 2016 Rémi Tétreault <tetreault.remi@gmail.com>
+MIT Licensed, see LICENSE for more details.
+"""
+
+
+import os
+import binascii
+import threading
+
+
+
+########################################################################
+# Constants
+########################################################################
+# The maximum time in seconds to wait for the web browser to load the
+# page
+TIMEOUT = 60
+
+PAGE_TEMPLATE = u"""<!DOCTYPE html>
+<html>
+<head>
+<meta charset="utf-8">
+<meta name="referrer" content="no-referrer">
+<title>Derytelecom Extranet</title>
+</head>
+<body onload="document.forms[0].submit()">
+<form method="get" action="{action}">
+{inputs}
+<noscript><input type="submit" value="Continue"></noscript>
+</form>
+</body>
+</html>
+"""
+
+INPUT_TEMPLATE = u'<input type="hidden" name="{}" value="{}">'
+
+
+
+########################################################################
+# Helper functions
+########################################################################
+def handoff_page(url, params):
+    """Return the page of a form that submit itself to the URL with
+    the params.
+
+    Arguments:
+    url    -- the URL to which the form is submitted
+    params -- a dict of the parameters of the form, the session id
+              included
+    """
+
+    import cgi
+
+    inputs = "\n".join(INPUT_TEMPLATE.format(cgi.escape(k, True),
+                                             cgi.escape(v, True))
+                       for k, v in sorted(params.items()))
+    return PAGE_TEMPLATE.format(action=cgi.escape(url, True), inputs=inputs)
+
+
+def serve_once(page, open_url, timeout=TIMEOUT):
+    """Serve the page at a random path of a local HTTP server until it
+    has been served once.
+
+    Arguments:
+    page     -- the page to serve
+    open_url -- the function called with the URL of the page once the
+                server is listening, like webbrowser.open_new
+    timeout  -- the maximum time in seconds to wait for the page to be
+                served (default: TIMEOUT)
+
+    Return:
+    True if the page was served, False if the timeout expired
+    """
+
+    import BaseHTTPServer
+
+    path = "/" + binascii.hexlify(os.urandom(16))
+    body = page.encode("utf-8")
+    served = threading.Event()
+
+    class HandoffRequestHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+
+        def log_message(self, *args):
+            pass
+
+        def do_GET(self):
+            # The other requests, like the one of the favicon, and the
+            # page once it was served are not found
+            if self.path != path or served.is_set():
+                self.send_error(404)
+                return
+
+            self.send_response(200)
+            self.send_header("Content-Type", "text/html; charset=utf-8")
+            self.send_header("Content-Length", str(len(body)))
+            self.send_header("Cache-Control", "no-store")
+            self.end_headers()
+            self.wfile.write(body)
+            served.set()
+
+    server = BaseHTTPServer.HTTPServer(("127.0.0.1", 0),
+                                       HandoffRequestHandler)
+
+    # The page is served in the background since open_url wait for
+    # the text-mode web browsers to exit
+    thread = threading.Thread(target=server.serve_forever,
+                              kwargs={"poll_interval" : 0.05})
+    thread.daemon = True
+    thread.start()
+
+    try:
+        open_url("http://127.0.0.1:{}{}".format(server.server_port, path))
+        served.wait(timeout)
+
+    finally:
+        server.shutdown()
+        server.server_close()
+
+    return served.is_set()
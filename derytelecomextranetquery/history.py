@@ -0,0 +1,330 @@
+# -*- coding: utf-8 -*-
+
+"""
+history
+-------
+
+This module provides the HistoryStore class, a local SQLite store of
+the usage records of the accounts. The old records are downsampled and
+eventually removed, according to retention rules, so that the store
+stay small.
+
+Copyright(c) 2016 Rémi Tétreault <tetreault.remi@gmail.com>
+MIT Licensed, see LICENSE for more details.
+"""
+
+
+import os
+import time
+import sqlite3
+
+from usage import UsageRecord, format_date, parse_period
+
+
+
+########################################################################
+# Constants
+########################################################################
+DATA_DIR_NAME = "derytelecomextranetquery"
+HISTORY_FILE_NAME = "history.sqlite"
+
+MINUTE = 60
+HOUR = 60 * MINUTE
+DAY = 24 * HOUR
+
+# The resolution of the records that are kept as they were added
+RAW = 0
+
+# The retention rules, a list of (age, resolution) tuples sorted by
+# age. The records younger than the age of a rule are kept at its
+# resolution, in seconds. The records older than the age of the last
+# rule are removed.
+RETENTION_RULES = (
+    (7 * DAY, RAW),
+    (90 * DAY, HOUR),
+    (2 * 365 * DAY, DAY)
+)
+
+# The minimum delay between two automatic compactions of the store
+COMPACT_INTERVAL = DAY
+
+# The julian day of the day before the first day of the proleptic
+# Gregorian ordinals, so that julianday(date) - ORDINAL_EPOCH is equal
+# to date.toordinal()
+ORDINAL_EPOCH = 1721424.5
+
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS accounts (
+    id INTEGER PRIMARY KEY,
+    username TEXT NOT NULL UNIQUE
+);
+
+CREATE TABLE IF NOT EXISTS samples (
+    account_id INTEGER NOT NULL REFERENCES accounts(id),
+    fetched_at REAL NOT NULL,
+    resolution INTEGER NOT NULL,
+    available INTEGER,
+    used INTEGER,
+    total INTEGER,
+    period_start TEXT,
+    period_end TEXT,
+    PRIMARY KEY (account_id, fetched_at, resolution)
+);
+
+CREATE INDEX IF NOT EXISTS samples_by_time
+    ON samples (fetched_at, account_id);
+
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value
+);
+"""
+
+
+
+########################################################################
+# Helper functions
+########################################################################
+def default_history_path():
+    """Return the path of the history store, in the data directory of
+    this application as specified by the XDG Base Directory
+    Specification.
+    """
+
+    data_home = (os.environ.get("XDG_DATA_HOME")
+                 or os.path.join(os.path.expanduser("~"), ".local", "share"))
+    return os.path.join(data_home, DATA_DIR_NAME, HISTORY_FILE_NAME)
+
+
+def _where(account, since, until, conditions=()):
+    # Return the WHERE clause of a query of the samples of the account
+    # in the time range, and its parameters
+    conditions = list(conditions)
+    params = []
+
+    if account is not None:
+        conditions.append("a.username = ?")
+        params.append(account)
+    if since is not None:
+        conditions.append("s.fetched_at >= ?")
+        params.append(since)
+    if until is not None:
+        conditions.append("s.fetched_at < ?")
+        params.append(until)
+
+    where = "WHERE " + " AND ".join(conditions) if conditions else ""
+    return where, params
+
+
+
+########################################################################
+# Classes
+########################################################################
+class HistoryStore(object):
+    """This class store the usage records of the accounts in a SQLite
+    database. It must only be used from the thread that created it.
+    """
+
+    def __init__(self, path=None, retention_rules=RETENTION_RULES):
+        """Arguments:
+        path            -- the path of the database
+                           (default: default_history_path())
+        retention_rules -- the retention rules of the records
+                           (default: RETENTION_RULES)
+        """
+
+        if path is None:
+            path = default_history_path()
+
+        directory = os.path.dirname(path)
+        if directory and not os.path.isdir(directory):
+            os.makedirs(directory, 0o700)
+
+        self.path = path
+        self.retention_rules = retention_rules
+        self._db = sqlite3.connect(path)
+        self._db.executescript(SCHEMA)
+        self._account_ids = {}
+
+
+    def close(self):
+        self._db.close()
+
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+    def _account_id(self, username):
+        account_id = self._account_ids.get(username)
+        if account_id is None:
+            self._db.execute("INSERT OR IGNORE INTO accounts (username) "
+                             "VALUES (?)", (username,))
+            account_id = self._db.execute(
+                "SELECT id FROM accounts WHERE username = ?",
+                (username,)).fetchone()[0]
+            self._account_ids[username] = account_id
+        return account_id
+
+
+    def add(self, username, record):
+        """Add the UsageRecord of the account to the store."""
+
+        self.add_many([(username, record)])
+
+
+    def add_many(self, records):
+        """Add many usage records to the store in one transaction.
+
+        Arguments:
+        records -- an iterable of (username, UsageRecord) tuples
+        """
+
+        with self._db:
+            self._db.executemany(
+                "INSERT OR REPLACE INTO samples "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                [(self._account_id(username),
+                  r.fetched_at if r.fetched_at is not None else time.time(),
+                  RAW, r.available, r.used, r.total,
+                  format_date(r.period_start), format_date(r.period_end))
+                 for username, r in records])
+
+        self._compact_if_due()
+
+
+    def query(self, account=None, since=None, until=None, resolution=RAW):
+        """Return the usage records of the store.
+
+        Arguments:
+        account    -- only return the records of this username
+                      (optional)
+        since      -- only return the records fetched at or after this
+                      timestamp (optional)
+        until      -- only return the records fetched before this
+                      timestamp (optional)
+        resolution -- the resolution in seconds, the records are
+                      averaged over intervals of this duration, RAW
+                      return them as they are (default: RAW)
+
+        Return:
+        A generator of (username, UsageRecord) tuples, sorted by
+        username and time. When the records are averaged, their
+        fetched_at is the start of their interval.
+        """
+
+        where, params = _where(account, since, until)
+
+        if resolution:
+            sql = ("SELECT a.username, "
+                   "CAST(s.fetched_at / ? AS INTEGER) * ? AS t, "
+                   "CAST(AVG(s.available) AS INTEGER), "
+                   "CAST(AVG(s.used) AS INTEGER), MAX(s.total), "
+                   "MAX(s.period_start), MAX(s.period_end) "
+                   "FROM samples s JOIN accounts a ON a.id = s.account_id "
+                   "{} GROUP BY a.username, t ORDER BY a.username, t"
+                   .format(where))
+            params = [resolution, resolution] + params
+        else:
+            sql = ("SELECT a.username, s.fetched_at, s.available, s.used, "
+                   "s.total, s.period_start, s.period_end "
+                   "FROM samples s JOIN accounts a ON a.id = s.account_id "
+                   "{} ORDER BY a.username, s.fetched_at".format(where))
+
+        for (username, fetched_at, available, used, total,
+             period_start, period_end) in self._db.execute(sql, params):
+            period_start = parse_period(period_start or "")[0]
+            period_end = parse_period(period_end or "")[0]
+            yield username, UsageRecord(available, used, total,
+                                        period_start, period_end,
+                                        fetched_at)
+
+
+    def query_samples(self, account=None, since=None, until=None):
+        """Return the samples of the available data of the store as
+        rows of numbers, for the computations made on arrays, without
+        making a UsageRecord of each one. The samples without available
+        data are left out.
+
+        Arguments:
+        account -- only return the samples of this username (optional)
+        since   -- only return the samples fetched at or after this
+                   timestamp (optional)
+        until   -- only return the samples fetched before this
+                   timestamp (optional)
+
+        Return:
+        A tuple (usernames, rows), where usernames is a dict of the
+        usernames by account id and rows a list of (account_id,
+        period_start, period_end, fetched_at, available) tuples sorted
+        by account id, period start and time. The days of the billing
+        period are proleptic Gregorian ordinals, as returned by
+        date.toordinal, or 0 if they are unknown.
+        """
+
+        where, params = _where(account, since, until, ["s.available "
+                                                       "IS NOT NULL"])
+
+        usernames = dict(self._db.execute("SELECT id, username "
+                                          "FROM accounts"))
+
+        # The ordinals are computed by SQLite from the julian days
+        sql = ("SELECT s.account_id, "
+               "COALESCE(julianday(s.period_start) - ?, 0) AS p, "
+               "COALESCE(julianday(s.period_end) - ?, 0), "
+               "s.fetched_at, s.available "
+               "FROM samples s JOIN accounts a ON a.id = s.account_id "
+               "{} ORDER BY s.account_id, p, s.fetched_at".format(where))
+        params = [ORDINAL_EPOCH, ORDINAL_EPOCH] + params
+
+        return usernames, self._db.execute(sql, params).fetchall()
+
+
+    def compact(self, now=None):
+        """Apply the retention rules: downsample the records that are
+        older than the age of a rule to the resolution of the next one
+        and remove the records that are older than the age of the last
+        rule.
+        """
+
+        if now is None:
+            now = time.time()
+
+        with self._db:
+            rules = self.retention_rules
+            for (age, _), (_, resolution) in zip(rules, rules[1:]):
+                # Only compact complete intervals, so that an interval
+                # is never compacted twice
+                cutoff = (now - age) // resolution * resolution
+
+                self._db.execute(
+                    "INSERT OR REPLACE INTO samples "
+                    "SELECT account_id, "
+                    "CAST(fetched_at / ? AS INTEGER) * ? AS t, ?, "
+                    "CAST(AVG(available) AS INTEGER), "
+                    "CAST(AVG(used) AS INTEGER), MAX(total), "
+                    "MAX(period_start), MAX(period_end) "
+                    "FROM samples WHERE resolution < ? AND fetched_at < ? "
+                    "GROUP BY account_id, t",
+                    (resolution, resolution, resolution, resolution, cutoff))
+
+                self._db.execute(
+                    "DELETE FROM samples WHERE resolution < ? "
+                    "AND fetched_at < ?", (resolution, cutoff))
+
+            self._db.execute("DELETE FROM samples WHERE fetched_at < ?",
+                             (now - rules[-1][0],))
+
+            self._db.execute("INSERT OR REPLACE INTO meta VALUES "
+                             "('last_compaction', ?)", (now,))
+
+
+    def _compact_if_due(self):
+        row = self._db.execute("SELECT value FROM meta "
+                               "WHERE key = 'last_compaction'").fetchone()
+        if row is None or time.time() - row[0] >= COMPACT_INTERVAL:
+            self.compact()
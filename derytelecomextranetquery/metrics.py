@@ -0,0 +1,306 @@
+# -*- coding: utf-8 -*-
+
+"""
+metrics
+-------
+
+This module provides the Recorder class, that record the duration,
+the bytes transferred and the outcome of each phase of the queries
+(the requests made to the Derytelecom Extranet and the parsing of the
+web pages), and the gauges of the components that poll it, like the
+depth of the queue of the scheduler, and export them in the Prometheus
+text format or in JSON.
+
+Copyright(c) 2016 Rémi Tétreault <tetreault.remi@gmail.com>
+MIT Licensed, see LICENSE for more details.
+"""
+
+
+import json
+import time
+import threading
+from contextlib import contextmanager
+
+
+
+########################################################################
+# Constants
+########################################################################
+# The upper bounds in seconds of the buckets of the histogram of the
+# durations
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+PROMETHEUS_PREFIX = "derytelecom_phase"
+GAUGE_PREFIX = "derytelecom"
+
+OK = "ok"
+
+PROMETHEUS = "prometheus"
+JSON = "json"
+FORMATS = (PROMETHEUS, JSON)
+
+
+
+########################################################################
+# Helper functions
+########################################################################
+def outcome_of_exception(e):
+    """Return the outcome of a phase that raised the exception e."""
+
+    return type(e).__name__
+
+
+def escape_label_value(value):
+    """Escape a label value of the Prometheus text format."""
+
+    return (value.replace("\\", "\\\\").replace("\"", "\\\"")
+            .replace("\n", "\\n"))
+
+
+def _format_float(value):
+    return repr(float(value)) if value != float("inf") else "+Inf"
+
+
+
+########################################################################
+# Classes
+########################################################################
+class _PhaseStats(object):
+    # The statistics of one phase
+
+    __slots__ = ("count", "seconds", "max_seconds", "bytes", "outcomes",
+                 "buckets")
+
+    def __init__(self):
+        self.count = 0
+        self.seconds = 0.0
+        self.max_seconds = 0.0
+        self.bytes = 0
+        self.outcomes = {}
+        self.buckets = [0] * len(BUCKETS)
+
+
+    def as_dict(self):
+        return {"count" : self.count,
+                "seconds" : self.seconds,
+                "max_seconds" : self.max_seconds,
+                "bytes" : self.bytes,
+                "outcomes" : dict(self.outcomes),
+                "buckets" : dict(zip(map(str, BUCKETS), self.buckets))}
+
+
+
+class Recorder(object):
+    """This class record the phases of the queries. It can be shared by
+    many threads and many instances of DerytelecomExtranetQuery.
+
+    The phases are named after what they do:
+        login_page      -- retrieve the login page
+        auth            -- submit the login form
+        page.<content>  -- retrieve a web page, like page.internet.traffic
+        logout          -- log out
+        parse.soup      -- build the BeautifulSoup tree of a web page
+        parse.<field>   -- extract a field of a web page, like
+                           parse.available
+        schedule.lag    -- the delay between the time at which a poll
+                           of the scheduler was due and its start
+    """
+
+    def __init__(self):
+        self._phases = {}
+        self._gauges = {}
+        self._lock = threading.Lock()
+
+
+    def record(self, phase, seconds, bytes=0, outcome=OK):
+        """Record one run of the phase.
+
+        Arguments:
+        phase   -- the name of the phase
+        seconds -- the duration of the run
+        bytes   -- the number of bytes transferred (default: 0)
+        outcome -- OK or what went wrong (default: OK)
+        """
+
+        with self._lock:
+            stats = self._phases.get(phase)
+            if stats is None:
+                stats = self._phases[phase] = _PhaseStats()
+
+            stats.count += 1
+            stats.seconds += seconds
+            stats.max_seconds = max(stats.max_seconds, seconds)
+            stats.bytes += bytes
+            stats.outcomes[outcome] = stats.outcomes.get(outcome, 0) + 1
+
+            for i, bound in enumerate(BUCKETS):
+                if seconds <= bound:
+                    stats.buckets[i] += 1
+
+
+    def set_gauge(self, name, value, description):
+        """Set the current value of a gauge.
+
+        Arguments:
+        name        -- the name of the gauge, like scheduler_queue_depth
+        value       -- the current value
+        description -- what the gauge measure, for its HELP line
+        """
+
+        with self._lock:
+            self._gauges[name] = (value, description)
+
+
+    @contextmanager
+    def phase(self, name):
+        """Return a context manager that record the duration and the
+        outcome of the code it wrap as a run of the phase. The outcome
+        is the name of the exception if one is raised.
+        """
+
+        start = time.time()
+        try:
+            yield
+        except Exception as e:
+            self.record(name, time.time() - start,
+                        outcome=outcome_of_exception(e))
+            raise
+        else:
+            self.record(name, time.time() - start)
+
+
+    def snapshot(self):
+        """Return the statistics of the phases in a dict, by phase."""
+
+        with self._lock:
+            return dict((name, stats.as_dict())
+                        for name, stats in self._phases.items())
+
+
+    def gauges(self):
+        """Return the current values of the gauges in a dict, by name."""
+
+        with self._lock:
+            return dict((name, value)
+                        for name, (value, _) in self._gauges.items())
+
+
+    def as_dict(self):
+        """Return the statistics of the phases in a dict, by phase, the
+        gauges are under the gauges key when there are some.
+        """
+
+        snapshot = self.snapshot()
+        gauges = self.gauges()
+        if gauges:
+            snapshot["gauges"] = gauges
+        return snapshot
+
+
+    def to_json(self):
+        """Return the statistics of the phases as a JSON string, made
+        by as_dict.
+        """
+
+        return json.dumps(self.as_dict(), sort_keys=True)
+
+
+    def to_prometheus(self):
+        """Return the statistics of the phases in the Prometheus text
+        exposition format.
+        """
+
+        snapshot = self.snapshot()
+        phases = sorted(snapshot)
+        name = PROMETHEUS_PREFIX
+        lines = []
+
+        lines.append("# HELP {}_duration_seconds The duration of the "
+                     "phases of the queries.".format(name))
+        lines.append("# TYPE {}_duration_seconds histogram".format(name))
+        for phase in phases:
+            stats = snapshot[phase]
+            label = 'phase="{}"'.format(escape_label_value(phase))
+            for bound in BUCKETS + (float("inf"),):
+                count = stats["buckets"].get(str(bound), stats["count"])
+                lines.append('{}_duration_seconds_bucket{{{},le="{}"}} {}'
+                             .format(name, label, _format_float(bound),
+                                     count))
+            lines.append("{}_duration_seconds_sum{{{}}} {}".format(
+                name, label, _format_float(stats["seconds"])))
+            lines.append("{}_duration_seconds_count{{{}}} {}".format(
+                name, label, stats["count"]))
+
+        lines.append("# HELP {}_bytes_total The bytes transferred by the "
+                     "phases of the queries.".format(name))
+        lines.append("# TYPE {}_bytes_total counter".format(name))
+        for phase in phases:
+            lines.append('{}_bytes_total{{phase="{}"}} {}'.format(
+                name, escape_label_value(phase), snapshot[phase]["bytes"]))
+
+        lines.append("# HELP {}_outcomes_total The outcomes of the phases "
+                     "of the queries.".format(name))
+        lines.append("# TYPE {}_outcomes_total counter".format(name))
+        for phase in phases:
+            for outcome, count in sorted(snapshot[phase]["outcomes"].items()):
+                lines.append('{}_outcomes_total{{phase="{}",outcome="{}"}} {}'
+                             .format(name, escape_label_value(phase),
+                                     escape_label_value(outcome), count))
+
+        with self._lock:
+            gauges = sorted(self._gauges.items())
+        for gauge, (value, description) in gauges:
+            gauge_name = "{}_{}".format(GAUGE_PREFIX, gauge)
+            lines.append("# HELP {} {}".format(gauge_name, description))
+            lines.append("# TYPE {} gauge".format(gauge_name))
+            lines.append("{} {}".format(gauge_name, _format_float(value)))
+
+        return "\n".join(lines) + "\n"
+
+
+    def export(self, output_format):
+        """Return the statistics in the output format, one of FORMATS."""
+
+        if output_format == PROMETHEUS:
+            return self.to_prometheus()
+        elif output_format == JSON:
+            return self.to_json() + "\n"
+        else:
+            raise ValueError("'{}' is not a valid format"
+                             .format(output_format))
+
+
+    def write_file(self, path, output_format=PROMETHEUS):
+        """Atomically replace the content of the file at path by the
+        statistics in the output format, for example for the textfile
+        collector of the Prometheus node exporter. The file is only
+        readable and writable by its owner, and the processes that
+        write it at the same time do not share a temporary file.
+        """
+
+        from sessionstore import write_private_file
+
+        write_private_file(path, self.export(output_format).encode("utf-8"))
+
+
+    def format_profile(self):
+        """Return the statistics of the phases as a text table, by
+        order of total duration.
+        """
+
+        snapshot = self.snapshot()
+        lines = ["{:<24} {:>6} {:>10} {:>10} {:>10}  {}".format(
+            "phase", "count", "total ms", "max ms", "bytes", "outcomes")]
+
+        for phase, stats in sorted(snapshot.items(),
+                                   key=lambda item: -item[1]["seconds"]):
+            outcomes = " ".join("{}={}".format(k, v) for k, v
+                                in sorted(stats["outcomes"].items()))
+            lines.append("{:<24} {:>6} {:>10.2f} {:>10.2f} {:>10}  {}".format(
+                phase, stats["count"], stats["seconds"] * 1000,
+                stats["max_seconds"] * 1000, stats["bytes"], outcomes))
+
+        for gauge, value in sorted(self.gauges().items()):
+            lines.append("{:<24} {:>6g}".format(gauge, value))
+
+        return "\n".join(lines) + "\n"
@@ -0,0 +1,401 @@
+# -*- coding: utf-8 -*-
+
+"""
+queryserver
+-----------
+
+This module provides a long-running server that keeps the sessions
+with the Derytelecom Extranet open and answers queries sent over a
+Unix socket. The queries and the answers are line-delimited JSON
+objects.
+
+Example of query:
+    {"data": "availabledata", "username": "user", "password": "pass"}
+
+Example of answers:
+    {"result": "60.3 Gb"}
+    {"error": "BadUsernamePasswordError", "msg": "Impossible to ..."}
+
+The metrics of the server can be queried in the Prometheus text format,
+the result is then the text, or in JSON, the result is then an object:
+    {"metrics": "prometheus"}
+    {"metrics": "json"}
+
+Copyright(c) 2016 Rémi Tétreault <tetreault.remi@gmail.com>
+MIT Licensed, see LICENSE for more details.
+"""
+
+
+import os
+import json
+import time
+import socket
+import threading
+import SocketServer
+
+from derytelecomextranetquery import (DerytelecomExtranetQuery,
+                                      DerytelecomExtranetQueryException,
+                                      UnexpectedLogOutError)
+from metrics import Recorder, JSON
+
+
+
+########################################################################
+# Constants
+########################################################################
+SOCKET_NAME = "derytelecomextranetquery.sock"
+
+# The time in seconds after which a session that was not used is closed,
+# and the delay between two checks of the sessions
+IDLE_TIMEOUT = 30 * 60
+EXPIRE_INTERVAL = 60
+
+# The data that can be queried, associated with the function used to
+# retrieve it from a connected DerytelecomExtranetQuery
+DATA = {
+    "availabledata" : lambda deq: deq.get_internettraffic().get_available(),
+    "usage" : lambda deq: deq.get_internettraffic().get_usage().as_dict(),
+    "traffic" : lambda deq: get_traffic(deq)
+}
+
+
+
+########################################################################
+# Helper functions
+########################################################################
+def get_traffic(deq):
+    """Retrieve the Internet > Traffic page a single time and return
+    both the available data and the usage read from it.
+
+    Arguments:
+    deq -- a connected DerytelecomExtranetQuery
+
+    Return:
+    A dict with the available data string (availabledata) and the
+    usage, a dict made by UsageRecord.as_dict (usage)
+    """
+
+    inet_traffic = deq.get_internettraffic()
+    return {"availabledata" : inet_traffic.get_available(),
+            "usage" : inet_traffic.get_usage().as_dict()}
+
+
+def default_socket_path():
+    """Return the path of the socket to use when none is specified.
+    The socket is created in the XDG runtime directory if there is
+    one, in the temporary directory otherwise.
+    """
+
+    runtime_dir = os.environ.get("XDG_RUNTIME_DIR")
+    if runtime_dir:
+        return os.path.join(runtime_dir, SOCKET_NAME)
+    else:
+        return os.path.join("/tmp", "{}-{}".format(os.getuid(),
+                                                   SOCKET_NAME))
+
+
+def query_server(socket_path, data, username, password):
+    """Send a query to a running QueryServer and return its answer.
+
+    Arguments:
+    socket_path -- the path of the socket on which the server listen
+    data        -- the data to retrieve
+    username    -- the username to use to log in
+    password    -- the password to use to log in
+
+    Return:
+    The answer of the server, a dict that contain either the key
+    "result" or the keys "error" and "msg"
+
+    Raise socket.error if the server can not be reached.
+    """
+
+    query = {"data" : data, "username" : username, "password" : password}
+
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        sock.connect(socket_path)
+        sock.sendall(json.dumps(query) + "\n")
+        answer = sock.makefile("rb").readline()
+    finally:
+        sock.close()
+
+    if not answer:
+        raise socket.error("The server closed the connection")
+
+    return json.loads(answer)
+
+
+
+########################################################################
+# Classes
+########################################################################
+class _Account(object):
+    # Hold the session of one account. The lock make sure that only
+    # one query at a time use the session. An expired account was
+    # removed from the server and must not be used anymore.
+
+    def __init__(self, username, password, cache, recorder):
+        self.username = username
+        self.password = password
+        self.cache = cache
+        self.recorder = recorder
+        self.deq = None
+        self.lock = threading.Lock()
+        self.last_used = time.time()
+        self.expired = False
+
+
+    def connect(self):
+        self.deq = DerytelecomExtranetQuery.connect(self.username,
+                                                    self.password,
+                                                    cache=self.cache,
+                                                    recorder=self.recorder)
+
+
+    def query(self, get_data):
+        # Must be called with the lock acquired
+
+        if self.deq is None or not self.deq.connected:
+            self.connect()
+            return get_data(self.deq)
+
+        try:
+            return get_data(self.deq)
+        except UnexpectedLogOutError:
+            # The Extranet closed the session, log in again and retry
+            # one time only
+            self.close()
+            self.connect()
+            return get_data(self.deq)
+
+
+    def close(self):
+        if self.deq is not None:
+            try:
+                self.deq.disconnect()
+            except Exception:
+                pass
+            self.deq = None
+
+
+
+class QueryRequestHandler(SocketServer.StreamRequestHandler):
+    """Handle the connection of a client. A client can send as many
+    queries as it want on the same connection, one per line.
+    """
+
+    def handle(self):
+        for line in iter(self.rfile.readline, ""):
+            if not line.strip():
+                continue
+
+            try:
+                query = json.loads(line)
+                if "metrics" in query:
+                    answer = self.server.metrics(query["metrics"])
+                else:
+                    answer = self.server.answer(query["data"],
+                                                query["username"],
+                                                query["password"])
+                answer = {"result" : answer}
+
+            except DerytelecomExtranetQueryException as e:
+                answer = {"error" : type(e).__name__, "msg" : str(e)}
+
+            except Exception:
+                # For unknow exceptions, act as if they were
+                # DerytelecomExtranetQueryException exceptions
+                e = DerytelecomExtranetQueryException()
+                answer = {"error" : type(e).__name__, "msg" : str(e)}
+
+            self.wfile.write(json.dumps(answer) + "\n")
+            self.wfile.flush()
+
+
+
+class QueryServer(SocketServer.ThreadingMixIn,
+                  SocketServer.UnixStreamServer):
+    """This class is a server that keep one logged in session with the
+    Derytelecom Extranet per account and use it to answer the queries
+    it receive on a Unix socket. A session is only established again
+    when the Extranet unexpectedly log it out, and it is closed once
+    it was not used for idle_timeout seconds.
+
+    A query with another password than the one of the session of the
+    account is made with a new session, which replace the other only
+    once it logged in, so a wrong password does not close a good
+    session.
+
+    Since the queries contain passwords, the socket is only accessible
+    by the user that started the server.
+    """
+
+    daemon_threads = True
+
+
+    def __init__(self, socket_path, cache=None, recorder=None,
+                 idle_timeout=IDLE_TIMEOUT):
+        """Arguments:
+        socket_path  -- the path of the socket to listen on
+        cache        -- the ResponseCache shared by the sessions
+                        (optional)
+        recorder     -- the metrics.Recorder of the phases of the
+                        queries (default: a new Recorder)
+        idle_timeout -- the time in seconds after which a session that
+                        was not used is closed (default: IDLE_TIMEOUT)
+        """
+
+        if os.path.exists(socket_path):
+            os.remove(socket_path)
+
+        self.cache = cache
+        self.recorder = recorder if recorder is not None else Recorder()
+        self.idle_timeout = idle_timeout
+        self._accounts = {}
+        self._accounts_lock = threading.Lock()
+        self._closed = threading.Event()
+
+        old_umask = os.umask(0o177)
+        try:
+            SocketServer.UnixStreamServer.__init__(self, socket_path,
+                                                   QueryRequestHandler)
+        finally:
+            os.umask(old_umask)
+
+
+    def answer(self, data, username, password):
+        """Retrieve the specified data for the specified account
+        using its open session, if there is one.
+
+        Arguments:
+        data     -- the data to retrieve
+        username -- the username to use to log in
+        password -- the password to use to log in
+
+        Return:
+        The retrieved data
+        """
+
+        if data not in DATA:
+            raise ValueError("'{}' is not a valid data".format(data))
+
+        while True:
+            account, known = self._get_account(username, password)
+            try:
+                with account.lock:
+                    if account.expired:
+                        continue
+                    account.last_used = time.time()
+                    return account.query(DATA[data])
+            finally:
+                if not known:
+                    self._adopt(account)
+
+
+    def _get_account(self, username, password):
+        # Return the account associated with the username and True. If
+        # the password is not the same as the one of the known account,
+        # return a new account that is not known yet and False.
+
+        with self._accounts_lock:
+            account = self._accounts.get(username)
+            if account is not None and account.password == password:
+                return account, True
+
+        return _Account(username, password, self.cache, self.recorder), False
+
+
+    def _adopt(self, account):
+        # Make the new account the one of its username if it logged in,
+        # and close the session of the account that it replace
+
+        if account.deq is None:
+            return
+
+        with self._accounts_lock:
+            old_account = self._accounts.get(account.username)
+            self._accounts[account.username] = account
+
+        if old_account is not None:
+            self._expire(old_account)
+
+
+    def _expire(self, account):
+        with account.lock:
+            account.expired = True
+            account.close()
+
+
+    def metrics(self, output_format):
+        """Return the metrics of the queries in the output format, one
+        of metrics.FORMATS. The JSON metrics are returned as a dict, so
+        that they are not encoded twice in the answer.
+        """
+
+        if output_format == JSON:
+            return self.recorder.as_dict()
+        return self.recorder.export(output_format)
+
+
+    def expire_idle(self, now=None):
+        """Close the sessions that were not used for idle_timeout
+        seconds.
+
+        Arguments:
+        now -- the current time (default: time.time())
+
+        Return:
+        The number of sessions closed
+        """
+
+        if now is None:
+            now = time.time()
+
+        expired = []
+        with self._accounts_lock:
+            for username, account in self._accounts.items():
+                # The accounts in use are not idle
+                if (now - account.last_used >= self.idle_timeout
+                        and not account.lock.locked()):
+                    del self._accounts[username]
+                    expired.append(account)
+
+        for account in expired:
+            self._expire(account)
+
+        return len(expired)
+
+
+    def _expire_idle_forever(self):
+        while not self._closed.wait(EXPIRE_INTERVAL):
+            self.expire_idle()
+
+
+    def serve_forever(self, poll_interval=0.5):
+        """Handle the queries until shutdown is called, and close the
+        sessions that become idle in the meantime.
+        """
+
+        thread = threading.Thread(target=self._expire_idle_forever)
+        thread.daemon = True
+        thread.start()
+
+        SocketServer.UnixStreamServer.serve_forever(self, poll_interval)
+
+
+    def server_close(self):
+        """Disconnect all the sessions and remove the socket."""
+
+        SocketServer.UnixStreamServer.server_close(self)
+        self._closed.set()
+
+        with self._accounts_lock:
+            accounts = self._accounts.values()
+            self._accounts.clear()
+
+        for account in accounts:
+            self._expire(account)
+
+        if os.path.exists(self.server_address):
+            os.remove(self.server_address)
@@ -0,0 +1,169 @@
+# -*- coding: utf-8 -*-
+
+"""
+responsecache
+-------------
+
+This module provides the ResponseCache class, an in-process cache of
+the web pages retrieved from the Derytelecom Extranet.
+
+Copyright(c) 2016 Rémi Tétreault <tetreault.remi@gmail.com>
+MIT Licensed, see LICENSE for more details.
+"""
+
+
+import time
+import threading
+from collections import OrderedDict
+
+
+
+########################################################################
+# Constants
+########################################################################
+# Time to live of the pages in seconds, by value of the content URL
+# parameter. The pages that are not listed use DEFAULT_TTL.
+TTLS = {
+    "internet"    : 5 * 60,
+    "telephonie"  : 60 * 60,
+    "television"  : 6 * 60 * 60,
+    "profil"      : 6 * 60 * 60,
+    "facturation" : 6 * 60 * 60
+}
+
+DEFAULT_TTL = 5 * 60
+
+# Once its time to live is over, a page is still served for this
+# fraction of its time to live while it is retrieved again
+STALE_RATIO = 0.5
+
+MAX_SIZE = 256
+
+
+# The states of a page in the cache
+FRESH = "fresh"
+STALE = "stale"
+
+
+
+########################################################################
+# Classes
+########################################################################
+class ResponseCache(object):
+    """This class is a size-bounded cache of web pages with a time to
+    live that depend on the page. When it is full, the least recently
+    used page is evicted.
+
+    When the time to live of a page is over, the page is stale. It is
+    still served for a while, but it must be retrieved again.
+
+    Attributes:
+        hits       -- the number of fresh pages served
+        stale_hits -- the number of stale pages served
+        misses     -- the number of pages that were not in the cache
+        evictions  -- the number of pages evicted because the cache
+                      was full
+    """
+
+    def __init__(self, ttls=TTLS, default_ttl=DEFAULT_TTL,
+                 stale_ratio=STALE_RATIO, max_size=MAX_SIZE):
+        """Arguments:
+        ttls        -- the time to live of the pages in seconds, by
+                       value of the content URL parameter
+                       (default: TTLS)
+        default_ttl -- the time to live of the pages that are not in
+                       ttls (default: DEFAULT_TTL)
+        stale_ratio -- the fraction of its time to live during which
+                       a stale page is still served
+                       (default: STALE_RATIO)
+        max_size    -- the maximum number of pages in the cache
+                       (default: MAX_SIZE)
+        """
+
+        self.ttls = ttls
+        self.default_ttl = default_ttl
+        self.stale_ratio = stale_ratio
+        self.max_size = max_size
+
+        self.hits = 0
+        self.stale_hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+        self._pages = OrderedDict()
+        self._lock = threading.Lock()
+
+
+    @staticmethod
+    def key(username, params):
+        """Return the key of the page associated with the URL
+        parameters for the username.
+        """
+
+        return (username, params.get("content"), params.get("sub"),
+                params.get("lang"))
+
+
+    def ttl(self, key):
+        """Return the time to live of the page of the key."""
+
+        return self.ttls.get(key[1], self.default_ttl)
+
+
+    def get(self, key):
+        """Return a tuple (page, state, stored_at) where state is
+        FRESH or STALE and stored_at is when the page was added to the
+        cache, or None if the page is not in the cache or is too old to
+        be served.
+        """
+
+        with self._lock:
+            entry = self._pages.pop(key, None)
+            if entry is None:
+                self.misses += 1
+                return None
+
+            page, stored_at = entry
+            age = time.time() - stored_at
+            ttl = self.ttl(key)
+
+            if age > ttl * (1 + self.stale_ratio):
+                self.misses += 1
+                return None
+
+            # Put the page back as the most recently used
+            self._pages[key] = entry
+
+            if age > ttl:
+                self.stale_hits += 1
+                return page, STALE, stored_at
+            else:
+                self.hits += 1
+                return page, FRESH, stored_at
+
+
+    def put(self, key, page):
+        """Add the page to the cache."""
+
+        with self._lock:
+            self._pages.pop(key, None)
+            self._pages[key] = (page, time.time())
+
+            while len(self._pages) > self.max_size:
+                self._pages.popitem(last=False)
+                self.evictions += 1
+
+
+    def clear(self):
+        """Remove all the pages from the cache."""
+
+        with self._lock:
+            self._pages.clear()
+
+
+    def stats(self):
+        """Return the counters of the cache in a dict."""
+
+        return {"size" : len(self._pages), "hits" : self.hits,
+                "stale_hits" : self.stale_hits, "misses" : self.misses,
+                "evictions" : self.evictions}
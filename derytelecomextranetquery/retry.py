@@ -0,0 +1,305 @@
+# -*- coding: utf-8 -*-
+
+"""
+retry
+-----
+
+This module provides the RetryPolicy class, that bound the time spent
+on the requests made to the Derytelecom Extranet and retry those that
+fail for a transient reason, and the CircuitBreaker class, that stop
+the requests for a while when the Extranet seem to be down.
+
+Copyright(c) 2016 Rémi Tétreault <tetreault.remi@gmail.com>
+MIT Licensed, see LICENSE for more details.
+"""
+
+
+import os
+import json
+import time
+import random
+import threading
+
+from sessionstore import write_private_file
+
+
+
+########################################################################
+# Constants
+########################################################################
+# The maximum time in seconds to wait for a response
+TIMEOUT = 10
+
+# The maximum time in seconds spent on an operation (connect,
+# get_content or disconnect), retries included
+BUDGET = 30
+
+# The number of times a request that failed for a transient reason is
+# made again
+RETRIES = 2
+
+# The delay before the first retry in seconds, it is doubled at each
+# retry up to MAX_BACKOFF. The actual delay is a random fraction of it.
+BACKOFF = 0.5
+MAX_BACKOFF = 5
+
+# The number of consecutive failed requests after which the circuit is
+# opened, and the time in seconds during which it stay open
+FAILURE_THRESHOLD = 3
+RESET_TIMEOUT = 60
+
+
+
+########################################################################
+# Helper functions
+########################################################################
+def is_transient(response):
+    """Return True if the status code of the response indicate a
+    failure that may not happen again (5xx).
+    """
+
+    return response.status_code >= 500
+
+
+
+########################################################################
+# Classes
+########################################################################
+class CircuitBreaker(object):
+    """This class count the consecutive failed requests. Once there
+    are too many, the circuit is open and no request should be made
+    until the reset timeout is over. Then the circuit is half-open:
+    a single request is allowed, the probe, and the others are not
+    until its outcome is recorded. If it succeed the circuit is
+    closed, otherwise it is open again. A probe whose outcome is never
+    recorded is given up after the reset timeout, and another request
+    is allowed.
+
+    The state can be kept in a file, so that it is shared by the
+    processes that query the Extranet one after the other, the probe
+    included.
+    """
+
+    def __init__(self, failure_threshold=FAILURE_THRESHOLD,
+                 reset_timeout=RESET_TIMEOUT, state_path=None):
+        """Arguments:
+        failure_threshold -- the number of consecutive failed requests
+                             that open the circuit
+                             (default: FAILURE_THRESHOLD)
+        reset_timeout     -- the time in seconds during which the
+                             circuit stay open (default: RESET_TIMEOUT)
+        state_path        -- the path of the file where the state is
+                             kept (optional)
+        """
+
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state_path = state_path
+
+        self.failures = 0
+        self.opened_at = None
+        self.probing_at = None
+        self._lock = threading.Lock()
+
+
+    def _load(self):
+        if self.state_path is None:
+            return
+
+        try:
+            with open(self.state_path, "rb") as f:
+                state = json.loads(f.read().decode("utf-8"))
+            self.failures = state["failures"]
+            self.opened_at = state["opened_at"]
+            self.probing_at = state.get("probing_at")
+        except (IOError, OSError, ValueError, KeyError):
+            self.failures = 0
+            self.opened_at = None
+            self.probing_at = None
+
+
+    def _save(self):
+        if self.state_path is None:
+            return
+
+        directory = os.path.dirname(self.state_path)
+        try:
+            if directory and not os.path.isdir(directory):
+                os.makedirs(directory, 0o700)
+            write_private_file(self.state_path, json.dumps(
+                {"failures" : self.failures,
+                 "opened_at" : self.opened_at,
+                 "probing_at" : self.probing_at}).encode("utf-8"))
+        except (IOError, OSError):
+            # The state is still kept in memory
+            pass
+
+
+    def _retry_after(self, now):
+        # Must be called with the lock acquired and the state loaded
+        if self.opened_at is None:
+            return 0
+        if self.probing_at is not None:
+            return max(self.probing_at + self.reset_timeout - now, 0)
+        return max(self.opened_at + self.reset_timeout - now, 0)
+
+
+    def retry_after(self):
+        """Return the number of seconds before the circuit let a
+        request through, 0 if it is not open.
+        """
+
+        with self._lock:
+            self._load()
+            return self._retry_after(time.time())
+
+
+    def allow(self):
+        """Return True if a request can be made. When the circuit is
+        half-open, only the first caller is allowed, its request is the
+        probe and record_success or record_failure must be called with
+        its outcome.
+        """
+
+        with self._lock:
+            self._load()
+            if self.opened_at is None:
+                return True
+
+            now = time.time()
+            if self._retry_after(now) > 0:
+                return False
+
+            self.probing_at = now
+            self._save()
+            return True
+
+
+    def record_success(self):
+        with self._lock:
+            if (self.failures or self.opened_at is not None
+                    or self.probing_at is not None):
+                self.failures = 0
+                self.opened_at = None
+                self.probing_at = None
+                self._save()
+
+
+    def record_failure(self):
+        with self._lock:
+            self._load()
+            self.failures += 1
+            if (self.failures >= self.failure_threshold
+                    or self.probing_at is not None):
+                self.opened_at = time.time()
+            self.probing_at = None
+            self._save()
+
+
+
+class RetryPolicy(object):
+    """This class make the requests with a timeout, within the time
+    budget of an operation, and retry those that fail for a transient
+    reason (an exception of requests or a 5xx status code) with an
+    exponential backoff and jitter.
+    """
+
+    def __init__(self, timeout=TIMEOUT, budget=BUDGET, retries=RETRIES,
+                 backoff=BACKOFF, max_backoff=MAX_BACKOFF, breaker=None,
+                 sleep=time.sleep, random=random.random):
+        """Arguments:
+        timeout     -- the maximum time in seconds to wait for a
+                       response, None to wait forever
+                       (default: TIMEOUT)
+        budget      -- the maximum time in seconds spent on an
+                       operation, None for no limit (default: BUDGET)
+        retries     -- the number of times a request is made again
+                       (default: RETRIES)
+        backoff     -- the delay before the first retry in seconds
+                       (default: BACKOFF)
+        max_backoff -- the maximum delay between two retries in
+                       seconds (default: MAX_BACKOFF)
+        breaker     -- the CircuitBreaker that record the outcome of
+                       the requests (optional)
+        sleep       -- the function used to wait (default: time.sleep)
+        random      -- the function that return a random number
+                       between 0 and 1 (default: random.random)
+        """
+
+        self.timeout = timeout
+        self.budget = budget
+        self.retries = retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.breaker = breaker
+        self.sleep = sleep
+        self.random = random
+
+
+    def deadline(self):
+        """Return the time at which an operation that start now must
+        be done, or None if there is no time budget.
+        """
+
+        if self.budget is None:
+            return None
+        return time.time() + self.budget
+
+
+    def request(self, session, method, url, deadline=None, **kwargs):
+        """Make a request with the session, retrying it if it fail for
+        a transient reason.
+
+        Arguments:
+        session  -- the requests.Session to use
+        method   -- the HTTP method
+        url      -- the URL of the request
+        deadline -- the time at which the operation must be done
+                    (optional)
+        kwargs   -- the other arguments of requests.Session.request
+
+        Return:
+        The response. When all the attempts fail, the last response
+        with a 5xx status code is returned or the last exception is
+        raised.
+        """
+
+        import requests
+
+        attempt = 0
+
+        while True:
+            timeout = self.timeout
+            if deadline is not None:
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    raise requests.Timeout("The time budget of the "
+                                           "operation is exhausted")
+                timeout = min(timeout, remaining) if timeout else remaining
+
+            response = error = None
+            try:
+                response = session.request(method, url, timeout=timeout,
+                                           **kwargs)
+            except requests.RequestException as e:
+                error = e
+
+            if error is None and not is_transient(response):
+                if self.breaker is not None:
+                    self.breaker.record_success()
+                return response
+
+            delay = self.random() * min(self.max_backoff,
+                                        self.backoff * 2 ** attempt)
+
+            if (attempt >= self.retries
+                    or (deadline is not None
+                        and time.time() + delay >= deadline)):
+                if self.breaker is not None:
+                    self.breaker.record_failure()
+                if error is not None:
+                    raise error
+                return response
+
+            attempt += 1
+            self.sleep(delay)
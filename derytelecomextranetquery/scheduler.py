@@ -0,0 +1,452 @@
+# -*- coding: utf-8 -*-
+
+"""
+scheduler
+---------
+
+This module provides the Scheduler class, that polls the data of many
+accounts forever without bursting the Derytelecom Extranet. The polls
+of each account are spread over its interval, the requests made by all
+the accounts are limited by a token bucket and the number of sessions
+open at the same time is bounded. When polls are waiting for a token
+or for a session, those of the accounts that are the closest to their
+cap are made first.
+
+Copyright(c) 2016 Rémi Tétreault <tetreault.remi@gmail.com>
+MIT Licensed, see LICENSE for more details.
+"""
+
+
+import sys
+import time
+import heapq
+import threading
+import Queue
+
+from derytelecomextranetquery import (DerytelecomExtranetQuery,
+                                      BadUsernamePasswordError,
+                                      MAX_WORKERS)
+
+
+
+########################################################################
+# Constants
+########################################################################
+# The maximum number of requests per second made to the Extranet
+DEFAULT_RATE = 2.0
+
+# The number of requests made by a poll: the login page, the login form
+# and the home page to which it redirect, the page of the data and the
+# logout, or only the page of the data when the session is reused from
+# a session store
+REQUESTS_PER_POLL = 5
+REQUESTS_PER_STORED_POLL = 1
+
+# The requests of a login that a poll was not expected to make, when
+# its stored session is rejected and it log in again
+LOGIN_REQUESTS = REQUESTS_PER_POLL - REQUESTS_PER_STORED_POLL
+
+# The maximum time in seconds to wait without checking the schedule, so
+# that an interruption is handled promptly
+MAX_WAIT = 1.0
+
+
+
+########################################################################
+# Classes
+########################################################################
+class TokenBucket(object):
+    """This class limit a rate of requests. The bucket is refilled at
+    rate tokens per second up to its capacity, and a request can only
+    be made once it took a token.
+    """
+
+    def __init__(self, rate, capacity, clock=time.time):
+        """Arguments:
+        rate     -- the number of tokens added per second
+        capacity -- the maximum number of tokens, that is the size of
+                    the largest burst
+        clock    -- the function that return the current time in
+                    seconds (default: time.time)
+        """
+
+        self.rate = float(rate)
+        self.capacity = float(capacity)
+        self.clock = clock
+
+        self._tokens = self.capacity
+        self._updated_at = clock()
+
+
+    def _refill(self):
+        now = self.clock()
+        self._tokens = min(self.capacity,
+                           self._tokens
+                           + (now - self._updated_at) * self.rate)
+        self._updated_at = now
+
+
+    @property
+    def tokens(self):
+        """The number of tokens in the bucket."""
+
+        self._refill()
+        return self._tokens
+
+
+    def take(self, tokens=1):
+        """Take tokens from the bucket.
+
+        Return:
+        True if they were taken, False if there is not enough tokens
+        """
+
+        self._refill()
+        if self._tokens < tokens:
+            return False
+        self._tokens -= tokens
+        return True
+
+
+    def charge(self, tokens):
+        """Take tokens from the bucket for requests that were already
+        made, even if there is not enough. The missing tokens are owed
+        and the next requests wait for them.
+        """
+
+        self._refill()
+        self._tokens -= tokens
+
+
+    def delay(self, tokens=1):
+        """Return the time in seconds until the bucket hold the number
+        of tokens.
+        """
+
+        self._refill()
+        return max(0.0, (tokens - self._tokens) / self.rate)
+
+
+
+class _Account(object):
+    # The schedule of the polls of one account
+
+    __slots__ = ("username", "password", "interval", "available",
+                 "dispatched_at", "logins")
+
+    def __init__(self, username, password, interval):
+        self.username = username
+        self.password = password
+        self.interval = interval
+        self.available = None
+        self.dispatched_at = None
+        self.logins = 0
+
+
+
+class Scheduler(object):
+    """This class poll many accounts forever. Each account has its own
+    AdaptiveInterval, the first polls are spread evenly over the
+    minimum interval, or over the time that the rate allow to poll all
+    the accounts if it is longer.
+
+    A poll is due at the time given by the interval of its account,
+    it is started once a session is free and the token bucket hold the
+    tokens of its requests. The due polls wait in a queue ordered by
+    the time at which they were due, but the polls of the accounts
+    under the threshold of their interval are moved ahead, by up to
+    the maximum interval for an account at its cap. So when the
+    Extranet can not be polled as often as wanted, the accounts that
+    are the closest to their cap are not the ones that fall behind,
+    and the others still get polled.
+
+    Attributes:
+        polls     -- the number of polls made
+        failures  -- the number of polls that failed
+        in_flight -- the number of polls in progress
+        lag       -- the delay in seconds between the time at which
+                     the last poll started was due and its start
+        max_lag   -- the largest lag
+    """
+
+    def __init__(self, accounts, get_data, get_record, make_interval,
+                 rate=DEFAULT_RATE, burst=None, max_in_flight=MAX_WORKERS,
+                 requests_per_poll=None, session_store=None, policy=None,
+                 recorder=None, corpus=None, transport=None,
+                 clock=time.time):
+        """Arguments:
+        accounts          -- an iterable of (username, password) tuples
+        get_data          -- a function that take a connected instance
+                             of DerytelecomExtranetQuery and return the
+                             result
+        get_record        -- a function that take a result and return
+                             its UsageRecord
+        make_interval     -- a function that return a new
+                             watch.AdaptiveInterval, one is made for
+                             each account
+        rate              -- the maximum number of requests per second
+                             (default: DEFAULT_RATE)
+        burst             -- the maximum number of requests made at
+                             once after the polls were idle
+                             (default: the requests of a poll)
+        max_in_flight     -- the maximum number of sessions open at the
+                             same time (default: MAX_WORKERS)
+        requests_per_poll -- the number of requests of a poll
+                             (default: REQUESTS_PER_POLL, or
+                             REQUESTS_PER_STORED_POLL with a session
+                             store, and then the polls that log in
+                             again are charged LOGIN_REQUESTS more)
+        session_store     -- a SessionStore to reuse the sessions of the
+                             accounts between their polls (optional)
+        policy            -- the RetryPolicy of the requests (optional)
+        recorder          -- the metrics.Recorder of the phases and of
+                             the gauges of the scheduler (optional)
+        corpus            -- the corpus.PageCorpus in which the
+                             retrieved web pages are recorded (optional)
+        transport         -- the transport.Transport of the sessions
+                             (default: the default Transport)
+        clock             -- the function that return the current time
+                             in seconds (default: time.time)
+        """
+
+        if requests_per_poll is None:
+            requests_per_poll = (REQUESTS_PER_POLL if session_store is None
+                                 else REQUESTS_PER_STORED_POLL)
+        if max_in_flight < 1:
+            raise ValueError("max_in_flight must be at least 1")
+
+        self.get_data = get_data
+        self.get_record = get_record
+        self.max_in_flight = max_in_flight
+        self.requests_per_poll = requests_per_poll
+        # The polls are expected to log in once, unless their session
+        # is reused from the session store
+        self.expected_logins = 1 if session_store is None else 0
+        self.session_store = session_store
+        self.policy = policy
+        self.recorder = recorder
+        self.corpus = corpus
+        self.transport = transport
+        self.clock = clock
+
+        # A poll must be able to take its tokens at once
+        self.bucket = TokenBucket(rate, max(burst or 0, requests_per_poll),
+                                  clock)
+
+        self.polls = 0
+        self.failures = 0
+        self.in_flight = 0
+        self.lag = 0.0
+        self.max_lag = 0.0
+
+        # The accounts whose poll is not due yet, by due time, and the
+        # accounts whose poll is due, by priority. The sequence number
+        # break the ties.
+        self._waiting = []
+        self._due = []
+        self._sequence = 0
+
+        accounts = [_Account(username, password, make_interval())
+                    for username, password in accounts]
+        if accounts:
+            spread = max(float(accounts[0].interval.min_interval),
+                         len(accounts) * requests_per_poll / float(rate))
+            start = clock()
+            for i, account in enumerate(accounts):
+                self._schedule(account, start + spread * i / len(accounts))
+
+
+    def _schedule(self, account, due):
+        self._sequence += 1
+        heapq.heappush(self._waiting, (due, self._sequence, account))
+
+
+    @property
+    def accounts(self):
+        """The number of accounts polled, those whose username or
+        password were rejected are no longer polled.
+        """
+
+        return len(self._waiting) + len(self._due) + self.in_flight
+
+
+    @property
+    def queue_depth(self):
+        """The number of polls that are due but not started."""
+
+        return len(self._due)
+
+
+    def stats(self):
+        """Return the counters and the gauges of the scheduler in a
+        dict.
+        """
+
+        return {"accounts" : self.accounts,
+                "queue_depth" : self.queue_depth,
+                "in_flight" : self.in_flight,
+                "polls" : self.polls,
+                "failures" : self.failures,
+                "lag_seconds" : self.lag,
+                "max_lag_seconds" : self.max_lag}
+
+
+    def _update_gauges(self):
+        if self.recorder is None:
+            return
+
+        self.recorder.set_gauge("scheduler_queue_depth", self.queue_depth,
+                                "The number of polls that are due but not "
+                                "started.")
+        self.recorder.set_gauge("scheduler_in_flight", self.in_flight,
+                                "The number of polls in progress.")
+        self.recorder.set_gauge("scheduler_lag_seconds", self.lag,
+                                "The delay between the time at which the "
+                                "last poll started was due and its start.")
+
+
+    def _priority(self, account, due):
+        # Return the key by which the due poll is started, the time at
+        # which it was due moved ahead by the closeness of the account
+        # to its cap. The accounts whose usage is unknown are as close
+        # as can be.
+        interval = account.interval
+
+        if account.available is None or account.available <= 0:
+            closeness = 1.0
+        elif account.available >= interval.threshold:
+            closeness = 0.0
+        else:
+            closeness = 1 - account.available / float(interval.threshold)
+
+        return due - closeness * interval.max_interval
+
+
+    def _poll(self, account):
+        # A connection that fail tried to log in
+        account.logins = 1
+        with DerytelecomExtranetQuery.connect(
+                account.username, account.password, self.session_store,
+                policy=self.policy, recorder=self.recorder,
+                corpus=self.corpus, transport=self.transport) as deq:
+            try:
+                return self.get_data(deq)
+            finally:
+                account.logins = deq.logins
+
+
+    def _dispatch(self, jobs):
+        # Start the due polls for which there is a session and tokens
+        now = self.clock()
+
+        while self._waiting and self._waiting[0][0] <= now:
+            due, sequence, account = heapq.heappop(self._waiting)
+            heapq.heappush(self._due, (self._priority(account, due), due,
+                                       sequence, account))
+
+        while (self._due and self.in_flight < self.max_in_flight
+               and self.bucket.take(self.requests_per_poll)):
+            _, due, _, account = heapq.heappop(self._due)
+
+            self.lag = max(0.0, now - due)
+            self.max_lag = max(self.max_lag, self.lag)
+            if self.recorder is not None:
+                self.recorder.record("schedule.lag", self.lag)
+
+            account.dispatched_at = now
+            self.in_flight += 1
+            jobs.put(account)
+
+
+    def _wait_time(self):
+        # Return the time to wait for a poll to finish before the
+        # schedule must be checked again
+        now = self.clock()
+        wait = MAX_WAIT
+
+        if self._waiting:
+            wait = min(wait, self._waiting[0][0] - now)
+        if self._due and self.in_flight < self.max_in_flight:
+            wait = min(wait, self.bucket.delay(self.requests_per_poll))
+
+        return max(0.0, wait)
+
+
+    def _complete(self, account, result, exception):
+        # Schedule the next poll of the account, unless its username
+        # or password were rejected
+        self.in_flight -= 1
+        self.polls += 1
+
+        # The logins that were not expected were not paid for
+        self.bucket.charge(max(0, account.logins - self.expected_logins)
+                           * LOGIN_REQUESTS)
+
+        if exception is not None:
+            self.failures += 1
+            if isinstance(exception, BadUsernamePasswordError):
+                return
+            record = None
+        else:
+            record = self.get_record(result)
+            if record.available is not None:
+                account.available = record.available
+
+        self._schedule(account,
+                       account.dispatched_at + account.interval.next(record))
+
+
+    def run(self):
+        """Poll the accounts until there is none left to poll, or until
+        the generator is closed. The errors are yielded in place of the
+        result and the polls of the account continue, except when its
+        username or password are rejected.
+
+        Return:
+        A generator of tuples (username, result, exception) where
+        either result or exception is None, in the order in which the
+        polls finish
+        """
+
+        jobs = Queue.Queue()
+        done = Queue.Queue()
+
+        def worker():
+            while True:
+                account = jobs.get()
+                if account is None:
+                    return
+
+                try:
+                    done.put((account, self._poll(account), None))
+                except Exception:
+                    done.put((account, None, sys.exc_info()[1]))
+
+        threads = [threading.Thread(target=worker)
+                   for _ in range(self.max_in_flight)]
+        for t in threads:
+            t.daemon = True
+            t.start()
+
+        try:
+            while self.accounts:
+                self._dispatch(jobs)
+                self._update_gauges()
+
+                try:
+                    account, result, exception = done.get(
+                        timeout=self._wait_time())
+                except Queue.Empty:
+                    continue
+
+                self._complete(account, result, exception)
+                self._update_gauges()
+                yield account.username, result, exception
+
+        finally:
+            # Let the polls in progress finish, so that their sessions
+            # are closed
+            for t in threads:
+                jobs.put(None)
+            for t in threads:
+                t.join()
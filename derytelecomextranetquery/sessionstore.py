@@ -0,0 +1,147 @@
+# -*- coding: utf-8 -*-
+
+"""
+sessionstore
+------------
+
+This module provides the SessionStore class, used to keep the cookies
+of a session with the Derytelecom Extranet on the disk so that the
+next connection can reuse it instead of logging in again.
+
+Copyright(c) 2016 Rémi Tétreault <tetreault.remi@gmail.com>
+MIT Licensed, see LICENSE for more details.
+"""
+
+
+import os
+import json
+import warnings
+import tempfile
+
+
+
+########################################################################
+# Constants
+########################################################################
+CACHE_DIR_NAME = "derytelecomextranetquery"
+SESSIONS_DIR_NAME = "sessions"
+
+
+
+########################################################################
+# Helper functions
+########################################################################
+def default_cache_dir():
+    """Return the cache directory of this application, as specified
+    by the XDG Base Directory Specification.
+    """
+
+    cache_home = (os.environ.get("XDG_CACHE_HOME")
+                  or os.path.join(os.path.expanduser("~"), ".cache"))
+    return os.path.join(cache_home, CACHE_DIR_NAME)
+
+
+def write_private_file(path, data):
+    """Atomically replace the content of the file at path by data.
+    The file is only readable and writable by its owner.
+
+    The data is first written to a temporary file of its own, in the
+    same directory, so that the threads and the processes that write
+    the same path at the same time do not write the same temporary
+    file: the last rename wins.
+    """
+
+    fd, tmp_path = tempfile.mkstemp(prefix=os.path.basename(path) + ".",
+                                    suffix=".tmp",
+                                    dir=os.path.dirname(path) or ".")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+        os.rename(tmp_path, path)
+    except BaseException:
+        try:
+            os.remove(tmp_path)
+        except OSError:
+            pass
+        raise
+
+
+
+########################################################################
+# Classes
+########################################################################
+class SessionStore(object):
+    """This class store the cookies of the sessions with the
+    Derytelecom Extranet, one file per username. The files are only
+    readable by their owner since they allow to access the account.
+    """
+
+    def __init__(self, directory=None):
+        """Arguments:
+        directory -- the directory in which the sessions are stored
+                     (default: the sessions directory in the XDG cache)
+        """
+
+        if directory is None:
+            directory = os.path.join(default_cache_dir(), SESSIONS_DIR_NAME)
+
+        self.directory = directory
+
+
+    def _path(self, username):
+        import urllib
+        return os.path.join(self.directory, urllib.quote(username, safe=""))
+
+
+    def load(self, username):
+        """Return the cookies stored for the username, as a list of
+        dicts with the keys name, value, domain and path, or None if
+        there is no stored session.
+        """
+
+        try:
+            with open(self._path(username), "rb") as f:
+                return json.load(f)
+        except (IOError, OSError, ValueError):
+            return None
+
+
+    def save(self, username, cookiejar):
+        """Store the cookies of the cookiejar for the username. A
+        failure to write them is only a warning, the session is still
+        valid, it will just not be reused.
+
+        Return:
+        True if the cookies were stored, False otherwise
+        """
+
+        cookies = [{"name" : c.name, "value" : c.value,
+                    "domain" : c.domain, "path" : c.path}
+                   for c in cookiejar]
+
+        try:
+            if not os.path.isdir(self.directory):
+                try:
+                    os.makedirs(self.directory, 0o700)
+                except OSError:
+                    # Another writer may have just created it
+                    if not os.path.isdir(self.directory):
+                        raise
+            write_private_file(self._path(username), json.dumps(cookies))
+
+        except (IOError, OSError) as e:
+            warnings.warn("The session of {} could not be stored: {}"
+                          .format(username, e), RuntimeWarning)
+            return False
+
+        return True
+
+
+    def delete(self, username):
+        """Remove the stored session of the username, if there is one.
+        """
+
+        try:
+            os.remove(self._path(username))
+        except OSError:
+            pass
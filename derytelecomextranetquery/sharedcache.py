@@ -0,0 +1,209 @@
+# -*- coding: utf-8 -*-
+
+"""
+sharedcache
+-----------
+
+This module provides the SharedCache class, that let the processes of
+a host that query the same account at the same time share a single
+query. The first process takes a lock and query the Derytelecom
+Extranet, the others wait for the lock and read its result instead of
+logging in themselves.
+
+The lock is an exclusive flock on a file, so it is released by the
+system if the process that hold it dies. Where fcntl is not available
+the processes do not wait for each other, but still reuse the results
+that are fresh enough.
+
+Copyright(c) 2016 Rémi Tétreault <tetreault.remi@gmail.com>
+MIT Licensed, see LICENSE for more details.
+"""
+
+
+import os
+import json
+import time
+import hashlib
+import binascii
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+from sessionstore import default_cache_dir, write_private_file
+
+
+
+########################################################################
+# Constants
+########################################################################
+RESULTS_DIR_NAME = "results"
+
+# The age in seconds under which a result is reused
+DEFAULT_MAX_AGE = 30
+
+# The maximum time in seconds to wait for the process that hold the
+# lock, after which the result is retrieved without it
+LOCK_TIMEOUT = 60
+
+# The delay in seconds between two attempts to take the lock
+POLL_INTERVAL = 0.05
+
+
+
+########################################################################
+# Helper functions
+########################################################################
+def _digest(salt, password):
+    # The results are only shared with the processes that know the
+    # password of the account
+    return hashlib.sha256(str(salt) + password).hexdigest()
+
+
+
+########################################################################
+# Classes
+########################################################################
+class SharedCache(object):
+    """This class keep the last result of each query of each account in
+    a file, readable only by its owner, and make sure that only one
+    process at a time run the query.
+
+    Attributes:
+        hits    -- the number of results reused without waiting
+        waits   -- the number of results reused after waiting for the
+                   process that retrieved them
+        fetches -- the number of results retrieved by this process
+    """
+
+    def __init__(self, max_age=DEFAULT_MAX_AGE, directory=None,
+                 lock_timeout=LOCK_TIMEOUT, sleep=time.sleep):
+        """Arguments:
+        max_age      -- the age in seconds under which a result is
+                        reused (default: DEFAULT_MAX_AGE)
+        directory    -- the directory in which the results are stored
+                        (default: the results directory in the XDG
+                        cache)
+        lock_timeout -- the maximum time in seconds to wait for the
+                        process that hold the lock
+                        (default: LOCK_TIMEOUT)
+        sleep        -- the function used to wait (default: time.sleep)
+        """
+
+        if directory is None:
+            directory = os.path.join(default_cache_dir(), RESULTS_DIR_NAME)
+
+        self.max_age = max_age
+        self.directory = directory
+        self.lock_timeout = lock_timeout
+        self.sleep = sleep
+
+        self.hits = 0
+        self.waits = 0
+        self.fetches = 0
+
+
+    def _path(self, username, name):
+        import urllib
+        return os.path.join(self.directory, "{}.{}".format(
+            urllib.quote(username, safe=""), name))
+
+
+    def _read(self, path, password):
+        # Return the result stored in the file if it is fresh and was
+        # stored with the same password, None otherwise
+        try:
+            with open(path, "rb") as f:
+                entry = json.loads(f.read().decode("utf-8"))
+            if (time.time() - entry["stored_at"] <= self.max_age
+                    and _digest(entry["salt"], password) == entry["digest"]):
+                return entry["result"]
+        except (IOError, OSError, ValueError, KeyError, TypeError):
+            pass
+        return None
+
+
+    def _write(self, path, password, result):
+        salt = binascii.hexlify(os.urandom(16))
+        try:
+            write_private_file(path, json.dumps(
+                {"stored_at" : time.time(), "salt" : salt,
+                 "digest" : _digest(salt, password),
+                 "result" : result}).encode("utf-8"))
+        except (IOError, OSError):
+            # The result is still returned, only not shared
+            pass
+
+
+    def _lock(self, path):
+        # Return the file descriptor of the lock file once the lock is
+        # taken, or None if it could not be taken in time
+        if fcntl is None:
+            return None
+
+        try:
+            fd = os.open(path + ".lock", os.O_RDWR | os.O_CREAT, 0o600)
+        except OSError:
+            return None
+
+        deadline = time.time() + self.lock_timeout
+        while True:
+            try:
+                fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                return fd
+            except (IOError, OSError):
+                if time.time() >= deadline:
+                    os.close(fd)
+                    return None
+                self.sleep(POLL_INTERVAL)
+
+
+    def get(self, username, password, name, fetch):
+        """Return the result of the query of the account, reusing the
+        one retrieved by another process if it is fresh enough.
+
+        Arguments:
+        username -- the username of the account
+        password -- the password of the account, the results are only
+                    reused by the processes that know it
+        name     -- the name of the query, like traffic
+        fetch    -- a function that retrieve the result, it must be
+                    serializable in JSON. Its exceptions are raised
+                    and nothing is stored.
+
+        Return:
+        A tuple (result, fetched) where fetched is True if the result
+        was retrieved by this process
+        """
+
+        path = self._path(username, name)
+
+        result = self._read(path, password)
+        if result is not None:
+            self.hits += 1
+            return result, False
+
+        if not os.path.isdir(self.directory):
+            try:
+                os.makedirs(self.directory, 0o700)
+            except OSError:
+                pass
+
+        fd = self._lock(path)
+        try:
+            # Another process may have stored the result while this
+            # one was waiting for the lock
+            result = self._read(path, password)
+            if result is not None:
+                self.waits += 1
+                return result, False
+
+            result = fetch()
+            self.fetches += 1
+            self._write(path, password, result)
+            return result, True
+
+        finally:
+            if fd is not None:
+                os.close(fd)
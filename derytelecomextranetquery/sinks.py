@@ -0,0 +1,562 @@
+# -*- coding: utf-8 -*-
+
+"""
+sinks
+-----
+
+This module provides the sinks, that deliver the usage samples of the
+accounts to a monitoring system: a JSON lines file, the textfile
+collector of the Prometheus node exporter, a Prometheus pushgateway,
+an InfluxDB server and a StatsD server.
+
+The samples are put in a bounded queue and delivered by batches from a
+background thread, so that the polls are not slowed down by a write
+per sample. When the queue is full, put wait for room (backpressure)
+or drop the sample.
+
+Example:
+    sink = make_sink("influxdb:http://localhost:8086/write?db=usage")
+    sink.put("user", usage_record)
+    sink.close()
+
+Copyright(c) 2016 Rémi Tétreault <tetreault.remi@gmail.com>
+MIT Licensed, see LICENSE for more details.
+"""
+
+
+import os
+import re
+import json
+import time
+import Queue
+import socket
+import threading
+
+from metrics import escape_label_value
+
+
+
+########################################################################
+# Constants
+########################################################################
+# The maximum number of samples waiting to be delivered
+QUEUE_SIZE = 1000
+
+# The maximum number of samples delivered at once
+BATCH_SIZE = 100
+
+# The maximum time in seconds a sample wait for its batch to be full
+FLUSH_INTERVAL = 1.0
+
+# The maximum time in seconds to wait for a HTTP server
+TIMEOUT = 10
+
+# The prefix of the names of the metrics
+PROMETHEUS_PREFIX = "derytelecom_usage"
+INFLUXDB_MEASUREMENT = "derytelecom_usage"
+STATSD_PREFIX = "derytelecom"
+
+PUSHGATEWAY_JOB = "derytelecomextranetquery"
+
+# The maximum size of a StatsD datagram, so that it is not fragmented
+STATSD_MAX_PACKET = 512
+
+# The amounts of data of the UsageRecords that are exported
+AMOUNTS = ("available", "used", "total")
+
+STATSD_NAME_RE = re.compile(r"[^\w-]")
+
+
+
+########################################################################
+# Helper functions
+########################################################################
+def prometheus_text(samples):
+    """Return the last sample of each account in the Prometheus text
+    exposition format.
+
+    Arguments:
+    samples -- a dict of UsageRecord by username
+    """
+
+    lines = []
+
+    for amount in AMOUNTS:
+        name = "{}_{}_bytes".format(PROMETHEUS_PREFIX, amount)
+        lines.append("# HELP {} The {} data of the account.".format(
+            name, amount))
+        lines.append("# TYPE {} gauge".format(name))
+        for username, record in sorted(samples.items()):
+            value = getattr(record, amount)
+            if value is not None:
+                lines.append('{}{{account="{}"}} {}'.format(
+                    name, escape_label_value(username), value))
+
+    name = PROMETHEUS_PREFIX + "_fetched_at_seconds"
+    lines.append("# HELP {} When the usage was retrieved.".format(name))
+    lines.append("# TYPE {} gauge".format(name))
+    for username, record in sorted(samples.items()):
+        if record.fetched_at is not None:
+            lines.append('{}{{account="{}"}} {!r}'.format(
+                name, escape_label_value(username), record.fetched_at))
+
+    return "\n".join(lines) + "\n"
+
+
+def _escape_influxdb_tag(value):
+    return re.sub(r"([,= ])", r"\\\1", value)
+
+
+def influxdb_lines(samples):
+    """Return the samples in the InfluxDB line protocol, with a
+    precision of a second.
+
+    Arguments:
+    samples -- a list of (username, UsageRecord) tuples
+    """
+
+    lines = []
+
+    for username, record in samples:
+        fields = ",".join("{}={}i".format(amount, getattr(record, amount))
+                          for amount in AMOUNTS
+                          if getattr(record, amount) is not None)
+        if not fields:
+            continue
+
+        line = "{},account={} {}".format(INFLUXDB_MEASUREMENT,
+                                         _escape_influxdb_tag(username),
+                                         fields)
+        if record.fetched_at is not None:
+            line += " {}".format(int(record.fetched_at))
+        lines.append(line)
+
+    return "\n".join(lines) + "\n" if lines else ""
+
+
+def statsd_packets(samples, prefix=STATSD_PREFIX):
+    """Return the samples as StatsD gauges, grouped in packets of at
+    most STATSD_MAX_PACKET bytes.
+
+    Arguments:
+    samples -- a list of (username, UsageRecord) tuples
+    prefix  -- the prefix of the names of the gauges
+               (default: STATSD_PREFIX)
+    """
+
+    packets = []
+    packet = ""
+
+    for username, record in samples:
+        account = STATSD_NAME_RE.sub("_", username)
+        for amount in AMOUNTS:
+            value = getattr(record, amount)
+            if value is None:
+                continue
+
+            line = "{}.{}.{}:{}|g".format(prefix, account, amount, value)
+            if packet and len(packet) + 1 + len(line) > STATSD_MAX_PACKET:
+                packets.append(packet)
+                packet = ""
+            packet = packet + "\n" + line if packet else line
+
+    if packet:
+        packets.append(packet)
+
+    return packets
+
+
+def grouping_label(name, value):
+    """Return the label of a grouping key of the Prometheus pushgateway
+    as a part of the URL of a group. The values that can not be in a
+    path, like those with a slash, are encoded in base64.
+    """
+
+    import urllib
+
+    if value and "/" not in value:
+        return "{}/{}".format(name, urllib.quote(value, safe=""))
+
+    import base64
+    return "{}@base64/{}".format(name,
+                                 base64.urlsafe_b64encode(value) or "=")
+
+
+def make_sink(spec):
+    """Return the sink specified by a string TYPE:TARGET, where TYPE
+    is one of SINK_TYPES:
+        jsonl:PATH          -- append the samples to a JSON lines file
+        textfile:PATH       -- the files of the Prometheus textfile
+                               collector, one per account named after
+                               PATH
+        pushgateway:URL     -- the URL of a Prometheus pushgateway
+        influxdb:URL        -- the URL of the write endpoint of an
+                               InfluxDB server, with its db parameter
+        statsd:HOST:PORT    -- the address of a StatsD server
+
+    Raise ValueError if the string is not valid.
+    """
+
+    sink_type, _, target = spec.partition(":")
+    if sink_type not in SINK_TYPES or not target:
+        raise ValueError("'{}' is not a valid sink, the valid types are {}"
+                         .format(spec, ", ".join(sorted(SINK_TYPES))))
+
+    if sink_type == "statsd":
+        host, _, port = target.rpartition(":")
+        if not host or not port.isdigit():
+            raise ValueError("'{}' is not a valid StatsD address, it must "
+                             "be HOST:PORT".format(target))
+        return StatsDSink(host, int(port))
+
+    return SINK_TYPES[sink_type](target)
+
+
+
+########################################################################
+# Classes
+########################################################################
+class _Marker(object):
+    # Put in the queue to request the delivery of the samples before
+    # it, and possibly the end of the background thread
+
+    def __init__(self, close=False):
+        self.close = close
+        self.done = threading.Event()
+
+
+
+class Sink(object):
+    """Base class of the sinks. The subclasses implement send, that
+    deliver a batch of samples. It is called from a background thread,
+    one batch at a time.
+
+    Attributes:
+        sent    -- the number of samples delivered
+        dropped -- the number of samples dropped because the queue was
+                   full
+        failed  -- the number of samples whose delivery failed
+        error   -- the last exception raised by send, or None
+    """
+
+    def __init__(self, queue_size=QUEUE_SIZE, batch_size=BATCH_SIZE,
+                 flush_interval=FLUSH_INTERVAL, block=True):
+        """Arguments:
+        queue_size     -- the maximum number of samples waiting to be
+                          delivered (default: QUEUE_SIZE)
+        batch_size     -- the maximum number of samples delivered at
+                          once (default: BATCH_SIZE)
+        flush_interval -- the maximum time in seconds a sample wait
+                          for its batch to be full
+                          (default: FLUSH_INTERVAL)
+        block          -- when the queue is full, wait for room if
+                          True, drop the sample if False
+                          (default: True)
+        """
+
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.block = block
+
+        self.sent = 0
+        self.dropped = 0
+        self.failed = 0
+        self.error = None
+
+        self._queue = Queue.Queue(queue_size)
+        self._closed = False
+        self._thread = threading.Thread(target=self._run)
+        self._thread.daemon = True
+        self._thread.start()
+
+
+    def send(self, samples):
+        """Deliver the samples, a list of (username, UsageRecord)
+        tuples.
+        """
+
+        raise NotImplementedError()
+
+
+    def put(self, username, record, timeout=None):
+        """Queue the sample of the account for its delivery.
+
+        Arguments:
+        username -- the username of the account
+        record   -- the UsageRecord of the account
+        timeout  -- when the queue is full and block is True, the
+                    maximum time in seconds to wait for room, None to
+                    wait as long as needed (default: None)
+
+        Return:
+        True if the sample was queued, False if it was dropped
+        """
+
+        if self._closed:
+            raise ValueError("The sink is closed")
+
+        try:
+            self._queue.put((username, record), self.block, timeout)
+            return True
+        except Queue.Full:
+            self.dropped += 1
+            return False
+
+
+    def flush(self, timeout=None):
+        """Wait until the samples queued so far are delivered, or
+        until the timeout in seconds is over.
+
+        Return:
+        True if they were delivered
+        """
+
+        return self._mark(_Marker(), timeout)
+
+
+    def close(self, timeout=None):
+        """Deliver the samples queued so far and stop the background
+        thread.
+
+        Return:
+        True if they were delivered before the timeout in seconds
+        """
+
+        if self._closed:
+            return True
+        self._closed = True
+        return self._mark(_Marker(close=True), timeout)
+
+
+    def _mark(self, marker, timeout):
+        deadline = None if timeout is None else time.time() + timeout
+        try:
+            self._queue.put(marker, True, timeout)
+        except Queue.Full:
+            return False
+
+        if deadline is None:
+            # Event.wait without a timeout can't be interrupted in
+            # Python 2
+            while not marker.done.wait(60):
+                pass
+            return True
+
+        return marker.done.wait(max(deadline - time.time(), 0))
+
+
+    def stats(self):
+        """Return the counters of the sink in a dict."""
+
+        return {"queued" : self._queue.qsize(), "sent" : self.sent,
+                "dropped" : self.dropped, "failed" : self.failed}
+
+
+    def _run(self):
+        batch = []
+        deadline = None
+
+        while True:
+            if batch:
+                timeout = max(deadline - time.time(), 0)
+            else:
+                timeout = None
+
+            try:
+                item = self._queue.get(True, timeout)
+            except Queue.Empty:
+                item = None
+
+            if isinstance(item, tuple):
+                if not batch:
+                    deadline = time.time() + self.flush_interval
+                batch.append(item)
+                if len(batch) < self.batch_size:
+                    continue
+
+            # The batch is full, its time is over, or the samples before
+            # a marker must be delivered
+            if batch:
+                self._send_batch(batch)
+                batch = []
+
+            if isinstance(item, _Marker):
+                item.done.set()
+                if item.close:
+                    return
+
+
+    def _send_batch(self, batch):
+        try:
+            self.send(batch)
+            self.sent += len(batch)
+        except Exception as e:
+            # A sink must not stop the polls, the error is kept
+            self.failed += len(batch)
+            self.error = e
+
+
+
+class JsonLinesSink(Sink):
+    """This sink append the samples to a file, one JSON object per
+    line, like the json output format of the get sub-command.
+    """
+
+    def __init__(self, path, **kwargs):
+        self.path = path
+        Sink.__init__(self, **kwargs)
+
+
+    def send(self, samples):
+        lines = "".join(json.dumps(dict(record.as_dict(), username=username),
+                                   sort_keys=True) + "\n"
+                        for username, record in samples)
+        with open(self.path, "ab") as f:
+            f.write(lines.encode("utf-8"))
+
+
+
+class PrometheusTextfileSink(Sink):
+    """This sink keep the last sample of each account in the textfile
+    collector of the Prometheus node exporter, in a file per account
+    named after the path and the account, so that the processes that
+    deliver the samples of different accounts do not replace the
+    samples of each other. The files of the accounts of a batch are
+    replaced once per batch.
+    """
+
+    def __init__(self, path, **kwargs):
+        """Arguments:
+        path -- the path of the files, the account is inserted before
+                its extension, like usage.user.prom for usage.prom
+        """
+
+        self.path = path
+        Sink.__init__(self, **kwargs)
+
+
+    def account_path(self, username):
+        """Return the path of the file of the account."""
+
+        import urllib
+
+        root, extension = os.path.splitext(self.path)
+        return "{}.{}{}".format(root, urllib.quote(username, safe=""),
+                                extension)
+
+
+    def send(self, samples):
+        from sessionstore import write_private_file
+
+        for username, record in dict(samples).items():
+            write_private_file(
+                self.account_path(username),
+                prometheus_text({username : record}).encode("utf-8"))
+
+
+
+class HTTPSink(Sink):
+    """Base class of the sinks that deliver each batch with a HTTP
+    request, on a keep-alive connection.
+    """
+
+    def __init__(self, url, timeout=TIMEOUT, **kwargs):
+        self.url = url
+        self.timeout = timeout
+        self._session = None
+        Sink.__init__(self, **kwargs)
+
+
+    def request(self, method, url, data):
+        import requests
+
+        if self._session is None:
+            self._session = requests.Session()
+
+        response = self._session.request(method, url, data=data,
+                                         timeout=self.timeout)
+        response.raise_for_status()
+
+
+    def close(self, timeout=None):
+        done = Sink.close(self, timeout)
+        if done and self._session is not None:
+            self._session.close()
+        return done
+
+
+
+class PushgatewaySink(HTTPSink):
+    """This sink keep the last sample of each account in a Prometheus
+    pushgateway, in a group per account whose grouping key is the job
+    and the account. The processes that deliver the samples of
+    different accounts then do not replace the samples of each other.
+    """
+
+    def __init__(self, url, job=PUSHGATEWAY_JOB, **kwargs):
+        self.job = job
+        HTTPSink.__init__(self, url, **kwargs)
+
+
+    def group_url(self, username):
+        """Return the URL of the group of the account."""
+
+        return "{}/metrics/{}/{}".format(self.url.rstrip("/"),
+                                         grouping_label("job", self.job),
+                                         grouping_label("account", username))
+
+
+    def send(self, samples):
+        # PUT replace the metrics of the group of the account only
+        for username, record in dict(samples).items():
+            self.request("PUT", self.group_url(username),
+                         prometheus_text({username : record}))
+
+
+
+class InfluxDBSink(HTTPSink):
+    """This sink write the samples to an InfluxDB server, with the line
+    protocol. The URL is the one of its write endpoint, including the
+    db parameter, like http://localhost:8086/write?db=usage.
+    """
+
+    def send(self, samples):
+        url = self.url + ("&" if "?" in self.url else "?") + "precision=s"
+        data = influxdb_lines(samples)
+        if data:
+            self.request("POST", url, data)
+
+
+
+class StatsDSink(Sink):
+    """This sink send the samples as gauges to a StatsD server, in UDP
+    datagrams.
+    """
+
+    def __init__(self, host, port, prefix=STATSD_PREFIX, **kwargs):
+        self.address = (host, port)
+        self.prefix = prefix
+        self._socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        Sink.__init__(self, **kwargs)
+
+
+    def send(self, samples):
+        for packet in statsd_packets(samples, self.prefix):
+            self._socket.sendto(packet.encode("utf-8"), self.address)
+
+
+    def close(self, timeout=None):
+        done = Sink.close(self, timeout)
+        if done:
+            self._socket.close()
+        return done
+
+
+
+SINK_TYPES = {
+    "jsonl" : JsonLinesSink,
+    "textfile" : PrometheusTextfileSink,
+    "pushgateway" : PushgatewaySink,
+    "influxdb" : InfluxDBSink,
+    "statsd" : StatsDSink
+}
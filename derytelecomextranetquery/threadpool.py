@@ -0,0 +1,94 @@
+# -*- coding: utf-8 -*-
+
+"""
+threadpool
+----------
+
+This module provides a function to apply a function on many items
+using a bounded number of threads.
+
+Copyright(c) 2016 Rémi Tétreault <tetreault.remi@gmail.com>
+MIT Licensed, see LICENSE for more details.
+"""
+
+
+import sys
+import threading
+import Queue
+
+
+
+# The delay in seconds between two checks for a result. On Python 2 a
+# wait on a queue without timeout can not be interrupted by Ctrl-C.
+POLL_INTERVAL = 0.1
+
+
+
+def imap_unordered(function, items, max_workers):
+    """Apply the function on each item using at most max_workers
+    threads and yield the results as soon as they are available, in
+    the order in which they finish.
+
+    An exception raised by the function does not stop the other
+    items from being processed, it is yielded in place of the result.
+
+    Arguments:
+    function    -- the function to apply, it take an item as argument
+    items       -- the items on which to apply the function
+    max_workers -- the maximum number of threads to use
+
+    Return:
+    A generator of tuples (item, result, exception) where either
+    result or exception is None
+    """
+
+    # The arguments are checked when called, not when the generator
+    # is first iterated
+    if max_workers < 1:
+        raise ValueError("max_workers must be at least 1")
+
+    return _imap_unordered(function, list(items), max_workers)
+
+
+def _imap_unordered(function, items, max_workers):
+    pending = Queue.Queue()
+    done = Queue.Queue()
+
+    for item in items:
+        pending.put(item)
+
+    def worker():
+        while True:
+            try:
+                item = pending.get_nowait()
+            except Queue.Empty:
+                return
+
+            try:
+                done.put((item, function(item), None))
+            except Exception:
+                done.put((item, None, sys.exc_info()[1]))
+
+    threads = [threading.Thread(target=worker)
+               for _ in range(min(max_workers, len(items)))]
+    for t in threads:
+        t.daemon = True
+        t.start()
+
+    for _ in range(len(items)):
+        yield _get(done)
+
+    # Let the threads finish before returning, so that none of them
+    # is still running when the interpreter shut down
+    for t in threads:
+        t.join()
+
+
+def _get(queue):
+    # Return the next item of the queue, waiting for it in a way that
+    # can be interrupted by a KeyboardInterrupt
+    while True:
+        try:
+            return queue.get(timeout=POLL_INTERVAL)
+        except Queue.Empty:
+            pass
@@ -0,0 +1,191 @@
+# -*- coding: utf-8 -*-
+
+"""
+transport
+---------
+
+This module provides the Transport class, the HTTP transport of the
+sessions with the Derytelecom Extranet. A Transport is a transport
+adapter of requests that is mounted on many sessions, so that they
+share its pool of keep-alive connections: the accounts queried one
+after the other, the sessions established again and the polls of a
+long-running process reuse the same connections instead of paying a
+new TCP and TLS handshake each time they log in.
+
+The Transport also negotiate the compression of the responses and
+count the connections that it opened and the bytes that it exchanged,
+to measure what a poll cost on the wire.
+
+Copyright(c) 2016 Rémi Tétreault <tetreault.remi@gmail.com>
+MIT Licensed, see LICENSE for more details.
+"""
+
+
+import threading
+
+import requests
+from requests.adapters import HTTPAdapter
+from requests.compat import urlparse
+
+from derytelecomextranetquery import BASE_URL
+
+
+
+########################################################################
+# Constants
+########################################################################
+# The maximum number of connections kept alive with the Extranet, the
+# requests made at the same time beyond it use connections that are
+# closed once done
+POOL_SIZE = 32
+
+# The encodings of the responses accepted when the compression is on
+COMPRESSED_ENCODINGS = "gzip, deflate"
+IDENTITY_ENCODING = "identity"
+
+# The length of the separator of the header lines and of the blank
+# line that end the headers
+CRLF_LENGTH = 2
+
+
+
+########################################################################
+# Helper functions
+########################################################################
+_default_transport = None
+_default_transport_lock = threading.Lock()
+
+
+def default_transport():
+    """Return the Transport shared by the sessions for which none is
+    specified, it is created the first time it is needed.
+    """
+
+    global _default_transport
+
+    with _default_transport_lock:
+        if _default_transport is None:
+            _default_transport = Transport()
+        return _default_transport
+
+
+def _headers_length(headers):
+    return sum(len(k) + len(": ") + len(v) + CRLF_LENGTH
+               for k, v in headers.items()) + CRLF_LENGTH
+
+
+
+########################################################################
+# Classes
+########################################################################
+class Transport(HTTPAdapter):
+    """A transport adapter of requests that can be mounted on many
+    sessions. Closing a session does not close its connections, they
+    are only closed by close_pools.
+
+    The bytes are counted as HTTP/1.1 messages, the body of a response
+    as it was received, before being decompressed, and the overhead of
+    TLS is not counted.
+
+    Attributes:
+        compress       -- True if the responses can be compressed
+        requests       -- the number of requests made
+        bytes_sent     -- the number of bytes of the requests
+        bytes_received -- the number of bytes of the responses
+    """
+
+    def __init__(self, pool_size=POOL_SIZE, compress=True):
+        """Arguments:
+        pool_size -- the maximum number of connections kept alive
+                     with each host (default: POOL_SIZE)
+        compress  -- accept the responses compressed with gzip or
+                     deflate (default: True)
+        """
+
+        self.compress = compress
+        self.requests = 0
+        self.bytes_sent = 0
+        self.bytes_received = 0
+        self._pools = set()
+        self._stats_lock = threading.Lock()
+
+        HTTPAdapter.__init__(self, pool_connections=1,
+                             pool_maxsize=pool_size)
+
+
+    def session(self):
+        """Return a new requests.Session whose requests to the
+        Derytelecom Extranet use this transport.
+        """
+
+        session = requests.Session()
+        session.mount(BASE_URL, self)
+        return session
+
+
+    @property
+    def connections(self):
+        """The number of connections opened, that is the number of
+        TCP handshakes, and of TLS handshakes over HTTPS.
+        """
+
+        with self._stats_lock:
+            return sum(pool.num_connections for pool in self._pools)
+
+
+    def stats(self):
+        """Return the counters of the transport in a dict."""
+
+        connections = self.connections
+        with self._stats_lock:
+            return {"connections" : connections,
+                    "requests" : self.requests,
+                    "bytes_sent" : self.bytes_sent,
+                    "bytes_received" : self.bytes_received}
+
+
+    def get_connection(self, url, proxies=None):
+        pool = HTTPAdapter.get_connection(self, url, proxies)
+        with self._stats_lock:
+            self._pools.add(pool)
+        return pool
+
+
+    def send(self, request, stream=False, **kwargs):
+        request.headers["Accept-Encoding"] = (COMPRESSED_ENCODINGS
+                                              if self.compress
+                                              else IDENTITY_ENCODING)
+
+        response = HTTPAdapter.send(self, request, stream=stream, **kwargs)
+
+        # The body is read here, instead of by the session, so that its
+        # length as received is known
+        if not stream:
+            response.content
+
+        sent = (len("{} {} HTTP/1.1".format(request.method,
+                                            request.path_url))
+                + CRLF_LENGTH + _headers_length(request.headers)
+                + len("Host: ") + len(urlparse(request.url).netloc)
+                + CRLF_LENGTH + len(request.body or ""))
+        received = (len("HTTP/1.1 {} {}".format(response.status_code,
+                                                response.reason))
+                    + CRLF_LENGTH + _headers_length(response.raw.headers)
+                    + (response.raw.tell() if not stream else 0))
+
+        with self._stats_lock:
+            self.requests += 1
+            self.bytes_sent += sent
+            self.bytes_received += received
+
+        return response
+
+
+    def close(self):
+        pass
+
+
+    def close_pools(self):
+        """Close the connections."""
+
+        HTTPAdapter.close(self)
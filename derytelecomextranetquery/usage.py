@@ -0,0 +1,156 @@
+# -*- coding: utf-8 -*-
+
+"""
+usage
+-----
+
+This module provides the UsageRecord class, a numeric record of the
+internet usage of an account, and the functions used to convert the
+strings of the Internet > Traffic page to numbers.
+
+Copyright(c) 2016 Rémi Tétreault <tetreault.remi@gmail.com>
+MIT Licensed, see LICENSE for more details.
+"""
+
+
+import re
+import datetime
+
+
+
+########################################################################
+# Constants
+########################################################################
+# The number of bytes of each unit displayed by the Extranet, in
+# english (b) and in french (o)
+UNITS = {
+    ""   : 1,
+    "k"  : 1000,
+    "m"  : 1000 ** 2,
+    "g"  : 1000 ** 3,
+    "t"  : 1000 ** 4
+}
+
+AMOUNT_RE = re.compile(r"(\d[\d\s]*(?:[.,]\d+)?)\s*([kmgt]?)[bo]\b",
+                       re.IGNORECASE)
+
+DATE_RE = re.compile(r"(\d{4})-(\d{2})-(\d{2})")
+
+DATE_FORMAT = "%Y-%m-%d"
+
+
+
+########################################################################
+# Helper functions
+########################################################################
+def parse_amount(string):
+    """Convert an amount of data like "60.3 Gb" to a number of bytes.
+
+    Return:
+    The number of bytes or None if the string is not an amount
+    """
+
+    m = AMOUNT_RE.search(string)
+    if m is None:
+        return None
+
+    number = float(re.sub(r"\s", "", m.group(1)).replace(",", "."))
+    return int(round(number * UNITS[m.group(2).lower()]))
+
+
+def format_amount(amount, unit="g"):
+    """Convert a number of bytes to an amount of data like "60.3 Gb",
+    in the specified unit (default: g).
+    """
+
+    if amount is None:
+        return ""
+
+    return "{:.1f} {}b".format(amount / float(UNITS[unit]), unit.upper())
+
+
+def parse_period(string):
+    """Return the first two dates (YYYY-MM-DD) of the string as a
+    tuple of datetime.date. The missing dates are None.
+    """
+
+    dates = [datetime.date(*map(int, m.groups()))
+             for m in DATE_RE.finditer(string)]
+    dates += [None, None]
+    return dates[0], dates[1]
+
+
+def format_date(date):
+    return date.strftime(DATE_FORMAT) if date is not None else None
+
+
+
+########################################################################
+# Classes
+########################################################################
+class UsageRecord(object):
+    """A record of the internet usage of an account at a given time.
+    The amounts of data are in bytes, those that are unknown are None.
+
+    Attributes:
+        available    -- the available data
+        used         -- the used data
+        total        -- the total data of the billing period
+        period_start -- the first day of the billing period (date)
+        period_end   -- the last day of the billing period (date)
+        fetched_at   -- when the record was retrieved (timestamp)
+    """
+
+    __slots__ = ("available", "used", "total", "period_start",
+                 "period_end", "fetched_at")
+
+    FIELDS = __slots__
+
+
+    def __init__(self, available=None, used=None, total=None,
+                 period_start=None, period_end=None, fetched_at=None):
+        # Deduce the missing amount when the two others are known
+        if total is None and available is not None and used is not None:
+            total = available + used
+        elif used is None and available is not None and total is not None:
+            used = total - available
+        elif available is None and used is not None and total is not None:
+            available = total - used
+
+        self.available = available
+        self.used = used
+        self.total = total
+        self.period_start = period_start
+        self.period_end = period_end
+        self.fetched_at = fetched_at
+
+
+    def as_dict(self):
+        """Return the record as a dict of values that can be
+        serialized, the dates are formatted as YYYY-MM-DD.
+        """
+
+        return {"available" : self.available,
+                "used" : self.used,
+                "total" : self.total,
+                "period_start" : format_date(self.period_start),
+                "period_end" : format_date(self.period_end),
+                "fetched_at" : self.fetched_at}
+
+
+    @classmethod
+    def from_dict(cls, values):
+        """Return the record of a dict made by as_dict."""
+
+        values = dict(values)
+        for k in ("period_start", "period_end"):
+            if values.get(k):
+                values[k] = datetime.datetime.strptime(values[k],
+                                                       DATE_FORMAT).date()
+
+        return cls(**dict((k, values.get(k)) for k in cls.FIELDS))
+
+
+    def __repr__(self):
+        return "UsageRecord({})".format(", ".join(
+            "{}={!r}".format(k, getattr(self, k)) for k in self.FIELDS))
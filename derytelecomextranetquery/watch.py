@@ -0,0 +1,212 @@
+# -*- coding: utf-8 -*-
+
+"""
+watch
+-----
+
+This module provides the watch function, that keeps one session with
+the Derytelecom Extranet open and polls it at an interval that adapts
+to the usage: less often when the usage is flat, more often when the
+available data approaches a threshold.
+
+Copyright(c) 2016 Rémi Tétreault <tetreault.remi@gmail.com>
+MIT Licensed, see LICENSE for more details.
+"""
+
+
+import time
+import random
+
+from derytelecomextranetquery import (DerytelecomExtranetQuery,
+                                      BadUsernamePasswordError,
+                                      UnexpectedLogOutError)
+
+
+
+########################################################################
+# Constants
+########################################################################
+MIN_INTERVAL = 60
+MAX_INTERVAL = 30 * 60
+
+# The available data under which the polls are made at MIN_INTERVAL
+DEFAULT_THRESHOLD = 10 * 1000 ** 3
+
+# The interval is multiplied by this factor after each poll where the
+# usage did not change
+BACKOFF = 2
+
+# The number of polls to make before the available data reach the
+# threshold, at the current consumption rate
+POLLS_BEFORE_THRESHOLD = 4
+
+# The intervals are randomly shortened or lengthened by this fraction,
+# so that many hosts do not poll at the same time
+JITTER = 0.1
+
+
+
+########################################################################
+# Helper functions
+########################################################################
+def watch(username, password, get_data, get_record, interval,
+          session_store=None, policy=None, recorder=None, corpus=None,
+          transport=None, sleep=time.sleep):
+    """Poll the data of an account forever, using one session. When
+    the Extranet close the session, log in again.
+
+    The errors that can be temporary are yielded in place of the
+    result and the polls continue, a bad username or password stop
+    them by raising BadUsernamePasswordError.
+
+    Arguments:
+    username      -- the username to use to log in
+    password      -- the password to use to log in
+    get_data      -- a function that take a connected instance of
+                     DerytelecomExtranetQuery and return the result
+    get_record    -- a function that take a result and return its
+                     UsageRecord
+    interval      -- the AdaptiveInterval that decide when to poll
+    session_store -- a SessionStore to reuse the session of a previous
+                     process (optional)
+    policy        -- the RetryPolicy of the requests (optional)
+    recorder      -- the metrics.Recorder of the phases (optional)
+    corpus        -- the corpus.PageCorpus in which the retrieved web
+                     pages are recorded (optional)
+    transport     -- the transport.Transport of the sessions, they
+                     reuse its connections (default: the default
+                     Transport)
+    sleep         -- the function used to wait (default: time.sleep)
+
+    Return:
+    A generator of tuples (result, exception) where either result or
+    exception is None
+    """
+
+    deq = None
+
+    try:
+        while True:
+            try:
+                if deq is None or not deq.connected:
+                    deq = DerytelecomExtranetQuery.connect(
+                        username, password, session_store, policy=policy,
+                        recorder=recorder, corpus=corpus,
+                        transport=transport)
+                try:
+                    result = get_data(deq)
+                except UnexpectedLogOutError:
+                    deq.disconnect()
+                    deq = DerytelecomExtranetQuery.connect(
+                        username, password, session_store, policy=policy,
+                        recorder=recorder, corpus=corpus,
+                        transport=transport)
+                    result = get_data(deq)
+
+            except BadUsernamePasswordError:
+                raise
+
+            except Exception as e:
+                if deq is not None:
+                    _disconnect(deq)
+                    deq = None
+                yield None, e
+                sleep(interval.next(None))
+
+            else:
+                yield result, None
+                sleep(interval.next(get_record(result)))
+
+    finally:
+        if deq is not None:
+            _disconnect(deq)
+
+
+def _disconnect(deq):
+    try:
+        deq.disconnect()
+    except Exception:
+        pass
+
+
+
+########################################################################
+# Classes
+########################################################################
+class AdaptiveInterval(object):
+    """This class compute the delay before the next poll from the
+    usage records of the previous ones.
+
+    When the usage does not change, the delay grows up to the maximum
+    interval. When the data is being consumed, the delay is such that
+    a few polls are made before the available data reach the
+    threshold. Under the threshold, the polls are made at the minimum
+    interval.
+    """
+
+    def __init__(self, min_interval=MIN_INTERVAL, max_interval=MAX_INTERVAL,
+                 threshold=DEFAULT_THRESHOLD, jitter=JITTER,
+                 random=random.random):
+        """Arguments:
+        min_interval -- the minimum delay in seconds
+                        (default: MIN_INTERVAL)
+        max_interval -- the maximum delay in seconds
+                        (default: MAX_INTERVAL)
+        threshold    -- the available data in bytes under which the
+                        polls are made at the minimum interval
+                        (default: DEFAULT_THRESHOLD)
+        jitter       -- the fraction by which the delays are randomly
+                        shortened or lengthened (default: JITTER)
+        random       -- the function that return a random number
+                        between 0 and 1 (default: random.random)
+        """
+
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.threshold = threshold
+        self.jitter = jitter
+        self.random = random
+
+        self.interval = min_interval
+        self._previous = None
+
+
+    def _clamp(self, interval):
+        return min(max(interval, self.min_interval), self.max_interval)
+
+
+    def next(self, record):
+        """Return the delay in seconds before the next poll.
+
+        Arguments:
+        record -- the UsageRecord of the last poll, or None if it
+                  failed
+        """
+
+        previous = self._previous
+
+        if record is None or record.available is None:
+            # Retry soon, without forgetting the previous record
+            self.interval = self.min_interval
+
+        elif record.available <= self.threshold:
+            self.interval = self.min_interval
+
+        elif previous is None or record.fetched_at <= previous.fetched_at:
+            self.interval = self.min_interval
+
+        else:
+            consumed = previous.available - record.available
+
+            if consumed <= 0:
+                self.interval = self._clamp(self.interval * BACKOFF)
+            else:
+                rate = consumed / (record.fetched_at - previous.fetched_at)
+                until_threshold = (record.available - self.threshold) / rate
+                self.interval = self._clamp(until_threshold
+                                            / POLLS_BEFORE_THRESHOLD)
+
+        if record is not None and record.available is not None:
+            self._previous = record
+
+        return self.interval * (1 + self.jitter * (2 * self.random() - 1))
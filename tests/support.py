@@ -0,0 +1,97 @@
+# -*- coding: utf-8 -*-
+
+"""
+support
+-------
+
+The setup shared by the tests. The modules of the application and the
+stand-in Extranet of the benchmarks are made importable, and the
+stand-in is started before the derytelecomextranetquery module read
+the URL of the Extranet, so that no test reach the real one, and the
+cache and data directories are temporary ones. Every test module
+import this module first.
+
+Copyright(c) 2016 Rémi Tétreault <tetreault.remi@gmail.com>
+MIT Licensed, see LICENSE for more details.
+"""
+
+
+import os
+import sys
+import atexit
+import shutil
+import tempfile
+import subprocess
+
+
+ROOT_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                        os.pardir)
+PACKAGE_DIR = os.path.join(ROOT_DIR, "derytelecomextranetquery")
+sys.path[:0] = [PACKAGE_DIR, os.path.join(ROOT_DIR, "benchmarks")]
+
+from stubserver import StubServer, Account, PAGE_TEMPLATE
+
+
+
+########################################################################
+# Constants
+########################################################################
+# The accounts of the stand-in, the low one has less data available
+# than the threshold under which the Available string is not displayed
+PASSWORD = "password"
+ACCOUNTS = {
+    "user" : Account(PASSWORD),
+    "low" : Account(PASSWORD, used=95.5)
+}
+
+
+
+########################################################################
+# Helper functions
+########################################################################
+def stub_page(username, params):
+    """Return the web page of the URL parameters of the account, as
+    served by the stand-in.
+    """
+
+    return PAGE_TEMPLATE.format(
+        content=server.content(ACCOUNTS[username], params))
+
+
+def run_command(*args, **kwargs):
+    """Run the command line program with the arguments, against the
+    stand-in, and return its exit code, its output and its error
+    output. The keyword arguments are passed to subprocess.Popen.
+    """
+
+    kwargs.setdefault("stdout", subprocess.PIPE)
+    process = subprocess.Popen([sys.executable, PACKAGE_DIR] + list(args),
+                               stderr=subprocess.PIPE, **kwargs)
+    output, error_output = process.communicate()
+    return process.returncode, output, error_output
+
+
+def make_temp_dir(test_case):
+    """Return a new temporary directory that is removed once the test
+    is done.
+    """
+
+    directory = tempfile.mkdtemp()
+    test_case.addCleanup(shutil.rmtree, directory)
+    return directory
+
+
+
+########################################################################
+# Setup
+########################################################################
+# The command line program keep the state of the circuit breaker in the
+# cache directory
+home_dir = tempfile.mkdtemp()
+atexit.register(shutil.rmtree, home_dir)
+os.environ["XDG_CACHE_HOME"] = os.path.join(home_dir, "cache")
+os.environ["XDG_DATA_HOME"] = os.path.join(home_dir, "data")
+
+server = StubServer(accounts=ACCOUNTS)
+os.environ["DERYTELECOM_EXTRANET_URL"] = server.start()
+atexit.register(server.stop)
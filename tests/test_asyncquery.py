@@ -0,0 +1,99 @@
+# -*- coding: utf-8 -*-
+
+"""
+test_asyncquery
+---------------
+
+Tests of the asyncquery module: the futures return the same results as
+DerytelecomExtranetQuery, and the retry policy, the recorder, the
+corpus and the transport are passed to the sessions.
+
+Copyright(c) 2016 Rémi Tétreault <tetreault.remi@gmail.com>
+MIT Licensed, see LICENSE for more details.
+"""
+
+
+import unittest
+
+import support
+
+from asyncquery import AsyncDerytelecomExtranetQuery, QueryPool, futures
+from corpus import PageCorpus
+from metrics import Recorder
+from retry import RetryPolicy
+from transport import Transport
+from derytelecomextranetquery import BadUsernamePasswordError
+
+
+
+########################################################################
+# Tests
+########################################################################
+@unittest.skipIf(futures is None, "concurrent.futures is not installed")
+class AsyncQueryTest(unittest.TestCase):
+
+    def setUp(self):
+        self.pool = QueryPool(4)
+        self.addCleanup(self.pool.shutdown)
+
+
+    def connect(self, username="user", password=support.PASSWORD,
+                **kwargs):
+        return AsyncDerytelecomExtranetQuery.connect(
+            username, password, pool=self.pool, **kwargs).result()
+
+
+    def test_many_accounts(self):
+        pending = [AsyncDerytelecomExtranetQuery.connect(
+                       username, support.PASSWORD, pool=self.pool)
+                   for username in ("user", "low", "user")]
+
+        available = []
+        for future in futures.as_completed(pending):
+            with future.result() as deq:
+                available.append(
+                    deq.get_internettraffic().result().get_available())
+
+        self.assertEqual(sorted(available), ["4.5 Gb", "60.3 Gb", "60.3 Gb"])
+
+
+    def test_bad_password(self):
+        future = AsyncDerytelecomExtranetQuery.connect("user", "wrong",
+                                                       pool=self.pool)
+
+        self.assertRaises(BadUsernamePasswordError, future.result)
+
+
+    def test_pool_transport_by_default(self):
+        before = self.pool.transport.requests
+
+        with self.connect() as deq:
+            deq.get_internettraffic().result()
+
+        self.assertGreater(self.pool.transport.requests, before)
+
+
+    def test_arguments_passed_to_session(self):
+        policy = RetryPolicy()
+        recorder = Recorder()
+        corpus = PageCorpus(support.make_temp_dir(self))
+        transport = Transport(2)
+        self.addCleanup(transport.close_pools)
+        before = self.pool.transport.requests
+
+        with self.connect(policy=policy, recorder=recorder, corpus=corpus,
+                          transport=transport) as deq:
+            self.assertIs(deq._deq._policy, policy)
+            deq.get_internettraffic().result()
+
+        self.assertEqual(
+            recorder.as_dict()["page.internet.traffic"]["count"], 1)
+        self.assertIn("internet.traffic",
+                      [name for name, _, _ in corpus.pages()])
+        self.assertGreater(transport.requests, 0)
+        self.assertEqual(self.pool.transport.requests, before)
+
+
+
+if __name__ == "__main__":
+    unittest.main()
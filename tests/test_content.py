@@ -0,0 +1,259 @@
+# -*- coding: utf-8 -*-
+
+"""
+test_content
+------------
+
+Tests of the parsers of the content module: the fast path must read
+the same values as BeautifulSoup on the pages of the stand-in and on
+the pages of a recorded corpus.
+
+Copyright(c) 2016 Rémi Tétreault <tetreault.remi@gmail.com>
+MIT Licensed, see LICENSE for more details.
+"""
+
+
+import re
+import unittest
+import warnings
+
+import support
+
+from content import (InternetTraffic, LongDistanceCalls, Invoices,
+                     FAST_PARSER, SOUP_PARSER)
+from corpus import (PageCorpus, replay_session, SCRUBBED_USERNAME,
+                    SCRUBBED_PASSWORD)
+from derytelecomextranetquery import DerytelecomExtranetQuery, PARAM
+
+
+
+########################################################################
+# Constants
+########################################################################
+# The URL parameters of the pages, by name of page
+PAGES = {
+    "internet.traffic" : dict(PARAM.CONTENT.INTERNET,
+                              **PARAM.CONTENT.SUB.INTERNET.TRAFFIC),
+    "telephonie.interurbain" : dict(
+        PARAM.CONTENT.TELEPHONIE,
+        **PARAM.CONTENT.SUB.TELEPHONIE.INTERURBAIN),
+    "facturation" : PARAM.CONTENT.FACTURATION
+}
+
+
+# The values read from each page, by name of page: its Content class
+# and the functions that read the values from a Content
+def _usage(content):
+    values = content.get_usage().as_dict()
+    del values["fetched_at"]
+    return values
+
+VALUES = {
+    "internet.traffic" : (InternetTraffic, [
+        lambda c: c.get_available(),
+        _usage,
+        lambda c: c.get_daily_traffic().as_dict()
+    ]),
+    "telephonie.interurbain" : (LongDistanceCalls, [
+        lambda c: list(c.iter_calls())
+    ]),
+    "facturation" : (Invoices, [
+        lambda c: list(c.iter_invoices())
+    ])
+}
+
+
+
+########################################################################
+# Helper functions
+########################################################################
+def parse(name, page, parser):
+    # Return the values read from the page named name with the parser,
+    # and True if BeautifulSoup was used
+    content_class, read = VALUES[name]
+
+    with warnings.catch_warnings():
+        # BeautifulSoup 3 warn that it is old when it is imported
+        warnings.simplefilter("ignore")
+        content = content_class(page, parser=parser)
+        values = [f(content) for f in read]
+
+    return values, content._soup_tree is not None
+
+
+def baseline_available(page):
+    # Return the available data as the first version of the
+    # InternetTraffic class found it, with unanchored patterns
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore")
+        from BeautifulSoup import BeautifulSoup
+        soup = BeautifulSoup(page)
+
+    def strings(elements):
+        return " ".join(s.string.strip() for s in elements)
+
+    available = soup.find(text=re.compile("Available"))
+    if available:
+        return strings(available.parent.contents[1:])
+
+    used = soup.find(text=re.compile("Used"))
+    if used:
+        return strings(used.parent.parent.findNextSibling("div")
+                       .find("span").contents[1:])
+    return ""
+
+
+
+########################################################################
+# Tests
+########################################################################
+class FastParserTest(unittest.TestCase):
+
+    def assertSameValues(self, name, page):
+        fast, fell_back = parse(name, page, FAST_PARSER)
+        soup, _ = parse(name, page, SOUP_PARSER)
+
+        self.assertFalse(fell_back, "the fast path was not used")
+        self.assertEqual(fast, soup)
+        return fast
+
+
+    def test_traffic_with_available_string(self):
+        available, usage, daily = self.assertSameValues(
+            "internet.traffic",
+            support.stub_page("user", PAGES["internet.traffic"]))
+
+        self.assertEqual(available, "60.3 Gb")
+        self.assertEqual(usage["available"], 60300000000)
+        self.assertEqual(usage["used"], 39700000000)
+        self.assertEqual(usage["total"], 100000000000)
+        self.assertEqual(usage["period_start"], "2016-05-01")
+        self.assertEqual(usage["period_end"], "2016-05-31")
+        self.assertTrue(daily["date"])
+
+
+    def test_traffic_without_available_string(self):
+        available, usage, _ = self.assertSameValues(
+            "internet.traffic",
+            support.stub_page("low", PAGES["internet.traffic"]))
+
+        self.assertEqual(available, "4.5 Gb")
+        self.assertEqual(usage["available"], 4500000000)
+        self.assertEqual(usage["period_end"], "2016-05-31")
+
+
+    def test_total_header_is_not_the_total_label(self):
+        # The Total header of the daily traffic table come before the
+        # Total label, and the used data must be deduced from the total
+        page = support.stub_page("user", PAGES["internet.traffic"])
+        used_start = page.index("<p>Used:")
+        used_end = page.index("</p>", used_start) + len("</p>")
+        page = page[:used_start] + page[used_end:]
+
+        table_start = page.index('<table class="daily">')
+        table_end = page.index("</table>") + len("</table>")
+        traffic_start = page.index('<div class="traffic">')
+        page = (page[:traffic_start] + page[table_start:table_end]
+                + page[traffic_start:table_start] + page[table_end:])
+
+        _, usage, _ = self.assertSameValues("internet.traffic", page)
+        self.assertEqual(usage["total"], 100000000000)
+        self.assertEqual(usage["used"], 39700000000)
+
+
+    def test_long_distance_calls(self):
+        calls, = self.assertSameValues(
+            "telephonie.interurbain",
+            support.stub_page("user", PAGES["telephonie.interurbain"]))
+
+        self.assertEqual(len(calls), support.ACCOUNTS["user"].calls)
+        self.assertEqual(calls[1]["duration"], 73)
+
+
+    def test_invoices(self):
+        invoices, = self.assertSameValues(
+            "facturation", support.stub_page("user", PAGES["facturation"]))
+
+        self.assertEqual(len(invoices), support.ACCOUNTS["user"].invoices)
+        self.assertEqual(invoices[0]["status"], "Unpaid")
+
+
+
+class LabelFallbackTest(unittest.TestCase):
+    """The labels that are not alone in their text are still found by
+    the patterns of the first version, which are the fallbacks.
+    """
+
+    def assertSameAsBaseline(self, page, expected):
+        for parser in (FAST_PARSER, SOUP_PARSER):
+            values, _ = parse("internet.traffic", page, parser)
+            self.assertEqual(values[0], expected, parser)
+        self.assertEqual(baseline_available(page), expected)
+
+
+    def traffic_page(self, username, label="Available: "):
+        page = support.stub_page(username, PAGES["internet.traffic"])
+        return page.replace("<p>Available: ", "<p>" + label)
+
+
+    def test_stand_in_pages(self):
+        self.assertSameAsBaseline(self.traffic_page("user"), "60.3 Gb")
+        self.assertSameAsBaseline(self.traffic_page("low"), "4.5 Gb")
+
+
+    def test_label_with_more_words(self):
+        self.assertSameAsBaseline(
+            self.traffic_page("user", "Available data: "), "60.3 Gb")
+
+
+    def test_label_with_entity(self):
+        self.assertSameAsBaseline(
+            self.traffic_page("user", "Available:&nbsp;"), "60.3 Gb")
+
+
+    def test_label_without_colon(self):
+        self.assertSameAsBaseline(
+            self.traffic_page("user", "Available "), "60.3 Gb")
+
+
+
+class CorpusTest(unittest.TestCase):
+
+    def setUp(self):
+        # Record the pages of the accounts of the stand-in
+        self.corpus = PageCorpus(support.make_temp_dir(self))
+
+        for username in sorted(support.ACCOUNTS):
+            with DerytelecomExtranetQuery.connect(
+                    username, support.PASSWORD, corpus=self.corpus) as deq:
+                deq.get_internettraffic()
+                deq.get_longdistancecalls()
+                deq.get_invoices()
+
+
+    def test_parsers_agree_on_recorded_pages(self):
+        parsed = set()
+
+        for name, path, page in self.corpus.pages():
+            if name in VALUES:
+                fast, fell_back = parse(name, page, FAST_PARSER)
+                soup, _ = parse(name, page, SOUP_PARSER)
+                self.assertFalse(fell_back, path)
+                self.assertEqual(fast, soup, path)
+                parsed.add(name)
+
+        self.assertEqual(parsed, set(VALUES))
+
+
+    def test_replayed_pages_parse_as_recorded(self):
+        with DerytelecomExtranetQuery.connect(
+                SCRUBBED_USERNAME, SCRUBBED_PASSWORD,
+                session=replay_session(self.corpus)) as deq:
+            usage = _usage(deq.get_internettraffic())
+
+        self.assertIn(usage["available"], (60300000000, 4500000000))
+
+
+
+if __name__ == "__main__":
+    unittest.main()
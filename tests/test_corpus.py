@@ -0,0 +1,101 @@
+# -*- coding: utf-8 -*-
+
+"""
+test_corpus
+-----------
+
+Tests of the scrubbing of the secrets of the pages recorded in a
+corpus: a secret is replaced where it appear as a whole token, in any
+of the forms in which a page can hold it, and the session ids of the
+URLs are always replaced.
+
+Copyright(c) 2016 Rémi Tétreault <tetreault.remi@gmail.com>
+MIT Licensed, see LICENSE for more details.
+"""
+
+
+import unittest
+
+import support
+
+from corpus import (PageCorpus, scrub, SCRUBBED_USERNAME,
+                    SCRUBBED_PASSWORD, SCRUBBED_SESSION_ID)
+
+
+
+########################################################################
+# Tests
+########################################################################
+class ScrubTest(unittest.TestCase):
+
+    def test_whole_tokens_only(self):
+        page = u'<p>Welcome user</p><label>username</label><p>user2</p>'
+
+        self.assertEqual(
+            scrub(page, {u"user" : SCRUBBED_USERNAME}),
+            u'<p>Welcome SCRUBBED_USERNAME</p><label>username</label>'
+            u'<p>user2</p>')
+
+
+    def test_underscore_separate_tokens(self):
+        page = u'<input name="abc123_login"><input value="abc123">'
+
+        self.assertEqual(
+            scrub(page, {u"abc123" : SCRUBBED_SESSION_ID}),
+            u'<input name="SCRUBBED_SESSION_ID_login">'
+            u'<input value="SCRUBBED_SESSION_ID">')
+
+
+    def test_escaped_and_quoted_forms(self):
+        page = (u'<a href="/?password=p%40ss%21&amp;x=1">p@ss!</a>'
+                u'<input value="a&amp;b"> a&b')
+
+        self.assertEqual(
+            scrub(page, {u"p@ss!" : SCRUBBED_PASSWORD,
+                         u"a&b" : SCRUBBED_USERNAME}),
+            u'<a href="/?password=SCRUBBED_PASSWORD&amp;x=1">'
+            u'SCRUBBED_PASSWORD</a><input value="SCRUBBED_USERNAME"> '
+            u'SCRUBBED_USERNAME')
+
+
+    def test_longest_secret_first(self):
+        page = u"<p>user</p><p>user-name</p>"
+
+        self.assertEqual(
+            scrub(page, {u"user" : SCRUBBED_USERNAME,
+                         u"user-name" : SCRUBBED_PASSWORD}),
+            u"<p>SCRUBBED_USERNAME</p><p>SCRUBBED_PASSWORD</p>")
+
+
+    def test_no_secret(self):
+        page = u"<p>user</p>"
+
+        self.assertIs(scrub(page, {}), page)
+        self.assertIs(scrub(page, {None : SCRUBBED_SESSION_ID}), page)
+
+
+
+
+class RecordTest(unittest.TestCase):
+
+    def test_url_session_ids_scrubbed(self):
+        # Like the links of PHP when it pass the session id in the URLs
+        corpus = PageCorpus(support.make_temp_dir(self))
+        path = corpus.record(
+            {"content" : "internet"},
+            u'<a href="index.php?content=x&amp;PHPSESSID=abc123">x</a>'
+            u'<a href="index.php?PHPSESSID=def456#top">top</a>'
+            u'<p>user</p>', {u"user" : SCRUBBED_USERNAME})
+
+        with open(path, "rb") as f:
+            self.assertEqual(
+                f.read().decode("utf-8"),
+                u'<a href="index.php?content=x&amp;PHPSESSID='
+                u'SCRUBBED_SESSION_ID">x</a>'
+                u'<a href="index.php?PHPSESSID=SCRUBBED_SESSION_ID#top">'
+                u'top</a><p>SCRUBBED_USERNAME</p>')
+
+
+
+if __name__ == "__main__":
+    unittest.main()
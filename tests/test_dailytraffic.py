@@ -0,0 +1,123 @@
+# -*- coding: utf-8 -*-
+
+"""
+test_dailytraffic
+-----------------
+
+Tests of the dailytraffic module: the columns of the daily usage are
+built from rows, concatenated, summed without the unknown amounts and
+converted to rows, CSV and NumPy arrays.
+
+Copyright(c) 2016 Rémi Tétreault <tetreault.remi@gmail.com>
+MIT Licensed, see LICENSE for more details.
+"""
+
+
+import datetime
+import unittest
+from StringIO import StringIO
+
+import support
+
+from dailytraffic import DailyTraffic
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+
+
+########################################################################
+# Constants
+########################################################################
+MAY_1 = datetime.date(2016, 5, 1)
+MAY_2 = datetime.date(2016, 5, 2)
+JUNE_1 = datetime.date(2016, 6, 1)
+
+ROWS = [(MAY_1, 1000, 200, None),
+        (MAY_2, None, 100, None),
+        (JUNE_1, 3000, 300, 3300)]
+
+
+
+########################################################################
+# Tests
+########################################################################
+class DailyTrafficTest(unittest.TestCase):
+
+    def test_from_rows(self):
+        table = DailyTraffic.from_rows(ROWS)
+
+        self.assertEqual(len(table), 3)
+        self.assertEqual(list(table.dates),
+                         [d.toordinal() for d, _, _, _ in ROWS])
+        # The total is deduced when the two others are known
+        self.assertEqual(table.total[0], 1200)
+        self.assertNotEqual(table.total[1], table.total[1])
+        self.assertNotEqual(table.download[1], table.download[1])
+
+
+    def test_columns_of_different_lengths(self):
+        self.assertRaises(ValueError, DailyTraffic, [MAY_1.toordinal()],
+                          [1], [2], [])
+
+
+    def test_rows(self):
+        table = DailyTraffic.from_rows(ROWS)
+
+        self.assertEqual(list(table.iter_rows())[:2], [
+            {"date" : "2016-05-01", "download" : 1000, "upload" : 200,
+             "total" : 1200},
+            {"date" : "2016-05-02", "download" : None, "upload" : 100,
+             "total" : None}])
+        self.assertEqual(table.as_dict(), {
+            "date" : ["2016-05-01", "2016-05-02", "2016-06-01"],
+            "download" : [1000, None, 3000],
+            "upload" : [200, 100, 300],
+            "total" : [1200, None, 3300]})
+
+
+    def test_sums_ignore_unknown_amounts(self):
+        self.assertEqual(DailyTraffic.from_rows(ROWS).sums(),
+                         {"download" : 4000, "upload" : 600,
+                          "total" : 4500})
+        self.assertEqual(DailyTraffic().sums(),
+                         {"download" : 0, "upload" : 0, "total" : 0})
+
+
+    def test_concatenate(self):
+        table = DailyTraffic.concatenate([DailyTraffic.from_rows(ROWS[:2]),
+                                          DailyTraffic(),
+                                          DailyTraffic.from_rows(ROWS[2:])])
+
+        self.assertEqual(table.as_dict(),
+                         DailyTraffic.from_rows(ROWS).as_dict())
+
+
+    def test_write_csv(self):
+        f = StringIO()
+        DailyTraffic.from_rows(ROWS[:2]).write_csv(f)
+
+        self.assertEqual(f.getvalue().splitlines(),
+                         ["date,download,upload,total",
+                          "2016-05-01,1000,200,1200",
+                          "2016-05-02,,100,"])
+
+
+    @unittest.skipIf(numpy is None, "NumPy is not installed")
+    def test_to_numpy(self):
+        columns = DailyTraffic.from_rows(ROWS).to_numpy()
+
+        self.assertEqual(columns["date"].dtype, numpy.dtype("datetime64[D]"))
+        self.assertEqual(str(columns["date"][2]), "2016-06-01")
+        self.assertEqual(columns["upload"].tolist(), [200, 100, 300])
+        self.assertEqual(numpy.nansum(columns["total"]), 4500)
+
+        empty = DailyTraffic().to_numpy()
+        self.assertEqual([len(c) for c in empty.values()], [0] * 4)
+
+
+
+if __name__ == "__main__":
+    unittest.main()
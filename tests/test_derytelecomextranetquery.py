@@ -0,0 +1,185 @@
+# -*- coding: utf-8 -*-
+
+"""
+test_derytelecomextranetquery
+-----------------------------
+
+Tests of the derytelecomextranetquery module: many web pages are
+retrieved at the same time over one session, which log in again only
+once when the Extranet reject it, and the pages are recorded whatever
+the session id cookies of the session, without the session ids of
+the URLs.
+
+Copyright(c) 2016 Rémi Tétreault <tetreault.remi@gmail.com>
+MIT Licensed, see LICENSE for more details.
+"""
+
+
+import os
+import json
+import unittest
+
+import support
+
+from content import Content, InternetTraffic, LongDistanceCalls, Invoices
+from corpus import PageCorpus
+from sessionstore import SessionStore
+from derytelecomextranetquery import (DerytelecomExtranetQuery, PARAM,
+                                      AUTH_PAGE_NAME, INDEX_PAGE_NAME,
+                                      COOKIE_NAME, HTTPNotOKError,
+                                      session_ids)
+
+
+
+########################################################################
+# Constants
+########################################################################
+PAGES = {
+    "traffic" : (dict(PARAM.CONTENT.INTERNET,
+                      **PARAM.CONTENT.SUB.INTERNET.TRAFFIC),
+                 InternetTraffic),
+    "calls" : (dict(PARAM.CONTENT.TELEPHONIE,
+                    **PARAM.CONTENT.SUB.TELEPHONIE.INTERURBAIN),
+               LongDistanceCalls),
+    "invoices" : (PARAM.CONTENT.FACTURATION, Invoices)
+}
+
+
+
+########################################################################
+# Helper functions
+########################################################################
+def requests_of(page_name):
+    return support.server.requests.get("/" + page_name, 0)
+
+
+def expire_session(path):
+    # Replace the session id of the stored session by one that the
+    # Extranet reject
+    with open(path, "rb") as f:
+        cookies = json.load(f)
+    for cookie in cookies:
+        if cookie["name"] == COOKIE_NAME:
+            cookie["value"] = "expired"
+    with open(path, "wb") as f:
+        json.dump(cookies, f)
+
+
+
+########################################################################
+# Classes
+########################################################################
+class BrokenContent(Content):
+    """A Content that can not read its web page."""
+
+    def __init__(self, page, **kwargs):
+        raise ValueError("broken")
+
+
+
+########################################################################
+# Tests
+########################################################################
+class GetContentsTest(unittest.TestCase):
+
+    def setUp(self):
+        self.deq = DerytelecomExtranetQuery.connect("user",
+                                                    support.PASSWORD)
+        self.addCleanup(self.deq.disconnect)
+
+
+    def test_pages_with_their_class(self):
+        contents = self.deq.get_contents(PAGES)
+
+        self.assertEqual(sorted(contents), sorted(PAGES))
+        for key, (_, content_class) in PAGES.items():
+            self.assertIsInstance(contents[key], content_class)
+            self.assertGreaterEqual(contents[key].elapsed, 0)
+        self.assertEqual(contents["traffic"].get_available(), "60.3 Gb")
+        self.assertEqual(len(list(contents["invoices"].iter_invoices())),
+                         support.ACCOUNTS["user"].invoices)
+
+
+    def test_pages_without_class(self):
+        params, _ = PAGES["traffic"]
+        contents = self.deq.get_contents({"traffic" : params})
+
+        self.assertIs(contents["traffic"].__class__, Content)
+
+
+    def test_no_pages(self):
+        before = requests_of(INDEX_PAGE_NAME)
+
+        self.assertEqual(self.deq.get_contents({}), {})
+        self.assertEqual(requests_of(INDEX_PAGE_NAME), before)
+
+
+    def test_not_connected(self):
+        self.deq.disconnect()
+
+        self.assertIsNone(self.deq.get_contents(PAGES))
+
+
+    def test_error_raised_once_others_done(self):
+        pages = dict(PAGES)
+        pages["broken"] = (PAGES["traffic"][0], BrokenContent)
+        before = requests_of(INDEX_PAGE_NAME)
+
+        self.assertRaises(ValueError, self.deq.get_contents, pages)
+        self.assertEqual(requests_of(INDEX_PAGE_NAME), before + len(pages))
+
+
+    def test_single_login_when_session_rejected(self):
+        directory = support.make_temp_dir(self)
+        store = SessionStore(directory)
+        DerytelecomExtranetQuery.connect("user", support.PASSWORD,
+                                         store).disconnect()
+        expire_session(os.path.join(directory, "user"))
+        before = requests_of(AUTH_PAGE_NAME)
+
+        with DerytelecomExtranetQuery.connect("user", support.PASSWORD,
+                                              store) as deq:
+            contents = deq.get_contents(PAGES)
+
+        self.assertEqual(contents["traffic"].get_available(), "60.3 Gb")
+        self.assertEqual(requests_of(AUTH_PAGE_NAME), before + 1)
+        self.assertEqual(deq.logins, 1)
+
+
+
+
+class RecordTest(unittest.TestCase):
+
+    def test_record_with_many_session_ids(self):
+        # The Extranet can set the session id cookie again for another
+        # path, then the jar hold two of them
+        corpus = PageCorpus(support.make_temp_dir(self))
+
+        with DerytelecomExtranetQuery.connect("user", support.PASSWORD,
+                                              corpus=corpus) as deq:
+            deq._session.cookies.set(COOKIE_NAME, "other", path="/other")
+            self.assertEqual(len(session_ids(deq._session.cookies)), 2)
+
+            self.assertEqual(deq.get_internettraffic().get_available(),
+                             "60.3 Gb")
+
+        self.assertEqual([name for name, _, _ in corpus.pages()],
+                         ["internet.traffic"])
+
+
+
+
+class HTTPNotOKErrorTest(unittest.TestCase):
+
+    def test_url_session_id_scrubbed(self):
+        e = HTTPNotOKError("https://host/index.php?PHPSESSID=abc123&lang=en",
+                           500, "Internal Server Error")
+
+        self.assertEqual(e.url, "https://host/index.php?"
+                                "PHPSESSID=SCRUBBED_SESSION_ID&lang=en")
+        self.assertNotIn("abc123", str(e))
+
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,147 @@
+# -*- coding: utf-8 -*-
+
+"""
+test_extraction
+---------------
+
+Tests of the extraction module: the fields are located from their
+labels, the alternative locators are tried in order, and the fast path
+find the same values as BeautifulSoup.
+
+Copyright(c) 2016 Rémi Tétreault <tetreault.remi@gmail.com>
+MIT Licensed, see LICENSE for more details.
+"""
+
+
+import re
+import unittest
+import warnings
+
+import support
+
+from extraction import ExtractionSpec, Field, Locator
+from usage import parse_amount
+
+
+
+########################################################################
+# Constants
+########################################################################
+PAGE = """<html><body>
+<div class="traffic">
+<p>Used: <b>39.7</b> <b>Gb</b></p>
+<p>Total: <b>100</b><b>Gb</b></p>
+</div>
+<div class="label"><span>Remaining</span></div>
+<div class="value"><span>
+<b>60.3</b><b>Gb</b></span></div>
+</body></html>"""
+
+SPEC = ExtractionSpec([
+    Field("used", [Locator(re.compile("Used"))], parse_amount),
+    Field("total", [Locator(re.compile("Total"))]),
+    Field("available", [
+        Locator(re.compile("Available")),
+        Locator(re.compile("Remaining"), up=2, next_sibling="div",
+                find="span")
+    ]),
+    Field("missing", [Locator(re.compile("Missing"))])
+])
+
+
+
+########################################################################
+# Helper functions
+########################################################################
+def soup(page):
+    with warnings.catch_warnings():
+        # BeautifulSoup 3 warn that it is old when it is imported
+        warnings.simplefilter("ignore")
+        from BeautifulSoup import BeautifulSoup
+        return BeautifulSoup(page)
+
+
+
+########################################################################
+# Tests
+########################################################################
+class ExtractionSpecTest(unittest.TestCase):
+
+    def extract(self, page, **kwargs):
+        # Return the values extracted with the fast path, after
+        # checking that BeautifulSoup extract the same ones
+        trees = []
+
+        def make_soup():
+            trees.append(soup(page))
+            return trees[-1]
+
+        values = SPEC.extract(page, make_soup, **kwargs)
+        self.assertEqual(values, SPEC.extract(page, make_soup, fast=False,
+                                              **kwargs))
+        return values, len(trees)
+
+
+    def test_fields(self):
+        values, _ = self.extract(PAGE)
+
+        self.assertEqual(values, {"used" : 39700000000,
+                                  "total" : "100 Gb",
+                                  "available" : "60.3 Gb",
+                                  "missing" : ""})
+        self.assertEqual(SPEC.names, ["used", "total", "available",
+                                      "missing"])
+
+
+    def test_soup_only_built_when_needed(self):
+        _, trees = self.extract(PAGE)
+        # Only for the extraction without the fast path
+        self.assertEqual(trees, 1)
+
+        # The fast path can not be sure of the tree of an unclosed p
+        page = PAGE.replace("<b>Gb</b></p>\n<p>Total", "<b>Gb</b>\n<p>Total")
+        values, trees = self.extract(page)
+        self.assertEqual(trees, 2)
+        self.assertEqual(values["used"], 39700000000)
+
+
+    def test_names(self):
+        values, _ = self.extract(PAGE, names=["total"])
+
+        self.assertEqual(values, {"total" : "100 Gb"})
+
+
+    def test_first_locator_found(self):
+        page = PAGE.replace("<p>Total", "<p>Available: <b>1</b><b>Gb</b></p>"
+                                        "\n<p>Total")
+        values, _ = self.extract(page)
+
+        self.assertEqual(values["available"], "1 Gb")
+
+
+    def test_first_text_of_anchor(self):
+        page = PAGE.replace("<p>Used",
+                            "<p>Total: <b>50</b><b>Gb</b></p>\n<p>Used")
+        values, _ = self.extract(page)
+
+        self.assertEqual(values["total"], "50 Gb")
+
+
+
+class LocatorTest(unittest.TestCase):
+
+    def test_follow(self):
+        tree = soup(PAGE)
+        label = tree.find(text=re.compile("Remaining"))
+
+        self.assertEqual(Locator(None).follow(label), "")
+        self.assertEqual(Locator(None, up=2, next_sibling="div",
+                                 find="span").follow(label), "60.3 Gb")
+        self.assertEqual(Locator(None, up=2, next_sibling="table")
+                         .follow(label), "")
+        self.assertEqual(Locator(None, up=100).follow(label), "")
+
+
+
+if __name__ == "__main__":
+    unittest.main()
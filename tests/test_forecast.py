@@ -0,0 +1,192 @@
+# -*- coding: utf-8 -*-
+
+"""
+test_forecast
+-------------
+
+Tests of the forecast module: the consumption rate of each account is
+computed over its current billing period, and tell if the account
+will run out of data before the end of it.
+
+Copyright(c) 2016 Rémi Tétreault <tetreault.remi@gmail.com>
+MIT Licensed, see LICENSE for more details.
+"""
+
+
+import os
+import time
+import datetime
+import unittest
+
+import support
+
+from usage import UsageRecord
+from history import HistoryStore, RAW
+from forecast import forecast, forecast_history, end_of_day, numpy
+
+
+
+########################################################################
+# Constants
+########################################################################
+HOUR = 60 * 60
+DAY = 24 * HOUR
+
+MAY = (datetime.date(2016, 5, 1), datetime.date(2016, 5, 31))
+APRIL = (datetime.date(2016, 4, 1), datetime.date(2016, 4, 30))
+
+# The time of the last sample, about three weeks before the end of May
+NOW = time.mktime(datetime.date(2016, 5, 10).timetuple())
+
+TOTAL = 100 * 10 ** 9
+
+
+
+########################################################################
+# Helper functions
+########################################################################
+def consumption(username, available, rate, hours, period=MAY, end=NOW):
+    # Return the hourly records of an account that consume data at the
+    # rate in bytes per hour, the last one fetched at end with the
+    # available data
+    return [(username, UsageRecord(available + rate * (hours - i), None,
+                                   TOTAL, period[0], period[1],
+                                   end - (hours - i) * HOUR))
+            for i in range(hours + 1)]
+
+
+
+########################################################################
+# Tests
+########################################################################
+@unittest.skipIf(numpy is None, "NumPy is not installed")
+class ForecastTest(unittest.TestCase):
+
+    def test_single_sample(self):
+        f, = forecast(consumption("user", 10 ** 9, 0, 0))
+
+        self.assertEqual((f.username, f.fetched_at, f.available),
+                         ("user", NOW, 10 ** 9))
+        self.assertIsNone(f.rate)
+        self.assertIsNone(f.exhausted_at)
+        self.assertIsNone(f.runs_out)
+
+
+    def test_steady_consumption(self):
+        records = (consumption("slow", 60 * 10 ** 9, 3600, 48)
+                   + consumption("fast", 6 * 10 ** 8, 3600 * 10 ** 3, 48))
+
+        fast, slow = forecast(records)
+
+        self.assertEqual((fast.username, slow.username), ("fast", "slow"))
+        self.assertAlmostEqual(fast.rate, 10 ** 3)
+        self.assertAlmostEqual(fast.exhausted_at, NOW + 6 * 10 ** 5)
+        self.assertTrue(fast.runs_out)
+        self.assertAlmostEqual(slow.rate, 1)
+        self.assertFalse(slow.runs_out)
+        self.assertEqual(slow.period_end, MAY[1])
+
+
+    def test_rate_over_window(self):
+        # The consumption was faster during the last day
+        records = (consumption("user", 10 ** 9 + 24 * 3600 * 10 ** 3,
+                               3600 * 10 ** 4, 24, end=NOW - DAY)[:-1]
+                   + consumption("user", 10 ** 9, 3600 * 10 ** 3, 24))
+
+        f, = forecast(records, window=DAY)
+
+        self.assertAlmostEqual(f.rate, 10 ** 3)
+
+
+    def test_no_consumption(self):
+        f, = forecast(consumption("user", 10 ** 9, 0, 24))
+
+        self.assertEqual(f.rate, 0)
+        self.assertIsNone(f.exhausted_at)
+        self.assertFalse(f.runs_out)
+
+
+    def test_several_billing_periods(self):
+        # April was almost exhausted, the usage was reset on May 1st
+        # and only its consumption is used
+        end_of_april = end_of_day(APRIL[1])
+        records = (consumption("user", 10 ** 6, 3600 * 10 ** 4, 48,
+                               APRIL, end_of_april - HOUR)
+                   + consumption("user", TOTAL - 10 ** 9, 3600 * 10 ** 3,
+                                 5, MAY, end_of_april + 5 * HOUR))
+
+        f, = forecast(records)
+
+        self.assertEqual(f.available, TOTAL - 10 ** 9)
+        self.assertEqual(f.fetched_at, end_of_april + 5 * HOUR)
+        self.assertAlmostEqual(f.rate, 10 ** 3)
+        self.assertEqual(f.period_end, MAY[1])
+        self.assertFalse(f.runs_out)
+
+
+    def test_single_sample_in_new_period(self):
+        records = (consumption("user", 10 ** 6, 3600 * 10 ** 4, 24, APRIL,
+                               NOW - DAY)
+                   + consumption("user", TOTAL, 0, 0))
+
+        f, = forecast(records)
+
+        self.assertEqual(f.available, TOTAL)
+        self.assertIsNone(f.rate)
+        self.assertIsNone(f.runs_out)
+
+
+    def test_records_without_available_data_ignored(self):
+        records = [("user", UsageRecord(fetched_at=NOW)),
+                   ("user", UsageRecord(10 ** 9))]
+
+        self.assertEqual(forecast(records), [])
+
+
+
+@unittest.skipIf(numpy is None, "NumPy is not installed")
+class ForecastHistoryTest(unittest.TestCase):
+
+    def setUp(self):
+        # The samples of 2016 are kept until they are forecast
+        path = os.path.join(support.make_temp_dir(self), "history.sqlite")
+        self.store = HistoryStore(path, retention_rules=((100 * 365 * DAY,
+                                                          RAW),))
+        self.addCleanup(self.store.close)
+
+
+    def test_same_as_records(self):
+        end_of_april = end_of_day(APRIL[1])
+        self.store.add_many(
+            consumption("user", 10 ** 6, 3600 * 10 ** 4, 48, APRIL,
+                        end_of_april - HOUR)
+            + consumption("user", TOTAL - 10 ** 9, 3600 * 10 ** 3, 5, MAY,
+                          end_of_april + 5 * HOUR)
+            + consumption("fast", 6 * 10 ** 8, 3600 * 10 ** 3, 48)
+            + consumption("idle", 10 ** 9, 0, 0, (None, None))
+            + [("low", UsageRecord(fetched_at=NOW))])
+
+        from_arrays = [f.as_dict() for f in forecast_history(self.store)]
+        from_records = [f.as_dict() for f in forecast(self.store.query())]
+
+        self.assertEqual([f["username"] for f in from_arrays],
+                         ["fast", "idle", "user"])
+        self.assertEqual(from_arrays, from_records)
+        self.assertEqual(from_arrays[2]["period_end"], "2016-05-31")
+        self.assertIsNone(from_arrays[1]["period_end"])
+
+
+    def test_account_and_since(self):
+        self.store.add_many(consumption("user", 10 ** 9, 3600, 48)
+                            + consumption("fast", 10 ** 9, 3600, 48))
+
+        f, = forecast_history(self.store, "user", NOW - HOUR)
+
+        self.assertEqual(f.username, "user")
+        self.assertAlmostEqual(f.rate, 1)
+        self.assertEqual(forecast_history(self.store, "other"), [])
+
+
+
+if __name__ == "__main__":
+    unittest.main()
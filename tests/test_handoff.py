@@ -0,0 +1,184 @@
+# -*- coding: utf-8 -*-
+
+"""
+test_handoff
+------------
+
+Tests of the handoff module: the form of the page is escaped, the page
+is served only once, and the form handoff of open_in_webbrowser let
+the web browser continue the session, which is logged out when the web
+browser did not take it over.
+
+Copyright(c) 2016 Rémi Tétreault <tetreault.remi@gmail.com>
+MIT Licensed, see LICENSE for more details.
+"""
+
+
+import re
+import urllib2
+import unittest
+import HTMLParser
+
+import requests
+
+import support
+
+import handoff
+from derytelecomextranetquery import (DerytelecomExtranetQuery, PARAM,
+                                      INDEX_URL, COOKIE_NAME,
+                                      default_policy)
+
+
+
+########################################################################
+# Constants
+########################################################################
+TRAFFIC_PARAMS = dict(PARAM.CONTENT.INTERNET,
+                      **PARAM.CONTENT.SUB.INTERNET.TRAFFIC)
+
+INPUT_RE = re.compile(r'<input type="hidden" name="([^"]*)" value="([^"]*)">')
+ACTION_RE = re.compile(r'<form method="get" action="([^"]*)">')
+
+
+
+########################################################################
+# Helper functions
+########################################################################
+def fetch(url):
+    # Return the status code and the body of the response to a GET
+    try:
+        response = urllib2.urlopen(url, timeout=5)
+    except urllib2.HTTPError as e:
+        return e.code, e.read()
+    return response.getcode(), response.read()
+
+
+def read_form(page):
+    # Return the action and the params of the form of a handoff page
+    unescape = HTMLParser.HTMLParser().unescape
+    return (unescape(ACTION_RE.search(page).group(1)),
+            dict((unescape(k), unescape(v))
+                 for k, v in INPUT_RE.findall(page)))
+
+
+
+########################################################################
+# Tests
+########################################################################
+class HandoffPageTest(unittest.TestCase):
+
+    def test_inputs_escaped(self):
+        page = handoff.handoff_page("http://host/?a=1&b=2",
+                                    {"content" : "internet",
+                                     "quote" : '"><script>'})
+
+        self.assertIn('action="http://host/?a=1&amp;b=2"', page)
+        self.assertIn('name="quote" value="&quot;&gt;&lt;script&gt;"', page)
+        self.assertNotIn("<script>", page)
+        self.assertEqual(read_form(page),
+                         ("http://host/?a=1&b=2",
+                          {"content" : "internet", "quote" : '"><script>'}))
+
+
+
+class ServeOnceTest(unittest.TestCase):
+
+    def test_served_once(self):
+        responses = []
+
+        def open_url(url):
+            # A web browser that also ask for the favicon, then reload
+            responses.append(fetch(url))
+            responses.append(fetch(url.rsplit("/", 1)[0] + "/favicon.ico"))
+            responses.append(fetch(url))
+
+        self.assertTrue(handoff.serve_once(u"<p>é</p>", open_url))
+        self.assertEqual([code for code, _ in responses], [200, 404, 404])
+        self.assertEqual(responses[0][1], u"<p>é</p>".encode("utf-8"))
+
+
+    def test_local_random_path(self):
+        urls = []
+
+        def open_url(url):
+            urls.append(url)
+            fetch(url)
+
+        handoff.serve_once(u"", open_url)
+        handoff.serve_once(u"", open_url)
+
+        self.assertTrue(all(url.startswith("http://127.0.0.1:")
+                            for url in urls))
+        self.assertNotEqual(urls[0].rsplit("/", 1)[1],
+                            urls[1].rsplit("/", 1)[1])
+
+
+    def test_timeout(self):
+        self.assertFalse(handoff.serve_once(u"", lambda url: None,
+                                            timeout=0.05))
+
+
+
+class FormHandoffTest(unittest.TestCase):
+
+    def setUp(self):
+        # The stand-in accept the session ids in the URLs only for
+        # these tests
+        support.server.url_session_ids = True
+        self.addCleanup(setattr, support.server, "url_session_ids", False)
+
+
+    def open_with_form(self, open_url):
+        return DerytelecomExtranetQuery._open_with_form(
+            TRAFFIC_PARAMS, "user", support.PASSWORD, default_policy(),
+            open_url)
+
+
+    def test_web_browser_continue_session(self):
+        pages = []
+
+        def open_url(url):
+            # A web browser, without the cookies of the module, that
+            # submit the form
+            _, page = fetch(url)
+            action, params = read_form(page.decode("utf-8"))
+            with requests.Session() as browser:
+                pages.append(browser.get(action, params=params).text)
+                pages.append(browser.get(INDEX_URL,
+                                         params=TRAFFIC_PARAMS).text)
+
+        self.assertTrue(self.open_with_form(open_url))
+        # The session id is only passed in the URL of the first page,
+        # then it is in the cookie
+        for page in pages:
+            self.assertIn("60.3", page)
+
+
+    def test_session_id_in_form_only(self):
+        forms = []
+
+        def open_url(url):
+            self.assertNotIn(COOKIE_NAME, url)
+            forms.append(read_form(fetch(url)[1].decode("utf-8")))
+
+        self.open_with_form(open_url)
+
+        (action, params), = forms
+        self.assertEqual(action, INDEX_URL)
+        self.assertEqual(sorted(params), sorted([COOKIE_NAME]
+                                                + list(TRAFFIC_PARAMS)))
+
+
+    def test_logged_out_when_not_served(self):
+        sessions = len(support.server._sessions)
+
+        def open_url(url):
+            raise OSError("no web browser")
+
+        self.assertRaises(OSError, self.open_with_form, open_url)
+        self.assertEqual(len(support.server._sessions), sessions)
+
+
+
+if __name__ == "__main__":
+    unittest.main()
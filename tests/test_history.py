@@ -0,0 +1,167 @@
+# -*- coding: utf-8 -*-
+
+"""
+test_history
+------------
+
+Tests of the history module: the retention rules downsample and
+remove the old records, and the records are queried by account, by
+time and at a resolution.
+
+Copyright(c) 2016 Rémi Tétreault <tetreault.remi@gmail.com>
+MIT Licensed, see LICENSE for more details.
+"""
+
+
+import os
+import time
+import datetime
+import unittest
+
+import support
+
+from usage import UsageRecord
+from history import HistoryStore, RAW, HOUR, DAY
+
+
+
+########################################################################
+# Constants
+########################################################################
+# The start of the current day, so that the records of a day are not
+# split between two
+NOW = int(time.time()) // DAY * DAY
+
+PERIOD_START = datetime.date(2016, 5, 1)
+PERIOD_END = datetime.date(2016, 5, 31)
+TOTAL = 100000
+
+
+
+########################################################################
+# Helper functions
+########################################################################
+def record(fetched_at, available):
+    return UsageRecord(available, None, TOTAL, PERIOD_START, PERIOD_END,
+                       fetched_at)
+
+
+def samples(store):
+    # Return the rows of the store as (username, fetched_at,
+    # resolution, available) tuples
+    return list(store._db.execute(
+        "SELECT a.username, s.fetched_at, s.resolution, s.available "
+        "FROM samples s JOIN accounts a ON a.id = s.account_id "
+        "ORDER BY a.username, s.fetched_at"))
+
+
+
+########################################################################
+# Tests
+########################################################################
+class HistoryTest(unittest.TestCase):
+
+    def setUp(self):
+        path = os.path.join(support.make_temp_dir(self), "history.sqlite")
+        self.store = HistoryStore(path)
+        self.addCleanup(self.store.close)
+
+
+    def test_compaction(self):
+        self.store.add_many(
+            # Kept as they were added
+            [("user", record(NOW - DAY, 100)),
+             ("user", record(NOW - DAY + 60, 200))]
+            # Averaged over an hour
+            + [("user", record(NOW - 10 * DAY + i * 600, (i + 1) * 100))
+               for i in range(3)]
+            # Averaged over an hour, then over a day
+            + [("user", record(NOW - 100 * DAY + i * HOUR, (i + 1) * 100))
+               for i in range(3)]
+            # Removed
+            + [("user", record(NOW - 3 * 365 * DAY, 100))])
+
+        self.store.compact(NOW)
+        expected = [
+            ("user", NOW - 100 * DAY, DAY, 200),
+            ("user", NOW - 10 * DAY, HOUR, 200),
+            ("user", NOW - DAY, RAW, 100),
+            ("user", NOW - DAY + 60, RAW, 200)]
+        self.assertEqual(samples(self.store), expected)
+
+        # The records already compacted are not compacted again
+        self.store.compact(NOW)
+        self.store.compact(NOW + HOUR)
+        self.assertEqual(samples(self.store), expected)
+
+        _, compacted = next(self.store.query(since=NOW - 11 * DAY))
+        self.assertEqual((compacted.available, compacted.used,
+                          compacted.total), (200, TOTAL - 200, TOTAL))
+        self.assertEqual((compacted.period_start, compacted.period_end),
+                         (PERIOD_START, PERIOD_END))
+
+
+    def test_query(self):
+        start = NOW - 2 * DAY
+        self.store.add_many(
+            [("user", record(start + i * 900, i * 100)) for i in range(8)]
+            + [("low", record(start, 5000))])
+
+        self.assertEqual(
+            [(u, r.fetched_at, r.available) for u, r in self.store.query()],
+            [("low", start, 5000)]
+            + [("user", start + i * 900, i * 100) for i in range(8)])
+
+        self.assertEqual(
+            [(r.fetched_at, r.available)
+             for _, r in self.store.query(account="user",
+                                          resolution=HOUR)],
+            [(start, 150), (start + HOUR, 550)])
+
+        self.assertEqual(
+            [r.available
+             for _, r in self.store.query(account="user",
+                                          since=start + 900,
+                                          until=start + 3 * 900)],
+            [100, 200])
+
+        self.assertEqual(
+            [(u, r.available)
+             for u, r in self.store.query(since=start, until=start + 1,
+                                          resolution=DAY)],
+            [("low", 5000), ("user", 0)])
+
+
+    def test_query_samples(self):
+        self.store.add_many([("user", record(NOW - DAY + 60, 200)),
+                             ("user", record(NOW - DAY, 100)),
+                             ("user", UsageRecord(fetched_at=NOW)),
+                             ("low", UsageRecord(5000, fetched_at=NOW))])
+
+        usernames, rows = self.store.query_samples(since=NOW - DAY)
+        user_id = self.store._account_id("user")
+        low_id = self.store._account_id("low")
+
+        self.assertEqual(usernames, {user_id : "user", low_id : "low"})
+        self.assertEqual(sorted(rows), sorted([
+            (user_id, PERIOD_START.toordinal(), PERIOD_END.toordinal(),
+             NOW - DAY, 100),
+            (user_id, PERIOD_START.toordinal(), PERIOD_END.toordinal(),
+             NOW - DAY + 60, 200),
+            (low_id, 0, 0, NOW, 5000)]))
+        self.assertEqual([r[3] for r in rows if r[0] == user_id],
+                         [NOW - DAY, NOW - DAY + 60])
+
+        _, rows = self.store.query_samples("low", until=NOW)
+        self.assertEqual(rows, [])
+
+
+    def test_query_of_unknown_account(self):
+        self.store.add("user", record(NOW - DAY, 100))
+
+        self.assertEqual(list(self.store.query(account="other")), [])
+
+
+
+if __name__ == "__main__":
+    unittest.main()
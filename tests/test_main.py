@@ -0,0 +1,92 @@
+# -*- coding: utf-8 -*-
+
+"""
+test_main
+---------
+
+Tests of the command line program: get queries the server of the
+--socket option and falls back on a direct query when it is not
+running, and the output to a reader that is gone ends quietly.
+
+Copyright(c) 2016 Rémi Tétreault <tetreault.remi@gmail.com>
+MIT Licensed, see LICENSE for more details.
+"""
+
+
+import os
+import threading
+import unittest
+
+import support
+
+from queryserver import QueryServer
+
+
+
+########################################################################
+# Constants
+########################################################################
+# The exit code of a process killed by SIGPIPE
+EXITCODE_BROKEN_PIPE = 141
+
+
+
+########################################################################
+# Tests
+########################################################################
+class SocketTest(unittest.TestCase):
+
+    def setUp(self):
+        self.socket_path = os.path.join(support.make_temp_dir(self),
+                                        "server.sock")
+
+
+    def get(self):
+        return support.run_command("get", "--socket", self.socket_path,
+                                   "user", support.PASSWORD)
+
+
+    def test_direct_query_without_server(self):
+        exitcode, output, error_output = self.get()
+
+        self.assertEqual((exitcode, output, error_output),
+                         (0, b"60.3 Gb\n", b""))
+
+
+    def test_query_server(self):
+        server = QueryServer(self.socket_path)
+        thread = threading.Thread(target=server.serve_forever,
+                                  kwargs={"poll_interval" : 0.01})
+        thread.daemon = True
+        thread.start()
+        self.addCleanup(server.server_close)
+        self.addCleanup(server.shutdown)
+
+        exitcode, output, _ = self.get()
+
+        self.assertEqual((exitcode, output), (0, b"60.3 Gb\n"))
+        self.assertEqual(server.recorder.snapshot()
+                         ["page.internet.traffic"]["count"], 1)
+
+
+
+class BrokenPipeTest(unittest.TestCase):
+
+    def test_reader_gone(self):
+        # The reader of the output is gone before the first row
+        read_end, write_end = os.pipe()
+        os.close(read_end)
+        try:
+            exitcode, _, error_output = support.run_command(
+                "get", "longdistance", "user", support.PASSWORD,
+                stdout=write_end)
+        finally:
+            os.close(write_end)
+
+        self.assertEqual((exitcode, error_output),
+                         (EXITCODE_BROKEN_PIPE, b""))
+
+
+
+if __name__ == "__main__":
+    unittest.main()
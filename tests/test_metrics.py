@@ -0,0 +1,180 @@
+# -*- coding: utf-8 -*-
+
+"""
+test_metrics
+------------
+
+Tests of the metrics module: the runs of the phases and the gauges are
+recorded, exported in the Prometheus text format and in JSON, and
+written to a file that only its owner can read.
+
+Copyright(c) 2016 Rémi Tétreault <tetreault.remi@gmail.com>
+MIT Licensed, see LICENSE for more details.
+"""
+
+
+import os
+import json
+import stat
+import threading
+import unittest
+
+import support
+
+from metrics import Recorder, escape_label_value, PROMETHEUS, JSON
+
+
+
+########################################################################
+# Helper functions
+########################################################################
+def recorder():
+    # Return a recorder with two phases and a gauge
+    r = Recorder()
+    r.record("page.internet.traffic", 0.02, bytes=1000)
+    r.record("page.internet.traffic", 3, bytes=500,
+             outcome="InternetConnectionError")
+    r.record("auth", 0.001)
+    r.set_gauge("scheduler_queue_depth", 4, "The polls waiting to run.")
+    return r
+
+
+
+########################################################################
+# Tests
+########################################################################
+class RecorderTest(unittest.TestCase):
+
+    def test_record(self):
+        stats = recorder().snapshot()["page.internet.traffic"]
+
+        self.assertEqual(stats["count"], 2)
+        self.assertAlmostEqual(stats["seconds"], 3.02)
+        self.assertEqual(stats["max_seconds"], 3)
+        self.assertEqual(stats["bytes"], 1500)
+        self.assertEqual(stats["outcomes"],
+                         {"ok" : 1, "InternetConnectionError" : 1})
+        self.assertEqual(stats["buckets"]["0.01"], 0)
+        self.assertEqual(stats["buckets"]["0.025"], 1)
+        self.assertEqual(stats["buckets"]["5"], 2)
+
+
+    def test_phase(self):
+        r = Recorder()
+        with r.phase("parse.available"):
+            pass
+        with self.assertRaises(KeyError):
+            with r.phase("parse.available"):
+                raise KeyError()
+
+        self.assertEqual(r.snapshot()["parse.available"]["outcomes"],
+                         {"ok" : 1, "KeyError" : 1})
+
+
+    def test_as_dict(self):
+        values = recorder().as_dict()
+
+        self.assertEqual(sorted(values),
+                         ["auth", "gauges", "page.internet.traffic"])
+        self.assertEqual(values["gauges"], {"scheduler_queue_depth" : 4})
+        self.assertNotIn("gauges", Recorder().as_dict())
+
+
+    def test_json(self):
+        r = recorder()
+
+        self.assertEqual(json.loads(r.to_json()), r.as_dict())
+        self.assertEqual(r.export(JSON), r.to_json() + "\n")
+
+
+    def test_prometheus(self):
+        lines = recorder().export(PROMETHEUS).splitlines()
+
+        self.assertIn("# TYPE derytelecom_phase_duration_seconds histogram",
+                      lines)
+        self.assertIn('derytelecom_phase_duration_seconds_bucket'
+                      '{phase="page.internet.traffic",le="0.025"} 1', lines)
+        self.assertIn('derytelecom_phase_duration_seconds_bucket'
+                      '{phase="page.internet.traffic",le="+Inf"} 2', lines)
+        self.assertIn('derytelecom_phase_duration_seconds_sum'
+                      '{phase="auth"} 0.001', lines)
+        self.assertIn('derytelecom_phase_bytes_total'
+                      '{phase="page.internet.traffic"} 1500', lines)
+        self.assertIn('derytelecom_phase_outcomes_total'
+                      '{phase="page.internet.traffic",'
+                      'outcome="InternetConnectionError"} 1', lines)
+        self.assertIn("# TYPE derytelecom_scheduler_queue_depth gauge",
+                      lines)
+        self.assertIn("derytelecom_scheduler_queue_depth 4.0", lines)
+
+
+    def test_escape_label_value(self):
+        self.assertEqual(escape_label_value('a\\b"c\nd'),
+                         'a\\\\b\\"c\\nd')
+
+
+    def test_unknown_format(self):
+        self.assertRaises(ValueError, recorder().export, "xml")
+
+
+    def test_profile(self):
+        lines = recorder().format_profile().splitlines()
+
+        self.assertTrue(lines[0].startswith("phase"))
+        # By order of total duration
+        self.assertTrue(lines[1].startswith("page.internet.traffic"))
+        self.assertTrue(lines[2].startswith("auth"))
+        self.assertTrue(lines[3].startswith("scheduler_queue_depth"))
+
+
+
+class WriteFileTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = support.make_temp_dir(self)
+        self.path = os.path.join(self.directory, "derytelecom.prom")
+
+
+    def test_write_file(self):
+        r = recorder()
+        r.write_file(self.path)
+
+        with open(self.path, "rb") as f:
+            self.assertEqual(f.read().decode("utf-8"), r.to_prometheus())
+        self.assertEqual(stat.S_IMODE(os.stat(self.path).st_mode), 0o600)
+
+        r.write_file(self.path, JSON)
+        with open(self.path, "rb") as f:
+            self.assertEqual(json.loads(f.read()), r.as_dict())
+
+
+    def test_concurrent_writers(self):
+        # The writers do not share a temporary file, so each write
+        # succeed and the file is always complete
+        recorders = [recorder() for _ in range(8)]
+        errors = []
+
+        def write(r):
+            try:
+                for _ in range(20):
+                    r.write_file(self.path)
+            except Exception as e:
+                errors.append(e)
+
+        threads = [threading.Thread(target=write, args=(r,))
+                   for r in recorders]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+
+        self.assertEqual(errors, [])
+        self.assertEqual(os.listdir(self.directory), ["derytelecom.prom"])
+        with open(self.path, "rb") as f:
+            self.assertEqual(f.read().decode("utf-8"),
+                             recorders[0].to_prometheus())
+
+
+
+if __name__ == "__main__":
+    unittest.main()
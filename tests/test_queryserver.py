@@ -0,0 +1,171 @@
+# -*- coding: utf-8 -*-
+
+"""
+test_queryserver
+----------------
+
+Tests of the queryserver module: the socket is only accessible by its
+user, the sessions are kept between the queries, a session is only
+replaced by one that logged in, and the idle sessions are closed.
+
+Copyright(c) 2016 Rémi Tétreault <tetreault.remi@gmail.com>
+MIT Licensed, see LICENSE for more details.
+"""
+
+
+import os
+import json
+import stat
+import time
+import socket
+import threading
+import unittest
+
+import support
+
+from queryserver import QueryServer, query_server
+from derytelecomextranetquery import AUTH_PAGE_NAME
+
+
+
+########################################################################
+# Constants
+########################################################################
+IDLE_TIMEOUT = 60
+
+
+
+########################################################################
+# Helper functions
+########################################################################
+def logins():
+    return support.server.requests.get("/" + AUTH_PAGE_NAME, 0)
+
+
+def query_metrics(socket_path, output_format):
+    # Send a query of the metrics, that query_server can not send
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        sock.connect(socket_path)
+        sock.sendall(json.dumps({"metrics" : output_format}) + "\n")
+        return json.loads(sock.makefile("rb").readline())
+    finally:
+        sock.close()
+
+
+
+########################################################################
+# Tests
+########################################################################
+class QueryServerTest(unittest.TestCase):
+
+    def setUp(self):
+        self.socket_path = os.path.join(support.make_temp_dir(self),
+                                        "server.sock")
+        self.server = QueryServer(self.socket_path,
+                                  idle_timeout=IDLE_TIMEOUT)
+
+        thread = threading.Thread(target=self.server.serve_forever,
+                                  kwargs={"poll_interval" : 0.01})
+        thread.daemon = True
+        thread.start()
+        self.addCleanup(self.server.server_close)
+        self.addCleanup(self.server.shutdown)
+
+
+    def query(self, data="availabledata", password=support.PASSWORD):
+        return query_server(self.socket_path, data, "user", password)
+
+
+    def test_socket_only_accessible_by_user(self):
+        mode = stat.S_IMODE(os.stat(self.socket_path).st_mode)
+        self.assertEqual(mode, 0o600)
+
+
+    def test_session_kept_between_queries(self):
+        before = logins()
+
+        self.assertEqual(self.query(), {"result" : "60.3 Gb"})
+        self.assertEqual(self.query("usage")["result"]["available"],
+                         60300000000)
+        self.assertEqual(logins(), before + 1)
+
+
+    def test_wrong_password_keep_session(self):
+        self.query()
+        account = self.server._accounts["user"]
+
+        answer = self.query(password="wrong")
+        self.assertEqual(answer["error"], "BadUsernamePasswordError")
+        self.assertIs(self.server._accounts["user"], account)
+        self.assertFalse(account.expired)
+
+        before = logins()
+        self.assertEqual(self.query(), {"result" : "60.3 Gb"})
+        self.assertEqual(logins(), before)
+
+
+    def test_new_password_replace_session_once_logged_in(self):
+        self.query()
+        old_account = self.server._accounts["user"]
+
+        stub_account = support.ACCOUNTS["user"]
+        self.addCleanup(setattr, stub_account, "password",
+                        stub_account.password)
+        stub_account.password = "new password"
+
+        self.assertEqual(self.query(password="new password"),
+                         {"result" : "60.3 Gb"})
+        self.assertIsNot(self.server._accounts["user"], old_account)
+        self.assertTrue(old_account.expired)
+        self.assertIsNone(old_account.deq)
+
+
+    def test_idle_sessions_expired(self):
+        self.query()
+        account = self.server._accounts["user"]
+
+        self.assertEqual(self.server.expire_idle(), 0)
+        self.assertEqual(
+            self.server.expire_idle(time.time() + IDLE_TIMEOUT), 1)
+        self.assertTrue(account.expired)
+        self.assertIsNone(account.deq)
+        self.assertNotIn("user", self.server._accounts)
+
+        before = logins()
+        self.assertEqual(self.query(), {"result" : "60.3 Gb"})
+        self.assertEqual(logins(), before + 1)
+
+
+    def test_account_in_use_not_expired(self):
+        self.query()
+        account = self.server._accounts["user"]
+
+        with account.lock:
+            self.assertEqual(
+                self.server.expire_idle(time.time() + IDLE_TIMEOUT), 0)
+        self.assertFalse(account.expired)
+
+
+    def test_metrics(self):
+        self.query()
+
+        answer = query_metrics(self.socket_path, "json")
+        self.assertIsInstance(answer["result"], dict)
+        self.assertEqual(
+            answer["result"]["page.internet.traffic"]["count"], 1)
+
+        answer = query_metrics(self.socket_path, "prometheus")
+        self.assertIn('derytelecom_phase_duration_seconds_count'
+                      '{phase="page.internet.traffic"} 1',
+                      answer["result"])
+
+
+    def test_socket_removed_when_closed(self):
+        self.server.server_close()
+        self.assertFalse(os.path.exists(self.socket_path))
+
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,188 @@
+# -*- coding: utf-8 -*-
+
+"""
+test_responsecache
+------------------
+
+Tests of the responsecache module: the pages go from fresh to stale
+to expired with their time to live, the least recently used page is
+evicted, and the stale pages are served while retrieved again.
+
+Copyright(c) 2016 Rémi Tétreault <tetreault.remi@gmail.com>
+MIT Licensed, see LICENSE for more details.
+"""
+
+
+import time
+import unittest
+
+import support
+
+from responsecache import ResponseCache, FRESH, STALE
+from derytelecomextranetquery import (DerytelecomExtranetQuery, PARAM,
+                                      INDEX_PAGE_NAME)
+
+
+
+########################################################################
+# Constants
+########################################################################
+TRAFFIC_KEY = ResponseCache.key("user", dict(
+    PARAM.CONTENT.INTERNET, **dict(PARAM.CONTENT.SUB.INTERNET.TRAFFIC,
+                                   **PARAM.LANG.ENG)))
+INVOICES_KEY = ResponseCache.key("user", dict(PARAM.CONTENT.FACTURATION,
+                                              **PARAM.LANG.ENG))
+
+# The maximum time in seconds to wait for a page retrieved again in
+# the background
+REVALIDATE_TIMEOUT = 5
+
+
+
+########################################################################
+# Helper functions
+########################################################################
+def age(cache, key, seconds):
+    # Make the page of the key older by the number of seconds
+    page, stored_at = cache._pages[key]
+    cache._pages[key] = (page, stored_at - seconds)
+
+
+
+########################################################################
+# Tests
+########################################################################
+class ResponseCacheTest(unittest.TestCase):
+
+    def setUp(self):
+        self.cache = ResponseCache(ttls={"internet" : 100,
+                                         "facturation" : 1000},
+                                   default_ttl=10, stale_ratio=0.5,
+                                   max_size=2)
+
+
+    def test_fresh_then_stale_then_expired(self):
+        self.cache.put(TRAFFIC_KEY, "page")
+        page, state, stored_at = self.cache.get(TRAFFIC_KEY)
+        self.assertEqual((page, state), ("page", FRESH))
+
+        age(self.cache, TRAFFIC_KEY, 120)
+        page, state, older_stored_at = self.cache.get(TRAFFIC_KEY)
+        self.assertEqual((page, state), ("page", STALE))
+        self.assertEqual(older_stored_at, stored_at - 120)
+
+        age(self.cache, TRAFFIC_KEY, 40)
+        self.assertIsNone(self.cache.get(TRAFFIC_KEY))
+        # The expired page is no longer in the cache
+        self.assertIsNone(self.cache.get(TRAFFIC_KEY))
+
+        self.assertEqual(self.cache.stats(), {
+            "size" : 0, "hits" : 1, "stale_hits" : 1, "misses" : 2,
+            "evictions" : 0})
+
+
+    def test_time_to_live_depend_on_page(self):
+        other_key = ResponseCache.key("user", {"content" : "profil"})
+        for key in (TRAFFIC_KEY, INVOICES_KEY):
+            self.cache.put(key, "page")
+            age(self.cache, key, 200)
+        self.cache.max_size = 3
+        self.cache.put(other_key, "page")
+        age(self.cache, other_key, 12)
+
+        self.assertIsNone(self.cache.get(TRAFFIC_KEY))
+        self.assertEqual(self.cache.get(INVOICES_KEY)[1], FRESH)
+        self.assertEqual(self.cache.get(other_key)[1], STALE)
+
+
+    def test_put_again_make_page_fresh(self):
+        self.cache.put(TRAFFIC_KEY, "old page")
+        age(self.cache, TRAFFIC_KEY, 120)
+        self.cache.put(TRAFFIC_KEY, "new page")
+
+        self.assertEqual(self.cache.get(TRAFFIC_KEY)[:2],
+                         ("new page", FRESH))
+
+
+    def test_least_recently_used_page_evicted(self):
+        other_key = ResponseCache.key("other", {"content" : "internet"})
+        self.cache.put(TRAFFIC_KEY, "traffic")
+        self.cache.put(INVOICES_KEY, "invoices")
+        # The traffic page is now the most recently used
+        self.cache.get(TRAFFIC_KEY)
+
+        self.cache.put(other_key, "other")
+
+        self.assertIsNone(self.cache.get(INVOICES_KEY))
+        self.assertEqual(self.cache.get(TRAFFIC_KEY)[0], "traffic")
+        self.assertEqual(self.cache.get(other_key)[0], "other")
+        self.assertEqual(self.cache.stats()["evictions"], 1)
+
+
+    def test_keys_of_accounts_differ(self):
+        self.cache.put(TRAFFIC_KEY, "page")
+
+        self.assertIsNone(self.cache.get(
+            ResponseCache.key("low", dict(PARAM.CONTENT.INTERNET,
+                                          **PARAM.LANG.ENG))))
+
+
+
+class CachedQueryTest(unittest.TestCase):
+
+    def setUp(self):
+        self.cache = ResponseCache()
+        self.deq = DerytelecomExtranetQuery.connect(
+            "user", support.PASSWORD, cache=self.cache)
+        self.addCleanup(self.deq.disconnect)
+
+
+    def index_requests(self):
+        return support.server.requests.get("/" + INDEX_PAGE_NAME, 0)
+
+
+    def test_fresh_page_served_without_request(self):
+        first = self.deq.get_internettraffic()
+        before = self.index_requests()
+        second = self.deq.get_internettraffic()
+
+        self.assertEqual(self.index_requests(), before)
+        self.assertEqual(second.get_available(), first.get_available())
+        self.assertEqual(second.fetched_at,
+                         self.cache._pages[TRAFFIC_KEY][1])
+
+
+    def test_stale_page_served_and_retrieved_again(self):
+        self.deq.get_internettraffic()
+        age(self.cache, TRAFFIC_KEY, 6 * 60)
+        _, stored_at = self.cache._pages[TRAFFIC_KEY]
+        before = self.index_requests()
+
+        content = self.deq.get_internettraffic()
+        self.assertEqual(content.fetched_at, stored_at)
+
+        # The page is retrieved again in the background
+        end = time.time() + REVALIDATE_TIMEOUT
+        while (self.cache._pages[TRAFFIC_KEY][1] == stored_at
+               and time.time() < end):
+            time.sleep(0.01)
+
+        self.assertGreater(self.cache._pages[TRAFFIC_KEY][1], stored_at)
+        self.assertEqual(self.index_requests(), before + 1)
+        self.assertEqual(self.cache.get(TRAFFIC_KEY)[1], FRESH)
+
+
+    def test_expired_page_retrieved_again(self):
+        self.deq.get_internettraffic()
+        age(self.cache, TRAFFIC_KEY, 8 * 60)
+        before = self.index_requests()
+
+        content = self.deq.get_internettraffic()
+
+        self.assertEqual(self.index_requests(), before + 1)
+        self.assertGreater(content.fetched_at, time.time() - 60)
+
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,267 @@
+# -*- coding: utf-8 -*-
+
+"""
+test_retry
+----------
+
+Tests of the retry module: the transitions of the states of the
+circuit breaker and the retries of the requests.
+
+Copyright(c) 2016 Rémi Tétreault <tetreault.remi@gmail.com>
+MIT Licensed, see LICENSE for more details.
+"""
+
+
+import os
+import time
+import unittest
+
+import support
+
+import requests
+
+from retry import CircuitBreaker, RetryPolicy
+
+
+
+########################################################################
+# Helper functions
+########################################################################
+def wait_reset_timeout(breaker):
+    # Move the state of the breaker back in time, as if its reset
+    # timeout was over
+    if breaker.opened_at is not None:
+        breaker.opened_at -= breaker.reset_timeout
+    if breaker.probing_at is not None:
+        breaker.probing_at -= breaker.reset_timeout
+
+
+
+########################################################################
+# Classes
+########################################################################
+class FakeResponse(object):
+
+    def __init__(self, status_code):
+        self.status_code = status_code
+
+
+
+class FakeSession(object):
+    """A session whose requests get the outcomes in turn, a status
+    code or an exception to raise.
+    """
+
+    def __init__(self, outcomes):
+        self.outcomes = list(outcomes)
+        self.timeouts = []
+
+    def request(self, method, url, timeout=None, **kwargs):
+        self.timeouts.append(timeout)
+        outcome = self.outcomes.pop(0)
+        if isinstance(outcome, Exception):
+            raise outcome
+        return FakeResponse(outcome)
+
+
+
+########################################################################
+# Tests
+########################################################################
+class CircuitBreakerTest(unittest.TestCase):
+
+    def setUp(self):
+        self.breaker = CircuitBreaker(failure_threshold=3, reset_timeout=60)
+
+
+    def open(self):
+        for _ in range(3):
+            self.breaker.record_failure()
+
+
+    def test_closed_until_threshold(self):
+        self.breaker.record_failure()
+        self.breaker.record_failure()
+        self.assertTrue(self.breaker.allow())
+        self.assertEqual(self.breaker.retry_after(), 0)
+
+        self.breaker.record_failure()
+        self.assertFalse(self.breaker.allow())
+        self.assertGreater(self.breaker.retry_after(), 59)
+
+
+    def test_success_resets_failures(self):
+        self.breaker.record_failure()
+        self.breaker.record_failure()
+        self.breaker.record_success()
+        self.breaker.record_failure()
+        self.breaker.record_failure()
+
+        self.assertTrue(self.breaker.allow())
+
+
+    def test_half_open_lets_a_single_probe_through(self):
+        self.open()
+        wait_reset_timeout(self.breaker)
+
+        self.assertEqual([self.breaker.allow() for _ in range(3)],
+                         [True, False, False])
+        self.assertGreater(self.breaker.retry_after(), 59)
+
+
+    def test_probe_success_closes(self):
+        self.open()
+        wait_reset_timeout(self.breaker)
+        self.breaker.allow()
+
+        self.breaker.record_success()
+        self.assertEqual([self.breaker.allow() for _ in range(3)],
+                         [True, True, True])
+        self.assertEqual(self.breaker.failures, 0)
+
+
+    def test_probe_failure_reopens(self):
+        self.open()
+        wait_reset_timeout(self.breaker)
+        self.breaker.allow()
+
+        self.breaker.record_failure()
+        self.assertFalse(self.breaker.allow())
+        self.assertGreater(self.breaker.retry_after(), 59)
+
+
+    def test_probe_failure_reopens_under_threshold(self):
+        breaker = CircuitBreaker(failure_threshold=1, reset_timeout=60)
+        breaker.record_failure()
+        wait_reset_timeout(breaker)
+        breaker.allow()
+        # A failure is enough even if the threshold was higher
+        breaker.failure_threshold = 100
+
+        breaker.record_failure()
+        self.assertFalse(breaker.allow())
+
+
+    def test_abandoned_probe_is_given_up(self):
+        self.open()
+        wait_reset_timeout(self.breaker)
+        self.breaker.allow()
+
+        wait_reset_timeout(self.breaker)
+        self.assertEqual([self.breaker.allow() for _ in range(2)],
+                         [True, False])
+
+
+    def test_state_shared_through_file(self):
+        path = os.path.join(support.make_temp_dir(self), "circuit.json")
+        first = CircuitBreaker(3, 60, path)
+        second = CircuitBreaker(3, 60, path)
+
+        for _ in range(3):
+            first.record_failure()
+        self.assertFalse(second.allow())
+
+        # The probe is claimed by the first process that ask for it
+        wait_reset_timeout(first)
+        first._save()
+        self.assertTrue(second.allow())
+        self.assertFalse(first.allow())
+
+        second.record_success()
+        self.assertTrue(first.allow())
+
+
+
+class RetryPolicyTest(unittest.TestCase):
+
+    def setUp(self):
+        self.delays = []
+        self.breaker = CircuitBreaker()
+
+
+    def policy(self, **kwargs):
+        # The delays are the maximum of their random fraction
+        return RetryPolicy(breaker=self.breaker, sleep=self.delays.append,
+                           random=lambda: 1.0, **kwargs)
+
+
+    def test_transient_failures_are_retried(self):
+        session = FakeSession([requests.ConnectionError(), 503, 200])
+
+        r = self.policy(retries=2, backoff=0.5).request(session, "GET", "url")
+
+        self.assertEqual(r.status_code, 200)
+        self.assertEqual(self.delays, [0.5, 1.0])
+        self.assertEqual(self.breaker.failures, 0)
+
+
+    def test_backoff_is_bounded(self):
+        session = FakeSession([500] * 5 + [200])
+
+        self.policy(retries=5, backoff=1, max_backoff=3).request(
+            session, "GET", "url")
+
+        self.assertEqual(self.delays, [1, 2, 3, 3, 3])
+
+
+    def test_last_response_returned_after_retries(self):
+        session = FakeSession([500, 502, 503])
+
+        r = self.policy(retries=2).request(session, "GET", "url")
+
+        self.assertEqual(r.status_code, 503)
+        self.assertEqual(len(self.delays), 2)
+        self.assertEqual(self.breaker.failures, 1)
+
+
+    def test_last_exception_raised_after_retries(self):
+        error = requests.ConnectionError()
+        session = FakeSession([500, error])
+
+        with self.assertRaises(requests.ConnectionError) as cm:
+            self.policy(retries=1).request(session, "GET", "url")
+
+        self.assertIs(cm.exception, error)
+        self.assertEqual(self.breaker.failures, 1)
+
+
+    def test_client_errors_are_not_retried(self):
+        session = FakeSession([404])
+
+        r = self.policy().request(session, "GET", "url")
+
+        self.assertEqual(r.status_code, 404)
+        self.assertEqual(self.delays, [])
+
+
+    def test_timeout_bounded_by_deadline(self):
+        session = FakeSession([200])
+
+        self.policy(timeout=10).request(session, "GET", "url",
+                                        time.time() + 2)
+
+        self.assertLessEqual(session.timeouts[0], 2)
+
+
+    def test_exhausted_budget(self):
+        session = FakeSession([200])
+
+        with self.assertRaises(requests.Timeout):
+            self.policy().request(session, "GET", "url", time.time() - 1)
+        self.assertEqual(session.outcomes, [200])
+
+
+    def test_no_retry_past_deadline(self):
+        # The delay before the retry would end after the deadline
+        session = FakeSession([500, 200])
+
+        r = self.policy(backoff=5).request(session, "GET", "url",
+                                           time.time() + 1)
+
+        self.assertEqual(r.status_code, 500)
+        self.assertEqual(self.delays, [])
+
+
+
+if __name__ == "__main__":
+    unittest.main()
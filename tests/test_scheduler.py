@@ -0,0 +1,302 @@
+# -*- coding: utf-8 -*-
+
+"""
+test_scheduler
+--------------
+
+Tests of the scheduler module: the token bucket bound the rate of the
+requests, the logins that were not expected are charged, and the polls
+of the accounts that are the closest to their cap are made first.
+
+The schedule is checked with a fake clock, by dispatching the polls
+and completing them directly, without the threads of Scheduler.run.
+
+Copyright(c) 2016 Rémi Tétreault <tetreault.remi@gmail.com>
+MIT Licensed, see LICENSE for more details.
+"""
+
+
+import unittest
+
+import support
+
+from usage import UsageRecord
+from watch import AdaptiveInterval
+from sessionstore import SessionStore
+from scheduler import (Scheduler, TokenBucket, REQUESTS_PER_POLL,
+                       LOGIN_REQUESTS)
+from derytelecomextranetquery import BadUsernamePasswordError
+
+
+
+########################################################################
+# Constants
+########################################################################
+MIN_INTERVAL = 60
+MAX_INTERVAL = 30 * 60
+THRESHOLD = 10 ** 9
+
+# The available data of an account far from its cap and of one under
+# the threshold, whose polls are made at the minimum interval
+FAR = 50 * 10 ** 9
+CLOSE = 10 ** 8
+
+
+
+########################################################################
+# Helper functions
+########################################################################
+def make_interval():
+    return AdaptiveInterval(MIN_INTERVAL, MAX_INTERVAL, THRESHOLD,
+                            jitter=0)
+
+
+def make_scheduler(usernames, clock, **kwargs):
+    return Scheduler([(u, support.PASSWORD) for u in usernames],
+                     get_data=None, get_record=lambda record: record,
+                     make_interval=make_interval, clock=clock, **kwargs)
+
+
+def waiting_accounts(scheduler):
+    # Return the accounts whose poll is not due yet, by username
+    return dict((account.username, account)
+                for _, _, account in scheduler._waiting)
+
+
+
+########################################################################
+# Classes
+########################################################################
+class FakeClock(object):
+
+    def __init__(self, now=1000.0):
+        self.now = now
+
+    def __call__(self):
+        return self.now
+
+    def advance(self, seconds):
+        self.now += seconds
+
+
+
+class Jobs(list):
+    # The queue of the polls to start, that Scheduler.run share with
+    # its threads
+
+    def put(self, account):
+        self.append(account)
+
+
+
+########################################################################
+# Tests
+########################################################################
+class TokenBucketTest(unittest.TestCase):
+
+    def setUp(self):
+        self.clock = FakeClock()
+        self.bucket = TokenBucket(rate=2, capacity=5, clock=self.clock)
+
+
+    def test_take_and_refill(self):
+        self.assertTrue(self.bucket.take(5))
+        self.assertFalse(self.bucket.take())
+        self.assertEqual(self.bucket.delay(), 0.5)
+
+        self.clock.advance(0.5)
+        self.assertTrue(self.bucket.take())
+        self.assertFalse(self.bucket.take())
+
+
+    def test_capacity(self):
+        self.bucket.take(5)
+        self.clock.advance(100)
+
+        self.assertEqual(self.bucket.tokens, 5)
+        self.assertEqual(self.bucket.delay(5), 0)
+        self.assertFalse(self.bucket.take(6))
+
+
+    def test_charge_owe_tokens(self):
+        self.bucket.charge(8)
+
+        self.assertEqual(self.bucket.tokens, -3)
+        self.assertEqual(self.bucket.delay(), 2)
+        self.clock.advance(1.9)
+        self.assertFalse(self.bucket.take())
+        self.clock.advance(0.1)
+        self.assertTrue(self.bucket.take())
+
+
+
+class SchedulerTest(unittest.TestCase):
+
+    def setUp(self):
+        self.clock = FakeClock()
+        self.start = self.clock.now
+
+
+    def complete(self, scheduler, accounts, available, logins=1):
+        # Complete the polls with a record of the available data
+        for account in accounts:
+            account.logins = logins
+            scheduler._complete(account, UsageRecord(
+                available, None, FAR * 2, fetched_at=self.clock.now), None)
+
+
+    def test_first_polls_spread_over_min_interval(self):
+        scheduler = make_scheduler(["a", "b", "c"], self.clock, rate=10)
+
+        self.assertEqual(sorted(due for due, _, _ in scheduler._waiting),
+                         [self.start, self.start + 20, self.start + 40])
+
+
+    def test_first_polls_spread_over_rate(self):
+        # Polling the accounts take 150 seconds at the rate
+        scheduler = make_scheduler([str(i) for i in range(30)], self.clock,
+                                   rate=1)
+
+        self.assertEqual(max(due for due, _, _ in scheduler._waiting),
+                         self.start + 145)
+
+
+    def test_closest_to_cap_first(self):
+        # The account far from its cap was due first, but there is only
+        # the tokens of one poll
+        scheduler = make_scheduler(["far", "close"], self.clock, rate=1)
+        accounts = waiting_accounts(scheduler)
+        accounts["far"].available = FAR
+        accounts["close"].available = CLOSE
+        self.clock.advance(MIN_INTERVAL)
+
+        jobs = Jobs()
+        scheduler._dispatch(jobs)
+        self.assertEqual([a.username for a in jobs], ["close"])
+        self.assertEqual(scheduler.queue_depth, 1)
+
+        # The other account is polled once the bucket is refilled
+        self.clock.advance(REQUESTS_PER_POLL)
+        scheduler._dispatch(jobs)
+        self.assertEqual([a.username for a in jobs], ["close", "far"])
+        self.assertEqual(scheduler.lag, REQUESTS_PER_POLL + MIN_INTERVAL)
+
+
+    def test_rate_bound(self):
+        # The accounts under the threshold want more polls than the
+        # rate allow, they still are all polled
+        duration = 600
+        scheduler = make_scheduler([str(i) for i in range(30)], self.clock,
+                                   rate=1)
+        polls = dict((str(i), 0) for i in range(30))
+
+        for _ in range(duration):
+            jobs = Jobs()
+            scheduler._dispatch(jobs)
+            for account in jobs:
+                polls[account.username] += 1
+            self.complete(scheduler, jobs, CLOSE)
+            self.clock.advance(1)
+
+        requests = sum(polls.values()) * REQUESTS_PER_POLL
+        self.assertLessEqual(requests, REQUESTS_PER_POLL + duration)
+        self.assertGreater(requests, duration - REQUESTS_PER_POLL)
+        self.assertGreaterEqual(min(polls.values()), 3)
+
+
+    def test_max_in_flight(self):
+        scheduler = make_scheduler(["a", "b", "c"], self.clock, rate=1000,
+                                   burst=1000, max_in_flight=2)
+        self.clock.advance(MIN_INTERVAL)
+
+        jobs = Jobs()
+        scheduler._dispatch(jobs)
+        self.assertEqual(len(jobs), 2)
+        self.assertEqual(scheduler.in_flight, 2)
+
+        self.complete(scheduler, jobs[:1], FAR)
+        scheduler._dispatch(jobs)
+        self.assertEqual([a.username for a in jobs], ["a", "b", "c"])
+
+        with self.assertRaises(ValueError):
+            make_scheduler(["a"], self.clock, max_in_flight=0)
+
+
+    def test_expected_login_not_charged(self):
+        scheduler = make_scheduler(["a"], self.clock, rate=1)
+        jobs = Jobs()
+        scheduler._dispatch(jobs)
+
+        self.complete(scheduler, jobs, FAR, logins=1)
+        self.assertEqual(scheduler.bucket.tokens, 0)
+
+
+    def test_login_again_charged_with_session_store(self):
+        store = SessionStore(support.make_temp_dir(self))
+        scheduler = make_scheduler(["a", "b"], self.clock, rate=1,
+                                   burst=2, session_store=store)
+        self.assertEqual(scheduler.requests_per_poll, 1)
+        jobs = Jobs()
+        scheduler._dispatch(jobs)
+
+        # The stored session was reused
+        self.complete(scheduler, jobs, FAR, logins=0)
+        self.assertEqual(scheduler.bucket.tokens, 1)
+
+        # The stored session was rejected, the poll logged in again
+        self.clock.advance(scheduler._waiting[0][0] - self.clock.now)
+        scheduler._dispatch(jobs)
+        self.complete(scheduler, jobs[1:], FAR, logins=1)
+        self.assertEqual(scheduler.bucket.tokens, 1 - LOGIN_REQUESTS)
+
+
+    def test_failed_poll_retried_at_min_interval(self):
+        scheduler = make_scheduler(["a"], self.clock, rate=1)
+        jobs = Jobs()
+        scheduler._dispatch(jobs)
+
+        scheduler._complete(jobs[0], None, IOError())
+
+        self.assertEqual(scheduler.failures, 1)
+        self.assertEqual(scheduler._waiting[0][0],
+                         self.start + MIN_INTERVAL)
+
+
+    def test_rejected_account_no_longer_polled(self):
+        scheduler = make_scheduler(["a", "b"], self.clock, rate=1)
+        jobs = Jobs()
+        scheduler._dispatch(jobs)
+
+        scheduler._complete(jobs[0], None, BadUsernamePasswordError())
+
+        self.assertEqual(scheduler.accounts, 1)
+        self.assertEqual(list(waiting_accounts(scheduler)), ["b"])
+
+
+
+class RunTest(unittest.TestCase):
+
+    def test_poll_accounts_of_stand_in(self):
+        scheduler = Scheduler(
+            [(u, support.PASSWORD) for u in sorted(support.ACCOUNTS)],
+            get_data=lambda deq: deq.get_internettraffic().get_usage(),
+            get_record=lambda record: record, make_interval=make_interval,
+            rate=1000)
+        polls = scheduler.run()
+
+        try:
+            # The first poll of the second account is due after a
+            # fraction of the minimum interval, only wait for the first
+            username, record, exception = next(polls)
+        finally:
+            polls.close()
+
+        self.assertIsNone(exception)
+        self.assertEqual(username, "low")
+        self.assertEqual(record.available, 4500000000)
+        self.assertEqual(scheduler.polls, 1)
+
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,166 @@
+# -*- coding: utf-8 -*-
+
+"""
+test_sessionstore
+-----------------
+
+Tests of the sessionstore module: a stored session is reused, an
+expired or corrupt one is replaced by a new login, the files are only
+accessible by their owner, and a session that can not be stored is
+only a warning.
+
+Copyright(c) 2016 Rémi Tétreault <tetreault.remi@gmail.com>
+MIT Licensed, see LICENSE for more details.
+"""
+
+
+import os
+import json
+import stat
+import unittest
+import warnings
+
+import support
+
+from sessionstore import SessionStore, write_private_file
+from derytelecomextranetquery import (DerytelecomExtranetQuery,
+                                      AUTH_PAGE_NAME, COOKIE_NAME)
+
+
+
+########################################################################
+# Helper functions
+########################################################################
+def logins():
+    return support.server.requests.get("/" + AUTH_PAGE_NAME, 0)
+
+
+def mode(path):
+    return stat.S_IMODE(os.stat(path).st_mode)
+
+
+
+########################################################################
+# Tests
+########################################################################
+class SessionStoreTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = os.path.join(support.make_temp_dir(self),
+                                      "sessions")
+        self.store = SessionStore(self.directory)
+
+
+    def query(self):
+        # Return the available data and the number of logins made to
+        # retrieve it
+        before = logins()
+        with DerytelecomExtranetQuery.connect(
+                "user", support.PASSWORD, self.store) as deq:
+            available = deq.get_internettraffic().get_available()
+        return available, logins() - before
+
+
+    def session_id(self):
+        for cookie in self.store.load("user"):
+            if cookie["name"] == COOKIE_NAME:
+                return cookie["value"]
+
+
+    def test_stored_session_reused(self):
+        self.assertEqual(self.query(), ("60.3 Gb", 1))
+        self.assertEqual(self.query(), ("60.3 Gb", 0))
+
+
+    def test_expired_session_replaced(self):
+        self.query()
+        cookies = self.store.load("user")
+        for cookie in cookies:
+            if cookie["name"] == COOKIE_NAME:
+                cookie["value"] = "expired"
+        with open(os.path.join(self.directory, "user"), "wb") as f:
+            f.write(json.dumps(cookies))
+
+        self.assertEqual(self.query(), ("60.3 Gb", 1))
+        self.assertNotEqual(self.session_id(), "expired")
+        self.assertEqual(self.query(), ("60.3 Gb", 0))
+
+
+    def test_corrupt_file_ignored(self):
+        os.makedirs(self.directory)
+        with open(os.path.join(self.directory, "user"), "wb") as f:
+            f.write(b'[{"name": "PHPSESSID", "val')
+
+        self.assertIsNone(self.store.load("user"))
+        self.assertEqual(self.query(), ("60.3 Gb", 1))
+        self.assertTrue(self.session_id())
+
+
+    def test_files_only_accessible_by_owner(self):
+        self.query()
+
+        self.assertEqual(mode(self.directory), 0o700)
+        self.assertEqual(mode(os.path.join(self.directory, "user")), 0o600)
+        # No temporary file is left behind
+        self.assertEqual(os.listdir(self.directory), ["user"])
+
+
+    def test_username_quoted_in_file_name(self):
+        self.store.save("../user", [])
+
+        self.assertEqual(os.listdir(self.directory), ["..%2Fuser"])
+        self.assertEqual(self.store.load("../user"), [])
+
+
+    def test_failed_save_is_a_warning(self):
+        # The directory can not be created where a file is
+        with open(self.directory, "wb"):
+            pass
+
+        with warnings.catch_warnings(record=True) as caught:
+            warnings.simplefilter("always")
+            self.assertFalse(self.store.save("user", []))
+            # The query still succeed without storing its session
+            self.assertEqual(self.query(), ("60.3 Gb", 1))
+
+        self.assertTrue(caught)
+        self.assertTrue(all(issubclass(w.category, RuntimeWarning)
+                            for w in caught))
+        self.assertIn("could not be stored", str(caught[0].message))
+
+
+    def test_delete(self):
+        self.query()
+        self.store.delete("user")
+        self.store.delete("user")
+
+        self.assertIsNone(self.store.load("user"))
+
+
+
+class WritePrivateFileTest(unittest.TestCase):
+
+    def test_replace_content(self):
+        path = os.path.join(support.make_temp_dir(self), "file")
+        write_private_file(path, b"first")
+        write_private_file(path, b"second")
+
+        with open(path, "rb") as f:
+            self.assertEqual(f.read(), b"second")
+        self.assertEqual(mode(path), 0o600)
+        self.assertEqual(os.listdir(os.path.dirname(path)), ["file"])
+
+
+    def test_temporary_file_removed_on_failure(self):
+        directory = support.make_temp_dir(self)
+        # The rename fails since the path is a directory
+        path = os.path.join(directory, "file")
+        os.mkdir(path)
+
+        self.assertRaises(OSError, write_private_file, path, b"data")
+        self.assertEqual(os.listdir(directory), ["file"])
+
+
+
+if __name__ == "__main__":
+    unittest.main()
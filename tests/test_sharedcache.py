@@ -0,0 +1,167 @@
+# -*- coding: utf-8 -*-
+
+"""
+test_sharedcache
+----------------
+
+Tests of the sharedcache module: a fresh result is reused only with
+the password that retrieved it, and a process that wait for the lock
+read the result of the process that hold it.
+
+Copyright(c) 2016 Rémi Tétreault <tetreault.remi@gmail.com>
+MIT Licensed, see LICENSE for more details.
+"""
+
+
+import os
+import json
+import stat
+import unittest
+
+import support
+
+from sharedcache import SharedCache, fcntl
+
+
+
+########################################################################
+# Constants
+########################################################################
+PASSWORD = "password"
+RESULT = {"availabledata" : "60.3 Gb"}
+
+
+
+########################################################################
+# Classes
+########################################################################
+class Fetch(object):
+    """A fetch function that count its calls."""
+
+    def __init__(self, result=RESULT):
+        self.result = result
+        self.calls = 0
+
+    def __call__(self):
+        self.calls += 1
+        if isinstance(self.result, Exception):
+            raise self.result
+        return self.result
+
+
+
+########################################################################
+# Tests
+########################################################################
+class SharedCacheTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = os.path.join(support.make_temp_dir(self),
+                                      "results")
+        self.cache = SharedCache(directory=self.directory)
+        self.path = os.path.join(self.directory, "user.traffic")
+
+
+    def get(self, fetch, password=PASSWORD, cache=None):
+        return (cache or self.cache).get("user", password, "traffic", fetch)
+
+
+    def test_fresh_result_reused(self):
+        fetch = Fetch()
+
+        self.assertEqual(self.get(fetch), (RESULT, True))
+        self.assertEqual(self.get(fetch), (RESULT, False))
+        self.assertEqual(fetch.calls, 1)
+        self.assertEqual((self.cache.fetches, self.cache.hits), (1, 1))
+
+
+    def test_files_only_accessible_by_owner(self):
+        self.get(Fetch())
+
+        self.assertEqual(stat.S_IMODE(os.stat(self.directory).st_mode),
+                         0o700)
+        self.assertEqual(stat.S_IMODE(os.stat(self.path).st_mode), 0o600)
+        # The password is not stored
+        with open(self.path, "rb") as f:
+            self.assertNotIn(PASSWORD, f.read())
+
+
+    def test_other_password_not_reused(self):
+        fetch = Fetch()
+        self.get(fetch)
+
+        self.assertEqual(self.get(fetch, "other"), (RESULT, True))
+        self.assertEqual(fetch.calls, 2)
+
+
+    def test_old_result_not_reused(self):
+        fetch = Fetch()
+        self.get(fetch)
+
+        with open(self.path, "rb") as f:
+            entry = json.load(f)
+        entry["stored_at"] -= self.cache.max_age + 1
+        with open(self.path, "wb") as f:
+            json.dump(entry, f)
+
+        self.assertEqual(self.get(fetch), (RESULT, True))
+        self.assertEqual(fetch.calls, 2)
+
+
+    def test_corrupt_result_not_reused(self):
+        fetch = Fetch()
+        self.get(fetch)
+        with open(self.path, "wb") as f:
+            f.write(b'{"stored_at": ')
+
+        self.assertEqual(self.get(fetch), (RESULT, True))
+
+
+    def test_fetch_error_not_stored(self):
+        self.assertRaises(ValueError, self.get, Fetch(ValueError()))
+        self.assertFalse(os.path.exists(self.path))
+        self.assertEqual(self.get(Fetch()), (RESULT, True))
+
+
+    @unittest.skipIf(fcntl is None, "fcntl is not available")
+    def test_result_of_lock_holder_read(self):
+        self.get(Fetch())
+        os.remove(self.path)
+
+        # Another process hold the lock, and store its result then
+        # release the lock while this one wait
+        fd = os.open(self.path + ".lock", os.O_RDWR)
+        fcntl.flock(fd, fcntl.LOCK_EX)
+
+        def sleep(seconds):
+            SharedCache(directory=self.directory)._write(self.path,
+                                                         PASSWORD, RESULT)
+            os.close(fd)
+
+        cache = SharedCache(directory=self.directory, sleep=sleep)
+        fetch = Fetch()
+
+        self.assertEqual(self.get(fetch, cache=cache), (RESULT, False))
+        self.assertEqual(fetch.calls, 0)
+        self.assertEqual(cache.waits, 1)
+
+
+    @unittest.skipIf(fcntl is None, "fcntl is not available")
+    def test_lock_timeout(self):
+        self.get(Fetch())
+        os.remove(self.path)
+
+        fd = os.open(self.path + ".lock", os.O_RDWR)
+        self.addCleanup(os.close, fd)
+        fcntl.flock(fd, fcntl.LOCK_EX)
+
+        cache = SharedCache(directory=self.directory, lock_timeout=0)
+        fetch = Fetch()
+
+        self.assertEqual(self.get(fetch, cache=cache), (RESULT, True))
+        self.assertEqual(fetch.calls, 1)
+
+
+
+if __name__ == "__main__":
+    unittest.main()
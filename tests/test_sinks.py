@@ -0,0 +1,329 @@
+# -*- coding: utf-8 -*-
+
+"""
+test_sinks
+----------
+
+Tests of the sinks module against the stand-in receivers of the
+benchmarks: each sink deliver the samples in its format, and the
+processes that deliver the samples of different accounts to the same
+Prometheus textfile or pushgateway keep the samples of each other.
+
+Copyright(c) 2016 Rémi Tétreault <tetreault.remi@gmail.com>
+MIT Licensed, see LICENSE for more details.
+"""
+
+
+import os
+import sys
+import json
+import stat
+import time
+import unittest
+import threading
+import subprocess
+
+import support
+
+import sinks
+from usage import UsageRecord
+from receivers import HTTPReceiver, UDPReceiver
+
+
+
+########################################################################
+# Constants
+########################################################################
+RECORD = UsageRecord(available=60300000000, used=39700000000,
+                     fetched_at=1462000000.0)
+
+# Deliver the samples of the accounts of the arguments to a sink, from
+# another process
+PUT_SCRIPT = """
+import sys
+sys.path.insert(0, {!r})
+import sinks
+from usage import UsageRecord
+sink = sinks.make_sink(sys.argv[1])
+for username in sys.argv[2:]:
+    sink.put(username, UsageRecord(1000, 2000, fetched_at=1462000000.0))
+sink.close()
+sys.exit(1 if sink.failed else 0)
+""".format(support.PACKAGE_DIR)
+
+ACCOUNT_PREFIX = 'derytelecom_usage_used_bytes{account="'
+
+
+
+########################################################################
+# Helper functions
+########################################################################
+def accounts_of_text(text):
+    # Return the accounts of a text in the Prometheus format
+    return set(line[len(ACCOUNT_PREFIX):].split('"')[0]
+               for line in text.splitlines()
+               if line.startswith(ACCOUNT_PREFIX))
+
+
+def put_from_processes(spec, *accounts):
+    # Deliver the samples of each list of accounts from its own process,
+    # all at the same time, and return their exit codes
+    processes = [subprocess.Popen([sys.executable, "-c", PUT_SCRIPT, spec]
+                                  + list(some))
+                 for some in accounts]
+    return [p.wait() for p in processes]
+
+
+
+########################################################################
+# Classes
+########################################################################
+class BlockedSink(sinks.Sink):
+    """A sink whose delivery wait until it is released."""
+
+    def __init__(self, **kwargs):
+        self.sending = threading.Event()
+        self.release = threading.Event()
+        sinks.Sink.__init__(self, **kwargs)
+
+    def send(self, samples):
+        self.sending.set()
+        self.release.wait(5)
+
+
+
+########################################################################
+# Tests
+########################################################################
+class FormatTest(unittest.TestCase):
+
+    def test_prometheus_text(self):
+        text = sinks.prometheus_text({"user" : RECORD,
+                                      'a"b' : UsageRecord(used=5)})
+        lines = text.splitlines()
+
+        self.assertIn('derytelecom_usage_available_bytes{account="user"} '
+                      '60300000000', lines)
+        self.assertIn('derytelecom_usage_total_bytes{account="user"} '
+                      '100000000000', lines)
+        self.assertIn('derytelecom_usage_used_bytes{account="a\\"b"} 5',
+                      lines)
+        self.assertIn('derytelecom_usage_fetched_at_seconds{account="user"} '
+                      '1462000000.0', lines)
+        self.assertNotIn('derytelecom_usage_available_bytes{account="a\\"b"}',
+                         text)
+
+
+    def test_influxdb_lines(self):
+        self.assertEqual(
+            sinks.influxdb_lines([("a user", RECORD),
+                                  ("empty", UsageRecord())]),
+            "derytelecom_usage,account=a\\ user available=60300000000i,"
+            "used=39700000000i,total=100000000000i 1462000000\n")
+        self.assertEqual(sinks.influxdb_lines([]), "")
+
+
+    def test_statsd_packets(self):
+        packets = sinks.statsd_packets([("user.{}".format(i), RECORD)
+                                        for i in range(20)])
+
+        self.assertGreater(len(packets), 1)
+        self.assertTrue(all(len(p) <= sinks.STATSD_MAX_PACKET
+                            for p in packets))
+        lines = "\n".join(packets).splitlines()
+        self.assertEqual(len(lines), 60)
+        self.assertEqual(lines[0], "derytelecom.user_0.available:"
+                                   "60300000000|g")
+
+
+    def test_grouping_label(self):
+        self.assertEqual(sinks.grouping_label("account", "a user"),
+                         "account/a%20user")
+        self.assertEqual(sinks.grouping_label("account", "a/b"),
+                         "account@base64/YS9i")
+        self.assertEqual(sinks.grouping_label("account", ""),
+                         "account@base64/=")
+
+
+    def test_make_sink(self):
+        self.assertRaises(ValueError, sinks.make_sink, "nosuch:target")
+        self.assertRaises(ValueError, sinks.make_sink, "jsonl:")
+        self.assertRaises(ValueError, sinks.make_sink, "statsd:host")
+
+        sink = sinks.make_sink("statsd:127.0.0.1:8125")
+        self.addCleanup(sink.close)
+        self.assertIsInstance(sink, sinks.StatsDSink)
+        self.assertEqual(sink.address, ("127.0.0.1", 8125))
+
+
+
+class FileSinkTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = support.make_temp_dir(self)
+
+
+    def test_json_lines(self):
+        path = os.path.join(self.directory, "usage.jsonl")
+        sink = sinks.JsonLinesSink(path)
+        sink.put("user", RECORD)
+        sink.put("low", RECORD)
+        self.assertTrue(sink.close())
+
+        with open(path) as f:
+            rows = [json.loads(line) for line in f]
+        self.assertEqual([r["username"] for r in rows], ["user", "low"])
+        self.assertEqual(rows[0]["available"], 60300000000)
+        self.assertEqual(sink.stats()["sent"], 2)
+
+
+    def test_textfile_per_account(self):
+        sink = sinks.PrometheusTextfileSink(
+            os.path.join(self.directory, "usage.prom"))
+        sink.put("user", UsageRecord(used=1))
+        sink.put("a/b", RECORD)
+        sink.put("user", RECORD)
+        self.assertTrue(sink.close())
+
+        self.assertEqual(sorted(os.listdir(self.directory)),
+                         ["usage.a%2Fb.prom", "usage.user.prom"])
+        path = sink.account_path("user")
+        self.assertEqual(stat.S_IMODE(os.stat(path).st_mode), 0o600)
+        with open(path) as f:
+            # The last sample of the account
+            self.assertEqual(f.read(), sinks.prometheus_text(
+                {"user" : RECORD}))
+
+
+    def test_textfile_processes_keep_accounts(self):
+        spec = "textfile:" + os.path.join(self.directory, "usage.prom")
+        self.assertEqual(put_from_processes(spec, ["user", "other"],
+                                            ["low"]), [0, 0])
+
+        accounts = set()
+        for name in os.listdir(self.directory):
+            with open(os.path.join(self.directory, name)) as f:
+                accounts |= accounts_of_text(f.read())
+        self.assertEqual(accounts, set(["user", "other", "low"]))
+
+
+
+class HTTPSinkTest(unittest.TestCase):
+
+    def setUp(self):
+        self.receiver = HTTPReceiver()
+        self.url = self.receiver.start()
+        self.addCleanup(self.receiver.stop)
+
+
+    def pushgateway_groups(self):
+        # Return the accounts of each group of the pushgateway, by path
+        # of the group, a PUT replace the whole group
+        groups = {}
+        for method, path, body in self.receiver.received:
+            self.assertEqual(method, "PUT")
+            groups[path] = accounts_of_text(body)
+        return groups
+
+
+    def test_pushgateway_group_per_account(self):
+        sink = sinks.PushgatewaySink(self.url)
+        sink.put("user", RECORD)
+        sink.put("a/b", RECORD)
+        self.assertTrue(sink.close())
+
+        job = "/metrics/job/" + sinks.PUSHGATEWAY_JOB
+        self.assertEqual(self.pushgateway_groups(), {
+            job + "/account/user" : set(["user"]),
+            job + "/account@base64/YS9i" : set(["a/b"])})
+
+
+    def test_pushgateway_processes_keep_accounts(self):
+        self.assertEqual(put_from_processes("pushgateway:" + self.url,
+                                            ["user", "other"], ["low"]),
+                         [0, 0])
+
+        accounts = set()
+        for group in self.pushgateway_groups().values():
+            accounts |= group
+        self.assertEqual(accounts, set(["user", "other", "low"]))
+
+
+    def test_pushgateway_error_kept(self):
+        self.receiver.status = 500
+        sink = sinks.PushgatewaySink(self.url)
+        sink.put("user", RECORD)
+        sink.close()
+
+        self.assertEqual(sink.failed, 1)
+        self.assertIsNotNone(sink.error)
+
+
+    def test_influxdb(self):
+        sink = sinks.InfluxDBSink(self.url + "/write?db=usage")
+        sink.put("user", RECORD)
+        sink.put("low", RECORD)
+        self.assertTrue(sink.close())
+
+        (method, path, body), = self.receiver.received
+        self.assertEqual((method, path),
+                         ("POST", "/write?db=usage&precision=s"))
+        self.assertEqual(body, sinks.influxdb_lines([("user", RECORD),
+                                                     ("low", RECORD)]))
+
+
+
+class StatsDSinkTest(unittest.TestCase):
+
+    def test_gauges(self):
+        receiver = UDPReceiver()
+        host, port = receiver.start()
+        self.addCleanup(receiver.stop)
+
+        sink = sinks.StatsDSink(host, port)
+        sink.put("user", RECORD)
+        self.assertTrue(sink.close())
+
+        # Let the receiver read the datagram
+        deadline = time.time() + 5
+        while not receiver.received and time.time() < deadline:
+            time.sleep(0.01)
+        self.assertEqual(sorted(receiver.lines()),
+                         ["derytelecom.user.available:60300000000|g",
+                          "derytelecom.user.total:100000000000|g",
+                          "derytelecom.user.used:39700000000|g"])
+
+
+
+class SinkTest(unittest.TestCase):
+
+    def test_full_queue_drop(self):
+        sink = BlockedSink(queue_size=1, batch_size=1, block=False)
+        self.addCleanup(sink.close)
+        self.addCleanup(sink.release.set)
+
+        # The first sample is being sent, the second wait in the queue
+        self.assertTrue(sink.put("user", RECORD))
+        sink.sending.wait(5)
+        self.assertTrue(sink.put("user", RECORD))
+
+        self.assertFalse(sink.put("user", RECORD))
+        self.assertEqual(sink.dropped, 1)
+
+        sink.release.set()
+        self.assertTrue(sink.flush(5))
+        self.assertEqual(sink.stats(), {"queued" : 0, "sent" : 2,
+                                        "dropped" : 1, "failed" : 0})
+
+
+    def test_put_after_close(self):
+        sink = sinks.JsonLinesSink(os.path.join(support.make_temp_dir(self),
+                                                "usage.jsonl"))
+        sink.close()
+
+        self.assertRaises(ValueError, sink.put, "user", RECORD)
+
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,99 @@
+# -*- coding: utf-8 -*-
+
+"""
+test_threadpool
+---------------
+
+Tests of the threadpool module: every item is processed once, by at
+most max_workers threads, the exceptions are yielded with their item,
+and the wait for the results can be interrupted.
+
+Copyright(c) 2016 Rémi Tétreault <tetreault.remi@gmail.com>
+MIT Licensed, see LICENSE for more details.
+"""
+
+
+import time
+import thread
+import threading
+import unittest
+
+import support
+
+from threadpool import imap_unordered
+
+
+
+########################################################################
+# Tests
+########################################################################
+class ImapUnorderedTest(unittest.TestCase):
+
+    def test_results(self):
+        results = imap_unordered(lambda x: x * 2, range(10), 3)
+
+        self.assertEqual(sorted(results),
+                         [(x, x * 2, None) for x in range(10)])
+
+
+    def test_exception_yielded_with_item(self):
+        def function(x):
+            if x == 2:
+                raise ValueError(x)
+            return x
+
+        results = dict((item, (result, exception))
+                       for item, result, exception
+                       in imap_unordered(function, range(4), 2))
+
+        self.assertEqual(results[1], (1, None))
+        self.assertIsNone(results[2][0])
+        self.assertIsInstance(results[2][1], ValueError)
+        self.assertEqual(len(results), 4)
+
+
+    def test_workers_bounded(self):
+        lock = threading.Lock()
+        running = [0]
+        most_running = [0]
+
+        def function(x):
+            with lock:
+                running[0] += 1
+                most_running[0] = max(most_running[0], running[0])
+            time.sleep(0.01)
+            with lock:
+                running[0] -= 1
+
+        self.assertEqual(len(list(imap_unordered(function, range(12), 3))),
+                         12)
+        self.assertLessEqual(most_running[0], 3)
+
+
+    def test_no_items(self):
+        self.assertEqual(list(imap_unordered(lambda x: x, [], 4)), [])
+
+
+    def test_workers_less_than_one(self):
+        # Raised when called, before the generator is iterated
+        self.assertRaises(ValueError, imap_unordered, lambda x: x, [1], 0)
+
+
+    def test_wait_interrupted(self):
+        release = threading.Event()
+        self.addCleanup(release.set)
+        results = imap_unordered(lambda x: release.wait(), [1], 1)
+
+        # Release the item later anyway, so that a wait that can not be
+        # interrupted make the test fail instead of hang
+        threading.Timer(0.05, thread.interrupt_main).start()
+        threading.Timer(2, release.set).start()
+
+        start = time.time()
+        self.assertRaises(KeyboardInterrupt, next, results)
+        self.assertLess(time.time() - start, 1)
+
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,143 @@
+# -*- coding: utf-8 -*-
+
+"""
+test_transport
+--------------
+
+Tests of the transport module: the sessions that share a Transport
+reuse its connections, even once closed, the responses are compressed
+when it is on, and the requests, the connections and the bytes are
+counted.
+
+Copyright(c) 2016 Rémi Tétreault <tetreault.remi@gmail.com>
+MIT Licensed, see LICENSE for more details.
+"""
+
+
+import re
+import unittest
+
+import support
+
+import transport
+from transport import Transport
+from derytelecomextranetquery import (DerytelecomExtranetQuery, BASE_URL,
+                                      INDEX_URL)
+
+
+
+########################################################################
+# Constants
+########################################################################
+# The session ids of the stand-in
+SESSION_ID_RE = re.compile("[0-9a-f]{32}")
+
+
+
+########################################################################
+# Helper functions
+########################################################################
+def get_login_page(t):
+    # Return the login page retrieved with a new session of the
+    # transport, without its session id, the session is closed
+    with t.session() as session:
+        return SESSION_ID_RE.sub("", session.get(BASE_URL).text)
+
+
+
+########################################################################
+# Tests
+########################################################################
+class TransportTest(unittest.TestCase):
+
+    def make_transport(self, *args, **kwargs):
+        t = Transport(*args, **kwargs)
+        self.addCleanup(t.close_pools)
+        return t
+
+
+    def test_sessions_share_connection(self):
+        t = self.make_transport()
+        before = support.server.connections
+
+        for _ in range(3):
+            get_login_page(t)
+
+        self.assertEqual(t.connections, 1)
+        self.assertEqual(support.server.connections, before + 1)
+        self.assertEqual(t.requests, 3)
+
+
+    def test_close_pools(self):
+        t = self.make_transport()
+        get_login_page(t)
+
+        t.close_pools()
+        get_login_page(t)
+
+        self.assertEqual(t.connections, 2)
+
+
+    def test_accounts_share_connection(self):
+        t = self.make_transport()
+
+        for username in sorted(support.ACCOUNTS):
+            with DerytelecomExtranetQuery.connect(username, support.PASSWORD,
+                                                  transport=t) as deq:
+                deq.get_internettraffic()
+
+        self.assertEqual(t.connections, 1)
+
+
+    def test_compression(self):
+        support.server.compress = True
+        self.addCleanup(setattr, support.server, "compress", False)
+        compressed = self.make_transport()
+        identity = self.make_transport(compress=False)
+
+        self.assertEqual(get_login_page(compressed),
+                         get_login_page(identity))
+        self.assertLess(compressed.bytes_received, identity.bytes_received)
+        self.assertEqual(compressed.bytes_sent - identity.bytes_sent,
+                         len(transport.COMPRESSED_ENCODINGS)
+                         - len(transport.IDENTITY_ENCODING))
+
+
+    def test_bytes_counted(self):
+        t = self.make_transport(compress=False)
+        page = get_login_page(t)
+
+        stats = t.stats()
+        self.assertEqual(sorted(stats), ["bytes_received", "bytes_sent",
+                                         "connections", "requests"])
+        # The request line and the headers, without a body
+        self.assertGreater(stats["bytes_sent"], len("GET / HTTP/1.1"))
+        self.assertGreater(stats["bytes_received"],
+                           len(page.encode("utf-8")))
+
+
+    def test_request_body_counted(self):
+        t = self.make_transport()
+        with t.session() as session:
+            session.get(INDEX_URL)
+            sent = t.bytes_sent
+            session.post(INDEX_URL, data="x" * 1000)
+
+        self.assertGreaterEqual(t.bytes_sent - sent, 1000)
+
+
+    def test_pool_size(self):
+        t = self.make_transport(2)
+
+        self.assertEqual(t._pool_maxsize, 2)
+        self.assertEqual(t.poolmanager.connection_pool_kw["maxsize"], 2)
+
+
+    def test_default_transport_shared(self):
+        self.assertIs(transport.default_transport(),
+                      transport.default_transport())
+
+
+
+if __name__ == "__main__":
+    unittest.main()
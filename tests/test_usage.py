@@ -0,0 +1,99 @@
+# -*- coding: utf-8 -*-
+
+"""
+test_usage
+----------
+
+Tests of the usage module: the amounts of data in english and in
+french are converted to bytes, and a UsageRecord deduce its missing
+amount and survive a round trip through a dict.
+
+Copyright(c) 2016 Rémi Tétreault <tetreault.remi@gmail.com>
+MIT Licensed, see LICENSE for more details.
+"""
+
+
+import datetime
+import unittest
+
+import support
+
+from usage import UsageRecord, parse_amount, format_amount, parse_period
+
+
+
+########################################################################
+# Tests
+########################################################################
+class ParseAmountTest(unittest.TestCase):
+
+    def test_units(self):
+        self.assertEqual(parse_amount("12 b"), 12)
+        self.assertEqual(parse_amount("500kb"), 500000)
+        self.assertEqual(parse_amount("4.5 Mb"), 4500000)
+        self.assertEqual(parse_amount("60.3 Gb"), 60300000000)
+        self.assertEqual(parse_amount("1.5 TB"), 1500000000000)
+
+
+    def test_french(self):
+        # A decimal comma, a space between the thousands and octets
+        self.assertEqual(parse_amount("60,3 Go"), 60300000000)
+        self.assertEqual(parse_amount("1 024 Mo"), 1024000000)
+
+
+    def test_first_amount_of_text(self):
+        self.assertEqual(parse_amount("Used: 39.7 Gb"), 39700000000)
+        self.assertEqual(parse_amount("4.5 Gb / 100 Gb"), 4500000000)
+
+
+    def test_not_an_amount(self):
+        self.assertIsNone(parse_amount(""))
+        self.assertIsNone(parse_amount("Available:"))
+        self.assertIsNone(parse_amount("60.3"))
+        self.assertIsNone(parse_amount("60.3 Gbit"))
+
+
+    def test_format_amount(self):
+        self.assertEqual(format_amount(60300000000), "60.3 Gb")
+        self.assertEqual(format_amount(4500000, "m"), "4.5 Mb")
+        self.assertEqual(format_amount(None), "")
+        self.assertEqual(parse_amount(format_amount(60300000000)),
+                         60300000000)
+
+
+    def test_parse_period(self):
+        self.assertEqual(parse_period("From 2016-05-01 to 2016-05-31"),
+                         (datetime.date(2016, 5, 1),
+                          datetime.date(2016, 5, 31)))
+        self.assertEqual(parse_period("2016-05-01"),
+                         (datetime.date(2016, 5, 1), None))
+        self.assertEqual(parse_period(""), (None, None))
+
+
+
+class UsageRecordTest(unittest.TestCase):
+
+    def test_missing_amount_deduced(self):
+        self.assertEqual(UsageRecord(available=60, used=40).total, 100)
+        self.assertEqual(UsageRecord(available=60, total=100).used, 40)
+        self.assertEqual(UsageRecord(used=40, total=100).available, 60)
+        self.assertIsNone(UsageRecord(available=60).total)
+
+
+    def test_dict_round_trip(self):
+        record = UsageRecord(available=60300000000, used=39700000000,
+                             period_start=datetime.date(2016, 5, 1),
+                             period_end=datetime.date(2016, 5, 31),
+                             fetched_at=1464000000.0)
+        values = record.as_dict()
+
+        self.assertEqual(values["total"], 100000000000)
+        self.assertEqual(values["period_start"], "2016-05-01")
+        self.assertEqual(UsageRecord.from_dict(values).as_dict(), values)
+        self.assertEqual(UsageRecord.from_dict({}).as_dict(),
+                         UsageRecord().as_dict())
+
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,154 @@
+# -*- coding: utf-8 -*-
+
+"""
+test_watch
+----------
+
+Tests of the watch module: the interval grows while the usage is flat,
+shrink as the available data approach the threshold, and the polls
+reuse one session.
+
+Copyright(c) 2016 Rémi Tétreault <tetreault.remi@gmail.com>
+MIT Licensed, see LICENSE for more details.
+"""
+
+
+import unittest
+
+import support
+
+from usage import UsageRecord
+from watch import watch, AdaptiveInterval, POLLS_BEFORE_THRESHOLD
+from derytelecomextranetquery import (AUTH_PAGE_NAME,
+                                      BadUsernamePasswordError)
+
+
+
+########################################################################
+# Constants
+########################################################################
+MIN_INTERVAL = 60
+MAX_INTERVAL = 1800
+THRESHOLD = 10 * 10 ** 9
+
+
+
+########################################################################
+# Helper functions
+########################################################################
+def logins():
+    return support.server.requests.get("/" + AUTH_PAGE_NAME, 0)
+
+
+def record(fetched_at, available):
+    return UsageRecord(available, fetched_at=float(fetched_at))
+
+
+def interval(**kwargs):
+    # Return an AdaptiveInterval without jitter by default
+    kwargs.setdefault("random", lambda: 0.5)
+    return AdaptiveInterval(MIN_INTERVAL, MAX_INTERVAL, THRESHOLD, **kwargs)
+
+
+
+########################################################################
+# Tests
+########################################################################
+class AdaptiveIntervalTest(unittest.TestCase):
+
+    def test_first_poll(self):
+        self.assertEqual(interval().next(record(0, 50 * 10 ** 9)),
+                         MIN_INTERVAL)
+
+
+    def test_flat_usage_back_off(self):
+        i = interval()
+        delays = [i.next(record(t * 60, 50 * 10 ** 9)) for t in range(8)]
+
+        self.assertEqual(delays, [60, 120, 240, 480, 960, 1800, 1800, 1800])
+
+
+    def test_consumption_approaching_threshold(self):
+        # 1 Gb per 100 seconds, so the threshold is reached in 1000
+        # seconds from 20 Gb available
+        i = interval()
+        i.next(record(0, 21 * 10 ** 9))
+
+        self.assertEqual(i.next(record(100, 20 * 10 ** 9)),
+                         1000.0 / POLLS_BEFORE_THRESHOLD)
+        self.assertEqual(i.next(record(200, 19.99 * 10 ** 9)),
+                         MAX_INTERVAL)
+        self.assertEqual(i.next(record(300, 10.5 * 10 ** 9)),
+                         MIN_INTERVAL)
+
+
+    def test_under_threshold(self):
+        i = interval()
+        i.next(record(0, 50 * 10 ** 9))
+        i.next(record(60, 50 * 10 ** 9))
+
+        self.assertEqual(i.next(record(120, THRESHOLD)), MIN_INTERVAL)
+
+
+    def test_failed_poll_keep_previous_record(self):
+        i = interval()
+        i.next(record(0, 21 * 10 ** 9))
+
+        self.assertEqual(i.next(None), MIN_INTERVAL)
+        self.assertEqual(i.next(UsageRecord(fetched_at=50.0)),
+                         MIN_INTERVAL)
+        # The rate is computed from the last record that succeeded
+        self.assertEqual(i.next(record(100, 20 * 10 ** 9)),
+                         1000.0 / POLLS_BEFORE_THRESHOLD)
+
+
+    def test_record_not_newer(self):
+        i = interval()
+        i.next(record(1000, 50 * 10 ** 9))
+        i.next(record(1060, 50 * 10 ** 9))
+
+        self.assertEqual(i.next(record(1060, 40 * 10 ** 9)), MIN_INTERVAL)
+
+
+    def test_jitter(self):
+        self.assertAlmostEqual(
+            interval(random=lambda: 0).next(record(0, 50 * 10 ** 9)), 54)
+        self.assertAlmostEqual(
+            interval(random=lambda: 1).next(record(0, 50 * 10 ** 9)), 66)
+
+
+
+class WatchTest(unittest.TestCase):
+
+    def polls(self, count, password=support.PASSWORD):
+        # Return the results of count polls and the delays between them
+        delays = []
+        polls = watch("user", password,
+                      lambda deq: deq.get_internettraffic().get_usage(),
+                      lambda usage: usage, interval(), sleep=delays.append)
+        try:
+            results = [next(polls) for _ in range(count)]
+        finally:
+            polls.close()
+        return results, delays
+
+
+    def test_polls_reuse_session(self):
+        before = logins()
+        results, delays = self.polls(3)
+
+        self.assertEqual([(r.available, e) for r, e in results],
+                         [(60300000000, None)] * 3)
+        # The usage of the stand-in does not change
+        self.assertEqual(delays, [MIN_INTERVAL, 2 * MIN_INTERVAL])
+        self.assertEqual(logins(), before + 1)
+
+
+    def test_bad_password_stop_polls(self):
+        self.assertRaises(BadUsernamePasswordError, self.polls, 1,
+                          "wrong")
+
+
+
+if __name__ == "__main__":
+    unittest.main()